@@ -8,6 +8,7 @@ streamlines.
 import re
 import collections.abc
 from functools import partial
+from multiprocessing import Pool
 import numbers
 import numpy as np
 import nibabel as nib
@@ -15,6 +16,7 @@ from dipy.align.metrics import CCMetric, EMMetric, SSDMetric
 from dipy.align.imwarp import (SymmetricDiffeomorphicRegistration,
                                DiffeomorphicMap)
 
+from dipy.align.scalespace import ScaleSpaceCache
 from dipy.align.imaffine import (transform_centers_of_mass,
                                  AffineMap,
                                  MutualInformationMetric,
@@ -35,6 +37,7 @@ from dipy.tracking.utils import transform_tracking_output
 from dipy.io.streamline import load_trk
 from dipy.io.utils import read_img_arr_or_path
 from dipy.io.image import load_nifti, save_nifti
+from dipy.utils.multiproc import determine_num_processes
 
 __all__ = ["syn_registration", "register_dwi_to_template",
            "write_mapping", "read_mapping", "resample",
@@ -87,6 +90,7 @@ def syn_registration(moving, static,
                      dim=3,
                      level_iters=None,
                      prealign=None,
+                     ss_cache=None,
                      **metric_kwargs):
     """Register a 2D/3D source image (moving) to a 2D/3D target image (static).
 
@@ -109,6 +113,10 @@ def syn_registration(moving, static,
         the number of iterations at each level of the Gaussian Pyramid (the
         length of the list defines the number of pyramid levels to be
         used). Default: [10, 10, 5].
+    ss_cache : ScaleSpaceCache, optional
+        A cache of scale spaces, used to build the scale space of `static`
+        only once when it is the static image of several registrations
+        (e.g. a template). Default: no caching.
     metric_kwargs : dict, optional
         Parameters for initialization of the metric object. If not provided,
         uses the default settings of each metric.
@@ -135,7 +143,8 @@ def syn_registration(moving, static,
     use_metric = syn_metric_dict[metric.upper()](dim, **metric_kwargs)
 
     sdr = SymmetricDiffeomorphicRegistration(use_metric, level_iters,
-                                             step_length=step_length)
+                                             step_length=step_length,
+                                             ss_cache=ss_cache)
 
     mapping = sdr.optimize(static, moving,
                            static_grid2world=static_affine,
@@ -343,6 +352,7 @@ def affine_registration(moving, static,
                         sigmas=None,
                         factors=None,
                         ret_metric=False,
+                        ss_cache=None,
                         **metric_kwargs):
     """
     Find the affine transformation between two 3D images. Alternatively, find
@@ -404,6 +414,12 @@ def affine_registration(moving, static,
         Set it to True to return the value of the optimized coefficients and
         the optimization quality metric.
 
+    ss_cache : ScaleSpaceCache, optional
+        A cache of scale spaces, used to build the scale space of `static`
+        only once when it is the static image of several registrations
+        (e.g. a template or the reference volume of a series). Default: a
+        cache shared only by the steps of the `pipeline`.
+
     nbins : int, optional
         MutualInformationMetric key-word argument: the number of bins to be
         used for computing the intensity histograms. The default is 32.
@@ -448,10 +464,15 @@ def affine_registration(moving, static,
     # For now, there is only one metric (mutual information)
     use_metric = affine_metric_dict[metric](**metric_kwargs)
 
+    # All the steps of the pipeline share the same static scale space
+    if ss_cache is None:
+        ss_cache = ScaleSpaceCache(max_items=1)
+
     affreg = AffineRegistration(metric=use_metric,
                                 level_iters=level_iters,
                                 sigmas=sigmas,
-                                factors=factors)
+                                factors=factors,
+                                ss_cache=ss_cache)
 
     # Convert pipeline to sanitized list of str
     pipeline = list(pipeline)
@@ -531,8 +552,31 @@ _METHOD_DICT = dict(  # mapping from str key -> (callable, class) tuple
     affine=(affine, AffineTransform3D))
 
 
+# Reference volume and registration settings shared by the workers of the
+# process pool used in `register_series`. These are set once per worker by
+# `_init_series_worker`, so that the reference is not pickled for each volume
+# and its scale space is only built once per worker.
+_series_worker_args = {}
+
+
+def _init_series_worker(ref, ref_affine, series_affine, pipeline):
+    _series_worker_args.update(ref=ref, ref_affine=ref_affine,
+                               series_affine=series_affine,
+                               pipeline=pipeline,
+                               ss_cache=ScaleSpaceCache(max_items=1))
+
+
+def _register_series_volume(moving):
+    return affine_registration(
+        moving, _series_worker_args['ref'],
+        moving_affine=_series_worker_args['series_affine'],
+        static_affine=_series_worker_args['ref_affine'],
+        pipeline=_series_worker_args['pipeline'],
+        ss_cache=_series_worker_args['ss_cache'])
+
+
 def register_series(series, ref, pipeline=None, series_affine=None,
-                    ref_affine=None):
+                    ref_affine=None, num_processes=1):
     """Register a series to a reference image.
 
     Parameters
@@ -555,6 +599,13 @@ def register_series(series, ref, pipeline=None, series_affine=None,
         The affine. If provided, this input will over-ride the affine provided
         together with the nifti img or file.
 
+    num_processes : int, optional
+        Split the registration of the volumes to a pool of children
+        processes. The reference volume is sent only once to each process,
+        and its scale space is built only once per process. Default is 1.
+        If < 0 the maximal number of cores minus |num_processes + 1| is used
+        (enter -1 to use as many cores as possible). 0 raises an error.
+
     Returns
     -------
     xformed, affines : 4D array with transformed data and a (4,4,n) array
@@ -562,6 +613,7 @@ def register_series(series, ref, pipeline=None, series_affine=None,
     data that was used to transform it into register with the static data.
     """
     pipeline = pipeline or ["center_of_mass", "translation", "rigid", "affine"]
+    num_processes = determine_num_processes(num_processes)
 
     series, series_affine = read_img_arr_or_path(series,
                                                  affine=series_affine)
@@ -580,25 +632,44 @@ def register_series(series, ref, pipeline=None, series_affine=None,
 
     xformed = np.zeros(series.shape)
     affines = np.zeros((4, 4, series.shape[-1]))
+    to_register = []
     for ii in range(series.shape[-1]):
-        this_moving = series[..., ii]
         if isinstance(ref_as_idx, numbers.Number) and ii == ref_as_idx:
             # This is the reference! No need to move and the xform is I(4):
-            xformed[..., ii] = this_moving
+            xformed[..., ii] = series[..., ii]
             affines[..., ii] = np.eye(4)
         else:
-            transformed, reg_affine = affine_registration(
-                this_moving, ref,
-                moving_affine=series_affine,
-                static_affine=ref_affine,
-                pipeline=pipeline)
-            xformed[..., ii] = transformed
-            affines[..., ii] = reg_affine
+            to_register.append(ii)
+
+    num_processes = min(num_processes, len(to_register))
+    if num_processes <= 1:
+        ss_cache = ScaleSpaceCache(max_items=1)
+        results = (affine_registration(series[..., ii], ref,
+                                       moving_affine=series_affine,
+                                       static_affine=ref_affine,
+                                       pipeline=pipeline,
+                                       ss_cache=ss_cache)
+                   for ii in to_register)
+    else:
+        pool = Pool(num_processes, initializer=_init_series_worker,
+                    initargs=(ref, ref_affine, series_affine, pipeline))
+        # imap keeps the results in the order of the volumes
+        results = pool.imap(_register_series_volume,
+                            (series[..., ii] for ii in to_register))
+
+    for ii, (transformed, reg_affine) in zip(to_register, results):
+        xformed[..., ii] = transformed
+        affines[..., ii] = reg_affine
+
+    if num_processes > 1:
+        pool.close()
+        pool.join()
 
     return xformed, affines
 
 
-def register_dwi_series(data, gtab, affine=None, b0_ref=0, pipeline=None):
+def register_dwi_series(data, gtab, affine=None, b0_ref=0, pipeline=None,
+                        num_processes=1):
     """
     Register a DWI series to the mean of the B0 images in that series (all
     first registered to the first B0 volume)
@@ -626,6 +697,11 @@ def register_dwi_series(data, gtab, affine=None, b0_ref=0, pipeline=None):
         The transformations to perform in sequence (from left to right):
         Default: ``[center_of_mass, translation, rigid, affine]``
 
+    num_processes : int, optional
+        Split the registration of the volumes to a pool of children
+        processes. Default is 1. If < 0 the maximal number of cores minus
+        |num_processes + 1| is used (enter -1 to use as many cores as
+        possible). 0 raises an error.
 
     Returns
     -------
@@ -644,7 +720,8 @@ def register_dwi_series(data, gtab, affine=None, b0_ref=0, pipeline=None):
         # First, register the b0s into one image and average:
         b0_img = nib.Nifti1Image(data[..., gtab.b0s_mask], affine)
         trans_b0, b0_affines = register_series(b0_img, ref=b0_ref,
-                                               pipeline=pipeline)
+                                               pipeline=pipeline,
+                                               num_processes=num_processes)
         ref_data = np.mean(trans_b0, -1)
     else:
         # There's only one b0 and we register everything to it
@@ -656,7 +733,8 @@ def register_dwi_series(data, gtab, affine=None, b0_ref=0, pipeline=None):
     series_arr = np.concatenate([ref_data, moving_data], -1)
     series = nib.Nifti1Image(series_arr, affine)
 
-    xformed, affines = register_series(series, ref=0, pipeline=pipeline)
+    xformed, affines = register_series(series, ref=0, pipeline=pipeline,
+                                       num_processes=num_processes)
     # Cut out the part pertaining to that first volume:
     affines = affines[..., 1:]
     xformed = xformed[..., 1:]
@@ -0,0 +1,59 @@
+""" Benchmarks for the streamline-based linear registration (SLR)
+
+With Pytest, Run this benchmark with:
+
+    pytest -svv -c bench.ini /path/to/bench_streamlinear.py
+
+"""
+import numpy as np
+from numpy.testing import measure, assert_array_almost_equal
+
+from dipy.data import get_fnames
+from dipy.io.streamline import load_tractogram
+from dipy.tracking.streamline import Streamlines, transform_streamlines
+from dipy.align.streamlinear import (BundleMinDistanceMetric,
+                                     compose_matrix44, slr_with_qbx)
+
+
+def generate_tractogram(nb_streamlines, rng):
+    """ Jittered copies of the fornix until `nb_streamlines` are reached """
+    fname = get_fnames('fornix')
+    fornix = load_tractogram(fname, 'same',
+                             bbox_valid_check=False).streamlines
+    fornix = list(Streamlines(fornix))
+
+    streamlines = []
+    while len(streamlines) < nb_streamlines:
+        offset = rng.normal(0, 5, 3)
+        streamlines += [s + offset + rng.normal(0, 0.5, s.shape)
+                        for s in fornix]
+    return Streamlines(streamlines[:nb_streamlines])
+
+
+def bench_slr_with_qbx():
+    repeat = 1
+    nb_streamlines = 100000
+    rng = np.random.RandomState(42)
+
+    static = generate_tractogram(nb_streamlines, rng)
+    mat = compose_matrix44([5, 3, -2, 5, 0, 0])
+    moving = transform_streamlines(static, mat)
+
+    def run(dtype):
+        return slr_with_qbx(static, moving, x0='rigid', rm_small_clusters=2,
+                            greater_than=10, less_than=500,
+                            rng=np.random.RandomState(42),
+                            metric=BundleMinDistanceMetric(dtype=dtype))
+
+    print("Timing slr_with_qbx() with {0:,} streamlines.".format(
+          nb_streamlines))
+    f64_time = measure("run(np.float64)", repeat)
+    print("float64 time: {0:.3f} sec".format(f64_time))
+    f32_time = measure("run(np.float32)", repeat)
+    print("float32 time: {0:.3f} sec".format(f32_time))
+    print("Speed up of {0:.2f}x".format(f64_time / f32_time))
+
+    # Make sure both precisions find the same transformation.
+    _, mat64, _, _ = run(np.float64)
+    _, mat32, _, _ = run(np.float32)
+    assert_array_almost_equal(mat32, mat64, 2)
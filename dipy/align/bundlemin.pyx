@@ -10,24 +10,29 @@ cimport cython
 cimport safe_openmp as openmp
 from safe_openmp cimport have_openmp
 
-from cython.parallel import prange
+from cython.parallel import parallel, prange, threadid
 from libc.stdlib cimport malloc, free
 from libc.math cimport sqrt, sin, cos
 
+from dipy.align.fused_types cimport floating
 from dipy.utils.omp import cpu_count, determine_num_threads
 from dipy.utils.omp cimport set_num_threads, restore_default_num_threads
 
 cdef cnp.dtype f64_dt = np.dtype(np.float64)
 
+# Number of streamlines per tile in the blocked distance kernels. A tile of
+# static and a tile of moving streamlines of 20 points each fit in L1 cache.
+cdef cnp.npy_intp BLOCK_SIZE = 32
 
-cdef double min_direct_flip_dist(double *a,double *b,
+
+cdef double min_direct_flip_dist(floating *a, double *b,
                                  cnp.npy_intp rows) nogil:
     r""" Minimum of direct and flip average (MDF) distance [Garyfallidis12]
     between two streamlines.
 
     Parameters
     ----------
-    a : double pointer
+    a : float or double pointer
         first streamline
     b : double pointer
         second streamline
@@ -50,7 +55,6 @@ cdef double min_direct_flip_dist(double *a,double *b,
         cnp.npy_intp i=0, j=0
         double sub=0, subf=0, distf=0, dist=0, tmprow=0, tmprowf=0
 
-
     for i in range(rows):
         tmprow = 0
         tmprowf = 0
@@ -130,7 +134,7 @@ def _bundle_minimum_distance_matrix(double [:, ::1] static,
     return np.asarray(D)
 
 
-def _bundle_minimum_distance(double [:, ::1] static,
+def _bundle_minimum_distance(floating [:, ::1] static,
                              double [:, ::1] moving,
                              cnp.npy_intp static_size,
                              cnp.npy_intp moving_size,
@@ -144,9 +148,9 @@ def _bundle_minimum_distance(double [:, ::1] static,
     Parameters
     -----------
     static : array
-        Static streamlines
+        Static streamlines (float32 or float64)
     moving : array
-        Moving streamlines
+        Moving streamlines (float64)
     static_size : int
         Number of static streamlines
     moving_size : int
@@ -168,54 +172,79 @@ def _bundle_minimum_distance(double [:, ::1] static,
     -----
     The difference with ``_bundle_minimum_distance_matrix`` is that it does not
     save the full distance matrix and therefore needs much less memory.
+
+    The static streamlines, which are fixed during the optimization, can be
+    stored in single precision to halve their memory footprint. The moving
+    streamlines are transformed at every evaluation and are kept in double
+    precision, so that the cost function stays smooth with respect to the
+    transformation parameters (needed by finite-difference gradients).
+
+    The distances are computed tile by tile (``BLOCK_SIZE`` static by
+    ``BLOCK_SIZE`` moving streamlines) so that both tiles stay in cache. The
+    static tiles are distributed among the threads, and each thread keeps its
+    own minima for the moving streamlines, which are reduced at the end.
+    Therefore no locking is needed.
     """
 
     cdef:
-        cnp.npy_intp i=0, j=0
+        cnp.npy_intp i=0, j=0, t=0, ib=0, jb=0, i_end=0, j_end=0
+        cnp.npy_intp static_blocks, moving_blocks
         double sum_i=0, sum_j=0, tmp=0
         double inf = np.finfo('f8').max
         double dist=0
         double * min_j
         double * min_i
-        openmp.omp_lock_t lock
+        double * min_i_thread
         int threads_to_use = -1
+        int tid = 0
 
     threads_to_use = determine_num_threads(num_threads)
-    set_num_threads(threads_to_use)
+    if not have_openmp:
+        threads_to_use = 1
 
-    with nogil:
+    static_blocks = (static_size + BLOCK_SIZE - 1) // BLOCK_SIZE
+    moving_blocks = (moving_size + BLOCK_SIZE - 1) // BLOCK_SIZE
 
-        if have_openmp:
-            openmp.omp_init_lock(&lock)
+    min_j = <double *> malloc(static_size * sizeof(double))
+    min_i = <double *> malloc(threads_to_use * moving_size * sizeof(double))
 
-        min_j = <double *> malloc(static_size * sizeof(double))
-        min_i = <double *> malloc(moving_size * sizeof(double))
+    with nogil:
 
         for i in range(static_size):
             min_j[i] = inf
 
-        for j in range(moving_size):
+        for j in range(threads_to_use * moving_size):
             min_i[j] = inf
 
-        for i in prange(static_size):
-
+        with parallel(num_threads=threads_to_use):
+            tid = threadid()
+            min_i_thread = min_i + tid * moving_size
+
+            for ib in prange(static_blocks, schedule='dynamic'):
+                i_end = (ib + 1) * BLOCK_SIZE
+                if i_end > static_size:
+                    i_end = static_size
+
+                for jb in range(moving_blocks):
+                    j_end = (jb + 1) * BLOCK_SIZE
+                    if j_end > moving_size:
+                        j_end = moving_size
+
+                    for i in range(ib * BLOCK_SIZE, i_end):
+                        for j in range(jb * BLOCK_SIZE, j_end):
+                            tmp = min_direct_flip_dist(&static[i * rows, 0],
+                                                       &moving[j * rows, 0],
+                                                       rows)
+                            if tmp < min_j[i]:
+                                min_j[i] = tmp
+                            if tmp < min_i_thread[j]:
+                                min_i_thread[j] = tmp
+
+        # Reduce the minima found by each thread
+        for t in range(1, threads_to_use):
             for j in range(moving_size):
-
-                tmp = min_direct_flip_dist(&static[i * rows, 0],
-                                       &moving[j * rows, 0], rows)
-
-                if have_openmp:
-                    openmp.omp_set_lock(&lock)
-                if tmp < min_j[i]:
-                    min_j[i] = tmp
-
-                if tmp < min_i[j]:
-                    min_i[j] = tmp
-                if have_openmp:
-                    openmp.omp_unset_lock(&lock)
-
-        if have_openmp:
-            openmp.omp_destroy_lock(&lock)
+                if min_i[t * moving_size + j] < min_i[j]:
+                    min_i[j] = min_i[t * moving_size + j]
 
         for i in range(static_size):
             sum_i += min_j[i]
@@ -230,14 +259,10 @@ def _bundle_minimum_distance(double [:, ::1] static,
 
         dist = 0.25 * dist * dist
 
-    if num_threads is not None:
-        restore_default_num_threads()
-
     return dist
 
 
-
-def _bundle_minimum_distance_asymmetric(double [:, ::1] static,
+def _bundle_minimum_distance_asymmetric(floating [:, ::1] static,
                                         double [:, ::1] moving,
                                         cnp.npy_intp static_size,
                                         cnp.npy_intp moving_size,
@@ -250,9 +275,9 @@ def _bundle_minimum_distance_asymmetric(double [:, ::1] static,
     Parameters
     -----------
     static : array
-        Static streamlines
+        Static streamlines (float32 or float64)
     moving : array
-        Moving streamlines
+        Moving streamlines (float64)
     static_size : int
         Number of static streamlines
     moving_size : int
@@ -284,22 +309,20 @@ def _bundle_minimum_distance_asymmetric(double [:, ::1] static,
 
     cdef:
         cnp.npy_intp i=0, j=0
-        double sum_i=0, sum_j=0, tmp=0
+        double sum_i=0, tmp=0
         double inf = np.finfo('f8').max
         double dist=0
         double * min_j
-        openmp.omp_lock_t lock
 
     with nogil:
 
-        if have_openmp:
-            openmp.omp_init_lock(&lock)
-
         min_j = <double *> malloc(static_size * sizeof(double))
 
-        for sz_i in range(static_size):
-            min_j[sz_i] = inf
+        for i in range(static_size):
+            min_j[i] = inf
 
+        # Each static streamline is handled by a single thread, so its
+        # minimum can be updated without locking
         for i in prange(static_size):
 
             for j in range(moving_size):
@@ -307,17 +330,9 @@ def _bundle_minimum_distance_asymmetric(double [:, ::1] static,
                 tmp = min_direct_flip_dist(&static[i * rows, 0],
                                            &moving[j * rows, 0], rows)
 
-                if have_openmp:
-                    openmp.omp_set_lock(&lock)
                 if tmp < min_j[i]:
                     min_j[i] = tmp
 
-                if have_openmp:
-                    openmp.omp_unset_lock(&lock)
-
-        if have_openmp:
-            openmp.omp_destroy_lock(&lock)
-
         for i in range(static_size):
             sum_i += min_j[i]
 
@@ -371,22 +386,22 @@ def distance_matrix_mdf(streamlines_a, streamlines_b):
         tracksB64[i] = np.ascontiguousarray(streamlines_b[i], dtype=f64_dt)
     # preallocate buffer array for track distance calculations
     cdef:
-        cnp.float64_t *t1_ptr
-        cnp.float64_t *t2_ptr
+        double *t1_ptr
+        double *t2_ptr
         cnp.float64_t *min_buffer
     # cycle over tracks
     cdef:
         cnp.ndarray [cnp.float64_t, ndim=2] t1, t2
-        cnp.npy_intp t1_len, t2_len
+        cnp.npy_intp t1_len, t2_len, t_len
         double d[2]
     t_len = tracksA64[0].shape[0]
 
     for i from 0 <= i < lentA:
         t1 = tracksA64[i]
-        t1_ptr = <cnp.float64_t *> cnp.PyArray_DATA(t1)
+        t1_ptr = <double *> cnp.PyArray_DATA(t1)
         for j from 0 <= j < lentB:
             t2 = tracksB64[j]
-            t2_ptr = <cnp.float64_t *> cnp.PyArray_DATA(t2)
+            t2_ptr = <double *> cnp.PyArray_DATA(t2)
 
             DM[i, j] = min_direct_flip_dist(t1_ptr, t2_ptr,t_len)
 
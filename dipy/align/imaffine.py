@@ -798,7 +798,8 @@ class AffineRegistration(object):
                  method='L-BFGS-B',
                  ss_sigma_factor=None,
                  options=None,
-                 verbosity=VerbosityLevels.STATUS):
+                 verbosity=VerbosityLevels.STATUS,
+                 ss_cache=None):
         """Initialize an instance of the AffineRegistration class.
 
         Parameters
@@ -839,9 +840,16 @@ class AffineRegistration(object):
         options : dict, optional
             extra optimization options. The default is None, implying
             no extra options are passed to the optimizer.
+        ss_cache : None or ScaleSpaceCache, optional
+            if given, the scale space of the static image is taken from (and
+            stored in) this cache, so that it is built only once when the
+            same static image is used in several registrations. The default
+            is None, implying the scale space is built for every call to
+            `optimize`.
 
         """
         self.metric = metric
+        self.ss_cache = ss_cache
 
         if self.metric is None:
             self.metric = MutualInformationMetric()
@@ -975,19 +983,28 @@ class AffineRegistration(object):
                                                  self.sigmas,
                                                  moving_grid2world,
                                                  moving_spacing, False)
-
-            self.static_ss = IsotropicScaleSpace(static, self.factors,
-                                                 self.sigmas,
-                                                 static_grid2world,
-                                                 static_spacing, False)
+            if self.ss_cache is None:
+                self.static_ss = IsotropicScaleSpace(static, self.factors,
+                                                     self.sigmas,
+                                                     static_grid2world,
+                                                     static_spacing, False)
+            else:
+                self.static_ss = self.ss_cache.get_isotropic_scale_space(
+                    static, self.factors, self.sigmas, static_grid2world,
+                    static_spacing, False)
         else:
             self.moving_ss = ScaleSpace(moving, self.levels, moving_grid2world,
                                         moving_spacing, self.ss_sigma_factor,
                                         False)
-
-            self.static_ss = ScaleSpace(static, self.levels, static_grid2world,
-                                        static_spacing, self.ss_sigma_factor,
-                                        False)
+            if self.ss_cache is None:
+                self.static_ss = ScaleSpace(static, self.levels,
+                                            static_grid2world,
+                                            static_spacing,
+                                            self.ss_sigma_factor, False)
+            else:
+                self.static_ss = self.ss_cache.get_scale_space(
+                    static, self.levels, static_grid2world, static_spacing,
+                    self.ss_sigma_factor, False)
 
     def optimize(self, static, moving, transform, params0,
                  static_grid2world=None, moving_grid2world=None,
@@ -890,7 +890,8 @@ class SymmetricDiffeomorphicRegistration(DiffeomorphicRegistration):
                  opt_tol=1e-5,
                  inv_iter=20,
                  inv_tol=1e-3,
-                 callback=None):
+                 callback=None,
+                 ss_cache=None):
         """ Symmetric Diffeomorphic Registration (SyN) Algorithm
 
         Performs the multi-resolution optimization algorithm for non-linear
@@ -924,6 +925,12 @@ class SymmetricDiffeomorphicRegistration(DiffeomorphicRegistration):
             a function receiving a SymmetricDiffeomorphicRegistration object
             to be called after each iteration (this optimizer will call this
             function passing self as parameter)
+        ss_cache : None or ScaleSpaceCache, optional
+            if given, the scale space of the static image is taken from (and
+            stored in) this cache, so that it is built only once when the
+            same static image (e.g. a template) is used in several
+            registrations. The default is None, implying the scale space is
+            built for every call to `optimize`.
         """
         super(SymmetricDiffeomorphicRegistration, self).__init__(metric)
         if level_iters is None:
@@ -943,6 +950,7 @@ class SymmetricDiffeomorphicRegistration(DiffeomorphicRegistration):
         self.full_energy_profile = []
         self.verbosity = VerbosityLevels.STATUS
         self.callback = callback
+        self.ss_cache = ss_cache
         self.moving_ss = None
         self.static_ss = None
         self.static_direction = None
@@ -1082,9 +1090,14 @@ class SymmetricDiffeomorphicRegistration(DiffeomorphicRegistration):
                         ' Levels: %d. Sigma factor: %f.' %
                         (self.levels, self.ss_sigma_factor))
 
-        self.static_ss = ScaleSpace(static, self.levels, static_grid2world,
-                                    static_spacing, self.ss_sigma_factor,
-                                    self.mask0)
+        if self.ss_cache is None:
+            self.static_ss = ScaleSpace(static, self.levels, static_grid2world,
+                                        static_spacing, self.ss_sigma_factor,
+                                        self.mask0)
+        else:
+            self.static_ss = self.ss_cache.get_scale_space(
+                static, self.levels, static_grid2world, static_spacing,
+                self.ss_sigma_factor, self.mask0)
 
         if self.verbosity >= VerbosityLevels.DEBUG:
             logger.info('Moving scale space:')
@@ -1,11 +1,18 @@
+import hashlib
 import logging
+import os
+import tempfile
+from collections import OrderedDict
+
 from dipy.align import floating
+from dipy.io.pickles import save_pickle, load_pickle
 import numpy as np
 import numpy.linalg as npl
 from scipy.ndimage import gaussian_filter
 
 logger = logging.getLogger(__name__)
 
+
 class ScaleSpace(object):
     def __init__(self, image, num_levels,
                  image_grid2world=None,
@@ -422,3 +429,152 @@ class IsotropicScaleSpace(ScaleSpace):
             self.affines.append(affine)
             self.affine_invs.append(npl.inv(affine))
             self.sigmas.append(new_sigmas)
+
+
+class ScaleSpaceCache(object):
+    def __init__(self, max_items=4, cache_dir=None):
+        """ ScaleSpaceCache
+
+        Keeps the scale spaces of previously seen images, so that registering
+        many images to the same static image (e.g. a template, or the
+        reference volume of a series) builds its pyramid only once. Scale
+        spaces are keyed on the content of the image and on all the
+        parameters used to build them, and are evicted in least-recently-used
+        order. Optionally, they are also stored on disk, so that they can be
+        reused across sessions.
+
+        The scale spaces returned by the cache are shared and must be treated
+        as read-only.
+
+        Parameters
+        ----------
+        max_items : int, optional
+            the maximum number of scale spaces kept in memory. The default
+            is 4.
+        cache_dir : str, optional
+            directory where the scale spaces are persisted. If None (default),
+            the cache only lives in memory. The files of this directory are
+            unpickled, so it must not be writable by untrusted users.
+            Unreadable files are rebuilt and overwritten.
+        """
+        if max_items < 1:
+            raise ValueError('max_items must be a positive integer')
+        self.max_items = max_items
+        self.cache_dir = cache_dir
+        if cache_dir is not None and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        self._items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def clear(self):
+        """Remove all the scale spaces held in memory
+
+        Files persisted in `cache_dir` are kept.
+        """
+        self._items.clear()
+
+    def _key(self, kind, image, *params):
+        image = np.ascontiguousarray(image)
+        digest = hashlib.sha1()
+        digest.update(kind.encode())
+        digest.update(str(image.dtype).encode())
+        digest.update(str(image.shape).encode())
+        digest.update(image.data)
+        for param in params:
+            if param is None:
+                digest.update(b'None')
+            else:
+                param = np.ascontiguousarray(param, dtype=np.float64)
+                digest.update(str(param.shape).encode())
+                digest.update(param.data)
+        return digest.hexdigest()
+
+    def _get(self, key, build):
+        if key in self._items:
+            self._items.move_to_end(key)
+            self.hits += 1
+            return self._items[key]
+
+        fname = None
+        ss = None
+        if self.cache_dir is not None:
+            fname = os.path.join(self.cache_dir, key + '.pkl')
+            if os.path.isfile(fname):
+                ss = self._load(fname)
+        if ss is not None:
+            self.hits += 1
+        else:
+            ss = build()
+            self.misses += 1
+            if fname is not None:
+                self._save(fname, ss)
+
+        self._items[key] = ss
+        while len(self._items) > self.max_items:
+            self._items.popitem(last=False)
+        return ss
+
+    def _load(self, fname):
+        try:
+            return load_pickle(fname)
+        except Exception as e:
+            logger.warning('Ignoring unreadable cached scale space %s: %s',
+                           fname, e)
+            return None
+
+    def _save(self, fname, ss):
+        # Write to a temporary file renamed at the end, so that concurrent
+        # readers never see a partially written file
+        fd, tmp_fname = tempfile.mkstemp(suffix='.tmp', dir=self.cache_dir)
+        os.close(fd)
+        try:
+            save_pickle(tmp_fname, ss)
+            os.replace(tmp_fname, fname)
+        except BaseException:
+            os.remove(tmp_fname)
+            raise
+
+    def get_scale_space(self, image, num_levels, image_grid2world=None,
+                        input_spacing=None, sigma_factor=0.2, mask0=False):
+        """Cached version of ScaleSpace
+
+        Returns the ScaleSpace of the image, building it only if it is not
+        already in the cache. The parameters are those of ScaleSpace.
+
+        Returns
+        -------
+        ss : instance of ScaleSpace
+            the (shared) scale space of the image
+        """
+        key = self._key('ScaleSpace', image, num_levels, image_grid2world,
+                        input_spacing, sigma_factor, mask0)
+        return self._get(key, lambda: ScaleSpace(image, num_levels,
+                                                 image_grid2world,
+                                                 input_spacing, sigma_factor,
+                                                 mask0))
+
+    def get_isotropic_scale_space(self, image, factors, sigmas,
+                                  image_grid2world=None, input_spacing=None,
+                                  mask0=False):
+        """Cached version of IsotropicScaleSpace
+
+        Returns the IsotropicScaleSpace of the image, building it only if it
+        is not already in the cache. The parameters are those of
+        IsotropicScaleSpace.
+
+        Returns
+        -------
+        ss : instance of IsotropicScaleSpace
+            the (shared) scale space of the image
+        """
+        key = self._key('IsotropicScaleSpace', image, factors, sigmas,
+                        image_grid2world, input_spacing, mask0)
+        return self._get(key, lambda: IsotropicScaleSpace(image, factors,
+                                                          sigmas,
+                                                          image_grid2world,
+                                                          input_spacing,
+                                                          mask0))
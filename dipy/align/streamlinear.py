@@ -76,6 +76,28 @@ class BundleMinDistanceMetric(StreamlineDistanceMetric):
                         2014.
     """
 
+    def __init__(self, num_threads=None, dtype=np.float64):
+        """ Bundle-based Minimum Distance aka BMD
+
+        Parameters
+        ----------
+        num_threads : int, optional
+            Number of threads to be used for OpenMP parallelization. If None
+            (default) the value of OMP_NUM_THREADS environment variable is used
+            if it is set, otherwise all available threads are used. If < 0 the
+            maximal number of threads minus |num_threads + 1| is used (enter -1
+            to use as many threads as possible). 0 raises an error.
+        dtype : np.float32 or np.float64, optional
+            Precision in which the static streamlines are stored. np.float32
+            halves the memory traffic of the distance kernel. The moving
+            streamlines are always transformed in double precision.
+            Default np.float64.
+        """
+        super(BundleMinDistanceMetric, self).__init__(num_threads=num_threads)
+        if np.dtype(dtype) not in (np.float32, np.float64):
+            raise ValueError('dtype must be np.float32 or np.float64')
+        self.dtype = dtype
+
     def setup(self, static, moving):
         """ Setup static and moving sets of streamlines
 
@@ -97,7 +119,7 @@ class BundleMinDistanceMetric(StreamlineDistanceMetric):
     def _set_static(self, static):
         static_centered_pts, st_idx = unlist_streamlines(static)
         self.static_centered_pts = np.ascontiguousarray(static_centered_pts,
-                                                        dtype=np.float64)
+                                                        dtype=self.dtype)
         self.block_size = st_idx[0]
 
     def _set_moving(self, moving):
@@ -614,7 +636,8 @@ def bundle_min_distance_fast(t, static, moving, block_size, num_threads=None):
     static : array
         N*M x 3 array. All the points of the static streamlines. With order of
         streamlines intact. Where N is the number of streamlines and M
-        is the number of points per streamline.
+        is the number of points per streamline. It can be float32 to halve
+        its memory footprint; otherwise it is used in double precision.
 
     moving : array
         K*M x 3 array. All the points of the moving streamlines. With order of
@@ -646,6 +669,9 @@ def bundle_min_distance_fast(t, static, moving, block_size, num_threads=None):
 
     """
 
+    if static.dtype != np.float32:
+        static = np.ascontiguousarray(static, dtype=np.float64)
+
     aff = compose_matrix44(t)
     moving = np.dot(aff[:3, :3], moving.T).T + aff[:3, 3]
     moving = np.ascontiguousarray(moving, dtype=np.float64)
@@ -680,7 +706,8 @@ def bundle_min_distance_asymmetric_fast(t, static, moving, block_size):
     static : array
         N*M x 3 array. All the points of the static streamlines. With order of
         streamlines intact. Where N is the number of streamlines and M
-        is the number of points per streamline.
+        is the number of points per streamline. It can be float32 to halve
+        its memory footprint; otherwise it is used in double precision.
 
     moving : array
         K*M x 3 array. All the points of the moving streamlines. With order of
@@ -696,6 +723,9 @@ def bundle_min_distance_asymmetric_fast(t, static, moving, block_size):
     cost: float
     """
 
+    if static.dtype != np.float32:
+        static = np.ascontiguousarray(static, dtype=np.float64)
+
     aff = compose_matrix44(t)
     moving = np.dot(aff[:3, :3], moving.T).T + aff[:3, 3]
     moving = np.ascontiguousarray(moving, dtype=np.float64)
@@ -737,6 +767,7 @@ def progressive_slr(static, moving, metric, x0, bounds, method='L-BFGS-B',
     static : Streamlines
     moving : Streamlines
     metric : StreamlineDistanceMetric
+        If None, ``BundleMinDistanceMetric`` is used with `num_threads`.
     x0 : string
         Could be any of 'translation', 'rigid', 'similarity', 'scaling',
         'affine'
@@ -764,6 +795,9 @@ def progressive_slr(static, moving, metric, x0, bounds, method='L-BFGS-B',
     if verbose:
         logger.info('Progressive Registration is Enabled')
 
+    if metric is None:
+        metric = BundleMinDistanceMetric(num_threads=num_threads)
+
     if x0 == 'translation' or x0 == 'rigid' or \
        x0 == 'similarity' or x0 == 'scaling' or x0 == 'affine':
         if verbose:
@@ -859,7 +893,8 @@ def slr_with_qbx(static, moving,
                  less_than=250,
                  qbx_thr=[40, 30, 20, 15],
                  nb_pts=20,
-                 progressive=True, rng=None, num_threads=None):
+                 progressive=True, rng=None, num_threads=None,
+                 metric=None):
     """ Utility function for registering large tractograms.
 
     For efficiency, we apply the registration on cluster centroids and remove
@@ -910,6 +945,12 @@ def slr_with_qbx(static, moving,
         use as many threads as possible). 0 raises an error. Only metrics
         using OpenMP will use this variable.
 
+    metric : StreamlineDistanceMetric, optional
+        Metric used by the registration of the centroids. If None (default),
+        ``BundleMinDistanceMetric`` is used with `num_threads`. For example,
+        ``BundleMinDistanceMetric(dtype=np.float32)`` uses the single
+        precision distance kernel.
+
     Notes
     -----
     The order of operations is the following. First short or long streamlines
@@ -983,7 +1024,7 @@ def slr_with_qbx(static, moving,
         t = time()
 
     if not progressive:
-        slr = StreamlineLinearRegistration(x0=x0,
+        slr = StreamlineLinearRegistration(metric=metric, x0=x0,
                                            options={'maxiter': maxiter},
                                            num_threads=num_threads)
         slm = slr.optimize(qb_centroids1, qb_centroids2)
@@ -991,7 +1032,7 @@ def slr_with_qbx(static, moving,
         bounds = DEFAULT_BOUNDS
 
         slm = progressive_slr(qb_centroids1, qb_centroids2,
-                              x0=x0, metric=None,
+                              x0=x0, metric=metric,
                               bounds=bounds, num_threads=num_threads)
 
     if verbose:
@@ -221,6 +221,23 @@ def test_register_series():
     npt.assert_(np.all(xformed[..., ref_idx] == img.get_fdata()[..., ref_idx]))
 
 
+def test_register_series_parallel():
+    fdata, fbval, fbvec = dpd.get_fnames('small_64D')
+    img = nib.load(fdata)
+    data = img.get_fdata()[..., :6]
+    xformed, affines = register_series(data, 0, series_affine=img.affine,
+                                       pipeline=['center_of_mass', 'rigid'])
+    xformed_p, affines_p = register_series(data, 0,
+                                           series_affine=img.affine,
+                                           pipeline=['center_of_mass',
+                                                     'rigid'],
+                                           num_processes=2)
+    npt.assert_almost_equal(affines_p, affines)
+    npt.assert_almost_equal(xformed_p, xformed)
+    npt.assert_raises(ValueError, register_series, data, 0,
+                      series_affine=img.affine, num_processes=0)
+
+
 def test_register_dwi_series_and_motion_correction():
     fdata, fbval, fbvec = dpd.get_fnames('small_64D')
     with nbtmp.InTemporaryDirectory() as tmpdir:
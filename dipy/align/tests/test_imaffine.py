@@ -14,6 +14,7 @@ from dipy.align import vector_fields as vf
 from dipy.align import imaffine
 from dipy.align.imaffine import AffineInversionError, AffineInvalidValuesError, \
     AffineMap, _number_dim_affine_matrix
+from dipy.align.scalespace import ScaleSpaceCache
 from dipy.align.transforms import (Transform,
                                    regtransforms)
 from dipy.align.tests.test_parzenhist import (setup_random_transform,
@@ -230,6 +231,25 @@ def test_affreg_all_transforms():
     assert_raises(ValueError, imaffine.AffineRegistration, metric, [])
 
 
+def test_affreg_ss_cache():
+    trans = regtransforms[('RIGID', 3)]
+    static, moving, static_g2w, moving_g2w, smask, mmask, T = \
+        setup_random_transform(trans, factors[('RIGID', 3)][0], 45, 1.0)
+    x0 = trans.get_identity_parameters()
+    affreg = imaffine.AffineRegistration(level_iters=[100, 10, 5])
+    expected = affreg.optimize(static, moving, trans, x0, static_g2w,
+                               moving_g2w)
+
+    cache = ScaleSpaceCache()
+    affreg = imaffine.AffineRegistration(level_iters=[100, 10, 5],
+                                         ss_cache=cache)
+    for _ in range(2):
+        actual = affreg.optimize(static, moving, trans, x0, static_g2w,
+                                 moving_g2w)
+        assert_array_almost_equal(actual.affine, expected.affine)
+    assert_equal((cache.hits, cache.misses), (1, 1))
+
+
 def test_affreg_defaults():
     # Test all default arguments with an arbitrary transform
     # Select an arbitrary transform (all of them are already tested
@@ -1,3 +1,5 @@
+import os
+
 import numpy as np
 import scipy as sp
 from numpy.testing import (assert_array_equal,
@@ -8,7 +10,9 @@ from numpy.testing import (assert_array_equal,
 from dipy.align import floating
 from dipy.align.imwarp import get_direction_and_spacings
 from dipy.align.scalespace import (ScaleSpace,
-                          IsotropicScaleSpace)
+                                   IsotropicScaleSpace,
+                                   ScaleSpaceCache)
+from nibabel.tmpdirs import InTemporaryDirectory
 from dipy.align.tests.test_imwarp import get_synthetic_warped_circle
 
 
@@ -88,3 +92,67 @@ def test_scale_space_exceptions():
         img = ss.get_image(level)
         z = (img == 0).astype(np.int32)
         assert_array_equal(zeros, z)
+
+
+def test_scale_space_cache():
+    moving, static = get_synthetic_warped_circle(20)
+    input_spacing = np.array([1.1, 1.2, 1.5])
+    grid2world = np.diag(tuple(input_spacing) + (1.0,))
+    factors = [4, 2, 1]
+    sigmas = [3.0, 1.0, 0.0]
+
+    assert_raises(ValueError, ScaleSpaceCache, 0)
+
+    cache = ScaleSpaceCache(max_items=2)
+    ss = cache.get_isotropic_scale_space(static, factors, sigmas, grid2world,
+                                         input_spacing)
+    expected = IsotropicScaleSpace(static, factors, sigmas, grid2world,
+                                   input_spacing)
+    for level in range(3):
+        assert_array_equal(ss.get_image(level), expected.get_image(level))
+        assert_array_equal(ss.get_affine(level), expected.get_affine(level))
+
+    # The same content and parameters give back the same object
+    ss2 = cache.get_isotropic_scale_space(static.copy(), factors, sigmas,
+                                          grid2world, input_spacing)
+    assert_equal(ss2 is ss, True)
+    assert_equal((cache.hits, cache.misses), (1, 1))
+
+    # Different parameters or content build a new scale space
+    ss3 = cache.get_scale_space(static, 3, grid2world, input_spacing)
+    assert_equal(isinstance(ss3, IsotropicScaleSpace), False)
+    cache.get_isotropic_scale_space(moving, factors, sigmas, grid2world,
+                                    input_spacing)
+    assert_equal(cache.misses, 3)
+
+    # The least recently used entry was evicted
+    assert_equal(len(cache), 2)
+    ss4 = cache.get_isotropic_scale_space(static, factors, sigmas,
+                                          grid2world, input_spacing)
+    assert_equal(ss4 is ss, False)
+    assert_equal(cache.misses, 4)
+
+    # Persisted scale spaces are reloaded by a new cache
+    with InTemporaryDirectory() as tmpdir:
+        cache = ScaleSpaceCache(cache_dir=tmpdir)
+        ss = cache.get_scale_space(static, 3, grid2world, input_spacing)
+        cache = ScaleSpaceCache(cache_dir=tmpdir)
+        ss2 = cache.get_scale_space(static, 3, grid2world, input_spacing)
+        assert_equal((cache.hits, cache.misses), (1, 0))
+        for level in range(3):
+            assert_array_equal(ss2.get_image(level), ss.get_image(level))
+            assert_array_equal(ss2.get_sigmas(level), ss.get_sigmas(level))
+        # No temporary file is left behind
+        assert_equal(len(os.listdir(tmpdir)), 1)
+
+        # A truncated file is a cache miss, and is rebuilt
+        fname = os.path.join(tmpdir, os.listdir(tmpdir)[0])
+        with open(fname, 'r+b') as f:
+            f.truncate(10)
+        cache = ScaleSpaceCache(cache_dir=tmpdir)
+        ss3 = cache.get_scale_space(static, 3, grid2world, input_spacing)
+        assert_equal((cache.hits, cache.misses), (0, 1))
+        assert_array_equal(ss3.get_image(0), ss.get_image(0))
+        cache = ScaleSpaceCache(cache_dir=tmpdir)
+        cache.get_scale_space(static, 3, grid2world, input_spacing)
+        assert_equal((cache.hits, cache.misses), (1, 0))
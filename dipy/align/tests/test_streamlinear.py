@@ -286,6 +286,47 @@ def test_openmp_locks():
     assert_almost_equal(dist1, dist2, 6)
 
 
+def test_bundle_minimum_distance_float32():
+
+    rng = np.random.RandomState(42)
+    pts = 20
+    # Sizes that are not multiples of the tile size
+    static = [rng.rand(pts, 3) for i in range(101)]
+    moving = [s + 2 for s in static[3:]]
+
+    points, offsets = unlist_streamlines(static)
+    points2, offsets2 = unlist_streamlines(moving)
+
+    D = np.zeros((len(offsets), len(offsets2)), dtype='f8')
+    _bundle_minimum_distance_matrix(points, points2,
+                                    len(offsets), len(offsets2),
+                                    pts, D)
+    expected = 0.25 * (np.sum(np.min(D, axis=0)) / float(D.shape[1]) +
+                       np.sum(np.min(D, axis=1)) / float(D.shape[0])) ** 2
+
+    for num_threads in [1, 2, 3]:
+        dist = _bundle_minimum_distance(points, points2,
+                                        len(offsets), len(offsets2),
+                                        pts, num_threads)
+        assert_almost_equal(dist, expected)
+
+        dist32 = _bundle_minimum_distance(points.astype(np.float32),
+                                          points2,
+                                          len(offsets), len(offsets2),
+                                          pts, num_threads)
+        assert_almost_equal(dist32, expected, 4)
+
+    assert_raises(ValueError, BundleMinDistanceMetric, dtype=np.int32)
+
+    x_test = [0.01, 0, 0, 0, 0, 0]
+    bmd = BundleMinDistanceMetric()
+    bmd.setup(static, moving)
+    bmd32 = BundleMinDistanceMetric(dtype=np.float32)
+    bmd32.setup(static, moving)
+    assert_equal(bmd32.static_centered_pts.dtype, np.float32)
+    assert_almost_equal(bmd32.distance(x_test), bmd.distance(x_test), 4)
+
+
 def test_from_to_rigid():
 
     t = np.array([10, 2, 3, 0.1, 20., 30.])
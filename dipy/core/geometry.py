@@ -916,8 +916,9 @@ def perpendicular_directions(v, num=30, half=False):
 
     Parameters
     -----------
-    v : array (3,)
-        Array containing the three cartesian coordinates of vector v
+    v : array (3,) or (N, 3)
+        Array containing the three cartesian coordinates of vector v, or of
+        N vectors.
     num : int, optional
         Number of perpendicular directions to generate
     half : bool, optional
@@ -928,7 +929,7 @@ def perpendicular_directions(v, num=30, half=False):
 
     Returns
     -------
-    psamples : array (n, 3)
+    psamples : array (n, 3) or (N, n, 3)
         array of vectors perpendicular to v
 
     Notes
@@ -983,7 +984,7 @@ def perpendicular_directions(v, num=30, half=False):
     v = np.array(v, dtype=float)
 
     # Float error used for floats comparison
-    er = np.finfo(v[0]).eps * 1e3
+    er = np.finfo(v.dtype).eps * 1e3
 
     # Define circumference or semi-circumference
     if half is True:
@@ -993,18 +994,23 @@ def perpendicular_directions(v, num=30, half=False):
 
     cosa = np.cos(a)
     sina = np.sin(a)
+    vx = v[..., 0, None]
+    vy = v[..., 1, None]
+    vz = v[..., 2, None]
 
     # Check if vector is not aligned to the x axis
-    if abs(v[0] - 1.) > er:
-        sq = np.sqrt(v[1]**2 + v[2]**2)
-        psamples = np.array([- sq*sina, (v[0]*v[1]*sina - v[2]*cosa) / sq,
-                             (v[0]*v[2]*sina + v[1]*cosa) / sq])
-    else:
-        sq = np.sqrt(v[0]**2 + v[2]**2)
-        psamples = np.array([- (v[2]*cosa + v[0]*v[1]*sina) / sq, sina*sq,
-                             (v[0]*cosa - v[2]*v[1]*sina) / sq])
-
-    return psamples.T
+    aligned = np.abs(vx - 1.) <= er
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sq = np.sqrt(vy**2 + vz**2)
+        psamples = np.stack([- sq*sina, (vx*vy*sina - vz*cosa) / sq,
+                             (vx*vz*sina + vy*cosa) / sq], axis=-1)
+        if np.any(aligned):
+            sq = np.sqrt(vx**2 + vz**2)
+            xsamples = np.stack([- (vz*cosa + vx*vy*sina) / sq, sina*sq,
+                                 (vx*cosa - vz*vy*sina) / sq], axis=-1)
+            psamples = np.where(aligned[..., None], xsamples, psamples)
+
+    return psamples
 
 
 def dist_to_corner(affine):
@@ -4,6 +4,7 @@ import abc
 import numpy as np
 import scipy.sparse as sps
 import scipy.optimize as opt
+from scipy.sparse.linalg import aslinearoperator
 from scipy.optimize import minimize
 
 
@@ -289,6 +290,184 @@ def sparse_nnls(y, X,
         iteration += 1
 
 
+def sbb_nnls(y, X, max_iter=1000, tol=1e-4):
+    """
+    Solve y=Xh for h >= 0 with the subspace Barzilai-Borwein method.
+
+    This is a projected gradient method whose step sizes alternate between
+    the two Barzilai-Borwein steps, computed on the free variables (the ones
+    that are not held at 0 by the constraint) [Kim2013]_. It converges much
+    faster than :func:`sparse_nnls` and only needs one product with `X` and
+    one with its transpose per iteration.
+
+    Parameters
+    ----------
+    y : 1-d array of shape (N)
+        The data. Needs to be dense.
+
+    X : ndarray, sparse matrix or LinearOperator. Shape (N, M)
+       The regressors
+
+    max_iter : int, optional (default: 1000)
+        Maximum number of iterations.
+
+    tol : float, optional (default: 1e-4)
+        The iterations stop when the norm of the projected gradient is lower
+        than `tol` times its initial value.
+
+    Returns
+    -------
+    h : The estimate of the parameters.
+
+    References
+    ----------
+    .. [Kim2013] Kim, D., Sra, S., and Dhillon, I. S. (2013). A non-monotonic
+       method for large-scale non-negative least squares. Optimization
+       Methods and Software, 28(5), 1012-1039.
+
+    """
+    X = aslinearoperator(X)
+    h = np.zeros(X.shape[1])
+    gradient = -X.rmatvec(y)
+    pg_norm_0 = None
+    for iteration in range(max_iter):
+        # Projected gradient, on the free variables
+        free = (h > 0) | (gradient < 0)
+        pg = np.where(free, gradient, 0)
+        pg_norm = np.sqrt(np.dot(pg, pg))
+        if pg_norm_0 is None:
+            pg_norm_0 = pg_norm
+        if pg_norm == 0 or pg_norm <= tol * pg_norm_0:
+            break
+
+        step = 0
+        if iteration > 0:
+            s = (h - h_old)[free]
+            dg = (gradient - gradient_old)[free]
+            s_dg = np.dot(s, dg)
+            if s_dg > 0:
+                if iteration % 2:
+                    step = np.dot(s, s) / s_dg
+                else:
+                    step = s_dg / np.dot(dg, dg)
+        if not step > 0:
+            # Exact line search along the projected gradient
+            X_pg = X.matvec(pg)
+            step = pg_norm ** 2 / np.dot(X_pg, X_pg)
+
+        h_old, gradient_old = h, gradient
+        h = np.maximum(h - step * pg, 0)
+        gradient = X.rmatvec(X.matvec(h) - y)
+    return h
+
+
+def batch_levenberg_marquardt(residuals_func, x0, bounds=None, max_iter=100,
+                              ftol=1.49e-8, xtol=1.49e-8):
+    """
+    Minimize the sums of squared residuals of several independent problems
+    at once with the Levenberg-Marquardt algorithm.
+
+    Parameters
+    ----------
+    residuals_func : callable
+        ``residuals_func(x, index)`` returns the residuals (k, m) and their
+        Jacobians (k, m, p) of the problems `index` (k, ) at `x` (k, p).
+
+    x0 : ndarray (n, p)
+        Initial parameters of the n problems.
+
+    bounds : tuple of array_like, optional
+        Lower and upper bounds of the parameters, broadcastable to (n, p).
+        The initial parameters must be within the bounds. Default: None (no
+        bounds).
+
+    max_iter : int, optional (default: 100)
+        Maximum number of iterations.
+
+    ftol : float, optional (default: 1.49e-8)
+        Relative reduction of the sum of squares below which a problem has
+        converged.
+
+    xtol : float, optional (default: 1.49e-8)
+        Relative step size below which a problem has converged.
+
+    Returns
+    -------
+    x : ndarray (n, p)
+        The parameters minimizing the sum of squared residuals of each
+        problem.
+
+    Notes
+    -----
+    As in MINPACK's ``lmder`` (used by ``scipy.optimize.leastsq``), the
+    damping term is scaled by the diagonal of the approximated Hessian, so
+    the steps do not depend on the scale of the parameters. The parameters
+    held at a bound by the gradient are not updated, the other steps leaving
+    the bounds are projected on them, and steps are only accepted if they
+    reduce the sum of squares. The problems that converged are removed from the
+    following iterations, so the cost of an iteration decreases as the
+    problems converge.
+
+    """
+    x = np.array(x0, dtype=float)
+    n, nparams = x.shape
+    if bounds is not None:
+        lb = np.broadcast_to(np.asarray(bounds[0], dtype=float), x.shape)
+        ub = np.broadcast_to(np.asarray(bounds[1], dtype=float), x.shape)
+    residuals, jacobian = residuals_func(x, np.arange(n))
+    cost = np.sum(residuals ** 2, axis=-1)
+    active = np.flatnonzero(np.isfinite(cost))
+    lam = np.full(n, 1e-3)
+    diag = np.arange(nparams)
+    for _ in range(max_iter):
+        if not len(active):
+            break
+        p = x[active]
+        J = jacobian[active]
+        JT = np.swapaxes(J, -1, -2)
+        A = np.matmul(JT, J)
+        g = np.matmul(JT, residuals[active][..., None])
+        scale = A[:, diag, diag]
+        scale = np.maximum(scale, 1e-12 * scale.max(axis=-1, keepdims=True))
+        scale[scale == 0] = 1
+        A[:, diag, diag] += lam[active, None] * scale
+        if bounds is not None:
+            # Parameters held at a bound by the gradient are not updated
+            fixed = (((p <= lb[active]) & (g[..., 0] > 0)) |
+                     ((p >= ub[active]) & (g[..., 0] < 0)))
+            A[fixed[:, :, None] | fixed[:, None, :]] = 0
+            A[:, diag, diag] += fixed
+            g[fixed] = 0
+        try:
+            step = -np.linalg.solve(A, g)[..., 0]
+        except np.linalg.LinAlgError:
+            step = -np.matmul(np.linalg.pinv(A), g)[..., 0]
+        new_p = p + step
+        if bounds is not None:
+            new_p = np.clip(new_p, lb[active], ub[active])
+            step = new_p - p
+        new_residuals, new_jacobian = residuals_func(new_p, active)
+        new_cost = np.sum(new_residuals ** 2, axis=-1)
+        old_cost = cost[active]
+
+        better = new_cost < old_cost
+        index = active[better]
+        x[index] = new_p[better]
+        residuals[index] = new_residuals[better]
+        jacobian[index] = new_jacobian[better]
+        cost[index] = new_cost[better]
+        lam[index] /= 10
+        lam[active[~better]] *= 10
+
+        small_step = np.sqrt(np.sum(step ** 2, axis=-1)) <= \
+            xtol * (np.sqrt(np.sum(p ** 2, axis=-1)) + xtol)
+        small_reduction = better & (old_cost - new_cost <= ftol * old_cost)
+        done = (small_step | small_reduction | (lam[active] > 1e16) |
+                ~np.all(np.isfinite(step), axis=-1))
+        active = active[~done]
+    return x
+
+
 class SKLearnLinearSolver(object, metaclass=abc.ABCMeta):
     """
     Provide a sklearn-like uniform interface to algorithms that solve problems
@@ -317,6 +317,14 @@ def test_perpendicular_directions():
                 rest = rest - delta_a
             assert_almost_equal(rest, 0)
 
+    # Several vectors at once
+    pds = perpendicular_directions(vectors_v, num=num, half=True)
+    assert_equal(pds.shape, (4, num, 3))
+    for vector_v, pd in zip(vectors_v, pds):
+        assert_array_almost_equal(pd, perpendicular_directions(vector_v,
+                                                               num=num,
+                                                               half=True))
+
 
 def _rotation_from_angles(r):
     R = np.array([[1, 0, 0],
@@ -1,8 +1,10 @@
 import numpy as np
 import scipy.sparse as sps
+from scipy.optimize import nnls
 
 import numpy.testing as npt
-from dipy.core.optimize import Optimizer, sparse_nnls, spdot
+from dipy.core.optimize import (Optimizer, sparse_nnls, sbb_nnls, spdot,
+                                batch_levenberg_marquardt)
 import dipy.core.optimize as opt
 
 
@@ -110,5 +112,47 @@ def test_sparse_nnls():
     npt.assert_array_almost_equal(beta, beta_hat_sparse, decimal=1)
 
 
+def test_sbb_nnls():
+    rng = np.random.RandomState(42)
+    X = rng.randn(200, 20)
+    # Some of the weights are zero at the solution:
+    beta = np.clip(rng.randn(20), 0, None)
+    y = np.dot(X, beta)
+    npt.assert_array_almost_equal(sbb_nnls(y, X, tol=1e-10), beta)
+    npt.assert_array_almost_equal(sbb_nnls(y, sps.csr_matrix(X), tol=1e-10),
+                                  beta)
+    # With noise, the solution is the one of the active-set solver:
+    y = y + 0.5 * rng.randn(200)
+    beta_hat = sbb_nnls(y, X, tol=1e-10)
+    npt.assert_(np.all(beta_hat >= 0))
+    npt.assert_array_almost_equal(beta_hat, nnls(X, y)[0], decimal=4)
+
+
+def test_batch_levenberg_marquardt():
+    # Exponential decays y = a * exp(-b * t) of different problems
+    rng = np.random.RandomState(42)
+    t = np.linspace(0, 4, 30)
+    params = np.column_stack([rng.uniform(1, 10, 50), rng.uniform(.1, 2, 50)])
+    y = params[:, :1] * np.exp(-params[:, 1:] * t)
+
+    def residuals_func(x, index):
+        e = np.exp(-x[:, 1:] * t)
+        residuals = x[:, :1] * e - y[index]
+        jacobian = np.stack([e, -x[:, :1] * t * e], axis=-1)
+        return residuals, jacobian
+
+    x0 = np.tile([1., 1.], (50, 1))
+    npt.assert_array_almost_equal(batch_levenberg_marquardt(residuals_func,
+                                                            x0), params)
+
+    # The solution of bounded problems is projected on the bounds
+    x = batch_levenberg_marquardt(residuals_func, x0,
+                                  bounds=([0, 0], [np.inf, 1.]))
+    npt.assert_(np.all(x[:, 1] <= 1))
+    fast = params[:, 1] > 1
+    npt.assert_array_almost_equal(x[fast, 1], 1)
+    npt.assert_array_almost_equal(x[~fast], params[~fast])
+
+
 if __name__ == '__main__':
     npt.run_module_suite()
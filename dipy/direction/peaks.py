@@ -10,8 +10,8 @@ import numpy as np
 import scipy.optimize as opt
 
 from dipy.reconst.odf import gfa
-from dipy.reconst.recspeed import (local_maxima, remove_similar_vertices,
-                                   search_descending)
+from dipy.reconst.recspeed import (local_maxima, local_maxima_block,
+                                   remove_similar_vertices, search_descending)
 from dipy.core.sphere import Sphere
 from dipy.data import default_sphere
 from dipy.core.ndindex import ndindex
@@ -208,6 +208,71 @@ def _pam_from_attrs(klass, sphere, peak_indices, peak_values, peak_dirs,
     return this_pam
 
 
+def _peak_directions_block(odfs, sphere, relative_peak_threshold,
+                           min_separation_angle, npeaks, num_threads=None):
+    """ The largest peaks of a block of ODFs, as in ``peak_directions``
+
+    Parameters
+    ----------
+    odfs : (M, N) ndarray
+        The ODFs of M voxels on the N vertices of `sphere`.
+    sphere : Sphere
+        The Sphere providing discrete directions for evaluation.
+    relative_peak_threshold : float
+        See ``peak_directions``.
+    min_separation_angle : float
+        See ``peak_directions``.
+    npeaks : int
+        Maximum number of peaks of each voxel.
+    num_threads : int, optional
+        Number of threads used to find the local maxima (see
+        ``local_maxima_block``).
+
+    Returns
+    -------
+    indices : (M, npeaks) ndarray
+        Vertex indices of the peaks of each voxel, in descending order of
+        their values, -1 after the last peak.
+    """
+    values, order, count = local_maxima_block(
+        np.ascontiguousarray(odfs, dtype=np.float64), sphere.edges,
+        num_threads=num_threads)
+    nb_candidates = count.max() if len(count) else 0
+    values = values[:, :nb_candidates]
+    order = order[:, :nb_candidates]
+    rows = np.arange(len(odfs))
+
+    # Remove small peaks (a single peak is always kept)
+    odf_min = np.maximum(odfs.min(axis=-1), 0)
+    values_norm = values - odf_min[:, None]
+    valid = values_norm >= relative_peak_threshold * values_norm[:, :1]
+    valid &= np.arange(nb_candidates) < count[:, None]
+    if nb_candidates:
+        valid[:, 0] |= count == 1
+        valid &= values[:, :1] >= 0
+
+    # Remove peaks too close to a larger one
+    cos_similarity = np.cos(np.pi / 180 * min_separation_angle)
+    indices = np.full((len(odfs), npeaks), -1, dtype=int)
+    directions = np.zeros((len(odfs), npeaks, 3))
+    nb_peaks = np.zeros(len(odfs), dtype=int)
+    for i in range(nb_candidates):
+        voxels = rows[valid[:, i] & (nb_peaks < npeaks)]
+        if len(voxels) == 0:
+            continue
+        vertex = sphere.vertices[order[voxels, i]]
+        kept = directions[voxels]
+        similarity = np.abs(kept[..., 0] * vertex[:, None, 0] +
+                            kept[..., 1] * vertex[:, None, 1] +
+                            kept[..., 2] * vertex[:, None, 2])
+        unique = ~np.any(similarity > cos_similarity, axis=-1)
+        voxels = voxels[unique]
+        indices[voxels, nb_peaks[voxels]] = order[voxels, i]
+        directions[voxels, nb_peaks[voxels]] = vertex[unique]
+        nb_peaks[voxels] += 1
+    return indices
+
+
 class PeaksAndMetrics(EuDXDirectionGetter):
     def __reduce__(self): return _pam_from_attrs, (self.__class__,
                                                    self.sphere,
@@ -225,7 +290,8 @@ class PeaksAndMetrics(EuDXDirectionGetter):
 def _peaks_from_model_parallel(model, data, sphere, relative_peak_threshold,
                                min_separation_angle, mask, return_odf,
                                return_sh, gfa_thr, normalize_peaks, sh_order,
-                               sh_basis_type, npeaks, B, invB, num_processes):
+                               sh_basis_type, npeaks, B, invB, num_processes,
+                               step, dtype):
 
     shape = list(data.shape)
     data = np.reshape(data, (-1, shape[-1]))
@@ -263,7 +329,9 @@ def _peaks_from_model_parallel(model, data, sphere, relative_peak_threshold,
                                repeat(sh_basis_type),
                                repeat(npeaks),
                                repeat(B),
-                               repeat(invB)))
+                               repeat(invB),
+                               repeat(step),
+                               repeat(dtype)))
         pool.close()
 
         pam = PeaksAndMetrics()
@@ -355,6 +423,8 @@ def _peaks_from_model_parallel_sub(args):
     npeaks = args[12]
     B = args[13]
     invB = args[14]
+    step = args[15]
+    dtype = args[16]
 
     data = np.load(data_file_name, mmap_mode='r')[start_pos:end_pos]
     if mask_file_name is not None:
@@ -366,7 +436,121 @@ def _peaks_from_model_parallel_sub(args):
                             min_separation_angle, mask, return_odf,
                             return_sh, gfa_thr, normalize_peaks,
                             sh_order, sh_basis_type, npeaks, B, invB,
-                            parallel=False, num_processes=None)
+                            parallel=False, num_processes=None, step=step,
+                            dtype=dtype, num_threads=1)
+
+
+def _peaks_voxel_by_voxel(model, data, mask, sphere, relative_peak_threshold,
+                          min_separation_angle, gfa_thr, normalize_peaks,
+                          invB, gfa_array, qa_array, peak_dirs, peak_values,
+                          peak_indices, shm_coeff, odf_array):
+    """ Fit the model and find the peaks of the voxels of `mask` one by one
+
+    The metrics are written in the arrays given as arguments, `shm_coeff`
+    and `odf_array` are skipped when they are None (see
+    ``peaks_from_model``). The QA are not normalized yet.
+
+    Returns
+    -------
+    global_max : float
+        The largest ODF value used to normalize the QA.
+    """
+    global_max = -np.inf
+    npeaks = peak_values.shape[-1]
+    for idx in ndindex(mask.shape):
+        if not mask[idx]:
+            continue
+
+        odf = model.fit(data[idx]).odf(sphere)
+
+        if shm_coeff is not None:
+            shm_coeff[idx] = np.dot(odf, invB)
+
+        if odf_array is not None:
+            odf_array[idx] = odf
+
+        gfa_array[idx] = gfa(odf)
+        if gfa_array[idx] < gfa_thr:
+            global_max = max(global_max, odf.max())
+            continue
+
+        # Get peaks of odf
+        direction, pk, ind = peak_directions(odf, sphere,
+                                             relative_peak_threshold,
+                                             min_separation_angle)
+
+        # Calculate peak metrics
+        if pk.shape[0] != 0:
+            global_max = max(global_max, pk[0])
+
+            n = min(npeaks, pk.shape[0])
+            qa_array[idx][:n] = pk[:n] - odf.min()
+
+            peak_dirs[idx][:n] = direction[:n]
+            peak_indices[idx][:n] = ind[:n]
+            peak_values[idx][:n] = pk[:n]
+
+            if normalize_peaks:
+                peak_values[idx][:n] /= pk[0]
+                peak_dirs[idx] *= peak_values[idx][:, None]
+    return global_max
+
+
+def _peaks_by_blocks(model, data, mask, sphere, relative_peak_threshold,
+                     min_separation_angle, gfa_thr, normalize_peaks, invB,
+                     gfa_array, qa_array, peak_dirs, peak_values,
+                     peak_indices, shm_coeff, odf_array, step,
+                     num_threads=None):
+    """ Fit the model and find the peaks of blocks of `step` voxels of `mask`
+
+    Same as ``_peaks_voxel_by_voxel``, for blocks of voxels at once.
+
+    Returns
+    -------
+    global_max : float
+        The largest ODF value used to normalize the QA.
+    """
+    global_max = -np.inf
+    npeaks = peak_values.shape[-1]
+    voxels = np.argwhere(mask)
+    for start in range(0, len(voxels), step):
+        block = tuple(voxels[start:start + step].T)
+        odfs = np.asarray(model.fit(data[block]).odf(sphere))
+
+        if shm_coeff is not None:
+            shm_coeff[block] = np.dot(odfs, invB)
+
+        if odf_array is not None:
+            odf_array[block] = odfs
+
+        gfa_array[block] = gfa(odfs)
+        low_gfa = gfa_array[block] < gfa_thr
+        if np.any(low_gfa):
+            global_max = max(global_max, odfs[low_gfa].max())
+            odfs = odfs[~low_gfa]
+            block = tuple(index[~low_gfa] for index in block)
+
+        # Get peaks of odfs
+        indices = _peak_directions_block(odfs, sphere,
+                                         relative_peak_threshold,
+                                         min_separation_angle, npeaks,
+                                         num_threads=num_threads)
+        found = indices >= 0
+        values = np.where(found,
+                          odfs[np.arange(len(odfs))[:, None], indices], 0)
+
+        # Calculate peak metrics
+        if np.any(found[:, 0]):
+            global_max = max(global_max, values[found[:, 0], 0].max())
+        qa_array[block] = np.where(found, values - odfs.min(-1)[:, None], 0)
+        directions = sphere.vertices[indices] * found[..., None]
+        if normalize_peaks:
+            values[found[:, 0]] /= values[found[:, 0], :1]
+            directions *= values[..., None]
+        peak_dirs[block] = directions
+        peak_indices[block] = indices
+        peak_values[block] = values
+    return global_max
 
 
 @deprecated_params('nbr_processes', 'num_processes', since='1.4', until='1.5')
@@ -374,7 +558,8 @@ def peaks_from_model(model, data, sphere, relative_peak_threshold,
                      min_separation_angle, mask=None, return_odf=False,
                      return_sh=True, gfa_thr=0, normalize_peaks=False,
                      sh_order=8, sh_basis_type=None, npeaks=5, B=None,
-                     invB=None, parallel=False, num_processes=None):
+                     invB=None, parallel=False, num_processes=None,
+                     step=None, dtype=np.float64, num_threads=None):
     """Fit the model to data and computes peaks and metrics
 
     Parameters
@@ -427,6 +612,30 @@ def peaks_from_model(model, data, sphere, relative_peak_threshold,
         (default multiprocessing.cpu_count()). If < 0 the maximal number of
         cores minus |num_processes + 1| is used (enter -1 to use as many cores
         as possible). 0 raises an error.
+    step : int, optional
+        If given, the model is fitted to blocks of `step` voxels of the mask
+        at once, the ODFs of each block are computed together and their peaks
+        are found together, which is much faster for models computing the
+        ODFs of many voxels at once (e.g. ``GeneralizedQSamplingModel``).
+        Only the ODFs of one block are kept in memory. The model must accept
+        data of shape (step, N). The peak values are the same as voxel by
+        voxel, but when vertices have equal values up to round-off the
+        chosen vertex can differ: for symmetric ODFs (e.g. from SH models) a
+        peak can be given by its antipodal vertex, with the opposite
+        direction, and the peaks of a constant ODF are arbitrary.
+        Default: None, the model is fitted voxel by voxel.
+    dtype : data-type, optional
+        Data type of the returned GFA, QA, peak values and directions, SH
+        coefficients and ODFs. With np.float32, they take half of the memory.
+        Default: np.float64.
+    num_threads : int, optional
+        Number of threads used to find the peaks of the blocks of voxels
+        when `step` is given. If None (default) the value of OMP_NUM_THREADS
+        environment variable is used if it is set, otherwise all available
+        threads are used. If < 0 the maximal number of threads minus
+        |num_threads + 1| is used (enter -1 to use as many threads as
+        possible). 0 raises an error. With `parallel`, each process uses a
+        single thread.
 
     Returns
     -------
@@ -469,7 +678,9 @@ def peaks_from_model(model, data, sphere, relative_peak_threshold,
                                           npeaks,
                                           B,
                                           invB,
-                                          num_processes)
+                                          num_processes,
+                                          step,
+                                          dtype)
 
     shape = data.shape[:-1]
     if mask is None:
@@ -478,58 +689,35 @@ def peaks_from_model(model, data, sphere, relative_peak_threshold,
         if mask.shape != shape:
             raise ValueError("Mask is not the same shape as data.")
 
-    gfa_array = np.zeros(shape)
-    qa_array = np.zeros((shape + (npeaks,)))
+    gfa_array = np.zeros(shape, dtype=dtype)
+    qa_array = np.zeros((shape + (npeaks,)), dtype=dtype)
 
-    peak_dirs = np.zeros((shape + (npeaks, 3)))
-    peak_values = np.zeros((shape + (npeaks,)))
+    peak_dirs = np.zeros((shape + (npeaks, 3)), dtype=dtype)
+    peak_values = np.zeros((shape + (npeaks,)), dtype=dtype)
     peak_indices = np.zeros((shape + (npeaks,)), dtype='int')
     peak_indices.fill(-1)
 
     if return_sh:
         n_shm_coeff = (sh_order + 2) * (sh_order + 1) // 2
-        shm_coeff = np.zeros((shape + (n_shm_coeff,)))
+        shm_coeff = np.zeros((shape + (n_shm_coeff,)), dtype=dtype)
 
     if return_odf:
-        odf_array = np.zeros((shape + (len(sphere.vertices),)))
-
-    global_max = -np.inf
-    for idx in ndindex(shape):
-        if not mask[idx]:
-            continue
-
-        odf = model.fit(data[idx]).odf(sphere)
-
-        if return_sh:
-            shm_coeff[idx] = np.dot(odf, invB)
-
-        if return_odf:
-            odf_array[idx] = odf
-
-        gfa_array[idx] = gfa(odf)
-        if gfa_array[idx] < gfa_thr:
-            global_max = max(global_max, odf.max())
-            continue
-
-        # Get peaks of odf
-        direction, pk, ind = peak_directions(odf, sphere,
-                                             relative_peak_threshold,
-                                             min_separation_angle)
-
-        # Calculate peak metrics
-        if pk.shape[0] != 0:
-            global_max = max(global_max, pk[0])
-
-            n = min(npeaks, pk.shape[0])
-            qa_array[idx][:n] = pk[:n] - odf.min()
-
-            peak_dirs[idx][:n] = direction[:n]
-            peak_indices[idx][:n] = ind[:n]
-            peak_values[idx][:n] = pk[:n]
-
-            if normalize_peaks:
-                peak_values[idx][:n] /= pk[0]
-                peak_dirs[idx] *= peak_values[idx][:, None]
+        odf_array = np.zeros((shape + (len(sphere.vertices),)), dtype=dtype)
+
+    if step is None or data.ndim == 1:
+        global_max = _peaks_voxel_by_voxel(
+            model, data, mask, sphere, relative_peak_threshold,
+            min_separation_angle, gfa_thr, normalize_peaks, invB, gfa_array,
+            qa_array, peak_dirs, peak_values, peak_indices,
+            shm_coeff if return_sh else None,
+            odf_array if return_odf else None)
+    else:
+        global_max = _peaks_by_blocks(
+            model, data, mask, sphere, relative_peak_threshold,
+            min_separation_angle, gfa_thr, normalize_peaks, invB, gfa_array,
+            qa_array, peak_dirs, peak_values, peak_indices,
+            shm_coeff if return_sh else None,
+            odf_array if return_odf else None, step, num_threads)
 
     qa_array /= global_max
 
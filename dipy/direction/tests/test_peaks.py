@@ -16,11 +16,14 @@ from dipy.direction.peaks import (peaks_from_model,
 from dipy.core.subdivide_octahedron import create_unit_hemisphere
 from dipy.core.sphere import unit_icosahedron
 from dipy.sims.voxel import multi_tensor, multi_tensor_odf
-from dipy.data import get_fnames, get_sphere, default_sphere
+from dipy.data import get_fnames, get_sphere, default_sphere, dsi_voxels
 from dipy.core.gradients import gradient_table, GradientTable
 from dipy.core.sphere_stats import angular_similarity
 from dipy.core.sphere import HemiSphere
 from dipy.io.gradients import read_bvals_bvecs
+from dipy.reconst.gqi import GeneralizedQSamplingModel
+from dipy.reconst.shm import CsaOdfModel
+from dipy.io.image import load_nifti_data
 
 
 def test_peak_directions_nl():
@@ -590,6 +593,67 @@ def test_peaksFromModelParallel():
             assert_array_almost_equal(pam.odf, pam_single.odf)
 
 
+def test_peaks_from_model_blocks():
+    data, gtab = dsi_voxels()
+    mask = data[..., 0] > data[..., 0].mean()
+    model = GeneralizedQSamplingModel(gtab, 'gqi2', 1.2)
+    for normalize_peaks, gfa_thr in [(False, 0), (True, 0.05)]:
+        pam_voxels = peaks_from_model(model, data, default_sphere, .5, 25,
+                                      mask=mask, return_odf=True,
+                                      normalize_peaks=normalize_peaks,
+                                      gfa_thr=gfa_thr)
+        for step in [1, 7, 1000]:
+            pam = peaks_from_model(model, data, default_sphere, .5, 25,
+                                   mask=mask, return_odf=True, step=step,
+                                   normalize_peaks=normalize_peaks,
+                                   gfa_thr=gfa_thr)
+            assert_array_equal(pam.peak_indices, pam_voxels.peak_indices)
+            assert_array_almost_equal(pam.peak_values,
+                                      pam_voxels.peak_values)
+            assert_array_almost_equal(pam.peak_dirs, pam_voxels.peak_dirs)
+            assert_array_almost_equal(pam.qa, pam_voxels.qa)
+            assert_array_almost_equal(pam.gfa, pam_voxels.gfa)
+            assert_array_almost_equal(pam.odf, pam_voxels.odf)
+            assert_array_almost_equal(pam.shm_coeff, pam_voxels.shm_coeff)
+
+    # The threads and the processes do not change the peaks
+    pam_blocks = peaks_from_model(model, data, default_sphere, .5, 25,
+                                  mask=mask, step=7, num_threads=1)
+    for kwargs in [dict(num_threads=2),
+                   dict(parallel=True, num_processes=2)]:
+        pam = peaks_from_model(model, data, default_sphere, .5, 25,
+                               mask=mask, step=7, **kwargs)
+        assert_array_equal(pam.peak_indices, pam_blocks.peak_indices)
+        assert_array_almost_equal(pam.peak_values, pam_blocks.peak_values)
+
+    # Single precision outputs
+    pam_double = peaks_from_model(model, data, default_sphere, .5, 25,
+                                  mask=mask, step=100)
+    pam = peaks_from_model(model, data, default_sphere, .5, 25, mask=mask,
+                           step=100, dtype=np.float32)
+    for array in [pam.gfa, pam.qa, pam.peak_values, pam.peak_dirs,
+                  pam.shm_coeff]:
+        assert_equal(array.dtype, np.float32)
+    assert_array_equal(pam.peak_indices, pam_double.peak_indices)
+    assert_array_almost_equal(pam.qa, pam_double.qa, 5)
+
+    # With symmetric ODFs, a peak can be given by its antipodal vertex
+    fdata, fbvals, fbvecs = get_fnames('small_64D')
+    data = load_nifti_data(fdata)
+    gtab = gradient_table(*read_bvals_bvecs(fbvals, fbvecs))
+    mask = data[..., 0] > data[..., 0].mean()
+    model = CsaOdfModel(gtab, 6)
+    pam_voxels = peaks_from_model(model, data, default_sphere, .5, 25,
+                                  mask=mask)
+    pam = peaks_from_model(model, data, default_sphere, .5, 25, mask=mask,
+                           step=100)
+    assert_array_almost_equal(pam.peak_values, pam_voxels.peak_values)
+    assert_array_almost_equal(pam.qa, pam_voxels.qa)
+    assert_array_almost_equal(
+        np.abs(np.sum(pam.peak_dirs * pam_voxels.peak_dirs, -1)),
+        np.sum(pam_voxels.peak_dirs ** 2, -1))
+
+
 def test_peaks_shm_coeff():
 
     SNR = 100
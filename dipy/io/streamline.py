@@ -4,15 +4,21 @@ import os
 import time
 
 import nibabel as nib
-from nibabel.streamlines import detect_format
+from nibabel.affines import apply_affine
+from nibabel.streamlines import detect_format, Field, TckFile, TrkFile
 from nibabel.streamlines.tractogram import Tractogram
+from nibabel.streamlines.trk import (encode_value_in_name,
+                                     get_affine_rasmm_to_trackvis,
+                                     header_2_dtype)
 import numpy as np
 
 from dipy.io.stateful_tractogram import Origin, Space, StatefulTractogram
 from dipy.io.vtk import save_vtk_streamlines, load_vtk_streamlines
 from dipy.io.dpy import Dpy
-from dipy.io.utils import (create_tractogram_header,
+from dipy.io.utils import (create_tractogram_header, get_reference_info,
                            is_header_compatible)
+from dipy.tracking.streamline import Streamlines
+from dipy.tracking.streamlinespeed import compress_streamlines, length
 
 
 def save_tractogram(sft, filename, bbox_valid_check=True):
@@ -82,6 +88,252 @@ def save_tractogram(sft, filename, bbox_valid_check=True):
     return True
 
 
+def _write_tck_header(fileobj, header):
+    """ Write the text header of a tck file at the position of `fileobj`
+
+    Nibabel has no public function writing a tck header without the
+    streamlines, so this uses the private ``TckFile._write_header``, which has
+    this signature in the nibabel versions supported by DIPY (3.0 to 3.2).
+    The count of streamlines is written on a fixed width, so the header can
+    be written again with the final count.
+    """
+    TckFile._write_header(fileobj, header)
+
+
+class StreamlinesWriter(object):
+    """ Write streamlines to a tractogram file as they are generated
+
+    The streamlines (in RASMM space, with the NIFTI center origin) are
+    buffered, then filtered, compressed and appended to the file, so that
+    a whole tractogram never needs to be in memory. The header is written
+    again with the final counts when the writer is closed. Streaming is
+    supported for the trk and tck formats, the other formats (vtk, fib, dpy)
+    keep all the streamlines and save them with ``save_tractogram`` at
+    closing. When used as a context manager, the partial file is removed if
+    an exception is raised in the ``with`` block.
+
+    Examples
+    --------
+    >>> with StreamlinesWriter('tractogram.trk', 'fa.nii.gz') as writer:
+    ...     writer.extend(tracking_generator)  # doctest: +SKIP
+    """
+
+    def __init__(self, filename, reference, buffer_size=1000000,
+                 min_length=None, max_length=None, compress_tol=None,
+                 save_seeds=False):
+        """
+        Parameters
+        ----------
+        filename : string
+            Filename with valid extension.
+        reference : Nifti or Trk filename, Nifti1Image or TrkFile,
+            Nifti1Header, trk.header (dict) or another Stateful Tractogram
+            Reference that provides the spatial attribute.
+        buffer_size : int, optional
+            Number of points kept in memory before they are written to the
+            file. Default: 1000000.
+        min_length, max_length : float, optional
+            Streamlines shorter than `min_length` or longer than `max_length`
+            (in mm) are not written. Default: no filtering.
+        compress_tol : float, optional
+            If given, the streamlines are compressed with
+            ``compress_streamlines`` with this tolerance error (in mm) before
+            being written.
+        save_seeds : bool, optional
+            Whether the appended items are (streamline, seed) pairs, as
+            produced by tracking with ``save_seeds=True``. The seeds are saved
+            as 'seeds' in the ``data_per_streamline`` of trk files.
+        """
+        _, extension = os.path.splitext(filename)
+        if extension not in ['.trk', '.tck', '.vtk', '.fib', '.dpy']:
+            raise TypeError('Output filename is not one of the supported '
+                            'format.')
+        self.filename = filename
+        self.reference = reference
+        self.buffer_size = buffer_size
+        self.min_length = min_length
+        self.max_length = max_length
+        self.compress_tol = compress_tol
+        self.save_seeds = save_seeds
+        self.nb_streamlines = 0
+        self.nb_points = 0
+
+        self._extension = extension
+        self._streamlines = []
+        self._seeds = []
+        self._nb_buffered_points = 0
+        self._closed = False
+        self._file = None
+        if extension not in ['.trk', '.tck']:
+            self._all_streamlines = Streamlines()
+            self._all_seeds = []
+            return
+
+        space_attributes = get_reference_info(reference)
+        tractogram_type = detect_format(filename)
+        header = create_tractogram_header(tractogram_type, *space_attributes)
+        self._file = open(filename, 'wb')
+        if extension == '.trk':
+            self._header = np.zeros((), dtype=header_2_dtype.newbyteorder('<'))
+            for k, v in TrkFile.create_empty_header().items():
+                self._header[k] = v
+            for k, v in header.items():
+                if k in header_2_dtype.fields.keys():
+                    self._header[k] = v
+            if save_seeds:
+                property_name = np.zeros_like(self._header['property_name'])
+                property_name[0] = encode_value_in_name(3, 'seeds')
+                self._header['property_name'] = property_name
+                self._header[Field.NB_PROPERTIES_PER_STREAMLINE] = 3
+            self._affine = get_affine_rasmm_to_trackvis(self._header)
+            self._file.write(self._header.tobytes())
+        else:
+            self._header = TckFile.create_empty_header()
+            self._header.update(header)
+            _write_tck_header(self._file, self._header)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def append(self, streamline, seed=None):
+        """ Add a streamline (and its seed, if `save_seeds`) to the file
+        """
+        if self._closed:
+            raise ValueError('The writer is closed.')
+        streamline = np.asarray(streamline)
+        self._streamlines.append(streamline)
+        if self.save_seeds:
+            self._seeds.append(seed)
+        self._nb_buffered_points += len(streamline)
+        if self._nb_buffered_points >= self.buffer_size:
+            self.flush()
+
+    def extend(self, streamlines):
+        """ Add all the streamlines of an iterable (e.g. a tracking generator)
+
+        If `save_seeds`, the items of `streamlines` are (streamline, seed)
+        pairs.
+        """
+        for item in streamlines:
+            if self.save_seeds:
+                self.append(*item)
+            else:
+                self.append(item)
+
+    def _process_buffer(self):
+        streamlines = self._streamlines
+        seeds = self._seeds
+        self._streamlines = []
+        self._seeds = []
+        self._nb_buffered_points = 0
+        if not streamlines:
+            return streamlines, seeds
+
+        if self.min_length is not None or self.max_length is not None:
+            lengths = length(streamlines)
+            keep = np.ones(len(streamlines), dtype=bool)
+            if self.min_length is not None:
+                keep &= lengths >= self.min_length
+            if self.max_length is not None:
+                keep &= lengths <= self.max_length
+            streamlines = [s for s, k in zip(streamlines, keep) if k]
+            if self.save_seeds:
+                seeds = [s for s, k in zip(seeds, keep) if k]
+        if self.compress_tol is not None and streamlines:
+            streamlines = compress_streamlines(streamlines,
+                                               tol_error=self.compress_tol)
+        return streamlines, seeds
+
+    def flush(self):
+        """ Write the buffered streamlines to the file
+        """
+        streamlines, seeds = self._process_buffer()
+        if not streamlines:
+            return
+        self.nb_streamlines += len(streamlines)
+
+        if self._file is None:
+            self._all_streamlines.extend(streamlines)
+            self._all_seeds.extend(seeds)
+            return
+
+        lengths = np.array([len(s) for s in streamlines], dtype=np.intp)
+        points = np.concatenate(streamlines).astype(np.float64)
+        self.nb_points += len(points)
+        n_sls = len(lengths)
+        # Index of the first row (trk record or tck delimiter) of each
+        # streamline, in the output array
+        if self._extension == '.trk':
+            points = apply_affine(self._affine, points)
+            n_props = 3 if self.save_seeds else 0
+            sizes = 1 + 3 * lengths + n_props
+            starts = np.cumsum(sizes) - sizes
+            data = np.empty(sizes.sum(), dtype='<f4')
+            data.view('<i4')[starts] = lengths
+            point_starts = np.repeat(starts + 1 - 3 * (np.cumsum(lengths) -
+                                                       lengths), lengths)
+            rows = point_starts + 3 * np.arange(len(points))
+            data[rows[:, None] + np.arange(3)] = points
+            if n_props:
+                prop_rows = starts + 1 + 3 * lengths
+                data[prop_rows[:, None] + np.arange(3)] = \
+                    np.asarray(seeds, dtype=float).reshape((n_sls, 3))
+        else:
+            data = np.full((len(points) + n_sls, 3), np.nan, dtype='<f4')
+            rows = np.arange(len(points)) + np.repeat(np.arange(n_sls),
+                                                      lengths)
+            data[rows] = points
+        self._file.write(data.tobytes())
+
+    def close(self):
+        """ Write the remaining streamlines and finalize the header
+        """
+        if self._closed:
+            return
+        self.flush()
+        self._closed = True
+
+        if self._file is None:
+            seeds = {'seeds': self._all_seeds} if self.save_seeds else {}
+            sft = StatefulTractogram(self._all_streamlines, self.reference,
+                                     Space.RASMM, data_per_streamline=seeds)
+            save_tractogram(sft, self.filename, bbox_valid_check=False)
+            return
+
+        if self._extension == '.trk':
+            self._header[Field.NB_STREAMLINES] = self.nb_streamlines
+            if not self.nb_streamlines:
+                self._header[Field.NB_PROPERTIES_PER_STREAMLINE] = 0
+            self._file.seek(0, os.SEEK_SET)
+            self._file.write(self._header.tobytes())
+        else:
+            self._file.write(TckFile.EOF_DELIMITER.astype('<f4').tobytes())
+            self._header[Field.NB_STREAMLINES] = self.nb_streamlines
+            self._file.seek(0, os.SEEK_SET)
+            _write_tck_header(self._file, self._header)
+        self._file.close()
+        logging.debug('Saved %s with %s streamlines.', self.filename,
+                      self.nb_streamlines)
+
+    def abort(self):
+        """ Close the writer without finalizing it, and remove the file
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._streamlines = []
+        self._seeds = []
+        if self._file is not None:
+            self._file.close()
+            os.remove(self.filename)
+
+
 def load_tractogram(filename, reference, to_space=Space.RASMM,
                     to_origin=Origin.NIFTI, bbox_valid_check=True,
                     trk_header_check=True):
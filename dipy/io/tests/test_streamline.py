@@ -3,11 +3,12 @@ import os
 
 from dipy.data import fetch_gold_standard_io
 from dipy.io.streamline import (load_tractogram, save_tractogram,
-                                load_trk, save_trk)
+                                load_trk, save_trk, StreamlinesWriter)
 from dipy.io.stateful_tractogram import Space, StatefulTractogram
 from dipy.io.utils import create_nifti_header
 from dipy.io.vtk import save_vtk_streamlines, load_vtk_streamlines
-from dipy.tracking.streamline import Streamlines
+from dipy.tracking.streamline import (Streamlines, compress_streamlines,
+                                      length)
 import numpy as np
 import numpy.testing as npt
 import pytest
@@ -255,5 +256,54 @@ def test_io_trk_save():
                 msg='trk_saver should not be able to save a dpy')
 
 
+def test_streamlines_writer():
+    sft = load_tractogram(filepath_dix['gs.trk'], filepath_dix['gs.nii'])
+    sft.to_rasmm()
+    sft.to_center()
+    seeds = [s[0] for s in sft.streamlines]
+    lengths = length(sft.streamlines)
+    min_length = np.median(lengths)
+    keep = lengths >= min_length
+
+    with InTemporaryDirectory():
+        for ext in ['trk', 'tck', 'dpy']:
+            fname = 'streamed.' + ext
+            # A small buffer so that the file is written in several parts
+            with StreamlinesWriter(fname, filepath_dix['gs.nii'],
+                                   buffer_size=20) as writer:
+                writer.extend(sft.streamlines)
+            npt.assert_equal(writer.nb_streamlines, len(sft))
+            sft_streamed = load_tractogram(fname, filepath_dix['gs.nii'])
+            npt.assert_array_almost_equal(sft_streamed.streamlines.get_data(),
+                                          sft.streamlines.get_data(),
+                                          decimal=4)
+            npt.assert_array_equal(sft_streamed.streamlines._lengths,
+                                   sft.streamlines._lengths)
+
+        # Seeds, length filtering and compression
+        with StreamlinesWriter('streamed.trk', filepath_dix['gs.nii'],
+                               buffer_size=20, min_length=min_length,
+                               compress_tol=0.1, save_seeds=True) as writer:
+            writer.extend(zip(sft.streamlines, seeds))
+        npt.assert_equal(writer.nb_streamlines, keep.sum())
+        sft_streamed = load_tractogram('streamed.trk', filepath_dix['gs.nii'])
+        expected = Streamlines(compress_streamlines(sft.streamlines[keep],
+                                                    tol_error=0.1))
+        npt.assert_array_almost_equal(sft_streamed.streamlines.get_data(),
+                                      expected.get_data(), decimal=4)
+        npt.assert_array_almost_equal(
+            sft_streamed.data_per_streamline['seeds'],
+            np.array(seeds)[keep], decimal=4)
+
+        # Empty tractograms
+        for ext in ['trk', 'tck']:
+            StreamlinesWriter('empty.' + ext, filepath_dix['gs.nii']).close()
+            npt.assert_equal(len(load_tractogram('empty.' + ext,
+                                                 filepath_dix['gs.nii'])), 0)
+
+        npt.assert_raises(TypeError, StreamlinesWriter, 'streamed.txt',
+                          filepath_dix['gs.nii'])
+
+
 if __name__ == '__main__':
     npt.run_module_suite()
@@ -0,0 +1,67 @@
+import os
+
+import nibabel as nib
+import numpy as np
+import numpy.testing as npt
+from nibabel.tmpdirs import InTemporaryDirectory
+
+from dipy.io.stateful_tractogram import Space, StatefulTractogram
+from dipy.io.streamline import (load_tractogram, save_tractogram,
+                                StreamlinesWriter)
+
+
+def random_streamlines(rng, n):
+    # Streamlines inside the (20, 20, 20) volume of 2 mm voxels
+    return [rng.uniform(2, 36, size=(rng.randint(2, 30), 3)) + [-10, 0, 5]
+            for _ in range(n)]
+
+
+def read_bytes(fname):
+    with open(fname, 'rb') as f:
+        return f.read()
+
+
+def test_streamlines_writer_save_tractogram():
+    rng = np.random.RandomState(0)
+    streamlines = random_streamlines(rng, 100)
+    seeds = [s[0] for s in streamlines]
+    affine = np.diag([2., 2., 2., 1.])
+    affine[:3, 3] = [-10, 0, 5]
+
+    with InTemporaryDirectory():
+        nib.save(nib.Nifti1Image(np.zeros((20, 20, 20), dtype=np.float32),
+                                 affine), 'reference.nii.gz')
+
+        # The streamed files are the same as those of save_tractogram
+        for ext in ['trk', 'tck']:
+            sft = StatefulTractogram(streamlines, 'reference.nii.gz',
+                                     Space.RASMM)
+            save_tractogram(sft, 'saved.' + ext)
+            # A small buffer so that the file is written in several parts
+            with StreamlinesWriter('streamed.' + ext, 'reference.nii.gz',
+                                   buffer_size=50) as writer:
+                writer.extend(streamlines)
+            npt.assert_equal(read_bytes('streamed.' + ext),
+                             read_bytes('saved.' + ext))
+
+        sft = StatefulTractogram(streamlines, 'reference.nii.gz',
+                                 Space.RASMM,
+                                 data_per_streamline={'seeds': seeds})
+        save_tractogram(sft, 'saved.trk')
+        with StreamlinesWriter('streamed.trk', 'reference.nii.gz',
+                               buffer_size=50, save_seeds=True) as writer:
+            writer.extend(zip(streamlines, seeds))
+        npt.assert_equal(read_bytes('streamed.trk'), read_bytes('saved.trk'))
+
+        # An exception in the with block removes the partial file
+        for ext in ['trk', 'tck']:
+            fname = 'aborted.' + ext
+            with npt.assert_raises(RuntimeError):
+                with StreamlinesWriter(fname, 'reference.nii.gz',
+                                       buffer_size=50) as writer:
+                    writer.extend(streamlines)
+                    raise RuntimeError
+            npt.assert_(not os.path.exists(fname))
+            npt.assert_raises(ValueError, writer.append, streamlines[0])
+        npt.assert_equal(len(load_tractogram('streamed.trk',
+                                             'reference.nii.gz')), 100)
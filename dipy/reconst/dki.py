@@ -1,8 +1,10 @@
 #!/usr/bin/python
 """ Classes and functions for fitting the diffusion kurtosis model """
 
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
-import scipy.optimize as opt
+from scipy import sparse
 import dipy.core.sphere as dps
 from dipy.reconst.dti import (TensorFit, mean_diffusivity,
                               from_lower_triangular,
@@ -10,14 +12,17 @@ from dipy.reconst.dti import (TensorFit, mean_diffusivity,
                               MIN_POSITIVE_SIGNAL, nlls_fit_tensor,
                               restore_fit_tensor)
 from dipy.reconst.utils import dki_design_matrix as design_matrix
-from dipy.reconst.recspeed import local_maxima
 from dipy.reconst.base import ReconstModel
 from dipy.core.ndindex import ndindex
-from dipy.core.geometry import (sphere2cart, cart2sphere,
-                                perpendicular_directions)
+from dipy.core.geometry import perpendicular_directions
 from dipy.data import get_sphere, get_fnames
 from dipy.reconst.vec_val_sum import vec_val_vect
 from dipy.core.gradients import check_multi_b
+from dipy.utils.omp import determine_num_threads
+
+# Number of voxels times directions processed at once by the vectorized
+# kurtosis metrics
+_BLOCK_ELEMENTS = 2 ** 20
 
 
 def _positive_evals(L1, L2, L3, er=2e-7):
@@ -368,16 +373,48 @@ def _F2m(a, b, c):
     return F2
 
 
+def _dt_monomials(V):
+    """ Coefficients of the diffusion tensor elements in the apparent
+    diffusion coefficients along directions V (..., g, 3)
+    """
+    x, y, z = V[..., 0], V[..., 1], V[..., 2]
+    return np.stack([x * x, 2 * x * y, y * y, 2 * x * z, 2 * y * z, z * z],
+                    axis=-1)
+
+
+def _kt_monomials(V):
+    """ Coefficients of the kurtosis tensor elements in the apparent
+    diffusion variances along directions V (..., g, 3)
+    """
+    x, y, z = V[..., 0], V[..., 1], V[..., 2]
+    return np.stack([x * x * x * x,
+                     y * y * y * y,
+                     z * z * z * z,
+                     4 * x * x * x * y,
+                     4 * x * x * x * z,
+                     4 * x * y * y * y,
+                     4 * y * y * y * z,
+                     4 * x * z * z * z,
+                     4 * y * z * z * z,
+                     6 * x * x * y * y,
+                     6 * x * x * z * z,
+                     6 * y * y * z * z,
+                     12 * x * x * y * z,
+                     12 * x * y * y * z,
+                     12 * x * y * z * z], axis=-1)
+
+
 def directional_diffusion(dt, V, min_diffusivity=0):
     r""" Calculates the apparent diffusion coefficient (adc) in each direction
-    of a sphere for a single voxel [1]_.
+    of a sphere for a single voxel or for several voxels at once [1]_.
 
     Parameters
     ----------
-    dt : array (6,)
-        elements of the diffusion tensor of the voxel.
-    V : array (g, 3)
-        g directions of a Sphere in Cartesian coordinates
+    dt : array (6,) or (..., 6)
+        elements of the diffusion tensor of the voxel(s).
+    V : array (g, 3) or (..., g, 3)
+        g directions of a Sphere in Cartesian coordinates, shared by all
+        voxels or given for each voxel
     min_diffusivity : float (optional)
         Because negative eigenvalues are not physical and small eigenvalues
         cause quite a lot of noise in diffusion-based metrics, diffusivity
@@ -386,7 +423,7 @@ def directional_diffusion(dt, V, min_diffusivity=0):
 
     Returns
     --------
-    adc : ndarray (g,)
+    adc : ndarray (g,) or (..., g)
         Apparent diffusion coefficient (adc) in all g directions of a sphere
         for a single voxel.
 
@@ -397,13 +434,7 @@ def directional_diffusion(dt, V, min_diffusivity=0):
            Impact on the development of robust tractography procedures and
            novel biomarkers, NeuroImage 111: 85-99
     """
-    adc = \
-        V[:, 0] * V[:, 0] * dt[0] + \
-        2 * V[:, 0] * V[:, 1] * dt[1] + \
-        V[:, 1] * V[:, 1] * dt[2] + \
-        2 * V[:, 0] * V[:, 2] * dt[3] + \
-        2 * V[:, 1] * V[:, 2] * dt[4] + \
-        V[:, 2] * V[:, 2] * dt[5]
+    adc = np.matmul(_dt_monomials(V), dt[..., None])[..., 0]
 
     if min_diffusivity is not None:
         adc = adc.clip(min=min_diffusivity)
@@ -412,16 +443,17 @@ def directional_diffusion(dt, V, min_diffusivity=0):
 
 def directional_diffusion_variance(kt, V, min_kurtosis=-3/7):
     r""" Calculates the apparent diffusion variance (adv) in each direction
-    of a sphere for a single voxel [1]_.
+    of a sphere for a single voxel or for several voxels at once [1]_.
 
     Parameters
     ----------
-    dt : array (6,)
-        elements of the diffusion tensor of the voxel.
-    kt : array (15,)
-        elements of the kurtosis tensor of the voxel.
-    V : array (g, 3)
-        g directions of a Sphere in Cartesian coordinates
+    dt : array (6,) or (..., 6)
+        elements of the diffusion tensor of the voxel(s).
+    kt : array (15,) or (..., 15)
+        elements of the kurtosis tensor of the voxel(s).
+    V : array (g, 3) or (..., g, 3)
+        g directions of a Sphere in Cartesian coordinates, shared by all
+        voxels or given for each voxel
     min_kurtosis : float (optional)
         Because high-amplitude negative values of kurtosis are not physicaly
         and biologicaly pluasible, and these cause artefacts in
@@ -429,16 +461,16 @@ def directional_diffusion_variance(kt, V, min_kurtosis=-3/7):
         `min_kurtosis` are replaced with `min_kurtosis`. Default = -3./7
         (theoretical kurtosis limit for regions that consist of water confined
         to spherical pores [2]_)
-    adc : ndarray(g,) (optional)
+    adc : ndarray(g,) or (..., g) (optional)
         Apparent diffusion coefficient (adc) in all g directions of a sphere
         for a single voxel.
-    adv : ndarray(g,) (optional)
+    adv : ndarray(g,) or (..., g) (optional)
         Apparent diffusion variance coefficient (advc) in all g directions of
         a sphere for a single voxel.
 
     Returns
     --------
-    adv : ndarray (g,)
+    adv : ndarray (g,) or (..., g)
         Apparent diffusion variance (adv) in all g directions of a sphere for
         a single voxel.
 
@@ -449,22 +481,7 @@ def directional_diffusion_variance(kt, V, min_kurtosis=-3/7):
            Impact on the development of robust tractography procedures and
            novel biomarkers, NeuroImage 111: 85-99
     """
-    adv = \
-        V[:, 0] * V[:, 0] * V[:, 0] * V[:, 0] * kt[0] + \
-        V[:, 1] * V[:, 1] * V[:, 1] * V[:, 1] * kt[1] + \
-        V[:, 2] * V[:, 2] * V[:, 2] * V[:, 2] * kt[2] + \
-        4 * V[:, 0] * V[:, 0] * V[:, 0] * V[:, 1] * kt[3] + \
-        4 * V[:, 0] * V[:, 0] * V[:, 0] * V[:, 2] * kt[4] + \
-        4 * V[:, 0] * V[:, 1] * V[:, 1] * V[:, 1] * kt[5] + \
-        4 * V[:, 1] * V[:, 1] * V[:, 1] * V[:, 2] * kt[6] + \
-        4 * V[:, 0] * V[:, 2] * V[:, 2] * V[:, 2] * kt[7] + \
-        4 * V[:, 1] * V[:, 2] * V[:, 2] * V[:, 2] * kt[8] + \
-        6 * V[:, 0] * V[:, 0] * V[:, 1] * V[:, 1] * kt[9] + \
-        6 * V[:, 0] * V[:, 0] * V[:, 2] * V[:, 2] * kt[10] + \
-        6 * V[:, 1] * V[:, 1] * V[:, 2] * V[:, 2] * kt[11] + \
-        12 * V[:, 0] * V[:, 0] * V[:, 1] * V[:, 2] * kt[12] + \
-        12 * V[:, 0] * V[:, 1] * V[:, 1] * V[:, 2] * kt[13] + \
-        12 * V[:, 0] * V[:, 1] * V[:, 2] * V[:, 2] * kt[14]
+    adv = np.matmul(_kt_monomials(V), kt[..., None])[..., 0]
 
     return adv
 
@@ -472,18 +489,19 @@ def directional_diffusion_variance(kt, V, min_kurtosis=-3/7):
 def directional_kurtosis(dt, md, kt, V, min_diffusivity=0, min_kurtosis=-3/7,
                          adc=None, adv=None):
     r""" Calculates the apparent kurtosis coefficient (akc) in each direction
-    of a sphere for a single voxel [1]_.
+    of a sphere for a single voxel or for several voxels at once [1]_.
 
     Parameters
     ----------
-    dt : array (6,)
-        elements of the diffusion tensor of the voxel.
-    md : float
-        mean diffusivity of the voxel
-    kt : array (15,)
-        elements of the kurtosis tensor of the voxel.
-    V : array (g, 3)
-        g directions of a Sphere in Cartesian coordinates
+    dt : array (6,) or (..., 6)
+        elements of the diffusion tensor of the voxel(s).
+    md : float or array (...)
+        mean diffusivity of the voxel(s)
+    kt : array (15,) or (..., 15)
+        elements of the kurtosis tensor of the voxel(s).
+    V : array (g, 3) or (..., g, 3)
+        g directions of a Sphere in Cartesian coordinates, shared by all
+        voxels or given for each voxel
     min_diffusivity : float (optional)
         Because negative eigenvalues are not physical and small eigenvalues
         cause quite a lot of noise in diffusion-based metrics, diffusivity
@@ -496,16 +514,16 @@ def directional_kurtosis(dt, md, kt, V, min_diffusivity=0, min_kurtosis=-3/7,
         `min_kurtosis` are replaced with `min_kurtosis`. Default = -3./7
         (theoretical kurtosis limit for regions that consist of water confined
         to spherical pores [2]_)
-    adc : ndarray(g,) (optional)
+    adc : ndarray(g,) or (..., g) (optional)
         Apparent diffusion coefficient (adc) in all g directions of a sphere
         for a single voxel.
-    adv : ndarray(g,) (optional)
+    adv : ndarray(g,) or (..., g) (optional)
         Apparent diffusion variance (advc) in all g directions of a sphere for
         a single voxel.
 
     Returns
     --------
-    akc : ndarray (g,)
+    akc : ndarray (g,) or (..., g)
         Apparent kurtosis coefficient (AKC) in all g directions of a sphere for
         a single voxel.
 
@@ -526,7 +544,7 @@ def directional_kurtosis(dt, md, kt, V, min_diffusivity=0, min_kurtosis=-3/7,
     if adv is None:
         adv = directional_diffusion_variance(kt, V)
 
-    akc = adv * (md / adc) ** 2
+    akc = adv * (np.asarray(md)[..., None] / adc) ** 2
 
     if min_kurtosis is not None:
         akc = akc.clip(min=min_kurtosis)
@@ -621,11 +639,13 @@ def apparent_kurtosis_coef(dki_params, sphere, min_diffusivity=0,
     md = mean_diffusivity(evals)
     dt = lower_triangular(vec_val_vect(evecs, evals))
 
-    # loop over all relevant voxels
-    for vox in range(len(kt)):
-        akci[vox] = directional_kurtosis(dt[vox], md[vox], kt[vox], V,
-                                         min_diffusivity=min_diffusivity,
-                                         min_kurtosis=min_kurtosis)
+    # process the relevant voxels in blocks, to bound the memory of the
+    # intermediate directional diffusion arrays
+    step = max(1, _BLOCK_ELEMENTS // len(V))
+    for i in range(0, len(kt), step):
+        akci[i:i + step] = directional_kurtosis(
+            dt[i:i + step], md[i:i + step], kt[i:i + step], V,
+            min_diffusivity=min_diffusivity, min_kurtosis=min_kurtosis)
 
     # reshape data according to input data
     akc[rel_i] = akci
@@ -1021,19 +1041,23 @@ def radial_kurtosis(dki_params, min_kurtosis=-3./7, max_kurtosis=10,
 
         # select relevant voxels to process
         rel_i = _positive_evals(evals[..., 0], evals[..., 1], evals[..., 2])
-        dki_params = dki_params[rel_i]
         evecs = evecs[rel_i]
         RKi = RK[rel_i]
 
-        # loop over all voxels
-        KV = np.zeros((dki_params.shape[0], npa))
-        for vox in range(len(dki_params)):
-            V = perpendicular_directions(np.array(evecs[vox, :, 0]), num=npa,
+        kt = kt[rel_i]
+        evals = evals[rel_i]
+        md = mean_diffusivity(evals)
+        dt = lower_triangular(vec_val_vect(evecs, evals))
+
+        # directions perpendicular to the main direction of each voxel
+        step = max(1, _BLOCK_ELEMENTS // npa)
+        for i in range(0, len(kt), step):
+            V = perpendicular_directions(evecs[i:i + step, :, 0], num=npa,
                                          half=True)
-            sph = dps.Sphere(xyz=V)
-            KV[vox, :] = apparent_kurtosis_coef(dki_params[vox], sph,
-                                                min_kurtosis=min_kurtosis)
-        RKi = np.mean(KV, axis=-1)
+            KV = directional_kurtosis(dt[i:i + step], md[i:i + step],
+                                      kt[i:i + step], V,
+                                      min_kurtosis=min_kurtosis)
+            RKi[i:i + step] = np.mean(KV, axis=-1)
 
         RK[rel_i] = RKi
 
@@ -1144,9 +1168,7 @@ def axial_kurtosis(dki_params, min_kurtosis=-3./7, max_kurtosis=10,
     else:
         # Compute apparent directional kurtosis along evecs[0]
         dt = lower_triangular(vec_val_vect(evecs, evals))
-        for vox in range(len(kt)):
-            AKi[vox] = directional_kurtosis(dt[vox], md[vox], kt[vox],
-                                            np.array([evecs[vox, :, 0]]))
+        AKi = directional_kurtosis(dt, md, kt, evecs[:, None, :, 0])[:, 0]
 
     # reshape data according to input data
     AK[rel_i] = AKi
@@ -1160,36 +1182,209 @@ def axial_kurtosis(dki_params, min_kurtosis=-3./7, max_kurtosis=10,
     return AK.reshape(outshape)
 
 
-def _kt_maximum_converge(ang, dt, md, kt):
-    """ Helper function that computes the inverse of the directional kurtosis
-    of a voxel along a given direction in polar coordinates.
+def _local_maxima_batch(akc, edges):
+    """ Local maxima of the directional kurtosis of several voxels
+
+    Same criterion as ``dipy.reconst.recspeed.local_maxima``: a direction is
+    a local maximum if its value is larger than the one of at least one
+    neighbor and not smaller than the one of any neighbor.
 
     Parameters
     ----------
-    ang : array (2,)
-        array containing the two polar angles
-    dt : array (6,)
-        elements of the diffusion tensor of the voxel.
-    md : float
-        mean diffusivity of the voxel
-    kt : array (15,)
-        elements of the kurtosis tensor of the voxel.
+    akc : array (n, g)
+        Directional kurtosis of n voxels on the g vertices of a sphere.
+    edges : array (e, 2)
+        Pairs of neighboring vertices of the sphere.
 
     Returns
     -------
-    neg_kt : float
-        The inverse value of the apparent kurtosis for the given direction.
+    is_max : array (n, g) of bool
+        True for the local maxima.
+    """
+    a = akc[:, edges[:, 0]]
+    b = akc[:, edges[:, 1]]
+    n_vertices = akc.shape[1]
+    # incidence matrices of the first and second vertices of the edges
+    rows = np.arange(len(edges))
+    first = sparse.csr_matrix((np.ones(len(edges)), (rows, edges[:, 0])),
+                              shape=(len(edges), n_vertices))
+    second = sparse.csr_matrix((np.ones(len(edges)), (rows, edges[:, 1])),
+                               shape=(len(edges), n_vertices))
+    lower = (a < b).astype(float)
+    higher = (a > b).astype(float)
+    smaller = (first.T.dot(lower.T) + second.T.dot(higher.T)).T > 0
+    larger = (first.T.dot(higher.T) + second.T.dot(lower.T)).T > 0
+    return larger & ~smaller
+
+
+def _kt_tensor_index():
+    """ Index in the 15 kurtosis tensor elements of each element of the full
+    4D kurtosis tensor (see ``Wcons``)
+    """
+    key = np.arange(1, 4)
+    key = (key[:, None, None, None] * key[None, :, None, None] *
+           key[None, None, :, None] * key[None, None, None, :])
+    return np.vectorize(ind_ele.get)(key)
+
+
+def _directional_kurtosis_gradient(dt, md, kt, n):
+    """ Gradient of the directional kurtosis of several voxels
+
+    Parameters
+    ----------
+    dt : array (m, 6)
+        elements of the diffusion tensors.
+    md : array (m,)
+        mean diffusivities.
+    kt : array (m, 15)
+        elements of the kurtosis tensors.
+    n : array (m, 3)
+        unit directions.
+
+    Returns
+    -------
+    grad : array (m, 3)
+        Gradient of the directional kurtosis at the directions `n`. Since the
+        directional kurtosis is a homogeneous function of degree 0 of the
+        direction, the gradient is tangent to the unit sphere.
+    """
+    Dn = np.einsum('mij,mj->mi', from_lower_triangular(dt), n)
+    D = np.sum(Dn * n, axis=-1)
+    Wnnn = np.einsum('mijkl,mj,mk,ml->mi', kt[:, _kt_tensor_index()], n, n, n)
+    W = np.sum(Wnnn * n, axis=-1)
+    # derivatives of W = W_ijkl n_i n_j n_k n_l and D = D_ij n_i n_j are
+    # 4 W_ijkl n_j n_k n_l and 2 D_ij n_j
+    return (md ** 2 / D ** 3)[:, None] * (4 * Wnnn * D[:, None] -
+                                          4 * W[:, None] * Dn)
+
+
+def _kurtosis_maximum_block(dt, md, kt, sphere, gtol=1e-2, max_iter=100):
+    """ Maximum of the directional kurtosis of several voxels
+
+    Parameters
+    ----------
+    dt : array (m, 6)
+        elements of the diffusion tensors.
+    md : array (m,)
+        mean diffusivities.
+    kt : array (m, 15)
+        elements of the kurtosis tensors.
+    sphere : Sphere class instance
+        The sphere providing sample directions for the initial search of the
+        maximum value of kurtosis.
+    gtol : float, optional
+        The refinement of each local maximum of the sampled directions stops
+        when the norm of the gradient of the directional kurtosis is less
+        than gtol. If gtol is None, the maxima are not refined.
+    max_iter : int, optional
+        Maximum number of iterations of the refinement.
+
+    Returns
+    -------
+    max_value : array (m,)
+        kurtosis tensor maximum values
+    max_dir : array (m, 3)
+        Cartesian coordinates of the directions of the maximal kurtosis
+        values
 
     Notes
     -----
-    This function is used to refine the kurtosis maximum estimate
-
-    See also
-    --------
-    dipy.reconst.dki.kurtosis_maximum
+    The directional kurtosis of all the voxels is sampled on the sphere with
+    one matrix product. Each local maximum is then refined by Newton
+    iterations on the unit sphere, run for all the local maxima at once,
+    with a backtracking step size per maximum. The Hessian in the tangent
+    plane is obtained from finite differences of the analytical gradient. A
+    maximum stops being refined once its gradient norm is below `gtol` or
+    its step size vanishes.
     """
-    n = np.array([sphere2cart(1, ang[0], ang[1])])
-    return -1. * directional_kurtosis(dt, md, kt, n)
+    akc = directional_kurtosis(dt, md, kt, sphere.vertices)
+    is_max = _local_maxima_batch(akc, sphere.edges)
+    vox, ind = np.nonzero(is_max)
+
+    # case that none maximum was find (spherical or null kurtosis tensors)
+    max_value = np.mean(akc, axis=-1)
+    max_dir = np.zeros((len(akc), 3))
+    has_max = np.any(is_max, axis=-1)
+    best = np.argmax(np.where(is_max, akc, -np.inf), axis=-1)
+    max_value[has_max] = akc[has_max, best[has_max]]
+    max_dir[has_max] = sphere.vertices[best[has_max]]
+
+    if gtol is None or len(vox) == 0:
+        return max_value, max_dir
+
+    def kurtosis(v, n):
+        return directional_kurtosis(dt[v], md[v], kt[v], n[:, None])[:, 0]
+
+    def gradient(v, n):
+        return _directional_kurtosis_gradient(dt[v], md[v], kt[v], n)
+
+    n = sphere.vertices[ind].astype(float)
+    f = akc[vox, ind]
+    g = gradient(vox, n)
+    step = np.ones(len(vox))
+    active = np.sqrt(np.sum(g ** 2, axis=-1)) >= gtol
+    eps = 1e-4
+    for _ in range(max_iter):
+        if not np.any(active):
+            break
+        a = np.nonzero(active)[0]
+
+        # orthonormal basis (u1, u2) of the tangent planes
+        axis = np.eye(3)[np.argmin(np.abs(n[a]), axis=-1)]
+        u1 = np.cross(n[a], axis)
+        u1 /= np.sqrt(np.sum(u1 ** 2, axis=-1))[:, None]
+        U = np.stack([u1, np.cross(n[a], u1)], axis=1)
+        grad = np.einsum('kij,kj->ki', U, g[a])
+
+        # Hessian in the tangent planes, from finite differences of the
+        # gradient
+        H = np.empty((len(a), 2, 2))
+        for j in range(2):
+            n_p = n[a] + eps * U[:, j]
+            n_m = n[a] - eps * U[:, j]
+            n_p /= np.sqrt(np.sum(n_p ** 2, axis=-1))[:, None]
+            n_m /= np.sqrt(np.sum(n_m ** 2, axis=-1))[:, None]
+            H[:, :, j] = np.einsum('kij,kj->ki', U,
+                                   gradient(vox[a], n_p) -
+                                   gradient(vox[a], n_m)) / (2 * eps)
+        H = (H + np.swapaxes(H, 1, 2)) / 2
+
+        # Newton direction, with the eigenvalues of the Hessian made
+        # negative so that it is an ascent direction
+        w, Q = np.linalg.eigh(H)
+        mu = 1e-8 + 1e-3 * np.max(np.abs(w), axis=-1)
+        w = np.minimum(w, -mu[:, None])
+        d = -np.einsum('kij,kj,klj,kl->ki', Q, 1. / w, Q, grad)
+        # at most a step of 0.5 radians
+        d *= np.minimum(1., 0.5 / np.sqrt(np.sum(d ** 2, axis=-1)))[:, None]
+        slope = np.sum(grad * d, axis=-1)
+
+        n_new = n[a] + step[a, None] * np.einsum('ki,kij->kj', d, U)
+        n_new /= np.sqrt(np.sum(n_new ** 2, axis=-1))[:, None]
+        f_new = kurtosis(vox[a], n_new)
+
+        # Armijo condition: rejected moves halve the step size
+        ok = f_new >= f[a] + 1e-4 * step[a] * slope
+        acc = a[ok]
+        n[acc] = n_new[ok]
+        f[acc] = f_new[ok]
+        g[acc] = gradient(vox[acc], n[acc])
+        step[acc] = 1.
+        step[a[~ok]] /= 2
+        active[a] = ((np.sqrt(np.sum(g[a] ** 2, axis=-1)) >= gtol) &
+                     (step[a] > 1e-10))
+
+    # the maximum of each voxel among its refined local maxima
+    order = np.lexsort((-f, vox))
+    vox = vox[order]
+    first = np.ones(len(vox), dtype=bool)
+    first[1:] = vox[1:] != vox[:-1]
+    best = order[first]
+    better = f[best] > max_value[vox[first]]
+    max_value[vox[first][better]] = f[best][better]
+    max_dir[vox[first][better]] = n[best][better]
+
+    return max_value, max_dir
 
 
 def _voxel_kurtosis_maximum(dt, md, kt, sphere, gtol=1e-2):
@@ -1220,41 +1415,14 @@ def _voxel_kurtosis_maximum(dt, md, kt, sphere, gtol=1e-2):
     max_dir : array (3,)
         Cartesian coordinates of the direction of the maximal kurtosis value
     """
-    # Estimation of maximum kurtosis candidates
-    akc = directional_kurtosis(dt, md, kt, sphere.vertices)
-    max_val, ind = local_maxima(akc, sphere.edges)
-    n = len(max_val)
-
-    # case that none maximum was find (spherical or null kurtosis tensors)
-    if n == 0:
-        return np.mean(akc), np.zeros(3)
-
-    max_dir = sphere.vertices[ind]
-
-    # Select the maximum from the candidates
-    max_value = max(max_val)
-    max_direction = max_dir[np.argmax(max_val.argmax)]
-
-    # refine maximum direction
-    if gtol is not None:
-        for p in range(n):
-            r, theta, phi = cart2sphere(max_dir[p, 0], max_dir[p, 1],
-                                        max_dir[p, 2])
-            ang = np.array([theta, phi])
-            ang[:] = opt.fmin_bfgs(_kt_maximum_converge, ang,
-                                   args=(dt, md, kt), disp=False,
-                                   retall=False, gtol=gtol)
-            k_dir = np.array([sphere2cart(1., ang[0], ang[1])])
-            k_val = directional_kurtosis(dt, md, kt, k_dir)
-            if k_val > max_value:
-                max_value = k_val
-                max_direction = k_dir
-
-    return max_value, max_direction
+    max_value, max_dir = _kurtosis_maximum_block(
+        np.asarray(dt, dtype=float)[None], np.atleast_1d(md),
+        np.asarray(kt, dtype=float)[None], sphere, gtol=gtol)
+    return max_value[0], max_dir[0]
 
 
 def kurtosis_maximum(dki_params, sphere='repulsion100', gtol=1e-2,
-                     mask=None):
+                     mask=None, num_threads=None):
     """ Computes kurtosis maximum value
 
     Parameters
@@ -1278,13 +1446,23 @@ def kurtosis_maximum(dki_params, sphere='repulsion100', gtol=1e-2,
     mask : ndarray
         A boolean array used to mark the coordinates in the data that should be
         analyzed that has the shape dki_params.shape[:-1]
+    num_threads : int, optional
+        Number of threads used to process blocks of voxels concurrently. If
+        None (default) the value of OMP_NUM_THREADS environment variable is
+        used if it is set, otherwise all available threads are used. If < 0
+        the maximal number of threads minus |num_threads + 1| is used (enter
+        -1 to use as many threads as possible). 0 raises an error.
 
     Returns
     --------
     max_value : float
         kurtosis tensor maximum value
-    max_dir : array (3,)
-        Cartesian coordinates of the direction of the maximal kurtosis value
+
+    Notes
+    -----
+    The kurtosis of all the voxels is first sampled on the directions of the
+    sphere, and its local maxima are then refined for all the voxels at once
+    by Newton iterations on the unit sphere.
     """
     shape = dki_params.shape[:-1]
 
@@ -1306,15 +1484,28 @@ def kurtosis_maximum(dki_params, sphere='repulsion100', gtol=1e-2,
     mask = np.logical_and(mask, pos_evals)
 
     kt_max = np.zeros(mask.shape)
-    dt = lower_triangular(vec_val_vect(evecs, evals))
-    md = mean_diffusivity(evals)
-
-    for idx in ndindex(shape):
-        if not mask[idx]:
-            continue
-        kt_max[idx], da = _voxel_kurtosis_maximum(dt[idx], md[idx], kt[idx],
-                                                  sphere, gtol=gtol)
+    dt = lower_triangular(vec_val_vect(evecs[mask], evals[mask]))
+    md = mean_diffusivity(evals[mask])
+    kt = kt[mask]
+    kt_max_in_mask = np.zeros(len(kt))
+
+    def process(start):
+        stop = start + step
+        kt_max_in_mask[start:stop] = _kurtosis_maximum_block(
+            dt[start:stop], md[start:stop], kt[start:stop], sphere,
+            gtol=gtol)[0]
+
+    step = max(1, _BLOCK_ELEMENTS // len(sphere.vertices))
+    starts = range(0, len(kt), step)
+    num_threads = determine_num_threads(num_threads)
+    if num_threads == 1 or len(starts) == 1:
+        for start in starts:
+            process(start)
+    else:
+        with ThreadPoolExecutor(max_workers=num_threads) as executor:
+            list(executor.map(process, starts))
 
+    kt_max[mask] = kt_max_in_mask
     return kt_max
 
 
@@ -2086,17 +2277,14 @@ class DiffusionKurtosisFit(TensorFit):
         return dki_prediction(self.model_params, gtab, S0)
 
 
-def _ols_iter(inv_design, sig, min_diffusivity):
-    """ Helper function used by ols_fit_dki - Applies OLS fit of the diffusion
-    kurtosis model to single voxel signals.
+def _lstsq_to_dki_params(result, min_diffusivity):
+    """ Helper function used by ols_fit_dki and wls_fit_dki - Converts the
+    linear least squares solutions of several voxels to DKI parameters.
 
     Parameters
     ----------
-    inv_design : array (g, 22)
-        Inverse of the design matrix holding the covariants used to solve for
-        the regression coefficients.
-    sig : array (g,)
-        Diffusion-weighted signal for a single voxel data.
+    result : array (N, 22)
+        Linear least squares solutions of the diffusion kurtosis model.
     min_diffusivity : float
         Because negative eigenvalues are not physical and small eigenvalues,
         much smaller than the diffusion weighting, cause quite a lot of noise
@@ -2105,7 +2293,7 @@ def _ols_iter(inv_design, sig, min_diffusivity):
 
     Returns
     -------
-    dki_params : array (27,)
+    dki_params : array (N, 27)
         All parameters estimated from the diffusion kurtosis model.
         Parameters are ordered as follows:
             1) Three diffusion tensor's eigenvalues
@@ -2113,27 +2301,20 @@ def _ols_iter(inv_design, sig, min_diffusivity):
                second and third coordinates of the eigenvector
             3) Fifteen elements of the kurtosis tensor
     """
-    # DKI ordinary linear least square solution
-    log_s = np.log(sig)
-    result = np.dot(inv_design, log_s)
-
     # Extracting the diffusion tensor parameters from solution
-    DT_elements = result[:6]
+    DT_elements = result[:, :6]
     evals, evecs = decompose_tensor(from_lower_triangular(DT_elements),
                                     min_diffusivity=min_diffusivity)
 
     # Extracting kurtosis tensor parameters from solution
-    MD_square = (evals.mean(0))**2
-    KT_elements = result[6:21] / MD_square
+    MD_square = evals.mean(-1) ** 2
+    KT_elements = result[:, 6:21] / MD_square[:, None]
 
     # Write output
-    dki_params = np.concatenate((evals, evecs[0], evecs[1], evecs[2],
-                                 KT_elements), axis=0)
-
-    return dki_params
+    return np.concatenate((evals, evecs.reshape(-1, 9), KT_elements), axis=-1)
 
 
-def ols_fit_dki(design_matrix, data):
+def ols_fit_dki(design_matrix, data, step=1e4):
     r""" Computes the diffusion and kurtosis tensors using an ordinary linear
     least squares (OLS) approach [1]_.
 
@@ -2145,6 +2326,9 @@ def ols_fit_dki(design_matrix, data):
     data : array (N, g)
         Data or response variables holding the data. Note that the last
         dimension should contain the data. It makes no copies of data.
+    step : int, optional
+        The chunk size as a number of voxels. The pseudo-inverse of the
+        design matrix is applied to `step` voxels at once. Default: 10,000.
 
     Returns
     -------
@@ -2173,15 +2357,17 @@ def ols_fit_dki(design_matrix, data):
     data = np.asarray(data)
     data_flat = data.reshape((-1, data.shape[-1]))
     dki_params = np.empty((len(data_flat), 27))
+    step = int(step) or max(len(data_flat), 1)
 
     # inverting design matrix and defining minimum diffusion
     min_diffusivity = tol / -design_matrix.min()
     inv_design = np.linalg.pinv(design_matrix)
 
-    # looping OLS solution on all data voxels
-    for vox in range(len(data_flat)):
-        dki_params[vox] = _ols_iter(inv_design, data_flat[vox],
-                                    min_diffusivity)
+    # OLS solution of all the voxels of each chunk
+    for i in range(0, len(data_flat), step):
+        log_s = np.log(data_flat[i:i + step])
+        result = np.dot(log_s, inv_design.T)
+        dki_params[i:i + step] = _lstsq_to_dki_params(result, min_diffusivity)
 
     # Reshape data according to the input data shape
     dki_params = dki_params.reshape((data.shape[:-1]) + (27,))
@@ -2189,66 +2375,7 @@ def ols_fit_dki(design_matrix, data):
     return dki_params
 
 
-def _wls_iter(design_matrix, inv_design, sig, min_diffusivity):
-    """ Helper function used by wls_fit_dki - Applies WLS fit of the diffusion
-    kurtosis model to single voxel signals.
-
-    Parameters
-    ----------
-    design_matrix : array (g, 22)
-        Design matrix holding the covariants used to solve for the regression
-        coefficients
-    inv_design : array (g, 22)
-        Inverse of the design matrix.
-    sig : array (g, )
-        Diffusion-weighted signal for a single voxel data.
-    min_diffusivity : float
-        Because negative eigenvalues are not physical and small eigenvalues,
-        much smaller than the diffusion weighting, cause quite a lot of noise
-        in metrics such as fa, diffusivity values smaller than
-        `min_diffusivity` are replaced with `min_diffusivity`.
-
-    Returns
-    -------
-    dki_params : array (27, )
-        All parameters estimated from the diffusion kurtosis model.
-        Parameters are ordered as follows:
-            1) Three diffusion tensor's eigenvalues
-            2) Three lines of the eigenvector matrix each containing the first,
-               second and third coordinates of the eigenvector
-            3) Fifteen elements of the kurtosis tensor
-    """
-    A = design_matrix
-
-    # DKI ordinary linear least square solution (initial guess)
-    log_s = np.log(sig)
-    ols_result = np.dot(inv_design, log_s)
-
-    # Define weights as diag(yn**2)
-    W = np.diag(np.exp(2 * np.dot(A, ols_result)))
-
-    # DKI weighted linear least square solution
-    inv_AT_W_A = np.linalg.pinv(np.dot(np.dot(A.T, W), A))
-    AT_W_LS = np.dot(np.dot(A.T, W), log_s)
-    wls_result = np.dot(inv_AT_W_A, AT_W_LS)
-
-    # Extracting the diffusion tensor parameters from solution
-    DT_elements = wls_result[:6]
-    evals, evecs = decompose_tensor(from_lower_triangular(DT_elements),
-                                    min_diffusivity=min_diffusivity)
-
-    # Extracting kurtosis tensor parameters from solution
-    MD_square = (evals.mean(0))**2
-    KT_elements = wls_result[6:21] / MD_square
-
-    # Write output
-    dki_params = np.concatenate((evals, evecs[0], evecs[1], evecs[2],
-                                 KT_elements), axis=0)
-
-    return dki_params
-
-
-def wls_fit_dki(design_matrix, data):
+def wls_fit_dki(design_matrix, data, step=1e4):
     r""" Computes the diffusion and kurtosis tensors using a weighted linear
     least squares (WLS) approach [1]_.
 
@@ -2260,6 +2387,10 @@ def wls_fit_dki(design_matrix, data):
     data : array (N, g)
         Data or response variables holding the data. Note that the last
         dimension should contain the data. It makes no copies of data.
+    step : int, optional
+        The chunk size as a number of voxels. The weighted normal equations
+        of `step` voxels are solved at once. A larger step value should speed
+        things up, but it will also take up more memory. Default: 10,000.
 
     Returns
     -------
@@ -2272,6 +2403,14 @@ def wls_fit_dki(design_matrix, data):
                second and third coordinates of the eigenvector
             3) Fifteen elements of the kurtosis tensor
 
+    Notes
+    -----
+    For each voxel, the weights are the squares of the signals predicted by
+    the OLS solution, and the WLS solution is obtained from the weighted
+    normal equations $(A^T W A) x = A^T W \log(S)$. The matrices $A^T W A$
+    of all the voxels of a chunk are computed as a single matrix product
+    of the weights with the outer products of the rows of $A$.
+
     References
     ----------
     [1] Veraart, J., Sijbers, J., Sunaert, S., Leemans, A., Jeurissen, B.,
@@ -2281,20 +2420,38 @@ def wls_fit_dki(design_matrix, data):
     """
 
     tol = 1e-6
+    A = design_matrix
+    n_params = A.shape[1]
 
     # preparing data and initializing parameters
     data = np.asarray(data)
     data_flat = data.reshape((-1, data.shape[-1]))
     dki_params = np.empty((len(data_flat), 27))
+    step = int(step) or max(len(data_flat), 1)
 
     # inverting design matrix and defining minimum diffusion
     min_diffusivity = tol / -design_matrix.min()
     inv_design = np.linalg.pinv(design_matrix)
 
-    # looping WLS solution on all data voxels
-    for vox in range(len(data_flat)):
-        dki_params[vox] = _wls_iter(design_matrix, inv_design, data_flat[vox],
-                                    min_diffusivity)
+    # outer products of the rows of the design matrix
+    A_outer = (A[:, :, None] * A[:, None, :]).reshape(len(A), -1)
+
+    # WLS solution of all the voxels of each chunk
+    for i in range(0, len(data_flat), step):
+        # DKI ordinary linear least square solution (initial guess)
+        log_s = np.log(data_flat[i:i + step])
+        ols_result = np.dot(log_s, inv_design.T)
+
+        # Define weights as yn**2
+        w = np.exp(2 * np.dot(ols_result, A.T))
+
+        # DKI weighted linear least square solution
+        AT_W_A = np.dot(w, A_outer).reshape(-1, n_params, n_params)
+        AT_W_LS = np.dot(w * log_s, A)
+        wls_result = np.matmul(np.linalg.pinv(AT_W_A),
+                               AT_W_LS[..., None])[..., 0]
+        dki_params[i:i + step] = _lstsq_to_dki_params(wls_result,
+                                                      min_diffusivity)
 
     # Reshape data according to the input data shape
     dki_params = dki_params.reshape((data.shape[:-1]) + (27,))
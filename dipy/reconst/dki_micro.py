@@ -19,7 +19,7 @@ import dipy.core.sphere as dps
 
 
 def axonal_water_fraction(dki_params, sphere='repulsion100', gtol=1e-2,
-                          mask=None):
+                          mask=None, num_threads=None):
     """ Computes the axonal water fraction from DKI [1]_.
 
     Parameters
@@ -43,6 +43,11 @@ def axonal_water_fraction(dki_params, sphere='repulsion100', gtol=1e-2,
     mask : ndarray
         A boolean array used to mark the coordinates in the data that should be
         analyzed that has the shape dki_params.shape[:-1]
+    num_threads : int, optional
+        Number of threads used to compute the kurtosis maxima of blocks of
+        voxels concurrently (see ``dipy.reconst.dki.kurtosis_maximum``).
+        If None (default) the value of OMP_NUM_THREADS environment variable
+        is used if it is set, otherwise all available threads are used.
 
     Returns
     --------
@@ -55,7 +60,8 @@ def axonal_water_fraction(dki_params, sphere='repulsion100', gtol=1e-2,
            characterization with diffusional kurtosis imaging.
            Neuroimage 58(1):177-88. doi: 10.1016/j.neuroimage.2011.06.006
     """
-    kt_max = kurtosis_maximum(dki_params, sphere=sphere, gtol=gtol, mask=mask)
+    kt_max = kurtosis_maximum(dki_params, sphere=sphere, gtol=gtol, mask=mask,
+                              num_threads=num_threads)
 
     awf = kt_max / (kt_max + 3)
 
@@ -335,7 +341,7 @@ class KurtosisMicrostructureModel(DiffusionKurtosisModel):
                                         **kwargs)
 
     def fit(self, data, mask=None, sphere='repulsion100', gtol=1e-2,
-            awf_only=False):
+            awf_only=False, num_threads=None):
         """ Fit method of the Diffusion Kurtosis Microstructural Model
 
         Parameters
@@ -361,6 +367,10 @@ class KurtosisMicrostructureModel(DiffusionKurtosisModel):
         awf_only : bool, optiomal
             If set to true only the axonal volume fraction is computed from
             the kurtosis tensor. Default = False
+
+        num_threads : int, optional
+            Number of threads used to compute the axonal water fraction of
+            blocks of voxels concurrently. Default: None (sequential).
         """
         if mask is not None:
             # Check for valid shape of the mask
@@ -379,7 +389,8 @@ class KurtosisMicrostructureModel(DiffusionKurtosisModel):
                                      *self.args, **self.kwargs)
 
         # Computing awf
-        awf = axonal_water_fraction(dki_params, sphere=sphere, gtol=gtol)
+        awf = axonal_water_fraction(dki_params, sphere=sphere, gtol=gtol,
+                                    num_threads=num_threads)
 
         if awf_only:
             params_all_mask = np.concatenate((dki_params, np.array([awf]).T),
@@ -1,9 +1,19 @@
+from itertools import product
+
 import numpy as np
+from numpy.lib import NumpyVersion as Version
+import scipy
 from scipy.ndimage import map_coordinates
-from scipy.fftpack import fftn, fftshift, ifftshift
+from scipy.sparse import coo_matrix
 from dipy.reconst.odf import OdfModel, OdfFit
 from dipy.reconst.cache import Cache
-from dipy.reconst.multi_voxel import multi_voxel_fit
+from dipy.utils.omp import determine_num_threads
+
+if Version(scipy.__version__) >= Version('1.4.0'):
+    import scipy.fft
+    _fft = scipy.fft
+else:
+    _fft = np.fft
 
 
 class DiffusionSpectrumModel(OdfModel, Cache):
@@ -124,26 +134,112 @@ class DiffusionSpectrumModel(OdfModel, Cache):
         b0 = np.min(self.bvals)
         self.dn = (self.bvals > b0).sum()
         self.gtab = gtab
+        # Indices of the signal values in the flattened q-space grid, in the
+        # unshifted layout of the FFT (origin at index 0). Values sharing a
+        # position are summed.
+        index = np.mod(self.qgrid - self.origin, self.qgrid_size)
+        index = np.ravel_multi_index(index.T, 3 * (self.qgrid_size, ))
+        self._qgrid_index, inverse = np.unique(index, return_inverse=True)
+        self._qgrid_sum = coo_matrix(
+            (np.ones(len(index)), (inverse, np.arange(len(index)))),
+            shape=(len(self._qgrid_index), len(index))).tocsr()
+
+    def fit(self, data, mask=None, step=50, num_threads=None):
+        """ Fit method for every voxel in data
+
+        The propagators and ODFs are only computed when requested, for
+        blocks of voxels at once.
+
+        Parameters
+        ----------
+        data : ndarray
+            Signal values, with the diffusion weightings along the last
+            dimension.
+        mask : ndarray, optional
+            Boolean array with the shape of ``data[..., 0]``, True for the
+            voxels to reconstruct. Default: all the voxels.
+        step : int, optional
+            Number of voxels processed at once. Default: 50.
+        num_threads : int, optional
+            Number of threads used by the FFTs. If None (default) the value of
+            OMP_NUM_THREADS environment variable is used if it is set,
+            otherwise all available threads are used. If < 0 the maximal
+            number of threads minus |num_threads + 1| is used (enter -1 to use
+            as many threads as possible). 0 raises an error.
+
+        Returns
+        -------
+        fit : DiffusionSpectrumFit
+        """
+        if mask is not None and mask.shape != data.shape[:-1]:
+            raise ValueError("mask and data shape do not match")
+        return DiffusionSpectrumFit(self, data, mask, step, num_threads)
+
+    def _fill_qspace(self, values):
+        """ Unshifted q-space grids of a block of voxels """
+        Sq = np.zeros((len(values), self.qgrid_size ** 3))
+        Sq[:, self._qgrid_index] = self._qgrid_sum.dot(values.T).T
+        return Sq.reshape((len(values), ) + 3 * (self.qgrid_size, ))
+
+    def _odf_matrix(self, sphere, half):
+        odf_matrix = self.cache_get('odf_matrix', key=(sphere, half))
+        if odf_matrix is None:
+            odf_matrix = pdf_odf_matrix(sphere, self.qradius, self.origin,
+                                        self.qgrid_size, half=half)
+            self.cache_set('odf_matrix', (sphere, half), odf_matrix)
+        return odf_matrix
+
+    def _pdf_block(self, values, normalized, workers):
+        """ Unshifted propagators of a block of voxels """
+        Sq = self._fill_qspace(values * self.filter)
+        Pr = _fft.fftn(Sq, axes=(1, 2, 3), **workers).real
+        # clipping negative values to 0 (ringing artefact)
+        Pr = np.maximum(Pr, 0)
+        if normalized:
+            Pr /= Pr.sum(axis=(1, 2, 3), keepdims=True)
+        return Pr
 
-    @multi_voxel_fit
-    def fit(self, data):
-        return DiffusionSpectrumFit(self, data)
+    def _odf_block(self, values, sphere, workers):
+        """ ODFs of a block of voxels """
+        Sq = self._fill_qspace(values * self.filter)
+        # The real part of the spectrum of a real grid is symmetric, so the
+        # half grid of the real FFT holds all the values of the propagators
+        Pr = np.maximum(_fft.rfftn(Sq, axes=(1, 2, 3), **workers).real, 0)
+        Pr = Pr.reshape(len(values), -1, Pr.shape[-1])
+        # weights of the half grid values in the sum of the full grid
+        weights = np.full(Pr.shape[-1], 2.)
+        weights[0] = 1
+        total = Pr.dot(weights).sum(axis=-1)
+        odf = self._odf_matrix(sphere, half=True).dot(
+            Pr.reshape(len(values), -1).T).T
+        return odf / total[:, None]
 
 
 class DiffusionSpectrumFit(OdfFit):
 
-    def __init__(self, model, data):
-        """ Calculates PDF and ODF and other properties for a single voxel
+    def __init__(self, model, data, mask=None, step=50, num_threads=None):
+        """ Calculates PDF and ODF and other properties of the voxels
 
         Parameters
         ----------
         model : object,
             DiffusionSpectrumModel
-        data : 1d ndarray,
-            signal values
+        data : ndarray,
+            signal values, with the diffusion weightings along the last
+            dimension
+        mask : ndarray, optional
+            voxels to reconstruct. Default: all the voxels.
+        step : int, optional
+            number of voxels processed at once. Default: 50.
+        num_threads : int, optional
+            number of threads used by the FFTs (see
+            ``DiffusionSpectrumModel.fit``).
         """
         self.model = model
         self.data = data
+        self.mask = mask
+        self.step = step
+        self.num_threads = num_threads
         self.qgrid_sz = self.model.qgrid_size
         self.dn = self.model.dn
         self._gfa = None
@@ -151,28 +247,43 @@ class DiffusionSpectrumFit(OdfFit):
         self._peak_values = None
         self._peak_indices = None
 
+    @property
+    def shape(self):
+        return self.data.shape[:-1]
+
+    def __getitem__(self, index):
+        """Allowing indexing into fit"""
+        if isinstance(index, tuple):
+            data_index = index + (Ellipsis,)
+        else:
+            data_index = index
+        mask = None if self.mask is None else self.mask[index]
+        return type(self)(self.model, self.data[data_index], mask,
+                          self.step, self.num_threads)
+
+    def _apply_to_voxels(self, func, shape=()):
+        """ Evaluates ``func(values, workers)`` on blocks of voxels """
+        data = self.data.reshape(-1, self.data.shape[-1])
+        if self.mask is None:
+            voxels = np.arange(len(data))
+        else:
+            voxels = np.flatnonzero(self.mask)
+        workers = _fft_workers(self.num_threads)
+        result = np.zeros((len(data), ) + shape)
+        for start in range(0, len(voxels), self.step):
+            block = voxels[start:start + self.step]
+            result[block] = func(data[block], workers)
+        return result.reshape(self.shape + shape)
+
     def pdf(self, normalized=True):
         """ Applies the 3D FFT in the q-space grid to generate
         the diffusion propagator
         """
-        values = self.data * self.model.filter
-        # create the signal volume
-        Sq = np.zeros((self.qgrid_sz, self.qgrid_sz, self.qgrid_sz))
-        # fill q-space
-
-        for i in range(len(values)):
-            qx, qy, qz = self.model.qgrid[i]
-            Sq[qx, qy, qz] += values[i]
-        # apply fourier transform
-        Pr = fftshift(np.real(fftn(ifftshift(Sq), 3 * (self.qgrid_sz, ))))
-        # clipping negative values to 0 (ringing artefact)
-        Pr = np.clip(Pr, 0, Pr.max())
-
-        # normalize the propagator to obtain a pdf
-        if normalized:
-            Pr /= Pr.sum()
+        def pdf(values, workers):
+            Pr = self.model._pdf_block(values, normalized, workers)
+            return _fft.fftshift(Pr, axes=(1, 2, 3))
 
-        return Pr
+        return self._apply_to_voxels(pdf, 3 * (self.qgrid_sz, ))
 
     def rtop_signal(self, filtering=True):
         """ Calculates the return to origin probability (rtop) from the signal
@@ -189,14 +300,12 @@ class DiffusionSpectrumFit(OdfFit):
             the return to origin probability
         """
 
-        if filtering:
-            values = self.data * self.model.filter
-        else:
-            values = self.data
-
-        rtop = values.sum()
+        def rtop(values, workers):
+            if filtering:
+                values = values * self.model.filter
+            return values.sum(axis=-1)
 
-        return rtop
+        return self._apply_to_voxels(rtop)
 
     def rtop_pdf(self, normalized=True):
         r""" Calculates the return to origin probability from the propagator, which is
@@ -229,12 +338,12 @@ class DiffusionSpectrumFit(OdfFit):
 
         """
 
-        Pr = self.pdf(normalized=normalized)
+        def rtop(values, workers):
+            # the center of the grid is at index 0 in the unshifted layout
+            return self.model._pdf_block(values, normalized,
+                                         workers)[:, 0, 0, 0]
 
-        center = self.qgrid_sz // 2
-
-        rtop = Pr[center, center, center]
-        return rtop
+        return self._apply_to_voxels(rtop)
 
     def msd_discrete(self, normalized=True):
         r""" Calculates the mean squared displacement on the discrete propagator
@@ -266,19 +375,18 @@ class DiffusionSpectrumFit(OdfFit):
 
         """
 
-        Pr = self.pdf(normalized=normalized)
-
-        # create the r squared 3D matrix
+        # create the r squared 3D matrix, in the unshifted layout
         gridsize = self.qgrid_sz
         center = gridsize // 2
-        a = np.arange(gridsize) - center
-        x = np.tile(a, (gridsize, gridsize, 1))
-        y = np.tile(a.reshape(gridsize, 1), (gridsize, 1, gridsize))
-        z = np.tile(a.reshape(gridsize, 1, 1), (1, gridsize, gridsize))
-        r2 = x ** 2 + y ** 2 + z ** 2
+        a = _fft.ifftshift(np.arange(gridsize) - center)
+        r2 = (a[:, None, None] ** 2 + a[None, :, None] ** 2 +
+              a[None, None, :] ** 2)
 
-        msd = np.sum(Pr * r2) / float((gridsize ** 3))
-        return msd
+        def msd(values, workers):
+            Pr = self.model._pdf_block(values, normalized, workers)
+            return np.sum(Pr * r2, axis=(1, 2, 3)) / float((gridsize ** 3))
+
+        return self._apply_to_voxels(msd)
 
     def odf(self, sphere):
         r""" Calculates the real discrete odf for a given discrete sphere
@@ -292,18 +400,17 @@ class DiffusionSpectrumFit(OdfFit):
         where $\hat{\mathbf{u}}$ is the unit vector which corresponds to a
         sphere point.
         """
-        interp_coords = self.model.cache_get('interp_coords',
-                                             key=sphere)
-        if interp_coords is None:
-            interp_coords = pdf_interp_coords(sphere,
-                                              self.model.qradius,
-                                              self.model.origin)
-            self.model.cache_set('interp_coords', sphere, interp_coords)
+        def odf(values, workers):
+            return self.model._odf_block(values, sphere, workers)
+
+        return self._apply_to_voxels(odf, (len(sphere.vertices), ))
 
-        Pr = self.pdf()
 
-        # calculate the orientation distribution function
-        return pdf_odf(Pr, self.model.qradius, interp_coords)
+def _fft_workers(num_threads):
+    """ Keyword arguments setting the number of threads of the FFTs """
+    if _fft is np.fft:
+        return {}
+    return {'workers': determine_num_threads(num_threads)}
 
 
 def create_qspace(gtab, origin):
@@ -422,6 +529,64 @@ def pdf_odf(Pr, rradius, interp_coords):
     return odf
 
 
+def pdf_odf_matrix(sphere, rradius, origin, qgrid_size, half=False):
+    r""" Sparse matrix calculating ODFs from unshifted propagators
+
+    The matrix applies the linear interpolation and radial integration of
+    ``pdf_odf`` to propagators in the layout of the FFT output, where the
+    origin is at index 0 instead of the center of the grid. The ODFs of many
+    voxels are then given by one sparse-dense product.
+
+    Parameters
+    ----------
+    sphere : object,
+            Sphere
+    rradius : array, shape (N,)
+            interpolation range on the radius
+    origin : int
+            center of the (shifted) grid
+    qgrid_size : int
+            size of the grid
+    half : bool, optional
+            If True, the columns index the grids of shape
+            ``(qgrid_size, qgrid_size, qgrid_size // 2 + 1)`` of the real
+            part of a real FFT (``rfftn``), which is symmetric for real grids.
+            Default: False.
+
+    Returns
+    -------
+    odf_matrix : sparse matrix, shape (M, K)
+            matrix mapping the flattened propagators of K values to the ODFs
+            on the M vertices of the sphere
+    """
+    coords = pdf_interp_coords(sphere, rradius, origin).reshape(3, -1)
+    nb_vertices = len(sphere.vertices)
+    rows = np.repeat(np.arange(nb_vertices), len(rradius))
+    radial = np.tile(rradius ** 2, nb_vertices)
+    # map_coordinates does not interpolate outside of the grid
+    inside = np.all((coords >= 0) & (coords <= qgrid_size - 1), axis=0)
+    coords, rows, radial = coords[:, inside], rows[inside], radial[inside]
+    low = np.clip(np.floor(coords), 0, qgrid_size - 2).astype(int)
+    frac = coords - low
+
+    half_size = qgrid_size // 2 + 1
+    shape = (qgrid_size, qgrid_size, half_size if half else qgrid_size)
+    columns = []
+    weights = []
+    for corner in product((0, 1), repeat=3):
+        corner = np.array(corner)[:, None]
+        index = np.mod(low + corner - origin, qgrid_size)
+        if half:
+            flip = index[2] >= half_size
+            index[:, flip] = np.mod(-index[:, flip], qgrid_size)
+        columns.append(np.ravel_multi_index(index, shape))
+        weights.append(radial * np.prod(np.where(corner, frac, 1 - frac),
+                                        axis=0))
+    return coo_matrix((np.concatenate(weights),
+                       (np.tile(rows, 8), np.concatenate(columns))),
+                      shape=(nb_vertices, np.prod(shape))).tocsr()
+
+
 def half_to_full_qspace(data, gtab):
     """ Half to full Cartesian grid mapping
 
@@ -549,9 +714,47 @@ class DiffusionSpectrumDeconvModel(DiffusionSpectrumModel):
                                         filter_width,
                                         normalize_peaks)
 
-    @multi_voxel_fit
-    def fit(self, data):
-        return DiffusionSpectrumDeconvFit(self, data)
+    def fit(self, data, mask=None, step=50, num_threads=None):
+        """ Fit method for every voxel in data
+
+        See ``DiffusionSpectrumModel.fit`` for the parameters.
+
+        Returns
+        -------
+        fit : DiffusionSpectrumDeconvFit
+        """
+        if mask is not None and mask.shape != data.shape[:-1]:
+            raise ValueError("mask and data shape do not match")
+        return DiffusionSpectrumDeconvFit(self, data, mask, step, num_threads)
+
+    def _deconv_otf(self):
+        """ Half of the optical transfer function of the deconvolution """
+        otf = self.cache_get('deconv_otf', key=self.gtab)
+        if otf is None:
+            DSID_PSF = gen_PSF(self.qgrid, self.qgrid_size, self.qgrid_size,
+                               self.qgrid_size)
+            otf = np.real(np.fft.fftn(np.fft.ifftshift(DSID_PSF)))
+            otf = otf[..., :self.qgrid_size // 2 + 1]
+            self.cache_set('deconv_otf', self.gtab, otf)
+        return otf
+
+    def _pdf_block(self, values, normalized, workers):
+        """ Deconvolved unshifted propagators of a block of voxels
+
+        The propagators are always normalized.
+        """
+        Sq = self._fill_qspace(values)
+        Pr = np.abs(_fft.fftn(Sq, axes=(1, 2, 3), **workers).real)
+        # threshold propagator, as in threshold_propagator
+        Pr[Pr < Pr.max(axis=(1, 2, 3), keepdims=True) / 15.] = 0
+        Pr /= Pr.sum(axis=(1, 2, 3), keepdims=True)
+        return _lr_deconv_block(Pr, self._deconv_otf(), 5, 2, workers)
+
+    def _odf_block(self, values, sphere, workers):
+        """ ODFs of a block of voxels """
+        Pr = self._pdf_block(values, True, workers)
+        return self._odf_matrix(sphere, half=False).dot(
+            Pr.reshape(len(values), -1).T).T
 
 
 class DiffusionSpectrumDeconvFit(DiffusionSpectrumFit):
@@ -562,27 +765,7 @@ class DiffusionSpectrumDeconvFit(DiffusionSpectrumFit):
         hard threshold and then deconvolve the propagator with the
         Lucy-Richardson deconvolution algorithm
         """
-        values = self.data
-        # create the signal volume
-        Sq = np.zeros((self.qgrid_sz, self.qgrid_sz, self.qgrid_sz))
-        # fill q-space
-        for i in range(len(values)):
-            qx, qy, qz = self.model.qgrid[i]
-            Sq[qx, qy, qz] += values[i]
-        # get deconvolution PSF
-        DSID_PSF = self.model.cache_get('deconv_psf', key=self.model.gtab)
-        if DSID_PSF is None:
-            DSID_PSF = gen_PSF(self.model.qgrid, self.qgrid_sz,
-                               self.qgrid_sz, self.qgrid_sz)
-        self.model.cache_set('deconv_psf', self.model.gtab, DSID_PSF)
-        # apply fourier transform
-        Pr = fftshift(np.abs(np.real(fftn(ifftshift(Sq),
-                                          3 * (self.qgrid_sz, )))))
-        # threshold propagator
-        Pr = threshold_propagator(Pr)
-        # apply LR deconvolution
-        Pr = LR_deconv(Pr, DSID_PSF, 5, 2)
-        return Pr
+        return DiffusionSpectrumFit.pdf(self)
 
 
 def threshold_propagator(P, estimated_snr=15.):
@@ -657,5 +840,34 @@ def LR_deconv(prop, psf, numit=5, acc_factor=1):
     return prop_deconv / prop_deconv.sum()
 
 
+def _lr_deconv_block(prop, otf, numit, acc_factor, workers):
+    """ Lucy-Richardson deconvolution of a block of propagators
+
+    Same as ``LR_deconv`` for the propagators stacked along the first axis,
+    given the half of the (real and symmetric) optical transfer function
+    matching the real FFTs of the propagators.
+    """
+    eps = 1e-16
+    axes = (1, 2, 3)
+
+    def blur(x):
+        return _fft.irfftn(otf * _fft.rfftn(x, axes=axes, **workers),
+                           s=x.shape[1:], axes=axes, **workers)
+
+    # Enforce Positivity
+    prop = np.clip(prop, 0, np.inf)
+    prop_deconv = prop.copy()
+    for it in range(numit):
+        # Blur the estimate
+        reBlurred = blur(prop_deconv)
+        reBlurred[reBlurred < eps] = eps
+        # Update the estimate
+        prop_deconv = prop_deconv * blur((prop / reBlurred) + eps) ** \
+            acc_factor
+        # Enforce positivity
+        prop_deconv = np.clip(prop_deconv, 0, np.inf)
+    return prop_deconv / prop_deconv.sum(axis=axes, keepdims=True)
+
+
 if __name__ == '__main__':
     pass
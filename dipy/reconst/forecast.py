@@ -3,17 +3,20 @@ from warnings import warn
 import numpy as np
 from distutils.version import LooseVersion
 from dipy.reconst.cache import Cache
-from dipy.reconst.multi_voxel import multi_voxel_fit
+from dipy.reconst.multi_voxel import MultiVoxelFit
 from dipy.reconst.csdeconv import csdeconv
 from dipy.reconst.shm import real_sh_descoteaux_from_index
 from scipy.special import gamma, hyp1f1
+from dipy.core.optimize import batch_levenberg_marquardt
 from dipy.core.geometry import cart2sphere
 from dipy.data import default_sphere
 from dipy.reconst.odf import OdfModel, OdfFit
-from scipy.optimize import leastsq
 from dipy.utils.optpkg import optional_package
 cvxpy, have_cvxpy, _ = optional_package("cvxpy")
 
+# diffusivities of the lookup table, bounded from 0 to 3e-03
+_TABLE_DIFFUSIVITIES = np.linspace(0, 3e-03, 31)
+
 
 class ForecastModel(OdfModel, Cache):
     r"""Fiber ORientation Estimated using Continuous Axially Symmetric Tensors
@@ -185,11 +188,59 @@ class ForecastModel(OdfModel, Cache):
         self.lambda_csd = lambda_csd
         self.fod = rho_matrix(sh_order, self.vertices)
 
-    @multi_voxel_fit
-    def fit(self, data):
+    def fit(self, data, mask=None):
+        """ Fit method of the FORECAST model class
+
+        The mean signal of each shell and the diffusivities are estimated for
+        all the voxels at once, the diffusivities by a lookup in a table of
+        mean signals refined with a batched least squares fit. Then the
+        voxels with the same diffusivities, rounded to 1e-05 mm^2/s, share
+        the same FORECAST matrix.
 
-        data_b0 = data[self.b0s_mask].mean()
-        data_single_b0 = np.r_[data_b0, data[~self.b0s_mask]] / data_b0
+        Parameters
+        ----------
+        data : array
+            The measured signal from one voxel or from several voxels, with
+            the diffusion weightings in the last dimension.
+        mask : array, optional
+            A boolean array used to mark the coordinates in the data that
+            should be analyzed that has the shape data.shape[:-1]
+        """
+        data = np.asarray(data)
+        single_voxel = data.ndim == 1
+        if single_voxel:
+            data = data[None]
+            if mask is not None:
+                mask = np.asarray(mask)[None]
+        if mask is None:
+            mask = np.ones(data.shape[:-1], dtype=bool)
+        elif mask.shape != data.shape[:-1]:
+            raise ValueError("mask and data shape do not match")
+        mask = np.array(mask, dtype=bool)
+        if single_voxel and not mask[0]:
+            # A masked single voxel has zero coefficients, as the masked
+            # voxels of a MultiVoxelFit
+            n_c = int((self.sh_order + 1) * (self.sh_order + 2) / 2)
+            return ForecastFit(self, data[0], np.zeros(n_c), 0., 0.)
+
+        signal = data[mask]
+        coef, d_par, d_perp = self._fit_voxels(signal)
+        fit_array = np.empty(mask.shape, dtype=object)
+        fits = fit_array[mask]
+        for i in range(len(signal)):
+            fits[i] = ForecastFit(self, signal[i], coef[i], d_par[i],
+                                  d_perp[i])
+        fit_array[mask] = fits
+        if single_voxel:
+            return fit_array[0]
+        return MultiVoxelFit(self, fit_array, mask)
+
+    def _fit_voxels(self, data):
+        """ FORECAST coefficients and diffusivities of voxels (N, K) """
+        data_b0 = data[:, self.b0s_mask].mean(axis=-1)
+        data_single_b0 = np.concatenate(
+            [data_b0[:, None], data[:, ~self.b0s_mask]], axis=-1) / \
+            data_b0[:, None]
 
         # calculates the mean signal at each b_values
         means = find_signal_means(self.b_unique,
@@ -198,80 +249,94 @@ class ForecastModel(OdfModel, Cache):
                                   self.srm,
                                   self.lb_matrix_signal)
 
-        # average diffusivity initialization
-        x = np.array([np.pi/4, np.pi/4])
-
-        x, status = leastsq(forecast_error_func, x,
-                            args=(self.b_unique, means))
-
-        # transform to bound the diffusivities from 0 to 3e-03
-        d_par = np.cos(x[0])**2 * 3e-03
-        d_perp = np.cos(x[1])**2 * 3e-03
-
-        if d_perp >= d_par:
-            temp = d_par
-            d_par = d_perp
-            d_perp = temp
+        table = self.cache_get('forecast_mean_signal_table',
+                               key=tuple(self.b_unique))
+        if table is None:
+            table = mean_signal_table(self.b_unique, _TABLE_DIFFUSIVITIES)
+            self.cache_set('forecast_mean_signal_table',
+                           key=tuple(self.b_unique), value=table)
+        d_par, d_perp = find_diffusivities(self.b_unique, means,
+                                           _TABLE_DIFFUSIVITIES, table)
 
         # round to avoid memory explosion
-        diff_key = str(int(np.round(d_par * 1e05))) + \
-            str(int(np.round(d_perp * 1e05)))
-
-        M_diff = self.cache_get('forecast_matrix', key=diff_key)
-        if M_diff is None:
-            M_diff = forecast_matrix(
-                self.sh_order,  d_par, d_perp, self.one_0_bvals)
-            self.cache_set('forecast_matrix', key=diff_key, value=M_diff)
+        i_par = np.round(d_par * 1e05).astype(int)
+        i_perp = np.round(d_perp * 1e05).astype(int)
 
-        M = M_diff * self.rho
-        M0 = M[:, 0]
         c0 = np.sqrt(1.0/(4*np.pi))
 
         # coefficients vector initialization
         n_c = int((self.sh_order + 1)*(self.sh_order + 2)/2)
-        coef = np.zeros(n_c)
-        coef[0] = c0
-        if int(np.round(d_par*1e05)) > int(np.round(d_perp*1e05)):
+        coef = np.zeros((len(data), n_c))
+        coef[:, 0] = c0
+
+        # only anisotropic voxels have non zero higher order coefficients
+        anisotropic = i_par > i_perp
+        pairs, groups = np.unique(
+            np.stack([i_par[anisotropic], i_perp[anisotropic]], axis=-1),
+            axis=0, return_inverse=True)
+        indices = np.nonzero(anisotropic)[0]
+        for group, diff_key in enumerate(map(tuple, pairs)):
+            index = indices[groups.ravel() == group]
+            M = self._forecast_matrix(diff_key)
             if self.wls:
-                data_r = data_single_b0 - M0*c0
-
-                Mr = M[:, 1:]
-                Lr = self.lb_matrix[1:, 1:]
-
-                pseudo_inv = np.dot(np.linalg.inv(
-                    np.dot(Mr.T, Mr) + self.lambda_lb*Lr), Mr.T)
-                coef = np.dot(pseudo_inv, data_r)
-                coef = np.r_[c0, coef]
-
-            if self.csd:
-                coef, _ = csdeconv(data_single_b0, M, self.fod, tau=0.1,
-                                   convergence=50)
-                coef = coef / coef[0] * c0
-
-            if self.pos:
-                c = cvxpy.Variable(M.shape[1])
-                if LooseVersion(cvxpy.__version__) < LooseVersion('1.1'):
-                    design_matrix = cvxpy.Constant(M) * c
-                else:
-                    design_matrix = cvxpy.Constant(M) @ c
-                objective = cvxpy.Minimize(
-                    cvxpy.sum_squares(design_matrix - data_single_b0) +
-                    self.lambda_lb * cvxpy.quad_form(c, self.lb_matrix))
-
-                if LooseVersion(cvxpy.__version__) < LooseVersion('1.1'):
-                    constraints = [c[0] == c0, self.fod * c >= 0]
-                else:
-                    constraints = [c[0] == c0, self.fod @ c >= 0]
-                prob = cvxpy.Problem(objective, constraints)
-                try:
-                    prob.solve(solver=cvxpy.OSQP, eps_abs=1e-05, eps_rel=1e-05)
-                    coef = np.asarray(c.value).squeeze()
-                except Exception:
-                    warn('Optimization did not find a solution')
-                    coef = np.zeros(M.shape[1])
-                    coef[0] = c0
-
-        return ForecastFit(self, data, coef, d_par, d_perp)
+                pseudo_inv = self.cache_get('forecast_pseudo_inv',
+                                            key=diff_key)
+                if pseudo_inv is None:
+                    Mr = M[:, 1:]
+                    Lr = self.lb_matrix[1:, 1:]
+                    pseudo_inv = np.dot(np.linalg.inv(
+                        np.dot(Mr.T, Mr) + self.lambda_lb*Lr), Mr.T)
+                    self.cache_set('forecast_pseudo_inv', key=diff_key,
+                                   value=pseudo_inv)
+                data_r = data_single_b0[index] - M[:, 0]*c0
+                coef[index, 1:] = np.dot(data_r, pseudo_inv.T)
+
+            for i in index:
+                if self.csd:
+                    coef[i], _ = csdeconv(data_single_b0[i], M, self.fod,
+                                          tau=0.1, convergence=50)
+                    coef[i] = coef[i] / coef[i, 0] * c0
+
+                if self.pos:
+                    coef[i] = self._positive_fit(data_single_b0[i], M, c0)
+
+        return coef, d_par, d_perp
+
+    def _forecast_matrix(self, diff_key):
+        """ FORECAST matrix for the diffusivities `diff_key` * 1e-05 """
+        M = self.cache_get('forecast_matrix', key=diff_key)
+        if M is None:
+            d_par, d_perp = np.array(diff_key) * 1e-05
+            M_diff = forecast_matrix(
+                self.sh_order,  d_par, d_perp, self.one_0_bvals)
+            M = M_diff * self.rho
+            self.cache_set('forecast_matrix', key=diff_key, value=M)
+        return M
+
+    def _positive_fit(self, data_single_b0, M, c0):
+        """ FORECAST coefficients with a positive fODF, using CVXPY """
+        c = cvxpy.Variable(M.shape[1])
+        if LooseVersion(cvxpy.__version__) < LooseVersion('1.1'):
+            design_matrix = cvxpy.Constant(M) * c
+        else:
+            design_matrix = cvxpy.Constant(M) @ c
+        objective = cvxpy.Minimize(
+            cvxpy.sum_squares(design_matrix - data_single_b0) +
+            self.lambda_lb * cvxpy.quad_form(c, self.lb_matrix))
+
+        if LooseVersion(cvxpy.__version__) < LooseVersion('1.1'):
+            constraints = [c[0] == c0, self.fod * c >= 0]
+        else:
+            constraints = [c[0] == c0, self.fod @ c >= 0]
+        prob = cvxpy.Problem(objective, constraints)
+        try:
+            prob.solve(solver=cvxpy.OSQP, eps_abs=1e-05, eps_rel=1e-05)
+            coef = np.asarray(c.value).squeeze()
+        except Exception:
+            warn('Optimization did not find a solution')
+            coef = np.zeros(M.shape[1])
+            coef[0] = c0
+        return coef
 
 
 class ForecastFit(OdfFit):
@@ -386,8 +451,8 @@ def find_signal_means(b_unique, data_norm, bvals, rho, lb_matrix, w=1e-03):
     ----------
     b_unique : 1d ndarray,
         unique b-values in a vector excluding zero
-    data_norm : 1d ndarray,
-        normalized diffusion signal
+    data_norm : ndarray (..., N),
+        normalized diffusion signal of one or several voxels
     bvals : 1d ndarray,
         the b-values
     rho : 2d ndarray,
@@ -399,25 +464,26 @@ def find_signal_means(b_unique, data_norm, bvals, rho, lb_matrix, w=1e-03):
 
     Returns
     -------
-    means : 1d ndarray
+    means : ndarray (..., len(b_unique))
         the average of the signal for each b-values
 
     """
+    data_norm = np.asarray(data_norm)
     lb = len(b_unique)
-    means = np.zeros(lb)
+    means = np.zeros(data_norm.shape[:-1] + (lb,))
     for u in range(lb):
         ind = bvals == b_unique[u]
-        shell = data_norm[ind]
+        shell = data_norm[..., ind]
         if np.sum(ind) > 20:
             M = rho[ind, :]
 
             pseudo_inv = np.dot(np.linalg.inv(
                 np.dot(M.T, M) + w*lb_matrix), M.T)
-            coef = np.dot(pseudo_inv, shell)
+            coef = np.dot(shell, pseudo_inv[0])
 
-            means[u] = coef[0] / np.sqrt(4*np.pi)
+            means[..., u] = coef / np.sqrt(4*np.pi)
         else:
-            means[u] = shell.mean()
+            means[..., u] = shell.mean(axis=-1)
 
     return means
 
@@ -440,6 +506,93 @@ def forecast_error_func(x, b_unique, E):
     return v
 
 
+def mean_signal_table(b_unique, diffusivities):
+    r"""Mean signal of each shell for a grid of diffusivities, using SMT
+
+    Parameters
+    ----------
+    b_unique : 1d ndarray,
+        unique b-values in a vector excluding zero
+    diffusivities : 1d ndarray,
+        the diffusivities of the grid
+
+    Returns
+    -------
+    table : ndarray (len(diffusivities), len(diffusivities), len(b_unique))
+        the mean signal of each shell for the parallel and perpendicular
+        diffusivities of indices (i, j), swapped when j > i, as in
+        ``forecast_error_func``
+
+    """
+    i_par, i_perp = np.tril_indices(len(diffusivities))
+    d_par = diffusivities[i_par, None]
+    d_perp = diffusivities[i_perp, None]
+    table = np.empty((len(diffusivities), len(diffusivities), len(b_unique)))
+    table[i_par, i_perp] = 0.5 * np.exp(-b_unique * d_perp) * \
+        psi_l(0, (b_unique * (d_par - d_perp)))
+    table[i_perp, i_par] = table[i_par, i_perp]
+    return table
+
+
+def find_diffusivities(b_unique, means, diffusivities, table):
+    r"""Fit the diffusivities of the mean signal of each shell of voxels
+
+    The initial diffusivities of each voxel are the ones of the closest mean
+    signals in `table`, then they are refined with a Levenberg-Marquardt fit
+    of all the voxels at once.
+
+    Parameters
+    ----------
+    b_unique : 1d ndarray,
+        unique b-values in a vector excluding zero
+    means : ndarray (N, len(b_unique)),
+        the average of the signal for each b-values of each voxel
+    diffusivities : 1d ndarray,
+        the diffusivities of the grid of the table
+    table : ndarray (len(diffusivities), len(diffusivities), len(b_unique)),
+        the mean signals of the grid, see ``mean_signal_table``
+
+    Returns
+    -------
+    d_par : 1d ndarray (N,)
+        the parallel diffusivities, between 0 and 3e-03
+    d_perp : 1d ndarray (N,)
+        the perpendicular diffusivities, smaller than `d_par`
+
+    """
+    i_par, i_perp = np.tril_indices(len(diffusivities))
+    entries = table[i_par, i_perp]
+    norms = np.sum(entries ** 2, axis=-1)
+    x0 = np.zeros((len(means), 2))
+    block_size = 1000
+    for start in range(0, len(means), block_size):
+        block = means[start:start + block_size]
+        best = np.argmin(norms - 2 * np.dot(block, entries.T), axis=-1)
+        x0[start:start + block_size, 0] = diffusivities[i_par[best]]
+        x0[start:start + block_size, 1] = diffusivities[i_perp[best]]
+
+    def residuals_func(x, index):
+        # as in forecast_error_func, the largest diffusivity is parallel
+        swap = x[:, 1] > x[:, 0]
+        d_par = np.where(swap, x[:, 1], x[:, 0])[:, None]
+        d_perp = np.where(swap, x[:, 0], x[:, 1])[:, None]
+        bd = b_unique * (d_par - d_perp)
+        attenuation = np.exp(-b_unique * d_perp)
+        E_reconst = 0.5 * attenuation * psi_l(0, bd)
+        # derivative of psi_l(0, x) = 2 * hyp1f1(1/2, 3/2, -x)
+        dpsi = -2. / 3 * hyp1f1(1.5, 2.5, -bd) * b_unique
+        jac_par = -0.5 * attenuation * dpsi
+        jac_perp = b_unique * E_reconst + 0.5 * attenuation * dpsi
+        jacobian = np.stack([np.where(swap[:, None], jac_perp, jac_par),
+                             np.where(swap[:, None], jac_par, jac_perp)],
+                            axis=-1)
+        return means[index] - E_reconst, jacobian
+
+    x = batch_levenberg_marquardt(residuals_func, x0,
+                                  bounds=(0, diffusivities[-1]))
+    return x.max(axis=-1), x.min(axis=-1)
+
+
 def psi_l(l, b):
     n = l//2
     v = (-b)**n
@@ -455,10 +608,9 @@ def forecast_matrix(sh_order,  d_par, d_perp, bvals):
     M = np.zeros((bvals.shape[0], n_c))
     counter = 0
     for l in range(0, sh_order + 1, 2):
-        for m in range(-l, l + 1):
-            M[:, counter] = 2 * np.pi * \
-                np.exp(-bvals * d_perp) * psi_l(l, bvals * (d_par - d_perp))
-            counter += 1
+        M[:, counter:counter + 2 * l + 1] = (2 * np.pi * np.exp(
+            -bvals * d_perp) * psi_l(l, bvals * (d_par - d_perp)))[:, None]
+        counter += 2 * l + 1
     return M
 
 
@@ -2,11 +2,13 @@
 contamination """
 
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 
 import scipy.optimize as opt
 
+from dipy.core.optimize import batch_levenberg_marquardt
 from dipy.reconst.base import ReconstModel
 
 from dipy.reconst.dti import (TensorFit, design_matrix, decompose_tensor,
@@ -18,6 +20,7 @@ from dipy.reconst.vec_val_sum import vec_val_vect
 from dipy.core.ndindex import ndindex
 from dipy.core.gradients import check_multi_b
 from dipy.reconst.multi_voxel import multi_voxel_fit
+from dipy.utils.omp import determine_num_threads
 
 
 def fwdti_prediction(params, gtab, S0=1, Diso=3.0e-3):
@@ -133,7 +136,6 @@ class FreeWaterTensorModel(ReconstModel):
             mes = "fwDTI requires at least 3 b-values (which can include b=0)"
             raise ValueError(mes)
 
-    @multi_voxel_fit
     def fit(self, data, mask=None):
         """ Fit method of the free water elimination DTI model class
 
@@ -144,7 +146,28 @@ class FreeWaterTensorModel(ReconstModel):
         mask : array
             A boolean array used to mark the coordinates in the data that
             should be analyzed that has the shape data.shape[:-1]
+
+        Notes
+        -----
+        The common fit methods ('WLS' and 'NLS') are fitted on all the
+        voxels at once, with ``wls_fit_tensor`` and ``nls_fit_tensor``. Other
+        fit methods are called for each voxel.
         """
+        batch_fit = _batch_fit_methods.get(self.fit_method)
+        if batch_fit is None or self.args:
+            return self._voxel_fit(data, mask)
+
+        data = np.asarray(data)
+        if data.ndim == 1:
+            fwdti_params = batch_fit(self.gtab, data[None], **self.kwargs)[0]
+        else:
+            fwdti_params = batch_fit(self.gtab, data, mask=mask,
+                                     **self.kwargs)
+        return FreeWaterTensorFit(self, fwdti_params)
+
+    @multi_voxel_fit
+    def _voxel_fit(self, data, mask=None):
+        """ Fit of a single voxel with the fit method of the model """
         S0 = np.mean(data[self.gtab.b0s_mask])
         fwdti_params = self.fit_method(self.design_matrix, data, S0,
                                        *self.args, **self.kwargs)
@@ -328,8 +351,155 @@ def wls_iter(design_matrix, sig, S0, Diso=3e-3, mdreg=2.7e-3,
     return fw_params
 
 
+def _wls_fit_block(design_matrix, data, S0, Diso=3e-3, mdreg=2.7e-3,
+                   min_signal=1.0e-6, piterations=3):
+    """ Weighted linear least squares fit of the water free elimination model
+    to the signals of several voxels, as ``wls_iter``.
+
+    Parameters
+    ----------
+    design_matrix : array (g, 7)
+        Design matrix holding the covariants used to solve for the regression
+        coefficients.
+    data : array (n, g)
+        Diffusion-weighted signals of n voxels.
+    S0 : array (n, )
+        Non diffusion weighted signals (i.e. signal for b-value=0).
+    Diso, mdreg, min_signal, piterations :
+        See ``wls_iter``.
+
+    Returns
+    -------
+    fw_params : array (n, 13)
+        All parameters estimated from the free water tensor model.
+
+    Notes
+    -----
+    For each refinement iteration, the tissue tensors of all the voxels and
+    of all the sampled volume fractions are obtained with one batched matrix
+    product.
+    """
+    W = design_matrix
+    fw_params = np.zeros((len(data), 13))
+
+    # DTI weighted linear least square solution of each voxel
+    log_s = np.log(np.maximum(data, min_signal))
+    WTS2 = W.T[None] * (data ** 2)[:, None, :]
+    inv_WT_S2_W = np.linalg.pinv(np.matmul(WTS2, W))
+    invWTS2W_WTS2 = np.matmul(inv_WT_S2_W, WTS2)
+    params = np.matmul(invWTS2W_WTS2, log_s[..., None])[..., 0]
+
+    md = (params[:, 0] + params[:, 2] + params[:, 5]) / 3
+    # Process voxels with significant signal from tissue
+    tissue = (md < mdreg) & (np.mean(data, axis=-1) > min_signal) & \
+        (S0 > min_signal)
+    fw_params[(md > mdreg) & ~tissue, 12] = 1.0
+    if not np.any(tissue):
+        return fw_params
+
+    sig = data[tissue]
+    S0 = S0[tissue]
+    invWTS2W_WTS2 = invWTS2W_WTS2[tissue]
+    n = len(sig)
+
+    # General free-water signal contribution
+    fwsig = np.exp(np.dot(design_matrix,
+                          np.array([Diso, 0, Diso, 0, 0, Diso, 0])))
+
+    df = 1  # initialize precision
+    flow = np.zeros(n)  # lower f evaluated
+    fhig = np.ones(n)  # higher f evaluated
+    ns = 9  # initial number of samples per iteration
+    for p in range(piterations):
+        df = df * 0.1
+        fs = np.linspace(flow + df, fhig - df, num=ns, axis=-1)  # (n, ns)
+        FS = fs[:, None, :]
+        SI = sig[:, :, None]
+        SFW = (S0[:, None] * fwsig[None, :])[:, :, None]
+        SA = SI - FS * SFW
+        # SA < 0 means that the signal components from the free water
+        # component is larger than the total fiber. This cases are present
+        # for inappropriate large volume fractions (given the current S0
+        # value estimated). To overcome this issue negative SA are replaced
+        # by data's min positive signal.
+        SA[SA <= 0] = min_signal
+        y = np.log(SA / (1 - FS))
+        all_new_params = np.matmul(invWTS2W_WTS2, y)  # (n, 7, ns)
+        # Select params for lower F2
+        SIpred = (1 - FS) * np.exp(np.matmul(W, all_new_params)) + FS * SFW
+        F2 = np.sum(np.square(SI - SIpred), axis=1)
+        Mind = np.argmin(F2, axis=-1)
+        params = all_new_params[np.arange(n), :, Mind]
+        f = fs[np.arange(n), Mind]  # Updated f
+        flow = f - df  # refining precision
+        fhig = f + df
+        ns = 19
+
+    evals, evecs = decompose_tensor(from_lower_triangular(params))
+    fw_params[tissue] = np.concatenate((evals, evecs.reshape(-1, 9),
+                                        f[:, None]), axis=-1)
+    return fw_params
+
+
+def _fit_blocks(fit_block, gtab, data, mask, step, num_threads, **kwargs):
+    """ Applies a free water fit function to blocks of voxels
+
+    Parameters
+    ----------
+    fit_block : callable
+        Fit function with the signature
+        ``fit_block(design_matrix, data, S0, **kwargs)``, fitting data (n, g)
+        and returning parameters (n, 13).
+    gtab : a GradientTable class instance
+        The gradient table containing diffusion acquisition parameters.
+    data : ndarray ([X, Y, Z, ...], g)
+        Data or response variables holding the data.
+    mask : array
+        A boolean array marking the voxels to fit, or None.
+    step : int
+        The chunk size as a number of voxels.
+    num_threads : int
+        Number of threads fitting blocks concurrently. If None or 1, the
+        blocks are fitted sequentially.
+    """
+    fw_params = np.zeros(data.shape[:-1] + (13,))
+    W = design_matrix(gtab)
+
+    # Prepare mask
+    if mask is None:
+        mask = np.ones(data.shape[:-1], dtype=bool)
+    else:
+        if mask.shape != data.shape[:-1]:
+            raise ValueError("Mask is not the same shape as data.")
+        mask = np.array(mask, dtype=bool, copy=False)
+
+    data_in_mask = np.reshape(data[mask], (-1, data.shape[-1]))
+    # Prepare S0
+    S0 = np.mean(data_in_mask[:, gtab.b0s_mask], axis=-1)
+    params_in_mask = np.zeros((len(data_in_mask), 13))
+
+    step = int(step) or max(len(data_in_mask), 1)
+
+    def fit(start):
+        stop = start + step
+        params_in_mask[start:stop] = fit_block(W, data_in_mask[start:stop],
+                                               S0[start:stop], **kwargs)
+
+    starts = range(0, len(data_in_mask), step)
+    if num_threads is None or num_threads == 1:
+        for start in starts:
+            fit(start)
+    else:
+        num_threads = determine_num_threads(num_threads)
+        with ThreadPoolExecutor(max_workers=num_threads) as executor:
+            list(executor.map(fit, starts))
+
+    fw_params[mask] = params_in_mask
+    return fw_params
+
+
 def wls_fit_tensor(gtab, data, Diso=3e-3, mask=None, min_signal=1.0e-6,
-                   piterations=3, mdreg=2.7e-3):
+                   piterations=3, mdreg=2.7e-3, step=1000, num_threads=None):
     r""" Computes weighted least squares (WLS) fit to calculate self-diffusion
     tensor using a linear regression model [1]_.
 
@@ -360,6 +530,16 @@ def wls_fit_tensor(gtab, data, Diso=3e-3, mask=None, min_signal=1.0e-6,
         diffusion (i.e. volume fraction will be set to 1 and tissue's diffusion
         parameters are set to zero). Default md_reg is 2.7e-3 $mm^{2}.s^{-1}$
         (corresponding to 90% of the free water diffusion value).
+    step : int, optional
+        The chunk size as a number of voxels. The candidate volume fractions
+        of all the voxels of a chunk are evaluated at once. A larger step
+        value should speed things up, but it will also take up more memory.
+        Default: 1000.
+    num_threads : int, optional
+        Number of threads fitting chunks concurrently. If None (default) or
+        1, chunks are fitted sequentially. If < 0 the maximal number of
+        threads minus |num_threads + 1| is used (enter -1 to use as many
+        threads as possible). 0 raises an error.
 
     Returns
     -------
@@ -378,28 +558,9 @@ def wls_fit_tensor(gtab, data, Diso=3e-3, mask=None, min_signal=1.0e-6,
            water elimination two-compartment model for diffusion tensor
            imaging. ReScience volume 3, issue 1, article number 2
     """
-    fw_params = np.zeros(data.shape[:-1] + (13,))
-    W = design_matrix(gtab)
-
-    # Prepare mask
-    if mask is None:
-        mask = np.ones(data.shape[:-1], dtype=bool)
-    else:
-        if mask.shape != data.shape[:-1]:
-            raise ValueError("Mask is not the same shape as data.")
-        mask = np.array(mask, dtype=bool, copy=False)
-
-    # Prepare S0
-    S0 = np.mean(data[:, :, :, gtab.b0s_mask], axis=-1)
-
-    index = ndindex(mask.shape)
-    for v in index:
-        if mask[v]:
-            params = wls_iter(W, data[v], S0[v], min_signal=min_signal,
-                              Diso=3e-3, piterations=piterations, mdreg=mdreg)
-            fw_params[v] = params
-
-    return fw_params
+    return _fit_blocks(_wls_fit_block, gtab, data, mask, step, num_threads,
+                       Diso=Diso, mdreg=mdreg, min_signal=min_signal,
+                       piterations=piterations)
 
 
 def _nls_err_func(tensor_elements, design_matrix, data, Diso=3e-3,
@@ -528,7 +689,7 @@ def _nls_jacobian_func(tensor_elements, design_matrix, data, Diso=3e-3,
                       np.array([Diso, 0, Diso, 0, 0, Diso, tensor[6]])))
     T = (f-1.0) * t[:, None] * design_matrix
     S = np.zeros(design_matrix.shape)
-    S[:, 6] = f * s
+    S[:, 6] = f * s * design_matrix[:, 6]
 
     if f_transform:
         df = (t-s) * (0.5*np.cos(tensor[7]-np.pi/2))
@@ -537,6 +698,189 @@ def _nls_jacobian_func(tensor_elements, design_matrix, data, Diso=3e-3,
     return np.concatenate((T - S, df[:, None]), axis=1)
 
 
+def _nls_residuals(params, design_matrix, data, Diso, cholesky,
+                   f_transform, weights):
+    """ Residuals and Jacobians of the free water elimination model for
+    several voxels
+
+    Parameters
+    ----------
+    params : array (n, 8)
+        Parameters of each voxel, as the tensor_elements of
+        ``_nls_err_func``.
+    design_matrix : array (g, 7)
+        The design matrix
+    data : array (n, g)
+        The signals of the voxels.
+    Diso : float
+        Value of the free water isotropic diffusion.
+    cholesky, f_transform : bool
+        See ``_nls_err_func``.
+    weights : array (g, ) or None
+        Weights of the residuals.
+
+    Returns
+    -------
+    residuals : array (n, g)
+    jacobian : array (n, g, 8)
+        Derivatives of the residuals with respect to the parameters.
+    """
+    W = design_matrix
+    if cholesky:
+        tensor = cholesky_to_lower_triangular(params[:, :6])
+    else:
+        tensor = params[:, :6]
+    if f_transform:
+        f = 0.5 * (1 + np.sin(params[:, 7] - np.pi/2))
+        df = 0.5 * np.cos(params[:, 7] - np.pi/2)
+    else:
+        f = params[:, 7]
+        df = np.ones(len(params))
+    f = f[:, None]
+
+    t = np.exp(np.dot(tensor, W[:, :6].T) + np.outer(params[:, 6], W[:, 6]))
+    s = np.exp(np.dot(W, np.array([Diso, 0, Diso, 0, 0, Diso, 0]))[None] +
+               np.outer(params[:, 6], W[:, 6]))
+    residuals = data - (1 - f) * t - f * s
+
+    jacobian = np.empty(data.shape + (8,))
+    jacobian[..., :7] = ((f - 1) * t)[..., None] * W
+    jacobian[..., 6] -= f * s * W[:, 6]
+    jacobian[..., 7] = (t - s) * df[:, None]
+    if cholesky:
+        # Chain rule with the derivatives of the tensor elements with respect
+        # to the Cholesky elements
+        R = params[:, :6]
+        dD = np.zeros((len(params), 6, 6))
+        dD[:, 0, 0] = 2 * R[:, 0]
+        dD[:, 1, 0] = R[:, 3]
+        dD[:, 1, 3] = R[:, 0]
+        dD[:, 2, 1] = 2 * R[:, 1]
+        dD[:, 2, 3] = 2 * R[:, 3]
+        dD[:, 3, 0] = R[:, 5]
+        dD[:, 3, 5] = R[:, 0]
+        dD[:, 4, 1] = R[:, 4]
+        dD[:, 4, 4] = R[:, 1]
+        dD[:, 4, 3] = R[:, 5]
+        dD[:, 4, 5] = R[:, 3]
+        dD[:, 5, 2] = 2 * R[:, 2]
+        dD[:, 5, 4] = 2 * R[:, 4]
+        dD[:, 5, 5] = 2 * R[:, 5]
+        jacobian[..., :6] = np.matmul(jacobian[..., :6], dD)
+
+    if weights is not None:
+        residuals = residuals * weights
+        jacobian = jacobian * weights[:, None]
+    return residuals, jacobian
+
+
+def _nls_fit_block(design_matrix, data, S0, Diso=3e-3, mdreg=2.7e-3,
+                   min_signal=1.0e-6, cholesky=False, f_transform=True,
+                   jac=False, weighting=None, sigma=None):
+    """ Non linear least squares fit of the water free elimination model to
+    the signals of several voxels, as ``nls_iter``.
+
+    Parameters
+    ----------
+    design_matrix : array (g, 7)
+        Design matrix holding the covariants used to solve for the regression
+        coefficients.
+    data : array (n, g)
+        Diffusion-weighted signals of n voxels.
+    S0 : array (n, )
+        Non diffusion weighted signals (i.e. signal for b-value=0).
+    Diso, mdreg, min_signal, cholesky, f_transform, jac, weighting, sigma :
+        See ``nls_iter``.
+
+    Returns
+    -------
+    fw_params : array (n, 13)
+        All parameters estimated from the free water tensor model.
+
+    Notes
+    -----
+    All voxels are refined at once with a batched Levenberg-Marquardt
+    algorithm, using the analytical Jacobian. The 'gmm' weighting depends on
+    the residuals of each voxel, so it is still fitted voxel by voxel with
+    ``nls_iter``.
+    """
+    if weighting == 'gmm':
+        fw_params = np.zeros((len(data), 13))
+        for v in range(len(data)):
+            fw_params[v] = nls_iter(design_matrix, data[v], S0[v], Diso=Diso,
+                                    mdreg=mdreg, min_signal=min_signal,
+                                    cholesky=cholesky,
+                                    f_transform=f_transform, jac=jac,
+                                    weighting=weighting, sigma=sigma)
+        return fw_params
+
+    weights = None
+    if weighting == 'sigma':
+        if sigma is None:
+            e_s = "Must provide sigma value as input to use this weighting"
+            e_s += " method"
+            raise ValueError(e_s)
+        weights = np.broadcast_to(1. / np.asarray(sigma, dtype=float),
+                                  data.shape[-1:])
+
+    # Initial guess
+    fw_params = _wls_fit_block(design_matrix, data, S0, Diso=Diso,
+                               mdreg=mdreg, min_signal=min_signal)
+
+    # Process voxels with significant signal from tissue
+    tissue = (fw_params[:, 12] < 0.99) & \
+        (np.mean(data, axis=-1) > min_signal) & (S0 > min_signal)
+    if not np.any(tissue):
+        return fw_params
+    params = fw_params[tissue]
+    sig = data[tissue]
+
+    # converting evals and evecs to diffusion tensor elements
+    evals = params[:, :3]
+    evecs = params[:, 3:12].reshape((-1, 3, 3))
+    dt = lower_triangular(vec_val_vect(evecs, evals))
+
+    # Cholesky decomposition if requested
+    start_dt = dt
+    if cholesky:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            dt = lower_triangular_to_cholesky(dt)
+
+    # f transformation if requested
+    if f_transform:
+        f = np.arcsin(2*params[:, 12] - 1) + np.pi/2
+    else:
+        f = params[:, 12]
+
+    start_params = np.concatenate((dt, -np.log(S0[tissue])[:, None],
+                                   f[:, None]), axis=-1)
+
+    def residuals_func(p, index):
+        return _nls_residuals(p, design_matrix, sig[index], Diso, cholesky,
+                              f_transform, weights)
+
+    with np.errstate(over='ignore', invalid='ignore'):
+        this_tensor = batch_levenberg_marquardt(residuals_func, start_params)
+
+    # Process tissue diffusion tensor
+    if cholesky:
+        this_tensor[:, :6] = cholesky_to_lower_triangular(this_tensor[:, :6])
+
+    # Tensors with nan elements are replaced by their initial guess
+    finite = np.all(np.isfinite(this_tensor[:, :6]), axis=-1)
+    this_tensor[~finite, :6] = start_dt[~finite]
+    evals, evecs = decompose_tensor(from_lower_triangular(this_tensor[:, :6]))
+
+    # Process water volume fraction f
+    f = this_tensor[:, 7]
+    if f_transform:
+        f = 0.5 * (1 + np.sin(f - np.pi/2))
+
+    fw_params[tissue] = np.concatenate((evals, evecs.reshape(-1, 9),
+                                        f[:, None]), axis=-1)
+    return fw_params
+
+
 def nls_iter(design_matrix, sig, S0, Diso=3e-3, mdreg=2.7e-3,
              min_signal=1.0e-6, cholesky=False, f_transform=True, jac=False,
              weighting=None, sigma=None):
@@ -651,7 +995,8 @@ def nls_iter(design_matrix, sig, S0, Diso=3e-3, mdreg=2.7e-3,
 
 def nls_fit_tensor(gtab, data, mask=None, Diso=3e-3, mdreg=2.7e-3,
                    min_signal=1.0e-6, f_transform=True, cholesky=False,
-                   jac=False, weighting=None, sigma=None):
+                   jac=False, weighting=None, sigma=None, step=1000,
+                   num_threads=None):
     """
     Fit the water elimination tensor model using the non-linear least-squares.
 
@@ -689,7 +1034,8 @@ def nls_fit_tensor(gtab, data, mask=None, Diso=3e-3, mdreg=2.7e-3,
         is positive define.
         Default: False
     jac : bool
-        Use the Jacobian? Default: False
+        Use the Jacobian? Only used with the 'gmm' weighting, the other fits
+        always use the analytical Jacobian. Default: False
     weighting: str, optional
         the weighting scheme to use in considering the
         squared-error. Default behavior is to use uniform weighting. Other
@@ -699,6 +1045,15 @@ def nls_fit_tensor(gtab, data, mask=None, Diso=3e-3, mdreg=2.7e-3,
         provided here. According to [Chang2005]_, a good value to use is
         1.5267 * std(background_noise), where background_noise is estimated
         from some part of the image known to contain no signal (only noise).
+    step : int, optional
+        The chunk size as a number of voxels. The voxels of a chunk are
+        fitted together. A larger step value should speed things up, but it
+        will also take up more memory. Default: 1000.
+    num_threads : int, optional
+        Number of threads fitting chunks concurrently. If None (default) or
+        1, chunks are fitted sequentially. If < 0 the maximal number of
+        threads minus |num_threads + 1| is used (enter -1 to use as many
+        threads as possible). 0 raises an error.
 
     Returns
     -------
@@ -710,30 +1065,14 @@ def nls_fit_tensor(gtab, data, mask=None, Diso=3e-3, mdreg=2.7e-3,
                first, second and third coordinates of the eigenvector
             3) The volume fraction of the free water compartment
     """
-    fw_params = np.zeros(data.shape[:-1] + (13,))
-    W = design_matrix(gtab)
-
-    # Prepare mask
-    if mask is None:
-        mask = np.ones(data.shape[:-1], dtype=bool)
-    else:
-        if mask.shape != data.shape[:-1]:
-            raise ValueError("Mask is not the same shape as data.")
-        mask = np.array(mask, dtype=bool, copy=False)
-
-    # Prepare S0
-    S0 = np.mean(data[:, :, :, gtab.b0s_mask], axis=-1)
-
-    index = ndindex(mask.shape)
-    for v in index:
-        if mask[v]:
-            params = nls_iter(W, data[v], S0[v], Diso=Diso, mdreg=mdreg,
-                              min_signal=min_signal, f_transform=f_transform,
-                              cholesky=cholesky, jac=jac, weighting=weighting,
-                              sigma=sigma)
-            fw_params[v] = params
-
-    return fw_params
+    if weighting == 'sigma' and sigma is None:
+        e_s = "Must provide sigma value as input to use this weighting"
+        e_s += " method"
+        raise ValueError(e_s)
+    return _fit_blocks(_nls_fit_block, gtab, data, mask, step, num_threads,
+                       Diso=Diso, mdreg=mdreg, min_signal=min_signal,
+                       f_transform=f_transform, cholesky=cholesky, jac=jac,
+                       weighting=weighting, sigma=sigma)
 
 
 def lower_triangular_to_cholesky(tensor_elements):
@@ -741,13 +1080,13 @@ def lower_triangular_to_cholesky(tensor_elements):
 
     Parameters
     ----------
-    tensor_elements : array (6,)
+    tensor_elements : array (..., 6)
         Array containing the six elements of diffusion tensor's lower
         triangular.
 
     Returns
     -------
-    cholesky_elements : array (6,)
+    cholesky_elements : array (..., 6)
         Array containing the six Cholesky's decomposition elements
         (R0, R1, R2, R3, R4, R5) [1]_.
 
@@ -758,14 +1097,14 @@ def lower_triangular_to_cholesky(tensor_elements):
            tensor-derived quantities in diffusion tensor imaging. Magnetic
            Resonance in Medicine, 55(4), 930-936. doi:10.1002/mrm.20832
     """
-    R0 = np.sqrt(tensor_elements[0])
-    R3 = tensor_elements[1] / R0
-    R1 = np.sqrt(tensor_elements[2] - R3**2)
-    R5 = tensor_elements[3] / R0
-    R4 = (tensor_elements[4] - R3*R5) / R1
-    R2 = np.sqrt(tensor_elements[5] - R4**2 - R5**2)
+    R0 = np.sqrt(tensor_elements[..., 0])
+    R3 = tensor_elements[..., 1] / R0
+    R1 = np.sqrt(tensor_elements[..., 2] - R3**2)
+    R5 = tensor_elements[..., 3] / R0
+    R4 = (tensor_elements[..., 4] - R3*R5) / R1
+    R2 = np.sqrt(tensor_elements[..., 5] - R4**2 - R5**2)
 
-    return np.array([R0, R1, R2, R3, R4, R5])
+    return np.stack([R0, R1, R2, R3, R4, R5], axis=-1)
 
 
 def cholesky_to_lower_triangular(R):
@@ -773,13 +1112,13 @@ def cholesky_to_lower_triangular(R):
 
     Parameters
     ----------
-    R : array (6,)
+    R : array (..., 6)
         Array containing the six Cholesky's decomposition elements
         (R0, R1, R2, R3, R4, R5) [1]_.
 
     Returns
     -------
-    tensor_elements : array (6,)
+    tensor_elements : array (..., 6)
         Array containing the six elements of diffusion tensor's lower
         triangular.
 
@@ -790,13 +1129,14 @@ def cholesky_to_lower_triangular(R):
            tensor-derived quantities in diffusion tensor imaging. Magnetic
            Resonance in Medicine, 55(4), 930-936. doi:10.1002/mrm.20832
     """
-    Dxx = R[0]**2
-    Dxy = R[0]*R[3]
-    Dyy = R[1]**2 + R[3]**2
-    Dxz = R[0]*R[5]
-    Dyz = R[1]*R[4] + R[3]*R[5]
-    Dzz = R[2]**2 + R[4]**2 + R[5]**2
-    return np.array([Dxx, Dxy, Dyy, Dxz, Dyz, Dzz])
+    R = np.asarray(R)
+    Dxx = R[..., 0]**2
+    Dxy = R[..., 0]*R[..., 3]
+    Dyy = R[..., 1]**2 + R[..., 3]**2
+    Dxz = R[..., 0]*R[..., 5]
+    Dyz = R[..., 1]*R[..., 4] + R[..., 3]*R[..., 5]
+    Dzz = R[..., 2]**2 + R[..., 4]**2 + R[..., 5]**2
+    return np.stack([Dxx, Dxy, Dyy, Dxz, Dyz, Dzz], axis=-1)
 
 
 common_fit_methods = {'WLLS': wls_iter,
@@ -804,3 +1144,7 @@ common_fit_methods = {'WLLS': wls_iter,
                       'NLLS': nls_iter,
                       'NLS': nls_iter,
                       }
+
+_batch_fit_methods = {wls_iter: wls_fit_tensor,
+                      nls_iter: nls_fit_tensor,
+                      }
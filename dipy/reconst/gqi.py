@@ -3,7 +3,6 @@ import numpy as np
 from dipy.reconst.odf import OdfModel, OdfFit, gfa
 from dipy.reconst.cache import Cache
 import warnings
-from dipy.reconst.multi_voxel import multi_voxel_fit
 from dipy.reconst.recspeed import local_maxima, remove_similar_vertices
 
 
@@ -78,49 +77,123 @@ class GeneralizedQSamplingModel(OdfModel, Cache):
         b_vector = gradsT * tmp  # element-wise product
         self.b_vector = b_vector.T
 
-    @multi_voxel_fit
-    def fit(self, data):
-        return GeneralizedQSamplingFit(self, data)
+    def fit(self, data, mask=None, step=10000):
+        """ Fit method for every voxel in data
+
+        The ODFs are only computed when requested, for blocks of voxels at
+        once.
+
+        Parameters
+        ----------
+        data : ndarray
+            Signal values, with the diffusion weightings along the last
+            dimension.
+        mask : ndarray, optional
+            Boolean array with the shape of ``data[..., 0]``, True for the
+            voxels to reconstruct. Default: all the voxels.
+        step : int, optional
+            Number of voxels whose ODFs are computed at once. Default: 10000.
+
+        Returns
+        -------
+        fit : GeneralizedQSamplingFit
+        """
+        if mask is not None and mask.shape != data.shape[:-1]:
+            raise ValueError("mask and data shape do not match")
+        return GeneralizedQSamplingFit(self, data, mask, step)
+
+    def _odf_operator(self, sphere, dtype):
+        """ Matrix (N, M) mapping N signal values to the ODF on M vertices
+        """
+        dtype = np.dtype(dtype)
+        operator = self.cache_get('gqi_vector', key=(sphere, dtype))
+        if operator is None:
+            if self.method == 'gqi2':
+                H = squared_radial_component
+                operator = np.real(H(np.dot(
+                    self.b_vector, sphere.vertices.T) *
+                    self.Lambda))
+            if self.method == 'standard':
+                operator = np.real(np.sinc(np.dot(
+                    self.b_vector, sphere.vertices.T) *
+                    self.Lambda / np.pi))
+            operator = np.ascontiguousarray(operator, dtype=dtype)
+            self.cache_set('gqi_vector', (sphere, dtype), operator)
+        return operator
 
 
 class GeneralizedQSamplingFit(OdfFit):
 
-    def __init__(self, model, data):
-        """ Calculates PDF and ODF for a single voxel
+    def __init__(self, model, data, mask=None, step=10000):
+        """ Calculates PDF and ODF of the voxels
 
         Parameters
         ----------
         model : object,
-            DiffusionSpectrumModel
-        data : 1d ndarray,
-            signal values
+            GeneralizedQSamplingModel
+        data : ndarray,
+            signal values, with the diffusion weightings along the last
+            dimension
+        mask : ndarray, optional
+            voxels to reconstruct. Default: all the voxels.
+        step : int, optional
+            number of voxels whose ODFs are computed at once. Default: 10000.
 
         """
         OdfFit.__init__(self, model, data)
+        self.mask = mask
+        self.step = step
         self._gfa = None
         self.npeaks = 5
         self._peak_values = None
         self._peak_indices = None
         self._qa = None
 
-    def odf(self, sphere):
+    @property
+    def shape(self):
+        return self.data.shape[:-1]
+
+    def __getitem__(self, index):
+        """Allowing indexing into fit"""
+        if isinstance(index, tuple):
+            data_index = index + (Ellipsis,)
+        else:
+            data_index = index
+        mask = None if self.mask is None else self.mask[index]
+        return GeneralizedQSamplingFit(self.model, self.data[data_index],
+                                       mask, self.step)
+
+    def odf(self, sphere, dtype=np.float64):
         """ Calculates the discrete ODF for a given discrete sphere.
+
+        Parameters
+        ----------
+        sphere : Sphere
+            The points on which to sample the ODF.
+        dtype : data-type, optional
+            Data type of the ODFs. With np.float32, the ODFs take half of the
+            memory and are computed faster. Default: np.float64.
+
+        Returns
+        -------
+        odf : ndarray, shape (..., M)
+            The ODFs on the M vertices of the sphere, zero outside of the
+            mask.
         """
-        self.gqi_vector = self.model.cache_get('gqi_vector', key=sphere)
-        if self.gqi_vector is None:
-            if self.model.method == 'gqi2':
-                H = squared_radial_component
-                # print self.gqi_vector.shape
-                self.gqi_vector = np.real(H(np.dot(
-                    self.model.b_vector, sphere.vertices.T) *
-                    self.model.Lambda))
-            if self.model.method == 'standard':
-                self.gqi_vector = np.real(np.sinc(np.dot(
-                    self.model.b_vector, sphere.vertices.T) *
-                    self.model.Lambda / np.pi))
-            self.model.cache_set('gqi_vector', sphere, self.gqi_vector)
-
-        return np.dot(self.data, self.gqi_vector)
+        operator = self.model._odf_operator(sphere, dtype)
+        data = self.data.reshape(-1, self.data.shape[-1])
+        if self.mask is None:
+            blocks = (slice(start, start + self.step)
+                      for start in range(0, len(data), self.step))
+        else:
+            voxels = np.flatnonzero(self.mask)
+            blocks = (voxels[start:start + self.step]
+                      for start in range(0, len(voxels), self.step))
+        odf = np.zeros((len(data), operator.shape[-1]), dtype=operator.dtype)
+        for block in blocks:
+            odf[block] = np.dot(np.asarray(data[block], dtype=operator.dtype),
+                                operator)
+        return odf.reshape(self.shape + (operator.shape[-1], ))
 
 
 def normalize_qa(qa, max_qa=None):
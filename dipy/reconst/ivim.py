@@ -1,11 +1,13 @@
 """ Classes and functions for fitting ivim model """
 
 from distutils.version import LooseVersion
+from multiprocessing import Pool
 import numpy as np
-from scipy.optimize import least_squares, differential_evolution
+from scipy.optimize import differential_evolution
 import warnings
+from dipy.core.optimize import batch_levenberg_marquardt
 from dipy.reconst.base import ReconstModel
-from dipy.reconst.multi_voxel import multi_voxel_fit
+from dipy.utils.multiproc import determine_num_processes
 from dipy.utils.optpkg import optional_package
 cvxpy, have_cvxpy, _ = optional_package("cvxpy")
 
@@ -13,13 +15,16 @@ cvxpy, have_cvxpy, _ = optional_package("cvxpy")
 # global variable for bounding least_squares in both models
 BOUNDS = ([0., 0., 0., 0.], [np.inf, .2, 1., 1.])
 
+# bounds of the search of D_star and D by the variable projection model
+_VP_SEARCH_BOUNDS = ((0.005, 0.01), (10**-4, 0.001))
+
 
 def ivim_prediction(params, gtab):
     """The Intravoxel incoherent motion (IVIM) model function.
 
     Parameters
     ----------
-    params : array
+    params : array (..., 4)
         An array of IVIM parameters - [S0, f, D_star, D].
 
     gtab : GradientTable class instance
@@ -32,12 +37,13 @@ def ivim_prediction(params, gtab):
 
     Returns
     -------
-    S : array
+    S : array (..., N)
         An array containing the IVIM signal estimated using given parameters.
 
     """
     b = gtab.bvals
-    S0, f, D_star, D = params
+    params = np.asarray(params)
+    S0, f, D_star, D = [params[..., i, None] for i in range(4)]
 
     S = S0 * (f * np.exp(-b * D_star) + (1 - f) * np.exp(-b * D))
 
@@ -128,6 +134,44 @@ def f_D_star_error(params, gtab, signal, S0, D):
     return signal - f_D_star_prediction([f, D_star], gtab, S0, D)
 
 
+def _ivim_residuals(params, bvals, signal):
+    """Residuals of the IVIM model for several voxels and their Jacobians.
+
+    Parameters
+    ----------
+    params : array (n, 4)
+        The IVIM parameters [S0, f, D_star, D] of each voxel.
+
+    bvals : array (N, )
+        The b-values.
+
+    signal : array (n, N)
+        The signals of the voxels.
+
+    Returns
+    -------
+    residuals : array (n, N)
+        The difference between the signals and the predicted signals.
+
+    jacobian : array (n, N, 4)
+        The derivatives of the residuals with respect to the parameters.
+    """
+    S0, f, D_star, D = [params[:, i, None] for i in range(4)]
+    perfusion = np.exp(-bvals * D_star)
+    diffusion = np.exp(-bvals * D)
+    S = f * perfusion + (1 - f) * diffusion
+    residuals = signal - S0 * S
+    jacobian = np.stack([-S, S0 * (diffusion - perfusion),
+                         S0 * f * bvals * perfusion,
+                         S0 * (1 - f) * bvals * diffusion], axis=-1)
+    return residuals, jacobian
+
+
+def _in_bounds(params, bounds):
+    """Voxels whose parameters (n, p) are within the bounds."""
+    return np.all((params >= bounds[0]) & (params <= bounds[1]), axis=-1)
+
+
 def ivim_model_selector(gtab, fit_method='trr', **kwargs):
     """
     Selector function to switch between the 2-stage Trust-Region Reflective
@@ -287,8 +331,7 @@ class IvimModelTRR(ReconstModel):
 
         self.bounds = bounds or BOUNDS
 
-    @multi_voxel_fit
-    def fit(self, data):
+    def fit(self, data, mask=None):
         """ Fit method of the IvimModelTRR class.
 
         The fitting takes place in the following steps: Linear fitting for D
@@ -303,19 +346,39 @@ class IvimModelTRR(ReconstModel):
         (default: 25%), we will reject the solution obtained from non-linear
         least squares fitting and consider only the linear fit.
 
+        All the voxels are fitted at once: the linear fits are closed-form
+        regressions and the non-linear fits use a batched bounded
+        Levenberg-Marquardt algorithm (see
+        ``dipy.core.optimize.batch_levenberg_marquardt``).
 
         Parameters
         ----------
         data : array
-            The measured signal from one voxel. A multi voxel decorator
-            will be applied to this fit method to scale it and apply it
-            to multiple voxels.
+            The measured signal from one voxel or from several voxels, with
+            the diffusion weightings in the last dimension.
 
+        mask : array, optional
+            A boolean array used to mark the coordinates in the data that
+            should be analyzed that has the shape data.shape[:-1]
 
         Returns
         -------
         IvimFit object
         """
+        data = np.asarray(data)
+        if mask is None:
+            mask = np.ones(data.shape[:-1], dtype=bool)
+        elif mask.shape != data.shape[:-1]:
+            raise ValueError("mask and data shape do not match")
+        mask = np.array(mask, dtype=bool)
+
+        params = np.zeros(data.shape[:-1] + (4,))
+        params[mask] = self._fit_voxels(data[mask].reshape(-1,
+                                                           data.shape[-1]))
+        return IvimFit(self, params)
+
+    def _fit_voxels(self, data):
+        """ Fits the IVIM model to the signals (n, N) of n voxels. """
         # Get S0_prime and D - parameters assuming a single exponential decay
         # for signals for bvals greater than `split_b_D`
         S0_prime, D = self.estimate_linear_fit(
@@ -332,21 +395,20 @@ class IvimModelTRR(ReconstModel):
         # Fit f and D_star using leastsq.
         params_f_D_star = [f_guess, D_star_prime]
         f, D_star = self.estimate_f_D_star(params_f_D_star, data, S0, D)
-        params_linear = np.array([S0, f, D_star, D])
+        params_linear = np.stack([S0, f, D_star, D], axis=-1)
         # Fit parameters again if two_stage flag is set.
         if self.two_stage:
             params_two_stage = self._leastsq(data, params_linear)
-            bounds_violated = ~(np.all(params_two_stage >= self.bounds[0]) and
-                                (np.all(params_two_stage <= self.bounds[1])))
-            if bounds_violated:
+            bounds_violated = ~_in_bounds(params_two_stage, self.bounds)
+            if np.any(bounds_violated):
                 warningMsg = "Bounds are violated for leastsq fitting. "
                 warningMsg += "Returning parameters from linear fit"
                 warnings.warn(warningMsg, UserWarning)
-                return IvimFit(self, params_linear)
-            else:
-                return IvimFit(self, params_two_stage)
+                params_two_stage[bounds_violated] = \
+                    params_linear[bounds_violated]
+            return params_two_stage
         else:
-            return IvimFit(self, params_linear)
+            return params_linear
 
     def estimate_linear_fit(self, data, split_b, less_than=True):
         """Estimate a linear fit by taking log of data.
@@ -354,7 +416,8 @@ class IvimModelTRR(ReconstModel):
         Parameters
         ----------
         data : array
-            An array containing the data to be fit
+            An array containing the data to be fit, with the diffusion
+            weightings in the last dimension.
 
         split_b : float
             The b value to split the data
@@ -364,22 +427,21 @@ class IvimModelTRR(ReconstModel):
 
         Returns
         -------
-        S0 : float
+        S0 : float or array
             The estimated S0 value. (intercept)
 
-        D : float
+        D : float or array
             The estimated value of D.
         """
         if less_than:
-            bvals_split = self.gtab.bvals[self.gtab.bvals <= split_b]
-            D, neg_log_S0 = np.polyfit(bvals_split,
-                                       -np.log(data[self.gtab.bvals <=
-                                                    split_b]), 1)
+            split = self.gtab.bvals <= split_b
         else:
-            bvals_split = self.gtab.bvals[self.gtab.bvals >= split_b]
-            D, neg_log_S0 = np.polyfit(bvals_split,
-                                       -np.log(data[self.gtab.bvals >=
-                                                    split_b]), 1)
+            split = self.gtab.bvals >= split_b
+        bvals_split = self.gtab.bvals[split]
+        design = np.column_stack([bvals_split, np.ones(len(bvals_split))])
+        coefficients = np.dot(-np.log(data[..., split]),
+                              np.linalg.pinv(design).T)
+        D, neg_log_S0 = coefficients[..., 0], coefficients[..., 1]
 
         S0 = np.exp(-neg_log_S0)
         return S0, D
@@ -396,44 +458,58 @@ class IvimModelTRR(ReconstModel):
         data : array
             Array containing the actual signal values.
 
-        S0 : float
+        S0 : float or array
             The parameters S0 obtained from a linear fit.
 
-        D : float
+        D : float or array
             The parameters D obtained from a linear fit.
 
         Returns
         -------
-        f : float
+        f : float or array
            Perfusion fraction estimated from the fit.
         D_star :
             The value of D_star estimated from the fit.
         """
-        gtol = self.options["gtol"]
-        ftol = self.options["ftol"]
-        xtol = self.tol
-        maxfev = self.options["maxiter"]
-
-        try:
-            res = least_squares(f_D_star_error,
-                                params_f_D_star,
-                                bounds=((0., 0.), (self.bounds[1][1],
-                                                   self.bounds[1][2])),
-                                args=(self.gtab, data, S0, D),
-                                ftol=ftol,
-                                xtol=xtol,
-                                gtol=gtol,
-                                max_nfev=maxfev)
-            f, D_star = res.x
-            return f, D_star
-        except ValueError:
+        bvals = self.gtab.bvals
+        data = np.asarray(data)
+        shape = data.shape[:-1]
+        x0 = np.stack(np.broadcast_arrays(*params_f_D_star), axis=-1)
+        x0 = np.array(np.broadcast_to(x0, shape + (2,)),
+                      dtype=float).reshape(-1, 2)
+        signal = data.reshape(-1, data.shape[-1])
+        S0 = np.broadcast_to(S0, shape).reshape(-1, 1)
+        D = np.broadcast_to(D, shape).reshape(-1, 1)
+        diffusion = S0 * np.exp(-bvals * D)
+
+        bounds = ((0., 0.), (self.bounds[1][1], self.bounds[1][2]))
+        feasible = _in_bounds(x0, bounds)
+        if not np.all(feasible):
             warningMsg = "x0 obtained from linear fitting is not feasibile"
             warningMsg += " as initial guess for leastsq while estimating "
             warningMsg += "f and D_star. Using parameters from the "
             warningMsg += "linear fit."
             warnings.warn(warningMsg, UserWarning)
-            f, D_star = params_f_D_star
-            return f, D_star
+
+        def residuals_func(x, index):
+            f, D_star = x[:, :1], x[:, 1:]
+            perfusion = S0[index] * np.exp(-bvals * D_star)
+            residuals = signal[index] - f * perfusion - \
+                (1 - f) * diffusion[index]
+            jacobian = np.stack([diffusion[index] - perfusion,
+                                 f * bvals * perfusion], axis=-1)
+            return residuals, jacobian
+
+        x = x0.copy()
+        if np.any(feasible):
+            index = np.flatnonzero(feasible)
+            x[feasible] = batch_levenberg_marquardt(
+                lambda x, i: residuals_func(x, index[i]), x0[feasible],
+                bounds=bounds, max_iter=self.options["maxiter"],
+                ftol=self.options["ftol"], xtol=self.tol)
+        x = x.reshape(shape + (2,))
+        f, D_star = x[..., 0], x[..., 1]
+        return f, D_star
 
     def predict(self, ivim_params, gtab, S0=1.):
         """
@@ -464,53 +540,62 @@ class IvimModelTRR(ReconstModel):
 
         Parameters
         ----------
-        data : array, (len(bvals))
-            An array containing the signal from a voxel.
-            If the data was a 3D image of 10x10x10 grid with 21 bvalues,
-            the multi_voxel decorator will run the single voxel fitting
-            on all the 1000 voxels to get the parameters in
-            IvimFit.model_paramters. The shape of the parameter array
-            will be (data[:-1], 4).
-
-        x0 : array
+        data : array, (..., len(bvals))
+            An array containing the signal from a voxel or from several
+            voxels. If the data was a 3D image of 10x10x10 grid with 21
+            bvalues, all the 1000 voxels are fitted at once to get the
+            parameters in IvimFit.model_paramters. The shape of the parameter
+            array will be (data[:-1], 4).
+
+        x0 : array, (..., 4)
             Initial guesses for the parameters S0, f, D_star and D
             calculated using a linear fitting.
 
         Returns
         -------
-        x0 : array
+        x0 : array, (..., 4)
             Estimates of the parameters S0, f, D_star and D.
         """
-        gtol = self.options["gtol"]
-        ftol = self.options["ftol"]
-        xtol = self.tol
-        maxfev = self.options["maxiter"]
-        bounds = self.bounds
-
-        try:
-            res = least_squares(_ivim_error,
-                                x0,
-                                bounds=bounds,
-                                ftol=ftol,
-                                xtol=xtol,
-                                gtol=gtol,
-                                max_nfev=maxfev,
-                                args=(self.gtab, data),
-                                x_scale=self.x_scale)
-            ivim_params = res.x
-            if np.all(np.isnan(ivim_params)):
-                return np.array([-1, -1, -1, -1])
-            return ivim_params
-        except ValueError:
+        bvals = self.gtab.bvals
+        data = np.asarray(data)
+        shape = data.shape[:-1]
+        signal = data.reshape(-1, data.shape[-1])
+        x0 = np.array(np.broadcast_to(x0, shape + (4,)),
+                      dtype=float).reshape(-1, 4)
+        x_scale = np.asarray(self.x_scale, dtype=float)
+
+        feasible = _in_bounds(x0, self.bounds)
+        if not np.all(feasible):
             warningMsg = "x0 is unfeasible for leastsq fitting."
             warningMsg += " Returning x0 values from the linear fit."
             warnings.warn(warningMsg, UserWarning)
-            return x0
+
+        # The parameters are scaled by x_scale during the optimization
+        index = np.flatnonzero(feasible)
+
+        def residuals_func(z, i):
+            residuals, jacobian = _ivim_residuals(z * x_scale, bvals,
+                                                  signal[index[i]])
+            return residuals, jacobian * x_scale
+
+        ivim_params = x0.copy()
+        if len(index):
+            with np.errstate(over='ignore', invalid='ignore'):
+                ivim_params[feasible] = x_scale * batch_levenberg_marquardt(
+                    residuals_func, x0[feasible] / x_scale,
+                    bounds=(np.asarray(self.bounds[0]) / x_scale,
+                            np.asarray(self.bounds[1]) / x_scale),
+                    max_iter=self.options["maxiter"],
+                    ftol=self.options["ftol"], xtol=self.tol)
+        failed = np.all(np.isnan(ivim_params), axis=-1) & feasible
+        ivim_params[failed] = -1
+        return ivim_params.reshape(shape + (4,))
 
 
 class IvimModelVP(ReconstModel):
 
-    def __init__(self, gtab, bounds=None, maxiter=10, xtol=1e-8):
+    def __init__(self, gtab, bounds=None, maxiter=10, xtol=1e-8,
+                 search='grid', grid_size=64):
         r""" Initialize an IvimModelVP class.
 
         The IVIM model assumes that biological tissue includes a volume
@@ -539,6 +624,18 @@ class IvimModelVP(ReconstModel):
             Tolerance for convergence of minimization.
             default : 1e-8
 
+        search : {'grid', 'differential_evolution'}, optional
+            Search of the diffusion coefficients minimizing the variable
+            projection cost. 'grid' evaluates the cost of all the voxels on
+            a grid of diffusion coefficients at once, and is deterministic.
+            'differential_evolution' runs the Differential Evolution of SciPy
+            voxel by voxel, in a pool of processes.
+            default : 'grid'
+
+        grid_size : int, optional
+            Number of values of D_star and of D of the grid search.
+            default : 64
+
         References
         ----------
         .. [1] Le Bihan, Denis, et al. "Separation of diffusion and perfusion
@@ -553,30 +650,61 @@ class IvimModelVP(ReconstModel):
                Resonance in Medicine (ISMRM), Montreal, Canada, 2019.
         """
 
+        if search not in ('grid', 'differential_evolution'):
+            raise ValueError("search should be 'grid' or "
+                             "'differential_evolution'")
         self.maxiter = maxiter
         self.xtol = xtol
+        self.search = search
+        self.grid_size = grid_size
         self.bvals = gtab.bvals
         self.yhat_perfusion = np.zeros(self.bvals.shape[0])
         self.yhat_diffusion = np.zeros(self.bvals.shape[0])
         self.exp_phi1 = np.zeros((self.bvals.shape[0], 2))
         self.bounds = bounds or (BOUNDS[0][1:], BOUNDS[1][1:])
 
-    @multi_voxel_fit
-    def fit(self, data, bounds_de=None):
+    def fit(self, data, mask=None, num_processes=1):
         r""" Fit method of the IvimModelVP model class
 
         MicroLearn framework (VarPro)[1]_.
 
         The VarPro computes the IVIM parameters using the MIX approach.
         This algorithm uses three different optimizers. It starts with a
-        differential evolution algorithm and fits the parameters in the
-        power of exponentials. Then the fitted parameters in the first step are
-        utilized to make a linear convex problem. Using a convex optimization,
-        the volume fractions are determined. Then the last step is non linear
-        least square fitting on all the parameters. The results of the first
-        and second step are utilized as the initial values for the last step
-        of the algorithm. (see [1]_ and [2]_ for a comparison and a through
-        discussion).
+        search of the parameters in the power of exponentials, on a grid or
+        with a differential evolution algorithm. Then the fitted parameters
+        in the first step are utilized to make a linear convex problem. Using
+        a convex optimization, the volume fractions are determined. Then the
+        last step is non linear least square fitting on all the parameters.
+        The results of the first and second step are utilized as the initial
+        values for the last step of the algorithm. (see [1]_ and [2]_ for a
+        comparison and a through discussion).
+
+        The volume fractions being constrained to sum to one, the convex
+        problem has a single unknown and is solved in closed form. The grid
+        search, the convex problem and the non linear least squares are
+        solved for all the voxels at once.
+
+        Parameters
+        ----------
+        data : array
+            The measured signal from one voxel or from several voxels, with
+            the diffusion weightings in the last dimension.
+
+        mask : array, optional
+            A boolean array used to mark the coordinates in the data that
+            should be analyzed that has the shape data.shape[:-1]
+
+        num_processes : int or None, optional
+            Split the differential evolution search to a pool of children
+            processes. This only applies when `search` is
+            'differential_evolution'. Default is 1. If None, all the cores
+            are used. If < 0 the maximal number of cores minus
+            |num_processes + 1| is used (enter -1 to use as many cores as
+            possible). 0 raises an error.
+
+        Returns
+        -------
+        IvimFit object
 
         References
         ----------
@@ -589,42 +717,130 @@ class IvimModelVP(ReconstModel):
                (2016).
 
         """
-        data_max = data.max()
-        data = data / data_max
+        data = np.asarray(data)
+        if mask is None:
+            mask = np.ones(data.shape[:-1], dtype=bool)
+        elif mask.shape != data.shape[:-1]:
+            raise ValueError("mask and data shape do not match")
+        mask = np.array(mask, dtype=bool)
+
+        data_in_mask = data[mask].reshape(-1, data.shape[-1])
+        data_max = data_in_mask.max(axis=-1, keepdims=True)
+        signal = data_in_mask / data_max
         b = self.bvals
 
-        # Setting up the bounds for differential_evolution
-        bounds_de = np.array([(0.005, 0.01), (10**-4, 0.001)])
-
-        # Optimizer #1: Differential Evolution
-        res_one = differential_evolution(self.stoc_search_cost, bounds_de,
-                                         maxiter=self.maxiter, args=(data,),
-                                         disp=False, polish=True, popsize=28)
-        x = res_one.x
-        phi = self.phi(x)
+        # Optimizer #1: Grid search or Differential Evolution
+        if self.search == 'grid':
+            x = self.grid_search(signal)
+        else:
+            x = self._differential_evolution(signal, num_processes)
+        perfusion = np.exp(-b * x[:, :1])
+        diffusion = np.exp(-b * x[:, 1:])
 
         # Optimizer #2: Convex Optimizer
-        f = self.cvx_fit(data, phi)
-        x_f = self.x_and_f_to_x_f(x, f)
-
-        # Setting up the bounds for least_squares
-        bounds = self.bounds
+        f = self.constrained_fractions(signal, perfusion, diffusion)
+        x_f = np.column_stack([f, x])
 
         # Optimizer #3: Nonlinear-Least Squares
-        res = least_squares(self.nlls_cost, x_f, bounds=(bounds),
-                            xtol=self.xtol, args=(data,))
-        result = res.x
-        f_est = result[0]
-        D_star_est = result[1]
-        D_est = result[2]
-
-        S0 = data / (f_est * np.exp(-b * D_star_est) + (1 - f_est) *
-                     np.exp(-b * D_est))
+        def residuals_func(x_f, index):
+            f, D_star, D = [x_f[:, i, None] for i in range(3)]
+            perfusion = np.exp(-b * D_star)
+            diffusion = np.exp(-b * D)
+            residuals = f * perfusion + (1 - f) * diffusion - signal[index]
+            jacobian = np.stack([perfusion - diffusion,
+                                 -f * b * perfusion,
+                                 -(1 - f) * b * diffusion], axis=-1)
+            return residuals, jacobian
+
+        result = batch_levenberg_marquardt(residuals_func, x_f,
+                                           bounds=self.bounds,
+                                           xtol=self.xtol)
+        f_est, D_star_est, D_est = [result[:, i, None] for i in range(3)]
+
+        S0 = signal / (f_est * np.exp(-b * D_star_est) + (1 - f_est) *
+                       np.exp(-b * D_est))
         S0_est = S0 * data_max
 
         # final result containing the four fit parameters: S0, f, D* and D
-        result = np.insert(result, 0, np.mean(S0_est), axis=0)
-        return IvimFit(self, result)
+        params = np.zeros(data.shape[:-1] + (4,))
+        params[mask] = np.column_stack([np.mean(S0_est, axis=-1), result])
+        return IvimFit(self, params)
+
+    def grid_search(self, signal):
+        """
+        Searches the non-linear parameters 'x' (D_star and D) minimizing the
+        variable projection cost of :func: `ivim_mix_cost_one` on a grid, for
+        several signals at once.
+
+        Parameters
+        ----------
+        signal : array (n, N)
+            The signal values of n voxels, normalized by their maximum.
+
+        Returns
+        -------
+        x : array (n, 2)
+            The D_star and D values of the grid with the lowest cost for each
+            voxel.
+        """
+        grid = np.meshgrid(np.linspace(*_VP_SEARCH_BOUNDS[0],
+                                       num=self.grid_size),
+                           np.linspace(*_VP_SEARCH_BOUNDS[1],
+                                       num=self.grid_size), indexing='ij')
+        grid = np.column_stack([g.ravel() for g in grid])
+        phi = np.exp(-self.bvals[None, :, None] * grid[:, None, :])
+        inv_phi_phi = np.linalg.inv(np.matmul(np.swapaxes(phi, 1, 2), phi))
+
+        # The cost of each grid point is |signal|^2 - the squared norm of the
+        # projection of the signal on the span of phi
+        x = np.empty((len(signal), 2))
+        step = max(1, 2 ** 20 // len(grid))
+        for start in range(0, len(signal), step):
+            block = signal[start:start + step]
+            phi_signal = np.tensordot(block, phi, axes=([1], [1]))
+            projection = np.einsum('nki,kij,nkj->nk', phi_signal, inv_phi_phi,
+                                   phi_signal)
+            cost = np.sum(block ** 2, axis=-1)[:, None] - projection
+            x[start:start + step] = grid[np.argmin(cost, axis=-1)]
+        return x
+
+    def _differential_evolution(self, signal, num_processes=1):
+        """ Differential Evolution search of 'x' for each signal (n, N). """
+        num_processes = determine_num_processes(num_processes)
+        args = [(self, s) for s in signal]
+        if num_processes == 1 or len(signal) < 2:
+            return np.array([_vp_differential_evolution(a) for a in args])
+        pool = Pool(num_processes)
+        x = pool.map(_vp_differential_evolution, args)
+        pool.close()
+        pool.join()
+        return np.array(x)
+
+    def constrained_fractions(self, signal, perfusion, diffusion):
+        """
+        Solves the constrained linear least-squares problem of :func:
+        `cvx_fit` for several signals at once. The two volume fractions sum
+        to one, so the problem only has one unknown, whose solution is the
+        unconstrained solution clipped to the constraints.
+
+        Parameters
+        ----------
+        signal : array (n, N)
+            The signal values measured for this model.
+
+        perfusion, diffusion : array (n, N)
+            The two columns of the arrays calculated from :func: `phi`.
+
+        Returns
+        -------
+        f : array (n, )
+            The perfusion volume fraction f1 of each voxel (f2 = 1 - f1).
+        """
+        d = perfusion - diffusion
+        f = np.sum(d * (signal - diffusion), axis=-1) / np.sum(d * d, axis=-1)
+        # Constraints of `cvx_fit` on f1 and on f2 = 1 - f1
+        return np.clip(f, max(0.011, 1 - 0.89),
+                       min(self.bounds[1][0], 1 - 0.011))
 
     def stoc_search_cost(self, x, signal):
         """
@@ -848,6 +1064,17 @@ class IvimModelVP(ReconstModel):
         return self.exp_phi1
 
 
+def _vp_differential_evolution(args):
+    """ Differential Evolution search of 'x' for one signal, as used by
+    :func: `IvimModelVP.fit`. Defined at the module level to be used with a
+    pool of processes. """
+    model, signal = args
+    res = differential_evolution(model.stoc_search_cost, _VP_SEARCH_BOUNDS,
+                                 maxiter=model.maxiter, args=(signal,),
+                                 disp=False, polish=True, popsize=28)
+    return res.x
+
+
 class IvimFit(object):
 
     def __init__(self, model, model_params):
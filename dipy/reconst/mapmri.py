@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 import numpy as np
 from distutils.version import LooseVersion
-from dipy.reconst.multi_voxel import multi_voxel_fit
+from dipy.reconst.multi_voxel import multi_voxel_fit, MultiVoxelFit
 from dipy.reconst.base import ReconstModel, ReconstFit
 from dipy.reconst.cache import Cache
 from scipy.special import hermite, gamma, genlaguerre
@@ -85,7 +85,8 @@ class MapmriModel(ReconstModel, Cache):
                  bval_threshold=np.inf,
                  dti_scale_estimation=True,
                  static_diffusivity=0.7e-3,
-                 cvxpy_solver=None):
+                 cvxpy_solver=None,
+                 scale_quantization=None):
         r""" Analytical and continuous modeling of the diffusion signal with
         respect to the MAPMRI basis [1]_.
 
@@ -170,6 +171,15 @@ class MapmriModel(ReconstModel, Cache):
             with a particular cvxpy solver. See http://www.cvxpy.org/ for
             details.
             Default: None (cvxpy chooses its own solver)
+        scale_quantization : float, optional
+            If set, the isotropic scale factors of the voxels are quantised
+            on a logarithmic grid with this relative spacing (e.g. 0.01 for
+            1%), and the voxels sharing a quantised scale factor are fitted
+            together, with the same design matrix and factorization. The
+            'GCV' weighting is then selected among many candidate weights at
+            once. Only available with the isotropic implementation and
+            without positivity constraint.
+            Default: None (each voxel is fitted with its own scale factor)
 
         References
         ----------
@@ -279,6 +289,15 @@ class MapmriModel(ReconstModel, Cache):
             self.tau = gtab.big_delta - gtab.small_delta / 3.0
         self.eigenvalue_threshold = eigenvalue_threshold
 
+        if scale_quantization is not None:
+            if anisotropic_scaling or positivity_constraint:
+                msg = "scale_quantization is only available with isotropic "
+                msg += "scaling and without positivity constraint."
+                raise ValueError(msg)
+            if scale_quantization <= 0:
+                raise ValueError("scale_quantization must be positive.")
+        self.scale_quantization = scale_quantization
+
         self.cvxpy_solver = cvxpy_solver
         self.cutoff = gtab.bvals < self.bval_threshold
         gtab_cutoff = gradient_table(bvals=self.gtab.bvals[self.cutoff],
@@ -314,8 +333,126 @@ class MapmriModel(ReconstModel, Cache):
                            self.laplacian_matrix)
                     self.MMt_inv_Mt = np.dot(np.linalg.pinv(MMt), self.M.T)
 
+    def fit(self, data, mask=None):
+        """ Fit method of the MAPMRI model class
+
+        Parameters
+        ----------
+        data : array
+            The measured signal from one voxel or from several voxels, with
+            the diffusion weightings in the last dimension.
+        mask : array, optional
+            A boolean array used to mark the coordinates in the data that
+            should be analyzed that has the shape data.shape[:-1]
+        """
+        if self.scale_quantization is None:
+            return self._voxel_fit(data, mask)
+        return self._grouped_fit(data, mask)
+
+    def _grouped_fit(self, data, mask=None):
+        """ Fits the voxels grouped by quantised isotropic scale factors """
+        data = np.asarray(data)
+        single_voxel = data.ndim == 1
+        if single_voxel:
+            data = data[None]
+            if mask is not None:
+                mask = np.asarray(mask)[None]
+        if mask is None:
+            mask = np.ones(data.shape[:-1], dtype=bool)
+        elif mask.shape != data.shape[:-1]:
+            raise ValueError("mask and data shape do not match")
+        mask = np.array(mask, dtype=bool)
+        if single_voxel and not mask[0]:
+            # A masked single voxel has zero coefficients, as the masked
+            # voxels of a MultiVoxelFit
+            return MapmriFit(self, np.zeros(self.ind_mat.shape[0]),
+                             np.ones(3), np.eye(3), 0., 0)
+        signal = data[mask]
+
+        tenfit = self.tenmodel.fit(signal[:, self.cutoff])
+        R = tenfit.evecs
+        if self.dti_scale_estimation:
+            evals = tenfit.evals
+            evals = np.clip(evals, self.eigenvalue_threshold,
+                            evals.max(axis=-1, keepdims=True))
+            u0 = _isotropic_scale_factors(evals * 2 * self.tau)
+            log_step = np.log1p(self.scale_quantization)
+            bins, groups = np.unique(np.round(np.log(u0) / log_step),
+                                     return_inverse=True)
+            scales = np.exp(bins * log_step)
+        else:
+            groups = np.zeros(len(signal), dtype=int)
+            scales = self.mu[:1]
+
+        coef = np.zeros((len(signal), self.ind_mat.shape[0]))
+        lopt = np.zeros(len(signal))
+        for group, scale in enumerate(scales):
+            index = groups == group
+            coef[index], lopt[index] = self._fit_group(signal[index], scale)
+
+        fit_array = np.empty(mask.shape, dtype=object)
+        fits = fit_array[mask]
+        for i in range(len(signal)):
+            mu = np.array([scales[groups[i]]] * 3)
+            fits[i] = MapmriFit(self, coef[i], mu, R[i], lopt[i], 0)
+        fit_array[mask] = fits
+        if single_voxel:
+            return fit_array[0]
+        return MultiVoxelFit(self, fit_array, mask)
+
+    def _group_factorization(self, scale):
+        """ Factorization of the design of the voxels with a scale factor
+
+        The design matrix M and the Laplacian regularization matrix L are
+        diagonalized together, with V^T M^T M V = I and V^T L V = diag(g),
+        so that the regularized solution for a weight w is
+        V diag(1 / (1 + w g)) U^T y with U = M V, for any weight.
+        """
+        factorization = self.cache_get('mapmri_group_factorization',
+                                       key=scale)
+        if factorization is not None:
+            return factorization
+        if self.dti_scale_estimation:
+            qvals = np.sqrt(self.gtab.bvals / self.tau) / (2 * np.pi)
+            M = mapmri_isotropic_M_mu_dependent(
+                self.radial_order, scale, qvals) * self.M_mu_independent
+        else:
+            M = self.M
+        U, sv, Vt = np.linalg.svd(M, full_matrices=False)
+        keep = sv > sv[0] * max(M.shape) * np.finfo(float).eps
+        U, sv, Vt = U[:, keep], sv[keep], Vt[keep]
+        if self.laplacian_regularization:
+            LR = np.dot(np.dot(Vt, self.laplacian_matrix * scale), Vt.T)
+            g, Q = np.linalg.eigh(LR / sv[:, None] / sv[None, :])
+            g = np.clip(g, 0, None)
+        else:
+            g, Q = np.zeros(len(sv)), np.eye(len(sv))
+        factorization = (np.dot(U, Q), np.dot(Vt.T, Q / sv[:, None]), g)
+        self.cache_set('mapmri_group_factorization', scale, factorization)
+        return factorization
+
+    def _fit_group(self, signal, scale):
+        """ Fits the signals (n, N) of voxels sharing a scale factor """
+        U, V, g = self._group_factorization(scale)
+        z = np.dot(signal, U)
+
+        if not self.laplacian_regularization:
+            lopt = np.zeros(len(signal))
+        elif (isinstance(self.laplacian_weighting, str) and
+                self.laplacian_weighting.upper() == 'GCV'):
+            lopt = _gcv_batch(signal, z, g, _GCV_WEIGHTS, refine=True)
+        elif np.isscalar(self.laplacian_weighting):
+            lopt = np.full(len(signal), float(self.laplacian_weighting))
+        else:
+            lopt = _gcv_batch(signal, z, g, self.laplacian_weighting,
+                              refine=False)
+
+        coef = np.dot(z / (1 + lopt[:, None] * g), V.T)
+        coef = coef / np.dot(coef, self.Bm)[:, None]
+        return coef, lopt
+
     @multi_voxel_fit
-    def fit(self, data):
+    def _voxel_fit(self, data):
         errorcode = 0
         tenfit = self.tenmodel.fit(data[self.cutoff])
         evals = tenfit.evals
@@ -1003,6 +1140,33 @@ def isotropic_scale_factor(mu_squared):
     return u0
 
 
+def _isotropic_scale_factors(mu_squared):
+    """ Isotropic scale factors of several voxels, as
+    ``isotropic_scale_factor``.
+
+    Parameters
+    ----------
+    mu_squared : array, shape (n, 3)
+        squared scale factors of mapmri basis in x, y, z of n voxels
+
+    Returns
+    -------
+    u0 : array, shape (n,)
+        closest isotropic scale factor for the isotropic basis
+    """
+    X, Y, Z = mu_squared.T
+    # companion matrices of the monic cubic polynomials of
+    # ``isotropic_scale_factor``
+    companion = np.zeros((len(mu_squared), 3, 3))
+    companion[:, 0, 0] = -(X + Y + Z) / 3
+    companion[:, 0, 1] = (X * Y + X * Z + Y * Z) / 3
+    companion[:, 0, 2] = X * Y * Z
+    companion[:, 1, 0] = 1
+    companion[:, 2, 1] = 1
+    roots = np.linalg.eigvals(companion)
+    return np.sqrt(np.real(roots).max(axis=-1))
+
+
 def mapmri_index_matrix(radial_order):
     r""" Calculates the indices for the MAPMRI [1]_ basis in x, y and z.
 
@@ -2013,6 +2177,74 @@ def mapmri_laplacian_reg_matrix(ind_mat, mu, S_mat, T_mat, U_mat):
     return LR
 
 
+def _gcv_batch(data, z, g, weights, refine=False):
+    """ Generalized Cross Validation of several voxels for several weights.
+
+    Parameters
+    ----------
+    data : array (n, N)
+        signals of n voxels
+    z : array (n, p)
+        projections of the signals on the basis U of the factorization of
+        their design matrix (see ``MapmriModel._group_factorization``)
+    g : array (p, )
+        generalized eigenvalues of the regularization matrix
+    weights : array (N_of_weights)
+        candidate regularization weights
+    refine : bool
+        If True, the weights minimizing the GCV cost function are refined
+        by parabolic interpolation of the cost in logarithmic scale, as for
+        a continuous minimization. Otherwise the weights are selected as
+        in ``generalized_crossvalidation_array``.
+
+    Returns
+    -------
+    lopt : array (n, )
+        optimal regularization weight of each voxel
+    """
+    weights = np.asarray(weights, dtype=float)
+    # Diagonal of the hat matrix S = U diag(h) U^T for each weight
+    h = 1. / (1 + weights[:, None] * g[None, :])
+    trS = h.sum(axis=-1)
+    # |y - S y|^2 = |y|^2 - sum((2 h - h^2) z^2)
+    norm2 = np.sum(data ** 2, axis=-1)[:, None] - np.dot(z ** 2,
+                                                         (2 * h - h ** 2).T)
+    gcv = np.sqrt(np.clip(norm2, 0, None)) / (data.shape[-1] - trS)
+
+    if not refine:
+        # The first local minimum, going through the weights
+        samples = len(weights)
+        increase = gcv[:, 1:samples - 1] > gcv[:, :samples - 2]
+        stop = np.where(increase.any(axis=-1), increase.argmax(axis=-1) + 1,
+                        max(samples - 2, 0))
+        return weights[stop - 1]
+
+    best = gcv.argmin(axis=-1)
+    lopt = weights[best]
+    inner = (best > 0) & (best < len(weights) - 1)
+    if np.any(inner):
+        i = np.flatnonzero(inner)
+        b = best[inner]
+        x = np.log(weights)
+        x0, x1, x2 = x[b - 1], x[b], x[b + 1]
+        y0, y1, y2 = gcv[i, b - 1], gcv[i, b], gcv[i, b + 1]
+        denominator = (x0 - x1) * (x0 - x2) * (x1 - x2)
+        a = (x2 * (y1 - y0) + x1 * (y0 - y2) + x0 * (y2 - y1))
+        c = (x2 ** 2 * (y0 - y1) + x1 ** 2 * (y2 - y0) +
+             x0 ** 2 * (y1 - y2))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            vertex = -c / (2 * a)
+        vertex = np.where((a / denominator > 0) & np.isfinite(vertex),
+                          np.clip(vertex, x0, x2), x1)
+        lopt[inner] = np.exp(vertex)
+    return lopt
+
+
+# candidate weights of the GCV of the fits grouped by scale factors, in the
+# bounds of the minimization of ``generalized_crossvalidation``
+_GCV_WEIGHTS = np.logspace(-5, 1, 121)
+
+
 def generalized_crossvalidation_array(data, M, LR, weights_array=None):
     """Generalized Cross Validation Function [1]_ eq. (15).
 
@@ -13,6 +13,10 @@ cimport numpy as cnp
 from libc.stdlib cimport malloc, free
 from libc.string cimport memcpy
 
+from cython.parallel import parallel, prange
+from safe_openmp cimport have_openmp
+from dipy.utils.omp import determine_num_threads
+
 cdef extern from "dpy_math.h" nogil:
     double floor(double x)
     double fabs(double x)
@@ -249,6 +253,71 @@ def local_maxima(double[:] odf, cnp.uint16_t[:, :] edges):
     return values, indices
 
 
+@cython.wraparound(False)
+@cython.boundscheck(False)
+def local_maxima_block(double[:, ::1] odfs, cnp.uint16_t[:, :] edges,
+                       num_threads=None):
+    """Local maxima of many functions evaluated on the same set of points.
+
+    Same as ``local_maxima`` for each row of `odfs`, in parallel over the
+    rows.
+
+    Parameters
+    ----------
+    odfs : array (M, N), dtype=double
+        The M functions evaluated on a set of N discrete points.
+    edges : array (E, 2)
+        The set of neighbor relations between the points. Every edge, ie
+        `edges[i, :]`, is a pair of neighboring points.
+    num_threads : int, optional
+        Number of threads to be used for OpenMP parallelization. If None
+        (default) the value of OMP_NUM_THREADS environment variable is used
+        if it is set, otherwise all available threads are used. If < 0 the
+        maximal number of threads minus |num_threads + 1| is used (enter -1 to
+        use as many threads as possible). 0 raises an error.
+
+    Returns
+    -------
+    peak_values : ndarray (M, N)
+        Values of each function at its maximum points, sorted in descending
+        order in the first ``peak_counts`` elements of each row.
+    peak_indices : ndarray (M, N)
+        Indices of the maximum points, sorted in the same order as
+        `peak_values`.
+    peak_counts : ndarray (M, )
+        Number of maxima of each function.
+
+    See Also
+    --------
+    local_maxima
+    """
+    cdef:
+        cnp.npy_intp i, j
+        cnp.npy_intp nb_rows = odfs.shape[0]
+        cnp.npy_intp n = odfs.shape[1]
+        double[:, ::1] values = np.zeros((nb_rows, n))
+        cnp.npy_intp[:, ::1] indices = np.zeros((nb_rows, n), dtype=np.intp)
+        cnp.npy_intp[::1] counts = np.zeros(nb_rows, dtype=np.intp)
+        int threads_to_use = determine_num_threads(num_threads)
+
+    if edges.shape[0] and np.asarray(edges).max() >= n:
+        raise IndexError("Values in edges must be < len(odf)")
+    if not have_openmp:
+        threads_to_use = 1
+
+    with nogil, parallel(num_threads=threads_to_use):
+        for i in prange(nb_rows, schedule='guided'):
+            counts[i] = _compare_neighbors(odfs[i], edges, &indices[i, 0])
+            if counts[i] > 0:
+                for j in range(counts[i]):
+                    values[i, j] = odfs[i, indices[i, j]]
+                _cosort(values[i, :counts[i]], indices[i, :counts[i]])
+
+    if np.any(np.asarray(counts) < 0):
+        raise ValueError("odf can not have nans")
+    return np.asarray(values), np.asarray(indices), np.asarray(counts)
+
+
 @cython.wraparound(False)
 @cython.boundscheck(False)
 cdef void _cosort(double[::1] A, cnp.npy_intp[::1] B) nogil:
@@ -549,3 +618,168 @@ def argmax_from_countarrs(cnp.ndarray vals,
         return np.array([])
     # fancy indexing always produces a copy
     return maxinds[argsort(maxes[:n_maxes])]
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+def batch_elastic_net(double[:, ::1] gram, double[:, ::1] Xy,
+                      double[::1] y_norm2, double alpha, double beta,
+                      bint positive=False, coef_init=None, int max_iter=1000,
+                      double tol=1e-4, num_threads=None):
+    """ Solve several elastic net problems sharing a design matrix with
+    coordinate descent, in parallel over the problems.
+
+    Each problem minimizes
+    ``0.5 * ||y - X w||^2 + alpha * ||w||_1 + 0.5 * beta * ||w||^2``, which
+    only depends on the data through the Gram matrix ``X^T X``, ``X^T y``
+    and ``||y||^2``.
+
+    Parameters
+    ----------
+    gram : ndarray (p, p)
+        The Gram matrix ``X^T X`` of the shared design matrix.
+    Xy : ndarray (n, p)
+        The products ``X^T y`` of the n problems.
+    y_norm2 : ndarray (n, )
+        The squared norms of the targets of the n problems.
+    alpha : float
+        The L1 regularization weight.
+    beta : float
+        The L2 regularization weight.
+    positive : bool, optional
+        Whether to constrain the coefficients to be non-negative (default
+        False).
+    coef_init : ndarray (n, p), optional
+        Initial coefficients, for instance the solutions of similar problems.
+        Default: None (zeros).
+    max_iter : int, optional
+        Maximum number of passes over the coefficients (default 1000).
+    tol : float, optional
+        A problem has converged when its duality gap is smaller than `tol`
+        times the squared norm of its target (default 1e-4).
+    num_threads : int, optional
+        Number of threads to be used for OpenMP parallelization. If None
+        (default) the value of OMP_NUM_THREADS environment variable is used
+        if it is set, otherwise all available threads are used. If < 0 the
+        maximal number of threads minus |num_threads + 1| is used (enter -1 to
+        use as many threads as possible). 0 raises an error.
+
+    Returns
+    -------
+    coef : ndarray (n, p)
+        The coefficients minimizing each problem.
+
+    Notes
+    -----
+    The coordinates are updated cyclically, with the same rules and the same
+    stopping criterion as the coordinate descent of scikit-learn's
+    ``ElasticNet`` with a precomputed Gram matrix, so a problem has the same
+    solution as scikit-learn's.
+    """
+    cdef:
+        cnp.npy_intp i
+        cnp.npy_intp n = Xy.shape[0]
+        cnp.npy_intp p = Xy.shape[1]
+        double[:, ::1] coef
+        double[:, ::1] H_w
+        int threads_to_use = determine_num_threads(num_threads)
+
+    if gram.shape[0] != p or gram.shape[1] != p or y_norm2.shape[0] != n:
+        raise ValueError("The shapes of gram, Xy and y_norm2 do not match.")
+    if coef_init is None:
+        coef = np.zeros((n, p))
+    else:
+        coef = np.array(coef_init, dtype=np.float64, order='C')
+        if coef.shape[0] != n or coef.shape[1] != p:
+            raise ValueError("coef_init should have the shape of Xy.")
+    H_w = np.ascontiguousarray(np.dot(coef, gram))
+    if not have_openmp:
+        threads_to_use = 1
+
+    with nogil, parallel(num_threads=threads_to_use):
+        for i in prange(n, schedule='dynamic'):
+            _enet_coordinate_descent_gram(gram, Xy[i], y_norm2[i], alpha,
+                                          beta, positive, coef[i], H_w[i],
+                                          max_iter, tol)
+    return np.asarray(coef)
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef void _enet_coordinate_descent_gram(double[:, ::1] H, double[::1] q,
+                                        double y_norm2, double alpha,
+                                        double beta, bint positive,
+                                        double[::1] w, double[::1] H_w,
+                                        int max_iter, double tol) nogil:
+    """ Coordinate descent of one elastic net problem, as in scikit-learn's
+    ``enet_coordinate_descent_gram``. `w` and `H_w` = H w are updated in
+    place.
+    """
+    cdef:
+        cnp.npy_intp ii, jj
+        cnp.npy_intp n_features = q.shape[0]
+        int n_iter
+        double w_ii, tmp, d_w_ii, d_w_max, w_max
+        double q_dot_w, XtA, dual_norm_XtA, R_norm2, w_norm2, l1_norm
+        double const, gap
+        double d_w_tol = tol
+
+    tol = tol * y_norm2
+    for n_iter in range(max_iter):
+        w_max = 0
+        d_w_max = 0
+        for ii in range(n_features):
+            if H[ii, ii] == 0:
+                continue
+            w_ii = w[ii]
+            tmp = q[ii] - H_w[ii] + w_ii * H[ii, ii]
+            if positive and tmp < 0:
+                w[ii] = 0
+            elif fabs(tmp) > alpha:
+                if tmp > 0:
+                    w[ii] = (tmp - alpha) / (H[ii, ii] + beta)
+                else:
+                    w[ii] = (tmp + alpha) / (H[ii, ii] + beta)
+            else:
+                w[ii] = 0
+            d_w_ii = w[ii] - w_ii
+            if d_w_ii != 0:
+                for jj in range(n_features):
+                    H_w[jj] += d_w_ii * H[ii, jj]
+            if fabs(d_w_ii) > d_w_max:
+                d_w_max = fabs(d_w_ii)
+            if fabs(w[ii]) > w_max:
+                w_max = fabs(w[ii])
+
+        if (w_max == 0 or d_w_max / w_max < d_w_tol or
+                n_iter == max_iter - 1):
+            # The duality gap decides of the convergence
+            q_dot_w = 0
+            dual_norm_XtA = 0
+            R_norm2 = y_norm2
+            w_norm2 = 0
+            l1_norm = 0
+            for ii in range(n_features):
+                q_dot_w += w[ii] * q[ii]
+                XtA = q[ii] - H_w[ii] - beta * w[ii]
+                if not positive:
+                    XtA = fabs(XtA)
+                if ii == 0 or XtA > dual_norm_XtA:
+                    dual_norm_XtA = XtA
+                R_norm2 += w[ii] * H_w[ii]
+                w_norm2 += w[ii] * w[ii]
+                l1_norm += fabs(w[ii])
+            R_norm2 -= 2 * q_dot_w
+
+            if dual_norm_XtA > alpha:
+                const = alpha / dual_norm_XtA
+                gap = 0.5 * R_norm2 * (1 + const * const)
+            else:
+                const = 1
+                gap = R_norm2
+            gap += (alpha * l1_norm - const * y_norm2 + const * q_dot_w +
+                    0.5 * beta * (1 + const * const) * w_norm2)
+            if gap < tol:
+                break
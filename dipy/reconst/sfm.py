@@ -15,7 +15,9 @@ This is an implementation of the sparse fascicle model described in
    Pestilli,  Brian A. Wandell (2014). Evaluating the accuracy of diffusion
    models at multiple b-values with cross-validation. ISMRM 2014.
 """
+import logging
 import warnings
+from time import time
 
 import numpy as np
 
@@ -32,16 +34,50 @@ import dipy.data as dpd
 from dipy.reconst.base import ReconstModel, ReconstFit
 from dipy.reconst.cache import Cache
 from dipy.core.onetime import auto_attr
+from dipy.reconst.recspeed import batch_elastic_net
 
 sklearn, has_sklearn, _ = optional_package('sklearn')
 lm, _, _ = optional_package('sklearn.linear_model')
 
-# If sklearn is unavailable, we can fall back on nnls (but we also warn the
-# user that we are about to do that):
-if not has_sklearn:
-    w = sklearn._msg + "\nAlternatively, you can use 'nnls' method to fit"
-    w += " the SparseFascicleModel"
-    warnings.warn(w)
+logger = logging.getLogger(__name__)
+
+
+class _ElasticNet(opt.SKLearnLinearSolver):
+    """
+    A non-negative elastic net with the parameters and the objective of Scikit
+    Learn's `ElasticNet`, used when Scikit Learn is not installed.
+    """
+    def __init__(self, l1_ratio=0.5, alpha=1.0):
+        self.l1_ratio = l1_ratio
+        self.alpha = alpha
+        self.positive = True
+
+    def fit(self, X, y):
+        """
+        Fit the elastic net, with an intercept
+
+        Parameters
+        ----------
+        X : array (n_samples, n_features)
+            The design matrix.
+        y : array (n_samples, )
+            The target.
+        """
+        X = np.asarray(X, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        X_mean = X.mean(0)
+        X_centered = X - X_mean
+        y_centered = y - y.mean()
+        n_samples = X.shape[0]
+        self.coef_ = batch_elastic_net(
+            np.dot(X_centered.T, X_centered),
+            np.dot(y_centered, X_centered)[None],
+            np.array([np.dot(y_centered, y_centered)]),
+            self.alpha * self.l1_ratio * n_samples,
+            self.alpha * (1 - self.l1_ratio) * n_samples,
+            positive=True, num_threads=1)[0]
+        self.intercept_ = y.mean() - np.dot(X_mean, self.coef_)
+        return self
 
 
 # Isotropic signal models: these are models of the part of the signal that
@@ -346,12 +382,19 @@ class SparseFascicleModel(ReconstModel, Cache):
         solver : string, or initialized linear model object.
             This will determine the algorithm used to solve the set of linear
             equations underlying this model. If it is a string it needs to be
-            one of the following: {'ElasticNet', 'NNLS'}. Otherwise, it can be
+            one of the following: {'ElasticNet', 'NNLS'}. 'ElasticNet' solves
+            the same non-negative elastic net problem as Scikit Learn's
+            `ElasticNet`, for blocks of voxels at once (see
+            `dipy.reconst.recspeed.batch_elastic_net`). The `solver` attribute
+            is then a `sklearn.linear_model.ElasticNet` with the parameters
+            of the problem (or a similar object if Scikit Learn is not
+            installed), whose `alpha` and `l1_ratio` are used by the fit.
+            Otherwise, it can be
             an object that inherits from `dipy.optimize.SKLearnLinearSolver`
             or an object with a similar interface from Scikit Learn:
             `sklearn.linear_model.ElasticNet`, `sklearn.linear_model.Lasso` or
             `sklearn.linear_model.Ridge` and other objects that inherit from
-            `sklearn.base.RegressorMixin`.
+            `sklearn.base.RegressorMixin`, which fit the voxels one by one.
             Default: 'ElasticNet'.
 
         l1_ratio : float, optional
@@ -390,9 +433,15 @@ class SparseFascicleModel(ReconstModel, Cache):
             isotropic = IsotropicModel
 
         self.isotropic = isotropic
+        # Whether the voxels are fitted by blocks with batch_elastic_net
+        self._batched = False
         if solver == 'ElasticNet':
-            self.solver = lm.ElasticNet(l1_ratio=l1_ratio, alpha=alpha,
-                                        positive=True, warm_start=True)
+            self._batched = True
+            if has_sklearn:
+                self.solver = lm.ElasticNet(l1_ratio=l1_ratio, alpha=alpha,
+                                            positive=True, warm_start=True)
+            else:
+                self.solver = _ElasticNet(l1_ratio=l1_ratio, alpha=alpha)
         elif solver == 'NNLS' or solver == 'nnls':
             self.solver = opt.NonNegativeLeastSquares()
 
@@ -420,7 +469,7 @@ class SparseFascicleModel(ReconstModel, Cache):
         return sfm_design_matrix(self.gtab, self.sphere, self.response,
                                  'signal')
 
-    def fit(self, data, mask=None):
+    def fit(self, data, mask=None, step=1000, num_threads=None):
         """
         Fit the SparseFascicleModel object to data.
 
@@ -434,6 +483,18 @@ class SparseFascicleModel(ReconstModel, Cache):
             should be analyzed. Has the shape `data.shape[:-1]`. Default: None,
             which implies that all points should be analyzed.
 
+        step : int, optional
+            The number of voxels fitted together by the 'ElasticNet' solver,
+            whose fitting time is logged. Default: 1000.
+
+        num_threads : int, optional
+            Number of threads used by the 'ElasticNet' solver to fit the
+            voxels of a block in parallel. If None (default) the value of
+            OMP_NUM_THREADS environment variable is used if it is set,
+            otherwise all available threads are used. If < 0 the maximal
+            number of threads minus |num_threads + 1| is used (enter -1 to
+            use as many threads as possible). 0 raises an error.
+
         Returns
         -------
         SparseFascicleFit object
@@ -441,12 +502,14 @@ class SparseFascicleModel(ReconstModel, Cache):
         if mask is None:
             # Flatten it to 2D either way:
             data_in_mask = np.reshape(data, (-1, data.shape[-1]))
+            coords = np.argwhere(np.ones(data.shape[:-1], dtype=bool))
         else:
             # Check for valid shape of the mask
             if mask.shape != data.shape[:-1]:
                 raise ValueError("Mask is not the same shape as data.")
             mask = np.array(mask, dtype=bool, copy=False)
             data_in_mask = np.reshape(data[mask], (-1, data.shape[-1]))
+            coords = np.argwhere(mask)
 
         # Fitting is done on the relative signal (S/S0):
         flat_S0 = np.mean(data_in_mask[..., self.gtab.b0s_mask], -1)
@@ -464,11 +527,16 @@ class SparseFascicleModel(ReconstModel, Cache):
         else:
             isopredict = isopredict[mask]
 
-        for vox, vox_data in enumerate(flat_S):
-            # In voxels in which S0 is 0, we just want to keep the
-            # parameters at all-zeros, and avoid nasty sklearn errors:
-            if not (np.any(~np.isfinite(vox_data)) or np.all(vox_data == 0)):
-                fit_it = vox_data - isopredict[vox]
+        # In voxels in which S0 is 0, we just want to keep the
+        # parameters at all-zeros, and avoid nasty sklearn errors:
+        fit_vox = ~(np.any(~np.isfinite(flat_S), -1) | np.all(flat_S == 0, -1))
+        if self._batched:
+            flat_params[fit_vox] = self._fit_elastic_net(
+                flat_S[fit_vox] - isopredict[fit_vox], coords[fit_vox], step,
+                num_threads)
+        else:
+            for vox in np.flatnonzero(fit_vox):
+                fit_it = flat_S[vox] - isopredict[vox]
                 with warnings.catch_warnings():
                     warnings.simplefilter("ignore")
                     flat_params[vox] = self.solver.fit(self.design_matrix,
@@ -487,6 +555,66 @@ class SparseFascicleModel(ReconstModel, Cache):
 
         return SparseFascicleFit(self, beta, S0, isotropic)
 
+    def _fit_elastic_net(self, to_fit, coords, step, num_threads):
+        """
+        Fit the non-negative elastic net of the voxels `to_fit` (n, g), at
+        the spatial coordinates `coords` (n, ndim), by blocks of voxels.
+
+        As in Scikit Learn's `ElasticNet`, an intercept is fitted, so the
+        design matrix and the signals are centered. The voxels are fitted in
+        two passes, like the black and white squares of a checkerboard: the
+        voxels of the second pass are initialized with the coefficients of
+        one of their neighbors fitted in the first pass.
+        """
+        X = self.design_matrix
+        n_samples = X.shape[0]
+        gram = self.cache_get('sfm_gram_matrix', key=self.gtab)
+        if gram is None:
+            X_centered = X - X.mean(0)
+            gram = np.dot(X_centered.T, X_centered)
+            self.cache_set('sfm_gram_matrix', key=self.gtab, value=gram)
+        y = to_fit - to_fit.mean(-1, keepdims=True)
+        Xy = np.dot(y, X)
+        y_norm2 = np.sum(y ** 2, -1)
+        alpha = self.solver.alpha * self.solver.l1_ratio * n_samples
+        beta = self.solver.alpha * (1 - self.solver.l1_ratio) * n_samples
+        coef = np.zeros((len(to_fit), X.shape[-1]))
+        step = int(step) or max(len(to_fit), 1)
+
+        def fit_blocks(voxels):
+            for start in range(0, len(voxels), step):
+                block = voxels[start:start + step]
+                t = time()
+                coef[block] = batch_elastic_net(
+                    gram, Xy[block], y_norm2[block], alpha, beta,
+                    positive=True, coef_init=coef[block],
+                    num_threads=num_threads)
+                logger.info('Fitted a block of %d voxels in %0.3f seconds'
+                            % (len(block), time() - t))
+
+        parity = np.sum(coords, -1) % 2
+        fit_blocks(np.flatnonzero(parity == 0))
+
+        second = np.flatnonzero(parity == 1)
+        if len(second):
+            shape = coords.max(0) + 1
+            lookup = np.full(shape, -1)
+            lookup[tuple(coords.T)] = np.arange(len(coords))
+            neighbor = np.full(len(second), -1)
+            for axis in range(coords.shape[-1]):
+                for shift in [-1, 1]:
+                    n_coords = coords[second].copy()
+                    n_coords[:, axis] += shift
+                    inside = np.all((n_coords >= 0) & (n_coords < shape), -1)
+                    candidate = np.full(len(second), -1)
+                    candidate[inside] = lookup[tuple(n_coords[inside].T)]
+                    missing = neighbor < 0
+                    neighbor[missing] = candidate[missing]
+            found = neighbor >= 0
+            coef[second[found]] = coef[neighbor[found]]
+            fit_blocks(second)
+        return coef
+
 
 class SparseFascicleFit(ReconstFit):
     def __init__(self, model, beta, S0, iso):
@@ -8,7 +8,7 @@ import numpy as np
 from scipy.special import genlaguerre, gamma, hyp2f1
 
 from dipy.reconst.cache import Cache
-from dipy.reconst.multi_voxel import multi_voxel_fit
+from dipy.reconst.multi_voxel import multi_voxel_fit, MultiVoxelFit
 from dipy.reconst.shm import real_sh_descoteaux_from_index
 from dipy.core.geometry import cart2sphere
 
@@ -206,11 +206,50 @@ class ShoreModel(Cache):
         self.pos_grid = pos_grid
         self.pos_radius = pos_radius
 
-    @multi_voxel_fit
-    def fit(self, data):
-        Lshore = l_shore(self.radial_order)
-        Nshore = n_shore(self.radial_order)
-        # Generate the SHORE basis
+    def fit(self, data, mask=None):
+        """ Fit method of the SHORE model class
+
+        Without the constraint on E(0), the regularized pseudo-inverse of the
+        SHORE matrix is computed once and applied to all the voxels at once.
+
+        Parameters
+        ----------
+        data : array
+            The measured signal from one voxel or from several voxels, with
+            the diffusion weightings in the last dimension.
+        mask : array, optional
+            A boolean array used to mark the coordinates in the data that
+            should be analyzed that has the shape data.shape[:-1]
+        """
+        if self.constrain_e0:
+            return self._voxel_fit(data, mask)
+
+        data = np.asarray(data)
+        if data.ndim == 1:
+            if mask is not None and np.asarray(mask).shape != ():
+                raise ValueError("mask and data shape do not match")
+            if mask is not None and not mask:
+                # A masked single voxel has zero coefficients, as the masked
+                # voxels of a MultiVoxelFit
+                M, _ = self._shore_matrices()
+                return ShoreFit(self, np.zeros(M.shape[1]))
+            return ShoreFit(self, self._fit_coefficients(data[None])[0])
+        if mask is None:
+            mask = np.ones(data.shape[:-1], dtype=bool)
+        elif mask.shape != data.shape[:-1]:
+            raise ValueError("mask and data shape do not match")
+        mask = np.array(mask, dtype=bool)
+
+        coef = self._fit_coefficients(data[mask])
+        fit_array = np.empty(mask.shape, dtype=object)
+        fits = fit_array[mask]
+        for i in range(len(coef)):
+            fits[i] = ShoreFit(self, coef[i])
+        fit_array[mask] = fits
+        return MultiVoxelFit(self, fit_array, mask)
+
+    def _shore_matrices(self):
+        """ The SHORE matrix and its regularized pseudo-inverse """
         M = self.cache_get('shore_matrix', key=self.gtab)
         if M is None:
             M = shore_matrix(
@@ -219,68 +258,78 @@ class ShoreModel(Cache):
 
         MpseudoInv = self.cache_get('shore_matrix_reg_pinv', key=self.gtab)
         if MpseudoInv is None:
+            Lshore = l_shore(self.radial_order)
+            Nshore = n_shore(self.radial_order)
             MpseudoInv = np.dot(
                 np.linalg.inv(np.dot(M.T, M) + self.lambdaN * Nshore +
                               self.lambdaL * Lshore), M.T)
             self.cache_set('shore_matrix_reg_pinv', self.gtab, MpseudoInv)
+        return M, MpseudoInv
 
-        # Compute the signal coefficients in SHORE basis
-        if not self.constrain_e0:
-            coef = np.dot(MpseudoInv, data)
+    def _fit_coefficients(self, data):
+        """ SHORE coefficients of voxels (N, K), normalized so that E(0) = 1
+        """
+        _, MpseudoInv = self._shore_matrices()
+        coef = np.dot(data, MpseudoInv.T)
+
+        basis_0 = np.array([
+            genlaguerre(n, 0.5)(0) * (
+                (factorial(n)) /
+                (2 * np.pi * (self.zeta ** 1.5) * gamma(n + 1.5))
+            ) ** 0.5
+            for n in range(int(self.radial_order / 2) + 1)])
+        signal_0 = np.dot(coef[:, :len(basis_0)], basis_0)
+        return coef / signal_0[:, None]
 
-            signal_0 = 0
+    @multi_voxel_fit
+    def _voxel_fit(self, data):
+        """ Fits one voxel with the constraint on E(0) """
+        Lshore = l_shore(self.radial_order)
+        Nshore = n_shore(self.radial_order)
+        M, _ = self._shore_matrices()
 
-            for n in range(int(self.radial_order / 2) + 1):
-                signal_0 += (
-                    coef[n] * (genlaguerre(n, 0.5)(0) * (
-                        (factorial(n)) /
-                        (2 * np.pi * (self.zeta ** 1.5) * gamma(n + 1.5))
-                    ) ** 0.5)
-                )
+        # Compute the signal coefficients in SHORE basis
+        data_norm = data / data[self.gtab.b0s_mask].mean()
+        M0 = M[self.gtab.b0s_mask, :]
 
-            coef = coef / signal_0
+        c = cvxpy.Variable(M.shape[1])
+        if LooseVersion(cvxpy.__version__) < LooseVersion('1.1'):
+            design_matrix = cvxpy.Constant(M) * c
         else:
-            data_norm = data / data[self.gtab.b0s_mask].mean()
-            M0 = M[self.gtab.b0s_mask, :]
-
-            c = cvxpy.Variable(M.shape[1])
+            design_matrix = cvxpy.Constant(M) @ c
+        objective = cvxpy.Minimize(
+            cvxpy.sum_squares(design_matrix - data_norm) +
+            self.lambdaN * cvxpy.quad_form(c, Nshore) +
+            self.lambdaL * cvxpy.quad_form(c, Lshore)
+        )
+
+        if not self.positive_constraint:
             if LooseVersion(cvxpy.__version__) < LooseVersion('1.1'):
-                design_matrix = cvxpy.Constant(M) * c
+                constraints = [M0[0] * c == 1]
             else:
-                design_matrix = cvxpy.Constant(M) @ c
-            objective = cvxpy.Minimize(
-                cvxpy.sum_squares(design_matrix - data_norm) +
-                self.lambdaN * cvxpy.quad_form(c, Nshore) +
-                self.lambdaL * cvxpy.quad_form(c, Lshore)
-            )
-
-            if not self.positive_constraint:
-                if LooseVersion(cvxpy.__version__) < LooseVersion('1.1'):
-                    constraints = [M0[0] * c == 1]
-                else:
-                    constraints = [M0[0] @ c == 1]
+                constraints = [M0[0] @ c == 1]
+        else:
+            lg = int(np.floor(self.pos_grid ** 3 / 2))
+            v, t = create_rspace(self.pos_grid, self.pos_radius)
+            psi = self.cache_get('shore_matrix_positive_constraint',
+                                 key=(self.pos_grid, self.pos_radius))
+            if psi is None:
+                psi = shore_matrix_pdf(
+                    self.radial_order, self.zeta, t[:lg])
+                self.cache_set(
+                    'shore_matrix_positive_constraint',
+                    (self.pos_grid, self.pos_radius), psi)
+            if LooseVersion(cvxpy.__version__) < LooseVersion('1.1'):
+                constraints = [(M0[0] * c) == 1., (psi * c) >= 1e-3]
             else:
-                lg = int(np.floor(self.pos_grid ** 3 / 2))
-                v, t = create_rspace(self.pos_grid, self.pos_radius)
-                psi = self.cache_get('shore_matrix_positive_constraint',
-                                     key=(self.pos_grid, self.pos_radius))
-                if psi is None:
-                    psi = shore_matrix_pdf(
-                        self.radial_order, self.zeta, t[:lg])
-                    self.cache_set(
-                        'shore_matrix_positive_constraint',
-                        (self.pos_grid, self.pos_radius), psi)
-                if LooseVersion(cvxpy.__version__) < LooseVersion('1.1'):
-                    constraints = [(M0[0] * c) == 1., (psi * c) >= 1e-3]
-                else:
-                    constraints = [(M0[0] @ c) == 1., (psi @ c) >= 1e-3]
-            prob = cvxpy.Problem(objective, constraints)
-            try:
-                prob.solve(solver=self.cvxpy_solver)
-                coef = np.asarray(c.value).squeeze()
-            except Exception:
-                warn('Optimization did not find a solution')
-                coef = np.zeros(M.shape[1])
+                constraints = [(M0[0] @ c) == 1., (psi @ c) >= 1e-3]
+        prob = cvxpy.Problem(objective, constraints)
+        try:
+            prob.solve(solver=self.cvxpy_solver)
+            coef = np.asarray(c.value).squeeze()
+        except Exception:
+            warn('Optimization did not find a solution')
+            coef = np.zeros(M.shape[1])
         return ShoreFit(self, coef)
 
 
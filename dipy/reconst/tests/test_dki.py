@@ -5,7 +5,7 @@ import random
 import dipy.reconst.dki as dki
 import dipy.reconst.dti as dti
 from numpy.testing import (assert_array_almost_equal, assert_array_equal,
-                           assert_almost_equal, assert_raises)
+                           assert_almost_equal, assert_raises, assert_)
 from dipy.sims.voxel import multi_tensor_dki
 from dipy.io.gradients import read_bvals_bvecs
 from dipy.core.gradients import gradient_table
@@ -17,7 +17,7 @@ from dipy.reconst.dki import (mean_kurtosis, carlson_rf,  carlson_rd,
                               _positive_evals, lower_triangular,
                               kurtosis_fractional_anisotropy)
 
-from dipy.core.sphere import Sphere
+from dipy.core.sphere import Sphere, unit_icosahedron
 from dipy.data import default_sphere
 from dipy.core.geometry import sphere2cart
 
@@ -140,6 +140,30 @@ def test_dki_fits():
     assert_array_almost_equal(dkiF_multi.model_params, multi_params)
 
 
+def test_dki_fits_chunks():
+    """ DKI fits of several voxels do not depend on the chunk size """
+    rng = np.random.RandomState(42)
+    data = signal_cross * (1 + 0.02 * rng.randn(7, len(signal_cross)))
+    A = dki.design_matrix(gtab_2s)
+    for fit_dki in [dki.ols_fit_dki, dki.wls_fit_dki]:
+        params = fit_dki(A, data, step=0)
+        assert_array_almost_equal(fit_dki(A, data, step=3), params)
+        for vox in range(len(data)):
+            assert_array_almost_equal(fit_dki(A, data[vox]), params[vox])
+
+    # Directional kurtosis of several voxels at once
+    evals, evecs, kt = dki.split_dki_param(params)
+    md = dti.mean_diffusivity(evals)
+    dt = lower_triangular(dti.vec_val_vect(evecs, evals))
+    akc = dki.directional_kurtosis(dt, md, kt, default_sphere.vertices)
+    for vox in range(len(data)):
+        assert_array_almost_equal(
+            akc[vox], dki.directional_kurtosis(dt[vox], md[vox], kt[vox],
+                                               default_sphere.vertices))
+    assert_array_almost_equal(
+        dki.apparent_kurtosis_coef(params, default_sphere), akc)
+
+
 def test_apparent_kurtosis_coef():
     """ Apparent kurtosis coefficients are tested for a spherical kurtosis
     tensor """
@@ -622,7 +646,7 @@ def test_kurtosis_maximum():
                                                        gtol=1e-5)
 
     yaxis = np.array([0., 1., 0.])
-    cos_angle = np.abs(np.dot(max_dir[0], yaxis))
+    cos_angle = np.abs(np.dot(max_dir, yaxis))
     assert_almost_equal(cos_angle, 1.)
 
     # TEST 2
@@ -662,7 +686,7 @@ def test_kurtosis_maximum():
 
     # check if max direction is perpendicular to fiber direction
     fdir = np.array([sphere2cart(1., np.deg2rad(theta), np.deg2rad(phi))])
-    cos_angle = np.abs(np.dot(max_dir[0], fdir[0]))
+    cos_angle = np.abs(np.dot(max_dir, fdir[0]))
     assert_almost_equal(cos_angle, 0., decimal=5)
 
     # check if max direction is equal to expected value
@@ -745,6 +769,20 @@ def test_multi_voxel_kurtosis_maximum():
     k_max = dki.kurtosis_maximum(dkiF.model_params, mask=mask)
     assert_almost_equal(k_max, RK, decimal=4)
 
+    # TEST - blocks of voxels processed concurrently
+    k_max_threads = dki.kurtosis_maximum(dkiF.model_params, mask=mask,
+                                         num_threads=2)
+    assert_array_almost_equal(k_max_threads, k_max)
+
+    # TEST - the refined maximum is the maximum over a dense sphere
+    k_max = dki.kurtosis_maximum(dkiF.model_params, default_sphere,
+                                 gtol=1e-5)
+    dense_sphere = unit_icosahedron.subdivide(5)
+    k_max_dense = dki.apparent_kurtosis_coef(dkiF.model_params,
+                                             dense_sphere).max(axis=-1)
+    assert_(np.all(k_max >= k_max_dense - 1e-7))
+    assert_array_almost_equal(k_max, k_max_dense, decimal=4)
+
 
 def test_kurtosis_fa():
     # KFA = sqrt(4/5) if kurtosis is non-zero only in one direction
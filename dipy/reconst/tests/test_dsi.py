@@ -5,7 +5,8 @@ from numpy.testing import (assert_equal,
                            assert_array_equal,
                            assert_raises)
 from dipy.data import get_fnames, dsi_voxels, default_sphere
-from dipy.reconst.dsi import DiffusionSpectrumModel
+from dipy.reconst.dsi import (DiffusionSpectrumModel, pdf_interp_coords,
+                              pdf_odf, pdf_odf_matrix)
 from dipy.reconst.odf import gfa
 from dipy.direction.peaks import peak_directions
 from dipy.sims.voxel import sticks_and_ball
@@ -70,6 +71,42 @@ def test_multivox_dsi():
     assert_equal(np.alltrue(np.isreal(PDF)), True)
 
 
+def test_dsi_blocks():
+    data, gtab = dsi_voxels()
+    ds = DiffusionSpectrumModel(gtab)
+    sphere = create_unit_sphere(3)
+    dsfit = ds.fit(data)
+    odf = dsfit.odf(sphere)
+    pdf = dsfit.pdf()
+    assert_equal(odf.shape, data.shape[:-1] + (len(sphere.vertices), ))
+
+    # Same results voxel by voxel and by blocks of voxels
+    for index in [(0, 0, 0), (5, 9, 3)]:
+        vfit = ds.fit(data[index])
+        assert_almost_equal(vfit.odf(sphere), odf[index])
+        assert_almost_equal(vfit.pdf(), pdf[index])
+        assert_almost_equal(vfit.rtop_pdf(), dsfit.rtop_pdf()[index])
+        assert_almost_equal(vfit.msd_discrete(), dsfit.msd_discrete()[index])
+        assert_almost_equal(dsfit[index].odf(sphere), odf[index])
+    assert_almost_equal(ds.fit(data, step=7, num_threads=2).odf(sphere), odf)
+
+    mask = np.zeros(data.shape[:-1], dtype=bool)
+    mask[1:3, 4:6] = True
+    masked_fit = ds.fit(data, mask=mask)
+    assert_almost_equal(masked_fit.odf(sphere)[mask], odf[mask])
+    assert_array_equal(masked_fit.odf(sphere)[~mask], 0)
+    assert_array_equal(masked_fit.rtop_signal()[~mask], 0)
+    assert_equal(masked_fit[1:3].shape, (2, ) + data.shape[1:-1])
+    assert_raises(ValueError, ds.fit, data, mask[0])
+
+    # The sparse interpolation matrix matches pdf_odf on the shifted PDF
+    interp_coords = pdf_interp_coords(sphere, ds.qradius, ds.origin)
+    odf_matrix = pdf_odf_matrix(sphere, ds.qradius, ds.origin, ds.qgrid_size)
+    unshifted = np.fft.ifftshift(pdf[0, 0, 0])
+    assert_almost_equal(odf_matrix.dot(unshifted.ravel()),
+                        pdf_odf(pdf[0, 0, 0], ds.qradius, interp_coords))
+
+
 def test_multib0_dsi():
     data, gtab = dsi_voxels()
     # Create a new data-set with a b0 measurement:
@@ -5,7 +5,8 @@ from numpy.testing import (assert_equal,
                            assert_array_equal,
                            assert_raises)
 from dipy.data import get_fnames, dsi_deconv_voxels, default_sphere
-from dipy.reconst.dsi import DiffusionSpectrumDeconvModel
+from dipy.reconst.dsi import (DiffusionSpectrumDeconvModel, LR_deconv,
+                              gen_PSF, threshold_propagator)
 from dipy.reconst.odf import gfa
 from dipy.direction.peaks import peak_directions
 from dipy.sims.voxel import sticks_and_ball
@@ -69,5 +70,27 @@ def test_multivox_dsi():
     assert_equal(np.alltrue(np.isreal(PDF)), True)
 
 
+def test_dsi_deconv_blocks():
+    data, gtab = dsi_deconv_voxels()
+    data[1, 1, 1] *= 2
+    DS = DiffusionSpectrumDeconvModel(gtab)
+    PDF = DS.fit(data, step=3).pdf()
+
+    # Deconvolution of each voxel on its own
+    qgrid_sz = DS.qgrid_size
+    psf = gen_PSF(DS.qgrid, qgrid_sz, qgrid_sz, qgrid_sz)
+    for index in [(0, 0, 0), (1, 1, 1)]:
+        Sq = np.zeros(3 * (qgrid_sz, ))
+        for i in range(data.shape[-1]):
+            qx, qy, qz = DS.qgrid[i]
+            Sq[qx, qy, qz] += data[index][i]
+        Pr = np.fft.fftshift(np.abs(np.real(np.fft.fftn(
+            np.fft.ifftshift(Sq)))))
+        Pr = LR_deconv(threshold_propagator(Pr), psf, 5, 2)
+        assert_almost_equal(PDF[index] / Pr.max(), Pr / Pr.max())
+        assert_almost_equal(DS.fit(data[index]).odf(default_sphere),
+                            DS.fit(data).odf(default_sphere)[index])
+
+
 if __name__ == '__main__':
     run_module_suite()
@@ -3,12 +3,16 @@
 import numpy as np
 
 from dipy.data import get_sphere, default_sphere, get_3shell_gtab
-from dipy.reconst.forecast import ForecastModel
+from dipy.reconst.forecast import (ForecastModel, find_signal_means,
+                                   find_diffusivities, forecast_error_func,
+                                   mean_signal_table)
 from dipy.sims.voxel import multi_tensor
 
 from numpy.testing import (assert_almost_equal,
+                           assert_array_almost_equal, assert_array_equal,
                            assert_equal,
                            run_module_suite)
+from scipy.optimize import leastsq
 import pytest
 from dipy.direction.peaks import peak_directions
 from dipy.core.sphere_stats import angular_similarity
@@ -211,5 +215,60 @@ def test_multivox_forecast():
     assert_almost_equal(mse3, 0.0, 3)
 
 
+def test_forecast_diffusivities():
+    gtab = get_3shell_gtab()
+    fm = ForecastModel(gtab, sh_order=6, dec_alg='WLS')
+    rng = np.random.RandomState(0)
+    S = np.zeros((4, 5, len(gtab.bvals)))
+    for ij in np.ndindex(S.shape[:-1]):
+        l1 = rng.uniform(0.0012, 0.0022)
+        l2 = rng.uniform(0.0002, 0.0008)
+        mevals = np.array([[l1, l2, l2], [l1, l2, l2]])
+        S[ij], _ = multi_tensor(gtab, mevals, S0=100.0,
+                                angles=[(0, 0), (rng.uniform(30, 90), 0)],
+                                fractions=[50, 50], snr=30)
+    mask = np.ones(S.shape[:-1], dtype=bool)
+    mask[0, 0] = False
+
+    # Compare with the voxel by voxel fit of the diffusivities
+    S_b0 = S[..., fm.b0s_mask].mean(-1)
+    data_single_b0 = np.concatenate([S_b0[..., None],
+                                     S[..., ~fm.b0s_mask]], -1) / \
+        S_b0[..., None]
+    means = find_signal_means(fm.b_unique, data_single_b0, fm.one_0_bvals,
+                              fm.srm, fm.lb_matrix_signal)
+    assert_equal(means.shape, (4, 5, len(fm.b_unique)))
+    for ij in np.ndindex(S.shape[:-1]):
+        assert_array_almost_equal(
+            means[ij], find_signal_means(fm.b_unique, data_single_b0[ij],
+                                         fm.one_0_bvals, fm.srm,
+                                         fm.lb_matrix_signal))
+
+    diffusivities = np.linspace(0, 3e-03, 31)
+    table = mean_signal_table(fm.b_unique, diffusivities)
+    d_par, d_perp = find_diffusivities(fm.b_unique, means.reshape(-1, 3),
+                                       diffusivities, table)
+    for i, mean in enumerate(means.reshape(-1, 3)):
+        x, _ = leastsq(forecast_error_func, np.array([np.pi/4, np.pi/4]),
+                       args=(fm.b_unique, mean))
+        d = np.sort(np.cos(x)**2 * 3e-03)
+        assert_almost_equal(d_par[i], d[1], 7)
+        assert_almost_equal(d_perp[i], d[0], 7)
+
+    f_fit = fm.fit(S, mask=mask)
+    assert_equal(f_fit.dpar[0, 0], 0)
+    assert_array_almost_equal(f_fit.dpar[mask], d_par[mask.ravel()])
+    assert_array_almost_equal(f_fit.dperp[mask], d_perp[mask.ravel()])
+    for ij in [(0, 1), (3, 4)]:
+        voxel_fit = fm.fit(S[ij])
+        assert_array_almost_equal(f_fit[ij].sh_coeff, voxel_fit.sh_coeff)
+    # A single voxel with a mask is fitted if it is in the mask
+    assert_array_almost_equal(fm.fit(S[0, 1], mask=mask[0, 1]).sh_coeff,
+                              f_fit[0, 1].sh_coeff)
+    voxel_fit = fm.fit(S[0, 0], mask=mask[0, 0])
+    assert_array_equal(voxel_fit.sh_coeff, f_fit.sh_coeff[0, 0])
+    assert_equal(voxel_fit.dpar, 0)
+
+
 if __name__ == '__main__':
     run_module_suite()
@@ -5,7 +5,7 @@ import dipy.reconst.dti as dti
 import dipy.reconst.fwdti as fwdti
 from dipy.reconst.fwdti import fwdti_prediction
 from numpy.testing import (assert_array_almost_equal, assert_almost_equal,
-                           assert_raises)
+                           assert_raises, assert_)
 from dipy.reconst.dti import (from_lower_triangular, decompose_tensor,
                               fractional_anisotropy)
 from dipy.reconst.fwdti import (lower_triangular_to_cholesky,
@@ -274,6 +274,47 @@ def test_standalone_functions():
     assert_array_almost_equal(fa, FAref)
 
 
+def test_standalone_functions_blocks():
+    # Noisy signals, fitted in blocks of voxels and fitted voxel by voxel
+    rng = np.random.RandomState(1234)
+    data = np.abs(DWI + rng.normal(0, 2, DWI.shape))
+    data[0, 0, 0] = 0
+    mask = np.ones(data.shape[:-1], dtype=bool)
+    mask[1, 0, 0] = False
+    W = dti.design_matrix(gtab_2s)
+    S0 = np.mean(data[..., gtab_2s.b0s_mask], -1)
+
+    params = wls_fit_tensor(gtab_2s, data, mask=mask, step=3, num_threads=2)
+    for v in np.ndindex(data.shape[:-1]):
+        if mask[v]:
+            assert_array_almost_equal(params[v],
+                                      fwdti.wls_iter(W, data[v], S0[v]))
+        else:
+            assert_array_almost_equal(params[v], 0)
+
+    # The solutions can differ where the model is degenerate (f close to 0),
+    # so the sums of squared residuals are compared
+    for kwargs in [{}, {'f_transform': False},
+                   {'weighting': 'sigma', 'sigma': 2.}]:
+        params = nls_fit_tensor(gtab_2s, data, step=3, num_threads=2,
+                                **kwargs)
+        for v in np.ndindex(data.shape[:-1]):
+            voxel_params = fwdti.nls_iter(W, data[v], S0[v], **kwargs)
+            sse = np.sum((data[v] - fwdti_prediction(params[v], gtab_2s,
+                                                     S0[v])) ** 2)
+            voxel_sse = np.sum((data[v] - fwdti_prediction(
+                voxel_params, gtab_2s, S0[v])) ** 2)
+            assert_(sse <= voxel_sse * (1 + 1e-6))
+
+    params = nls_fit_tensor(gtab_2s, DWI, cholesky=True, step=3,
+                            num_threads=2)
+    assert_array_almost_equal(params[..., 12], GTF)
+    assert_array_almost_equal(fractional_anisotropy(params[..., :3]), FAref)
+
+    assert_raises(ValueError, nls_fit_tensor, gtab_2s, data,
+                  weighting='sigma')
+
+
 def test_md_regularization():
     # single voxel
     gtf = 0.97  # for this ground truth value, md is larger than 2.7e-3
@@ -13,6 +13,7 @@ from dipy.direction.peaks import peak_directions
 
 from numpy.testing import (assert_equal,
                            assert_almost_equal,
+                           assert_raises,
                            run_module_suite)
 
 
@@ -76,5 +77,40 @@ def test_mvoxel_gqi():
     assert_equal(directions.shape[0], 2)
 
 
+def test_gqi_blocks():
+    data, gtab = dsi_voxels()
+    sphere = create_unit_sphere(3)
+    for method in ['gqi2', 'standard']:
+        gq = GeneralizedQSamplingModel(gtab, method)
+        odf = gq.fit(data).odf(sphere)
+        assert_equal(odf.shape, data.shape[:-1] + (len(sphere.vertices), ))
+        assert_equal(odf.dtype, np.float64)
+        for index in [(0, 0, 0), (2, 7, 4)]:
+            assert_almost_equal(gq.fit(data[index]).odf(sphere), odf[index])
+            assert_almost_equal(gq.fit(data)[index].odf(sphere), odf[index])
+        assert_almost_equal(gq.fit(data, step=13).odf(sphere), odf)
+
+        # The ODFs are the signal times a (N, M) matrix
+        operator = gq._odf_operator(sphere, np.float64)
+        assert_equal(operator.shape,
+                     (data.shape[-1], len(sphere.vertices)))
+        assert_almost_equal(odf, np.dot(data, operator))
+
+        odf32 = gq.fit(data.astype(np.int16), step=17).odf(sphere,
+                                                           np.float32)
+        assert_equal(odf32.dtype, np.float32)
+        assert_almost_equal(odf32 / np.abs(odf).max(),
+                            odf / np.abs(odf).max(), 5)
+
+        mask = np.zeros(data.shape[:-1], dtype=bool)
+        mask[1:3, 4:8] = True
+        masked_odf = gq.fit(data, mask=mask, step=5).odf(sphere)
+        assert_almost_equal(masked_odf[mask], odf[mask])
+        assert_equal(masked_odf[~mask], 0)
+        assert_equal(gq.fit(data, mask=mask)[1:3].shape,
+                     (2, ) + data.shape[1:-1])
+        assert_raises(ValueError, gq.fit, data, mask[0])
+
+
 if __name__ == "__main__":
     run_module_suite()
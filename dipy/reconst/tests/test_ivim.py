@@ -479,7 +479,6 @@ def test_leastsq_error():
     assert_array_almost_equal(fit, [-1, -1, -1, -1])
 
 
-@needs_cvxpy
 def test_perfusion_fraction_vp():
     """
     Test if the `IvimFit` class returns the correct f
@@ -489,7 +488,6 @@ def test_perfusion_fraction_vp():
                               decimal=2)
 
 
-@needs_cvxpy
 def test_D_star_vp():
     """
     Test if the `IvimFit` class returns the correct D_star
@@ -498,7 +496,6 @@ def test_D_star_vp():
     assert_array_almost_equal(ivim_fit_VP.D_star, D_star_VP, decimal=4)
 
 
-@needs_cvxpy
 def test_D_vp():
     """
     Test if the `IvimFit` class returns the correct D
@@ -507,5 +504,70 @@ def test_D_vp():
     assert_array_almost_equal(ivim_fit_VP.D, D_VP, decimal=4)
 
 
+def test_multivoxel_noisy_fit():
+    """
+    Test that fitting several noisy voxels at once gives the same parameters
+    as fitting them one by one.
+    """
+    rng = np.random.RandomState(42)
+    noisy_data = np.abs(data_multi + rng.normal(0, 10, data_multi.shape))
+    noisy_data[1, 1, 0] = noisy_single
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=UserWarning)
+        ivim_fit = ivim_model_trr.fit(noisy_data)
+        for ijk in np.ndindex(noisy_data.shape[:-1]):
+            assert_array_almost_equal(
+                ivim_fit.model_params[ijk],
+                ivim_model_trr.fit(noisy_data[ijk]).model_params)
+
+
+def test_vp_grid_search():
+    """
+    Test the grid search of the VarPro fit for several voxels and a mask.
+    """
+    mask = np.ones(data_multi.shape[:-1], dtype=bool)
+    mask[1, 1, 0] = False
+    ivim_fit_VP = ivim_model_VP.fit(data_multi, mask)
+    assert_array_almost_equal(ivim_fit_VP.model_params[~mask], 0)
+    assert_array_almost_equal(ivim_fit_VP.perfusion_fraction[mask], f_VP,
+                              decimal=2)
+    assert_array_almost_equal(ivim_fit_VP.D_star[mask], D_star_VP, decimal=4)
+    assert_array_almost_equal(ivim_fit_VP.D[mask], D_VP, decimal=4)
+    assert_array_almost_equal(ivim_fit_VP.predict(gtab)[mask],
+                              data_multi[mask], decimal=0)
+
+    x = ivim_model_VP.grid_search(data_multi[mask] / data_multi.max())
+    assert_equal(x.shape, (3, 2))
+    assert_raises(ValueError, IvimModel, gtab, fit_method='VarPro',
+                  search='random')
+
+
+def test_vp_differential_evolution():
+    """
+    Test the VarPro fit with the differential evolution search run in a pool
+    of processes.
+    """
+    ivim_model_de = IvimModel(gtab, fit_method='VarPro',
+                              search='differential_evolution')
+    ivim_fit_de = ivim_model_de.fit(data_multi[:, :1], num_processes=2)
+    assert_array_almost_equal(ivim_fit_de.perfusion_fraction, f_VP,
+                              decimal=2)
+    assert_array_almost_equal(ivim_fit_de.D_star, D_star_VP, decimal=4)
+    assert_array_almost_equal(ivim_fit_de.D, D_VP, decimal=4)
+
+
+@needs_cvxpy
+def test_constrained_fractions():
+    """
+    Test the closed-form volume fractions against the convex optimizer.
+    """
+    signal = data_single / data_single.max()
+    phi = ivim_model_VP.phi([0.008, 0.0009]).copy()
+    f = ivim_model_VP.constrained_fractions(signal[None], phi[None, :, 0],
+                                            phi[None, :, 1])
+    assert_array_almost_equal(f[0], ivim_model_VP.cvx_fit(signal, phi)[0],
+                              decimal=4)
+
+
 if __name__ == '__main__':
     run_module_suite()
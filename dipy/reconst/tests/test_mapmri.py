@@ -785,6 +785,63 @@ def test_laplacian_regularization(radial_order=6):
     assert_equal(laplacian_norm_laplacian < laplacian_norm_unreg, True)
 
 
+def test_mapmri_scale_quantization(radial_order=6):
+    gtab = get_gtab_taiwan_dsi()
+    np.random.seed(0)
+    signals = []
+    for angle, l1 in zip([30, 45, 60, 90], [0.0012, 0.0015, 0.0017, 0.002]):
+        S, _ = generate_signal_crossing(gtab, l1, 0.0003, 0.0003,
+                                        angle2=angle)
+        signals.append(add_noise(S, snr=20, S0=100.))
+    data = np.array(signals).reshape(2, 2, -1)
+    mask = np.array([[True, True], [False, True]])
+
+    weight_array = np.linspace(0, .3, 31)
+    for weighting in [0.05, weight_array]:
+        kwargs = dict(radial_order=radial_order, anisotropic_scaling=False,
+                      laplacian_weighting=weighting)
+        mapfit = MapmriModel(gtab, **kwargs).fit(data, mask=mask)
+        # With a tiny quantization all voxels have their own scale
+        mapfit_grouped = MapmriModel(gtab, scale_quantization=1e-10,
+                                     **kwargs).fit(data, mask=mask)
+        assert_array_almost_equal(mapfit_grouped.mapmri_coeff,
+                                  mapfit.mapmri_coeff, 4)
+        assert_array_almost_equal(
+            mapfit_grouped.rtop()[mask] / mapfit.rtop()[mask], 1)
+        assert_array_almost_equal(mapfit_grouped.lopt, mapfit.lopt)
+
+    # Coarse quantization of the scales still fits the signal well
+    kwargs = dict(radial_order=radial_order, anisotropic_scaling=False,
+                  laplacian_weighting="GCV")
+    mapfit = MapmriModel(gtab, **kwargs).fit(data, mask=mask)
+    mapfit_grouped = MapmriModel(gtab, scale_quantization=0.05,
+                                 **kwargs).fit(data, mask=mask)
+    error = np.abs(mapfit_grouped.fitted_signal() -
+                   mapfit.fitted_signal())[mask]
+    assert_(np.mean(error) < 0.01)
+    assert_equal(mapfit_grouped.mapmri_coeff[1, 0], 0)
+
+    # A single voxel gives a single fit
+    mapfit_voxel = MapmriModel(gtab, scale_quantization=0.05,
+                               **kwargs).fit(data[0, 0])
+    assert_equal(mapfit_voxel.mapmri_coeff.shape,
+                 mapfit.mapmri_coeff[0, 0].shape)
+    # A single voxel with a mask is fitted if it is in the mask
+    for model in [MapmriModel(gtab, **kwargs),
+                  MapmriModel(gtab, scale_quantization=0.05, **kwargs)]:
+        assert_array_almost_equal(
+            model.fit(data[0, 0], mask=np.array(True)).mapmri_coeff,
+            model.fit(data[0, 0]).mapmri_coeff)
+    mapfit_voxel = MapmriModel(gtab, scale_quantization=0.05,
+                               **kwargs).fit(data[1, 0], mask=mask[1, 0])
+    assert_equal(mapfit_voxel.mapmri_coeff,
+                 np.zeros_like(mapfit.mapmri_coeff[0, 0]))
+
+    assert_raises(ValueError, MapmriModel, gtab, scale_quantization=0.05)
+    assert_raises(ValueError, MapmriModel, gtab, anisotropic_scaling=False,
+                  scale_quantization=0.)
+
+
 def test_mapmri_odf(radial_order=6):
     gtab = get_gtab_taiwan_dsi()
 
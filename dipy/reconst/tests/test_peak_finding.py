@@ -1,8 +1,8 @@
 
 import numpy as np
 import numpy.testing as npt
-from dipy.reconst.recspeed import (local_maxima, remove_similar_vertices,
-                                   search_descending)
+from dipy.reconst.recspeed import (local_maxima, local_maxima_block,
+                                   remove_similar_vertices, search_descending)
 from dipy.data import default_sphere
 from dipy.core.sphere import unique_edges, HemiSphere
 from dipy.sims.voxel import all_tensor_evecs
@@ -75,6 +75,28 @@ def test_local_maxima():
     npt.assert_raises(IndexError, local_maxima, odf, edges)
 
 
+def test_local_maxima_block():
+    sphere = default_sphere
+    edges = unique_edges(sphere.faces)
+    rng = np.random.RandomState(0)
+    odfs = np.round(rng.rand(50, len(sphere.vertices)) * 5)
+    odfs[0] = abs(sphere.vertices.sum(-1))
+    odfs[1] = 0
+    for num_threads in [1, 2]:
+        values, indices, counts = local_maxima_block(odfs, edges,
+                                                     num_threads=num_threads)
+        npt.assert_equal(counts[1], 0)
+        for odf, v, i, n in zip(odfs, values, indices, counts):
+            peak_values, peak_index = local_maxima(odf, edges)
+            npt.assert_array_equal(v[:n], peak_values)
+            npt.assert_array_equal(i[:n], peak_index)
+
+    odfs[3, 20] = np.nan
+    npt.assert_raises(ValueError, local_maxima_block, odfs, edges)
+    edges[0, 0] = 9999
+    npt.assert_raises(IndexError, local_maxima_block, odfs[:1], edges)
+
+
 def test_remove_similar_peaks():
     vertices = np.array([[1., 0., 0.],
                          [0., 1., 0.],
@@ -2,8 +2,11 @@
 
 import numpy as np
 
+from scipy.optimize import minimize
+
 from dipy.reconst.recspeed import (adj_to_countarrs,
-                                   argmax_from_countarrs)
+                                   argmax_from_countarrs,
+                                   batch_elastic_net)
 
 from dipy.testing import assert_true, assert_false
 from numpy.testing import (assert_array_equal, assert_array_almost_equal,
@@ -65,3 +68,63 @@ def test_argmax_from_countarrs():
                         adj_counts,
                         adj_inds)
                         """
+
+
+def test_batch_elastic_net():
+    rng = np.random.RandomState(0)
+    X = rng.rand(40, 30)
+    coef_true = np.zeros((10, 30))
+    coef_true[:, rng.randint(0, 30, 3)] = rng.rand(10, 3)
+    Y = np.dot(coef_true, X.T) + 0.01 * rng.randn(10, 40)
+    gram = np.dot(X.T, X)
+    Xy = np.dot(Y, X)
+    y_norm2 = np.sum(Y ** 2, -1)
+    alpha, beta = 0.05, 0.02
+
+    def objective(w, y):
+        r = y - np.dot(X, w)
+        return (0.5 * np.dot(r, r) + alpha * np.sum(np.abs(w)) +
+                0.5 * beta * np.dot(w, w))
+
+    for positive in [False, True]:
+        coef = batch_elastic_net(gram, Xy, y_norm2, alpha, beta,
+                                 positive=positive, tol=1e-12,
+                                 num_threads=1)
+        assert_equal(coef.shape, Xy.shape)
+        if positive:
+            assert_true(np.all(coef >= 0))
+        # Optimality conditions of the elastic net
+        gradient = np.dot(coef, gram) - Xy + beta * coef
+        nonzero = coef != 0
+        assert_array_almost_equal(gradient[nonzero],
+                                  -alpha * np.sign(coef[nonzero]))
+        if positive:
+            assert_true(np.all(gradient[~nonzero] >= -alpha - 1e-6))
+        else:
+            assert_true(np.all(np.abs(gradient[~nonzero]) <= alpha + 1e-6))
+
+    # Non-negative problems are smooth, compare with L-BFGS-B
+    for i in range(3):
+        res = minimize(
+            objective, np.zeros(30), args=(Y[i],),
+            jac=lambda w, y: np.dot(gram, w) - np.dot(X.T, y) + alpha +
+            beta * w,
+            bounds=[(0, None)] * 30, method='L-BFGS-B',
+            options={'ftol': 1e-15, 'gtol': 1e-12})
+        assert_array_almost_equal(coef[i], res.x, 5)
+
+    # Warm starts from the solution, in parallel
+    coef_warm = batch_elastic_net(gram, Xy, y_norm2, alpha, beta,
+                                  positive=True, coef_init=coef,
+                                  num_threads=2)
+    assert_array_almost_equal(coef_warm, coef)
+
+    # Zero targets have zero coefficients
+    coef = batch_elastic_net(gram, np.zeros((2, 30)), np.zeros(2), alpha,
+                             beta, positive=True)
+    assert_array_equal(coef, 0)
+
+    assert_raises(ValueError, batch_elastic_net, gram, Xy, y_norm2[1:],
+                  alpha, beta)
+    assert_raises(ValueError, batch_elastic_net, gram, Xy, y_norm2,
+                  alpha, beta, coef_init=np.zeros((10, 29)))
@@ -1,7 +1,6 @@
 import warnings
 import numpy as np
 import numpy.testing as npt
-import pytest
 import dipy.reconst.sfm as sfm
 import dipy.data as dpd
 import dipy.core.gradients as grad
@@ -11,10 +10,6 @@ import dipy.reconst.cross_validation as xval
 from dipy.io.gradients import read_bvals_bvecs
 from dipy.io.image import load_nifti_data
 
-needs_sklearn = pytest.mark.skipif(
-    not sfm.has_sklearn,
-    reason=sfm.sklearn._msg if not sfm.has_sklearn else "")
-
 
 def test_design_matrix():
     data, gtab = dpd.dsi_voxels()
@@ -26,7 +21,6 @@ def test_design_matrix():
                      (np.sum(~gtab.b0s_mask), sphere.vertices.shape[0]))
 
 
-@needs_sklearn
 def test_sfm():
     fdata, fbvals, fbvecs = dpd.get_fnames()
     data = load_nifti_data(fdata)
@@ -54,7 +48,6 @@ def test_sfm():
             np.zeros(sfmodel.design_matrix[0].shape[-1]))
 
 
-@needs_sklearn
 def test_predict():
     SNR = 1000
     S0 = 100
@@ -125,6 +118,39 @@ def test_predict():
     npt.assert_equal(new_pred[0, 0, 0], 0)
 
 
+def test_sfm_blocks():
+    fdata, fbvals, fbvecs = dpd.get_fnames()
+    gtab = grad.gradient_table(fbvals, fbvecs)
+    mevals = np.array(([0.0015, 0.0003, 0.0003],
+                       [0.0015, 0.0003, 0.0003]))
+    data = np.zeros((3, 4, len(gtab.bvals)))
+    for i, j in np.ndindex(data.shape[:-1]):
+        angles = [(90, 10 * i), (90, 60 + 10 * j)]
+        data[i, j], _ = sims.multi_tensor(gtab, mevals, 100, angles=angles,
+                                          fractions=[50, 50], snr=None)
+    mask = np.ones(data.shape[:-1], dtype=bool)
+    mask[1, 1] = False
+    sfmodel = sfm.SparseFascicleModel(gtab)
+    sffit = sfmodel.fit(data, mask)
+    npt.assert_equal(sffit.beta[1, 1], 0)
+    npt.assert_(np.all(xval.coeff_of_determination(sffit.predict()[mask],
+                                                   data[mask]) > 90))
+    # The blocks and the threads do not change the fit
+    sffit_blocks = sfmodel.fit(data, mask, step=2, num_threads=2)
+    npt.assert_array_almost_equal(sffit_blocks.beta, sffit.beta)
+    # Voxels warm-started from their neighbors have the same fit
+    for ijk in [(0, 1), (2, 2)]:
+        npt.assert_array_almost_equal(sfmodel.fit(data[ijk]).beta,
+                                      sffit.beta[ijk], 3)
+    # The solver is an estimator with the parameters of the problem, which
+    # fits the voxels one by one when it is given to a model
+    npt.assert_equal((sfmodel.solver.alpha, sfmodel.solver.l1_ratio),
+                     (0.001, 0.5))
+    sfmodel_voxels = sfm.SparseFascicleModel(gtab, solver=sfmodel.solver)
+    npt.assert_array_almost_equal(sfmodel_voxels.fit(data, mask).beta,
+                                  sffit.beta, 2)
+
+
 def test_sfm_background():
     fdata, fbvals, fbvecs = dpd.get_fnames()
     data = load_nifti_data(fdata)
@@ -182,7 +208,6 @@ def test_sfm_sklearnlinearsolver():
                       solver=EvenSillierSolver())
 
 
-@needs_sklearn
 def test_exponential_iso():
     fdata, fbvals, fbvecs = dpd.get_fnames()
     data_dti = load_nifti_data(fdata)
@@ -69,6 +69,35 @@ def test_shore_fitting_no_constrain_e0():
     npt.assert_almost_equal(compute_e0(asmfit), 1)
 
 
+def test_shore_multivoxel_fit():
+    gtab = get_gtab_taiwan_dsi()
+    mevals = np.array(([0.0015, 0.0003, 0.0003],
+                       [0.0015, 0.0003, 0.0003]))
+    S = np.zeros((2, 3, len(gtab.bvals)))
+    for ij, angle in zip(np.ndindex(S.shape[:-1]), [0, 30, 45, 60, 75, 90]):
+        S[ij], _ = multi_tensor(gtab, mevals, S0=100.0,
+                                angles=[(0, 0), (angle, 0)],
+                                fractions=[50, 50], snr=None)
+    mask = np.ones(S.shape[:-1], dtype=bool)
+    mask[1, 1] = False
+    asm = ShoreModel(gtab, radial_order=6, zeta=700, lambdaN=1e-8,
+                     lambdaL=1e-8)
+    asmfit = asm.fit(S, mask=mask)
+    npt.assert_equal(asmfit.shore_coeff.shape[:-1], S.shape[:-1])
+    npt.assert_array_equal(asmfit.shore_coeff[1, 1], 0)
+    for ij in np.ndindex(S.shape[:-1]):
+        if mask[ij]:
+            npt.assert_array_almost_equal(asmfit.shore_coeff[ij],
+                                          asm.fit(S[ij]).shore_coeff)
+            npt.assert_almost_equal(compute_e0(asmfit[ij]), 1)
+    # A single voxel with a mask is fitted if it is in the mask
+    npt.assert_array_almost_equal(
+        asm.fit(S[0, 0], mask=mask[0, 0]).shore_coeff,
+        asmfit.shore_coeff[0, 0])
+    npt.assert_array_equal(asm.fit(S[1, 1], mask=mask[1, 1]).shore_coeff,
+                           asmfit.shore_coeff[1, 1])
+
+
 @needs_cvxpy
 def test_shore_fitting_constrain_e0():
     asm = ShoreModel(data.gtab, radial_order=data.radial_order,
@@ -1,5 +1,6 @@
 from time import time
 from itertools import chain
+from multiprocessing import Pool
 import logging
 
 import numpy as np
@@ -16,6 +17,7 @@ from dipy.align.streamlinear import (StreamlineLinearRegistration,
 from dipy.tracking.streamline import Streamlines, length
 
 from dipy.utils.deprecator import deprecated_params
+from dipy.utils.multiproc import determine_num_processes
 
 from nibabel.affines import apply_affine
 
@@ -30,6 +32,20 @@ def check_range(streamline, gt, lt):
 
 logger = logging.getLogger(__name__)
 
+# RecoBundles instance shared by the workers of the process pool used in
+# `RecoBundles.recognize_many`. It is set once per worker by
+# `_init_recognize_worker`, so that the clustered target tractogram is not
+# sent again for every model bundle.
+_recognize_worker_rb = {}
+
+
+def _init_recognize_worker(rb):
+    _recognize_worker_rb['rb'] = rb
+
+
+def _recognize_worker(args):
+    return _recognize_worker_rb['rb']._recognize_one(*args)
+
 
 def bundle_adjacency(dtracks0, dtracks1, threshold):
     """ Find bundle adjacency between two given tracks/bundles
@@ -209,6 +225,121 @@ def bundle_shape_similarity(bundle1, bundle2, rng, clust_thr=[5, 3, 1.5],
     return ba_value
 
 
+class BundleAtlasIndex(object):
+
+    def __init__(self, model_bundles, model_clust_thr, names=None, nb_pts=20,
+                 start_thr=[40, 25, 20], select_randomly=500000, rng=None):
+        """ Precomputed index of the model bundles of an atlas
+
+        Holds, for each model bundle, the bundle resampled to `nb_pts`
+        points and its centroids clustered with QuickBundlesX at
+        `model_clust_thr`, as used by ``RecoBundles.recognize``. Since the
+        atlas does not change between subjects, the index can be built once,
+        saved and reused, which removes the preprocessing of the atlas from
+        every recognition.
+
+        Parameters
+        ----------
+        model_bundles : sequence of Streamlines
+            model bundles of the atlas
+        model_clust_thr : float
+            MDF distance threshold for the clustering of the model bundles
+        names : sequence of str, optional
+            names of the model bundles (e.g. 'AF_L'). Default: '0', '1', ...
+        nb_pts : int, optional
+            Number of points per streamline (default 20)
+        start_thr : list, optional
+            Thresholds of the first levels of the hierarchical clustering,
+            as ``RecoBundles.start_thr`` (default [40, 25, 20]).
+        select_randomly : int, optional
+            Maximum number of streamlines of each bundle used for the
+            clustering (default 500000).
+        rng : RandomState, optional
+            If None, a new RandomState is created.
+
+        Notes
+        -----
+        RecoBundles resamples the model streamlines to 20 points before using
+        them, so the resampled bundles can be used in place of the original
+        ones when `nb_pts` is 20.
+        """
+        if rng is None:
+            rng = np.random.RandomState()
+        if names is None:
+            names = [str(i) for i in range(len(model_bundles))]
+        if len(names) != len(model_bundles):
+            raise ValueError('There should be one name per model bundle')
+
+        self.names = list(names)
+        self.model_clust_thr = model_clust_thr
+        self.nb_pts = nb_pts
+        self.bundles = [set_number_of_points(Streamlines(bundle), nb_pts)
+                        for bundle in model_bundles]
+        thresholds = list(start_thr) + [model_clust_thr]
+        self.centroids = [
+            Streamlines(qbx_and_merge(bundle, thresholds, nb_pts=nb_pts,
+                                      select_randomly=select_randomly,
+                                      rng=rng).centroids)
+            for bundle in self.bundles]
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, name):
+        """ Resampled bundle and centroids of the bundle called `name` """
+        idx = self.names.index(name)
+        return self.bundles[idx], self.centroids[idx]
+
+    def save(self, fname):
+        """ Save the index to `fname` (compressed .npz file)
+
+        Parameters
+        ----------
+        fname : str
+            file name of the index
+        """
+        arrays = {'names': np.array(self.names),
+                  'model_clust_thr': self.model_clust_thr,
+                  'nb_pts': self.nb_pts}
+        for i, (bundle, centroids) in enumerate(zip(self.bundles,
+                                                    self.centroids)):
+            arrays['bundle_%d' % i] = bundle.get_data().astype(np.float32)
+            arrays['centroids_%d' % i] = \
+                centroids.get_data().astype(np.float32)
+        np.savez_compressed(fname, **arrays)
+
+    @classmethod
+    def load(cls, fname):
+        """ Load an index saved with ``save``
+
+        Parameters
+        ----------
+        fname : str
+            file name of the index
+
+        Returns
+        -------
+        index : BundleAtlasIndex
+        """
+        with np.load(fname) as arrays:
+            index = cls.__new__(cls)
+            index.names = [str(name) for name in arrays['names']]
+            index.model_clust_thr = float(arrays['model_clust_thr'])
+            index.nb_pts = int(arrays['nb_pts'])
+            index.bundles = []
+            index.centroids = []
+            for i in range(len(index.names)):
+                for attr in ['bundle', 'centroids']:
+                    data = arrays['%s_%d' % (attr, i)]
+                    streamlines = Streamlines(
+                        data.reshape(-1, index.nb_pts, 3))
+                    if attr == 'bundle':
+                        index.bundles.append(streamlines)
+                    else:
+                        index.centroids.append(streamlines)
+        return index
+
+
 class RecoBundles(object):
 
     def __init__(self, streamlines,  greater_than=50, less_than=1000000,
@@ -334,7 +465,8 @@ class RecoBundles(object):
                   slr_select=(400, 600),
                   slr_method='L-BFGS-B',
                   pruning_thr=5,
-                  pruning_distance='mdf'):
+                  pruning_distance='mdf',
+                  model_centroids=None):
         """ Recognize the model_bundle in self.streamlines
 
         Parameters
@@ -403,6 +535,10 @@ class RecoBundles(object):
             Pruning after reducing the search space (default 5).
         pruning_distance : string, optional
             Pruning distance type can be mdf or mam (default mdf)
+        model_centroids : Streamlines, optional
+            Precomputed centroids of the model bundle clustered with
+            `model_clust_thr` (e.g. from a ``BundleAtlasIndex``). If None
+            (default) the model bundle is clustered here.
 
         Returns
         -------
@@ -421,9 +557,10 @@ class RecoBundles(object):
             t = time()
             logger.info('## Recognize given bundle ## \n')
 
-        model_centroids = self._cluster_model_bundle(
-            model_bundle,
-            model_clust_thr=model_clust_thr)
+        if model_centroids is None:
+            model_centroids = self._cluster_model_bundle(
+                model_bundle,
+                model_clust_thr=model_clust_thr)
 
         neighb_streamlines, neighb_indices = self._reduce_search_space(
             model_centroids,
@@ -459,6 +596,113 @@ class RecoBundles(object):
 
         return pruned_streamlines, self.filtered_indices[labels]
 
+    def recognize_many(self, model_bundles, model_clust_thr,
+                       num_processes=1, refine=False, refine_params=None,
+                       model_centroids=None, **recognize_params):
+        """ Recognize several model bundles in self.streamlines
+
+        The clustering of the target tractogram (and its centroids) is done
+        once, when creating this object, and is shared by the recognition of
+        all the model bundles, which can be distributed over a pool of
+        processes.
+
+        Parameters
+        ----------
+        model_bundles : sequence of Streamlines
+            model bundles (e.g. all the bundles of an atlas) used as
+            references to extract similar streamlines from input tractogram
+        model_clust_thr : float
+            MDF distance threshold for the model bundles
+        num_processes : int, optional
+            Split the recognition of the model bundles to a pool of children
+            processes. Default is 1. If < 0 the maximal number of cores minus
+            |num_processes + 1| is used (enter -1 to use as many cores as
+            possible). 0 raises an error. When more than one process is used,
+            `num_threads` defaults to 1 to avoid oversubscription.
+        refine : bool, optional
+            If True, the recognized bundles with more than one streamline are
+            refined with ``refine`` (default False).
+        refine_params : dict, optional
+            Keyword arguments of ``refine`` (other than `model_bundle`,
+            `pruned_streamlines`, `model_clust_thr` and `model_centroids`).
+        model_centroids : sequence of Streamlines, optional
+            Precomputed centroids of each model bundle clustered with
+            `model_clust_thr` (e.g. ``BundleAtlasIndex.centroids``). If None
+            (default) the model bundles are clustered here.
+        recognize_params : dict, optional
+            Keyword arguments of ``recognize`` (other than `model_bundle` and
+            `model_clust_thr`).
+
+        Returns
+        -------
+        recognized_bundles : list of Streamlines
+            Recognized bundles in the space of the model tractogram, in the
+            order of `model_bundles`
+        recognized_labels : list of arrays
+            Indices of each recognized bundle in the original tractogram
+
+        Notes
+        -----
+        Each model bundle gets its own random generator, seeded from
+        self.rng, so the results do not depend on `num_processes`.
+        """
+        num_processes = determine_num_processes(num_processes)
+        num_processes = min(num_processes, len(model_bundles))
+        if refine_params is None:
+            refine_params = {}
+        refine_params = refine_params if refine else None
+        if num_processes > 1:
+            recognize_params.setdefault('num_threads', 1)
+
+        if self.verbose:
+            t = time()
+            logger.info('## Recognize %d bundles ## \n'
+                        % (len(model_bundles),))
+
+        seeds = self.rng.randint(np.iinfo(np.int32).max,
+                                 size=len(model_bundles))
+        if model_centroids is None:
+            model_centroids = [None] * len(model_bundles)
+        tasks = [(model_bundle, seed, model_clust_thr, recognize_params,
+                  refine_params, centroids)
+                 for model_bundle, seed, centroids
+                 in zip(model_bundles, seeds, model_centroids)]
+
+        if num_processes <= 1:
+            rng = self.rng
+            results = [self._recognize_one(*task) for task in tasks]
+            self.rng = rng
+        else:
+            pool = Pool(num_processes, initializer=_init_recognize_worker,
+                        initargs=(self,))
+            results = pool.map(_recognize_worker, tasks)
+            pool.close()
+            pool.join()
+
+        if self.verbose:
+            logger.info('Total duration of recognition time is %0.3f sec.\n'
+                        % (time()-t,))
+
+        recognized_bundles = [bundle for bundle, _ in results]
+        recognized_labels = [labels for _, labels in results]
+        return recognized_bundles, recognized_labels
+
+    def _recognize_one(self, model_bundle, seed, model_clust_thr,
+                       recognize_params, refine_params=None,
+                       model_centroids=None):
+        self.rng = np.random.RandomState(seed)
+        if model_centroids is None:
+            model_centroids = self._cluster_model_bundle(
+                model_bundle, model_clust_thr=model_clust_thr)
+        recognized_bundle, labels = self.recognize(
+            model_bundle, model_clust_thr, model_centroids=model_centroids,
+            **recognize_params)
+        if refine_params is not None and len(recognized_bundle) > 1:
+            recognized_bundle, labels = self.refine(
+                model_bundle, recognized_bundle, model_clust_thr,
+                model_centroids=model_centroids, **refine_params)
+        return recognized_bundle, labels
+
     def refine(self, model_bundle, pruned_streamlines, model_clust_thr,
                reduction_thr=14,
                reduction_distance='mdf',
@@ -469,7 +713,8 @@ class RecoBundles(object):
                slr_select=(400, 600),
                slr_method='L-BFGS-B',
                pruning_thr=6,
-               pruning_distance='mdf'):
+               pruning_distance='mdf',
+               model_centroids=None):
         """ Refine and recognize the model_bundle in self.streamlines
         This method expects once pruned streamlines as input. It refines the
         first ouput of recobundle by applying second local slr (optional),
@@ -540,6 +785,10 @@ class RecoBundles(object):
             Pruning after reducing the search space (default 6).
         pruning_distance : string
             Pruning distance type can be mdf or mam (default mdf)
+        model_centroids : Streamlines, optional
+            Precomputed centroids of the model bundle clustered with
+            `model_clust_thr` (e.g. from a ``BundleAtlasIndex``). If None
+            (default) the model bundle is clustered here.
 
         Returns
         -------
@@ -564,9 +813,10 @@ class RecoBundles(object):
             t = time()
             logger.info('## Refine recognize given bundle ## \n')
 
-        model_centroids = self._cluster_model_bundle(
-            model_bundle,
-            model_clust_thr=model_clust_thr)
+        if model_centroids is None:
+            model_centroids = self._cluster_model_bundle(
+                model_bundle,
+                model_clust_thr=model_clust_thr)
 
         pruned_model_centroids = self._cluster_model_bundle(
             pruned_streamlines,
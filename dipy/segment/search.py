@@ -0,0 +1,262 @@
+""" Nearest neighbors search of streamlines with the MDF distance """
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from dipy.tracking.distances import _pairs_mdf
+from dipy.tracking.streamline import Streamlines, set_number_of_points
+
+
+def _resample(streamlines, nb_points):
+    """ Resampled streamlines as one float32 array (N, nb_points, 3) """
+    if isinstance(streamlines, np.ndarray) and streamlines.ndim == 3:
+        if streamlines.shape[1] == nb_points:
+            return np.ascontiguousarray(streamlines, dtype=np.float32)
+        streamlines = list(streamlines)
+    if len(streamlines) == 0:
+        return np.zeros((0, nb_points, 3), dtype=np.float32)
+    resampled = Streamlines(set_number_of_points(streamlines, nb_points))
+    return np.ascontiguousarray(resampled.get_data().reshape(-1, nb_points,
+                                                             3),
+                                dtype=np.float32)
+
+
+def flip_invariant_features(points):
+    """ Features whose euclidean distance is a lower bound of the MDF
+
+    Parameters
+    ----------
+    points : array (N, K, 3)
+        Streamlines with the same number of points.
+
+    Returns
+    -------
+    features : array (N, 3 + 3 * ((K + 1) // 2))
+        Features of each streamline, unchanged when a streamline is flipped.
+
+    Notes
+    -----
+    The features of a streamline are its centroid and the midpoints of its
+    symmetric pairs of points (the i-th and the i-th from the end), weighted
+    by 2 / K (1 / K for the middle point when K is odd), both scaled by
+    1 / sqrt(2).
+
+    By the triangle inequality, the distance between the centroids and the
+    weighted sum of the distances between the midpoints are both lower
+    bounds of the direct and flipped average distances, so of the MDF. The
+    euclidean norm of the weighted midpoints differences is smaller than
+    their weighted sum, so the euclidean distance between features is a
+    lower bound of the MDF.
+    """
+    points = np.asarray(points, dtype=np.float64)
+    nb_points = points.shape[1]
+    half = (nb_points + 1) // 2
+    midpoints = (points[:, :half] + points[:, ::-1][:, :half]) / 2.
+    weights = np.full(half, 2. / nb_points)
+    if nb_points % 2:
+        weights[-1] = 1. / nb_points
+    midpoints *= weights[None, :, None]
+    centroids = points.mean(axis=1)
+    midpoints = midpoints.reshape(len(points), 3 * half)
+    features = np.concatenate([centroids, midpoints], axis=1)
+    return features / np.sqrt(2)
+
+
+class StreamlineIndex(object):
+
+    def __init__(self, streamlines, nb_points=12, leafsize=16):
+        """ Index of streamlines for radius and k nearest neighbors queries
+
+        Distances are the minimum average direct-flip (MDF) distance between
+        streamlines resampled to `nb_points` points, as in
+        ``dipy.tracking.distances.bundles_distances_mdf``.
+
+        The streamlines are indexed by a k-d tree on flip invariant features
+        whose euclidean distance is a lower bound of the MDF (see
+        ``flip_invariant_features``). The tree selects candidates, whose MDF
+        are then computed exactly, so the results are the same as those of
+        a brute force search.
+
+        Parameters
+        ----------
+        streamlines : sequence or array (N, nb_points, 3)
+            Streamlines to index.
+        nb_points : int, optional
+            Number of points of the resampled streamlines (default 12).
+        leafsize : int, optional
+            Leaf size of the k-d tree (default 16).
+
+        Examples
+        --------
+        >>> import numpy as np
+        >>> from dipy.segment.search import StreamlineIndex
+        >>> streamlines = [np.array([[0, 0, 0], [10, 0, 0.]]),
+        ...                np.array([[0, 1, 0], [10, 1, 0.]]),
+        ...                np.array([[0, 9, 0], [10, 9, 0.]])]
+        >>> index = StreamlineIndex(streamlines)
+        >>> index.query_radius([np.array([[10, 0, 0], [0, 0, 0.]])], 2.)
+        [array([0, 1])]
+        """
+        if nb_points < 2:
+            raise ValueError("nb_points must be at least 2.")
+        self.nb_points = nb_points
+        self.leafsize = leafsize
+        self.points = _resample(streamlines, nb_points)
+        self._tree = cKDTree(flip_invariant_features(self.points),
+                             leafsize=leafsize)
+
+    def __len__(self):
+        return len(self.points)
+
+    def _candidates(self, features, radii, start):
+        """ Indexed streamlines whose features are within `radii` """
+        neighbors = self._tree.query_ball_point(features, radii)
+        counts = np.array([len(n) for n in neighbors], dtype=np.intp)
+        queries = np.repeat(np.arange(start, start + len(neighbors)), counts)
+        indices = np.fromiter((j for n in neighbors for j in n),
+                              dtype=np.intp, count=counts.sum())
+        return queries, indices
+
+    def _mdf(self, points, queries, indices, num_threads):
+        distances = np.empty(len(queries))
+        _pairs_mdf(points, self.points, np.ascontiguousarray(queries),
+                   np.ascontiguousarray(indices), distances,
+                   num_threads=num_threads)
+        return distances
+
+    def query_radius(self, streamlines, radius, return_distance=False,
+                     block_size=10000, num_threads=None):
+        """ Indexed streamlines within a MDF distance of each streamline
+
+        Parameters
+        ----------
+        streamlines : sequence or array (M, nb_points, 3)
+            Query streamlines.
+        radius : float
+            Maximum MDF distance (included).
+        return_distance : bool, optional
+            If True, also return the distances (default False).
+        block_size : int, optional
+            Number of query streamlines processed at once (default 10000).
+        num_threads : int, optional
+            Number of threads to be used for OpenMP parallelization. If None
+            (default) the value of OMP_NUM_THREADS environment variable is
+            used if it is set, otherwise all available threads are used. If
+            < 0 the maximal number of threads minus |num_threads + 1| is used
+            (enter -1 to use as many threads as possible). 0 raises an error.
+
+        Returns
+        -------
+        indices : list of arrays
+            For each query streamline, the indices of the indexed streamlines
+            within `radius`, sorted by increasing distance.
+        distances : list of arrays
+            The corresponding MDF distances, if `return_distance` is True.
+        """
+        points = _resample(streamlines, self.nb_points)
+        # Some slack for the float32 rounding of the distances
+        slack = radius * (1 + 1e-5) + 1e-5
+        all_indices = []
+        all_distances = []
+        for start in range(0, len(points), block_size):
+            block = points[start:start + block_size]
+            queries, indices = self._candidates(
+                flip_invariant_features(block), slack, start)
+            distances = self._mdf(points, queries, indices, num_threads)
+            keep = distances <= radius
+            queries = queries[keep]
+            indices = indices[keep]
+            distances = distances[keep]
+            order = np.lexsort((indices, distances, queries))
+            splits = np.cumsum(np.bincount(queries - start,
+                                           minlength=len(block)))[:-1]
+            all_indices.extend(np.split(indices[order], splits))
+            all_distances.extend(np.split(distances[order], splits))
+        if return_distance:
+            return all_indices, all_distances
+        return all_indices
+
+    def query_knn(self, streamlines, k=1, block_size=10000,
+                  num_threads=None):
+        """ The k nearest indexed streamlines of each streamline
+
+        Parameters
+        ----------
+        streamlines : sequence or array (M, nb_points, 3)
+            Query streamlines.
+        k : int, optional
+            Number of neighbors, at most the number of indexed streamlines
+            (default 1).
+        block_size : int, optional
+            Number of query streamlines processed at once (default 10000).
+        num_threads : int, optional
+            Number of threads to be used for OpenMP parallelization. If None
+            (default) the value of OMP_NUM_THREADS environment variable is
+            used if it is set, otherwise all available threads are used. If
+            < 0 the maximal number of threads minus |num_threads + 1| is used
+            (enter -1 to use as many threads as possible). 0 raises an error.
+
+        Returns
+        -------
+        distances : array (M, k)
+            MDF distances to the nearest indexed streamlines, in increasing
+            order.
+        indices : array (M, k)
+            Indices of the nearest indexed streamlines.
+        """
+        if k < 1 or k > len(self):
+            raise ValueError("k should be between 1 and the number of "
+                             "indexed streamlines.")
+        points = _resample(streamlines, self.nb_points)
+        all_distances = np.empty((len(points), k))
+        all_indices = np.empty((len(points), k), dtype=np.intp)
+        for start in range(0, len(points), block_size):
+            block = points[start:start + block_size]
+            features = flip_invariant_features(block)
+            # The k nearest features give an upper bound of the k-th MDF...
+            _, indices = self._tree.query(features, k=k)
+            indices = indices.reshape(len(block), k)
+            queries = np.repeat(np.arange(start, start + len(block)), k)
+            distances = self._mdf(points, queries, indices.ravel(),
+                                  num_threads)
+            bounds = distances.reshape(len(block), k).max(axis=1)
+            # ... and all the candidates are within that bound
+            queries, indices = self._candidates(
+                features, bounds * (1 + 1e-5) + 1e-5, start)
+            distances = self._mdf(points, queries, indices, num_threads)
+            order = np.lexsort((indices, distances, queries))
+            first = np.cumsum(np.bincount(queries - start,
+                                          minlength=len(block))) - \
+                np.bincount(queries - start, minlength=len(block))
+            nearest = order[first[:, None] + np.arange(k)]
+            all_distances[start:start + len(block)] = distances[nearest]
+            all_indices[start:start + len(block)] = indices[nearest]
+        return all_distances, all_indices
+
+    def save(self, filename):
+        """ Save the index to a ``.npz`` file
+
+        Parameters
+        ----------
+        filename : str
+            Path of the file.
+        """
+        np.savez(filename, points=self.points, nb_points=self.nb_points,
+                 leafsize=self.leafsize)
+
+    @classmethod
+    def load(cls, filename):
+        """ Load an index saved with ``StreamlineIndex.save``
+
+        Parameters
+        ----------
+        filename : str
+            Path of the file.
+
+        Returns
+        -------
+        index : StreamlineIndex
+        """
+        with np.load(filename) as data:
+            return cls(data['points'], nb_points=int(data['nb_points']),
+                       leafsize=int(data['leafsize']))
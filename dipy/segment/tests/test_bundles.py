@@ -1,16 +1,20 @@
+import os
 import sys
 import numpy as np
 import pytest
 
 from numpy.testing import (assert_equal,
                            assert_almost_equal,
+                           assert_array_almost_equal,
+                           assert_raises,
                            run_module_suite)
 from dipy.data import get_fnames
 from dipy.io.streamline import load_tractogram
-from dipy.segment.bundles import RecoBundles
+from dipy.segment.bundles import RecoBundles, BundleAtlasIndex
 from dipy.tracking.distances import bundles_distances_mam
 from dipy.tracking.streamline import Streamlines
 from dipy.segment.clustering import qbx_and_merge
+from nibabel.tmpdirs import InTemporaryDirectory
 
 is_big_endian = 'big' in sys.byteorder.lower()
 
@@ -254,6 +258,76 @@ def test_rb_reduction_mam():
         assert_equal(row.min(), 0)
 
 
+@pytest.mark.skipif(is_big_endian,
+                    reason="Little Endian architecture required")
+def test_rb_recognize_many():
+
+    results = []
+    for num_processes in [1, 2]:
+        rb = RecoBundles(f, greater_than=0, clust_thr=10,
+                         rng=np.random.RandomState(42))
+        results.append(rb.recognize_many([f2, f3], model_clust_thr=5.,
+                                         num_processes=num_processes,
+                                         refine=True,
+                                         refine_params={'reduction_thr': 10},
+                                         reduction_thr=10))
+
+    for rec_bundles, rec_labels in results:
+        assert_equal(len(rec_bundles), 2)
+        assert_equal(len(rec_labels), 2)
+        for model_bundle, labels in zip([f2, f3], rec_labels):
+            D = bundles_distances_mam(model_bundle, f[labels])
+            for row in D:
+                assert_equal(row.min(), 0)
+
+    # The result does not depend on the number of processes
+    for labels_1, labels_2 in zip(results[0][1], results[1][1]):
+        assert_equal(np.sort(labels_1), np.sort(labels_2))
+
+
+def test_bundle_atlas_index():
+
+    index = BundleAtlasIndex([f2, f3], model_clust_thr=5., names=['f2', 'f3'],
+                             rng=np.random.RandomState(42))
+    assert_equal(len(index), 2)
+    bundle, centroids = index['f3']
+    assert_equal(len(bundle), len(f3))
+    assert_equal(bundle.get_data().shape[0], 20 * len(f3))
+    assert_equal(len(centroids) > 0, True)
+    assert_raises(ValueError, BundleAtlasIndex, [f2, f3], 5., ['f2'])
+
+    with InTemporaryDirectory() as tmpdir:
+        fname = os.path.join(tmpdir, 'atlas_index.npz')
+        index.save(fname)
+        loaded = BundleAtlasIndex.load(fname)
+
+    assert_equal(loaded.names, index.names)
+    assert_equal(loaded.model_clust_thr, 5.)
+    assert_equal(loaded.nb_pts, 20)
+    for attr in ['bundles', 'centroids']:
+        for sl1, sl2 in zip(getattr(loaded, attr), getattr(index, attr)):
+            assert_equal(len(sl1), len(sl2))
+            assert_array_almost_equal(sl1.get_data(), sl2.get_data(),
+                                      decimal=4)
+
+    # Recognition from the precomputed index gives the same result as from
+    # the original model bundles with the same centroids
+    results = []
+    for model_bundles in [loaded.bundles, [f2, f3]]:
+        rb = RecoBundles(f, greater_than=0, clust_thr=10,
+                         rng=np.random.RandomState(42))
+        results.append(rb.recognize_many(
+            model_bundles, loaded.model_clust_thr,
+            model_centroids=loaded.centroids, reduction_thr=10)[1])
+    for labels_1, labels_2 in zip(*results):
+        assert_equal(np.sort(labels_1), np.sort(labels_2))
+
+    for model_bundle, labels in zip([f2, f3], results[0]):
+        D = bundles_distances_mam(f[labels], model_bundle)
+        for row in D:
+            assert_equal(row.min(), 0)
+
+
 if __name__ == '__main__':
 
     run_module_suite()
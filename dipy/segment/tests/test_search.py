@@ -0,0 +1,106 @@
+import os
+
+import numpy as np
+import numpy.testing as npt
+
+from dipy.segment.search import StreamlineIndex, flip_invariant_features
+from dipy.tracking.distances import bundles_distances_mdf
+from dipy.tracking.streamline import Streamlines, set_number_of_points
+from nibabel.tmpdirs import InTemporaryDirectory
+
+
+def random_streamlines(rng, n):
+    # Bundles of noisy straight lines, with random orientations
+    streamlines = []
+    for _ in range(n):
+        start = rng.randint(3, size=3) * 10.
+        direction = [1, 0, 0] if rng.rand() > 0.5 else [-1, 0, 0]
+        nb_points = rng.randint(5, 30)
+        line = start + np.linspace(0, 20, nb_points)[:, None] * direction
+        streamlines.append(line + rng.randn(nb_points, 3))
+    return streamlines
+
+
+def test_flip_invariant_features():
+    rng = np.random.RandomState(0)
+    for nb_points in [2, 7, 12]:
+        points = np.array(set_number_of_points(random_streamlines(rng, 50),
+                                               nb_points), dtype=np.float32)
+        features = flip_invariant_features(points)
+        npt.assert_equal(features.shape,
+                         (50, 3 + 3 * ((nb_points + 1) // 2)))
+        npt.assert_array_almost_equal(
+            features, flip_invariant_features(points[:, ::-1]))
+        mdf = bundles_distances_mdf(points, points)
+        bounds = np.sqrt(np.sum((features[:, None] - features[None]) ** 2,
+                                axis=-1))
+        npt.assert_(np.all(bounds <= mdf + 1e-4))
+
+
+def test_streamline_index():
+    rng = np.random.RandomState(42)
+    streamlines = Streamlines(random_streamlines(rng, 300))
+    queries = random_streamlines(rng, 50)
+
+    index = StreamlineIndex(streamlines, nb_points=12)
+    npt.assert_equal(len(index), 300)
+    mdf = bundles_distances_mdf(set_number_of_points(queries, 12),
+                                index.points)
+
+    for radius in [0., 2., 5.]:
+        indices, distances = index.query_radius(queries, radius,
+                                                return_distance=True,
+                                                block_size=16, num_threads=1)
+        npt.assert_equal(len(indices), len(queries))
+        for q, (ind, dist) in enumerate(zip(indices, distances)):
+            npt.assert_array_equal(np.sort(ind),
+                                   np.nonzero(mdf[q] <= radius)[0])
+            npt.assert_array_almost_equal(dist, mdf[q, ind])
+            npt.assert_(np.all(np.diff(dist) >= 0))
+
+    # Every indexed streamline is its own nearest neighbor
+    indices = index.query_radius(streamlines[:10], 0.)
+    for i, ind in enumerate(indices):
+        npt.assert_equal(ind[0], i)
+
+    for k in [1, 4]:
+        distances, indices = index.query_knn(queries, k, block_size=16)
+        npt.assert_array_almost_equal(distances, np.sort(mdf, axis=1)[:, :k])
+        npt.assert_array_almost_equal(
+            mdf[np.arange(len(queries))[:, None], indices], distances)
+
+    # Queries given as one array with another number of points
+    list_queries = set_number_of_points(queries, 20)
+    npt.assert_array_equal(index.query_knn(np.array(list_queries), 3)[1],
+                           index.query_knn(list_queries, 3)[1])
+
+    npt.assert_raises(ValueError, index.query_knn, queries, 301)
+    npt.assert_raises(ValueError, StreamlineIndex, streamlines, 1)
+
+    with InTemporaryDirectory():
+        index.save('index.npz')
+        npt.assert_(os.path.exists('index.npz'))
+        loaded = StreamlineIndex.load('index.npz')
+    npt.assert_equal(loaded.nb_points, 12)
+    npt.assert_array_equal(loaded.points, index.points)
+    npt.assert_array_equal(loaded.query_knn(queries, 3)[1],
+                           index.query_knn(queries, 3)[1])
+
+
+def test_streamline_index_empty():
+    rng = np.random.RandomState(0)
+    queries = random_streamlines(rng, 5)
+
+    empty = StreamlineIndex([])
+    npt.assert_equal(len(empty), 0)
+    npt.assert_equal(flip_invariant_features(empty.points).shape, (0, 21))
+    indices = empty.query_radius(queries, 10.)
+    npt.assert_equal(len(indices), len(queries))
+    npt.assert_(all(len(ind) == 0 for ind in indices))
+    npt.assert_raises(ValueError, empty.query_knn, queries, 1)
+
+    index = StreamlineIndex(random_streamlines(rng, 20))
+    npt.assert_equal(index.query_radius([], 10.), [])
+    distances, indices = index.query_knn([], 3)
+    npt.assert_equal(distances.shape, (0, 3))
+    npt.assert_equal(indices.shape, (0, 3))
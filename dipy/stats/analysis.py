@@ -2,8 +2,8 @@
 import os
 import numpy as np
 from scipy.spatial import cKDTree
-from scipy.ndimage import map_coordinates
-from scipy.spatial.distance import mahalanobis
+
+from nibabel.affines import apply_affine
 
 from dipy.utils.optpkg import optional_package
 from dipy.io.utils import save_buan_profiles_hdf5
@@ -67,10 +67,12 @@ def anatomical_measures(bundle, metric, dt, pname, bname, subject, group_id,
     bundle : string
         Name of bundle being analyzed
     metric : matrix of float values
-        dti metric e.g. FA, MD
+        dti metric e.g. FA, MD. Several metrics can be given at once as a 4D
+        matrix (one metric per volume along the last axis), they are then
+        interpolated in a single pass and `pname` is the list of their names.
     dt : DataFrame
         DataFrame to be populated
-    pname : string
+    pname : string or list of strings
         Name of the dti metric
     bname : string
         Name of bundle being analyzed.
@@ -84,28 +86,39 @@ def anatomical_measures(bundle, metric, dt, pname, bname, subject, group_id,
         path of output directory
 
     """
-    dt["streamline"] = []
-    dt["disk"] = []
-    dt["subject"] = []
-    dt[pname] = []
-    dt["group"] = []
-
-    values = map_coordinates(metric, bundle._data.T,
-                             order=1)
-
-    dt["disk"].extend(ind[list(range(len(values)))]+1)
-    dt["subject"].extend([subject]*len(values))
-    dt["group"].extend([group_id]*len(values))
-    dt[pname].extend(values)
-
+    if metric.ndim == 3:
+        metric = metric[..., None]
+        pnames = [pname]
+    else:
+        pnames = list(pname)
+    if len(pnames) != metric.shape[-1]:
+        raise ValueError("There should be one name per metric")
+
+    points = bundle._data
+    values = _interpolate_volumes(metric, points)
+    # Points outside of [0, shape - 1] are set to zero, as done by
+    # map_coordinates in constant mode
+    outside = np.any((points < 0) | (points > np.array(metric.shape[:3]) - 1),
+                     axis=1)
+    values[outside] = 0
+
+    streamline = []
     for st_i in range(len(bundle)):
 
         st = bundle[st_i]
-        dt["streamline"].extend([st_i]*len(st))
+        streamline.extend([st_i]*len(st))
+
+    for i, name in enumerate(pnames):
+        dt.clear()
+        dt["streamline"] = streamline
+        dt["disk"] = list(ind[list(range(len(values)))]+1)
+        dt["subject"] = [subject]*len(values)
+        dt[name] = list(values[:, i])
+        dt["group"] = [group_id]*len(values)
 
-    file_name = bname + "_" + pname
+        file_name = bname + "_" + name
 
-    save_buan_profiles_hdf5(os.path.join(dir, file_name), dt)
+        save_buan_profiles_hdf5(os.path.join(dir, file_name), dt)
 
 
 def assignment_map(target_bundle, model_bundle, no_disks):
@@ -171,10 +184,12 @@ def gaussian_weights(bundle, n_points=100, return_mahalnobis=False,
     """
     # Resample to same length for each streamline:
     bundle = set_number_of_points(bundle, n_points)
+    return _gaussian_weights(bundle, n_points, return_mahalnobis, stat)
 
-    # This is the output
-    w = np.zeros((len(bundle), n_points))
 
+def _gaussian_weights(bundle, n_points, return_mahalnobis=False,
+                      stat=np.mean):
+    """ ``gaussian_weights`` of a bundle already resampled to `n_points` """
     # If there's only one fiber here, it gets the entire weighting:
     if len(bundle) == 1:
         if return_mahalnobis:
@@ -182,33 +197,27 @@ def gaussian_weights(bundle, n_points=100, return_mahalnobis=False,
         else:
             return np.array([1])
 
-    for node in range(n_points):
-        # This should come back as a 3D covariance matrix with the spatial
-        # variance covariance of this node across the different streamlines
-        # This is a 3-by-3 array:
-        node_coords = bundle._data[node::n_points]
-        c = np.cov(node_coords.T, ddof=0)
-        # Reorganize as an upper diagonal matrix for expected Mahalanobis
-        # input:
-        c = np.array([[c[0, 0], c[0, 1], c[0, 2]],
-                      [0, c[1, 1], c[1, 2]],
-                      [0, 0, c[2, 2]]])
-        # Calculate the mean or median of this node as well
-        # delta = node_coords - np.mean(node_coords, 0)
-        m = stat(node_coords, 0)
-        # Weights are the inverse of the Mahalanobis distance
-        for fn in range(len(bundle)):
-            # In the special case where all the streamlines have the exact same
-            # coordinate in this node, the covariance matrix is all zeros, so
-            # we can't calculate the Mahalanobis distance, we will instead give
-            # each streamline an identical weight, equal to the number of
-            # streamlines:
-            if np.allclose(c, 0):
-                w[:, node] = len(bundle)
-                break
-            # Otherwise, go ahead and calculate Mahalanobis for node on
-            # fiber[fn]:
-            w[fn, node] = mahalanobis(node_coords[fn], m, np.linalg.inv(c))
+    # Coordinates of each node across streamlines, (n_points, n_sl, 3)
+    node_coords = bundle.get_data().reshape(len(bundle), n_points, 3)
+    node_coords = node_coords.transpose(1, 0, 2).astype(float)
+    # The spatial variance covariance of each node across the different
+    # streamlines, reorganized as upper diagonal matrices for expected
+    # Mahalanobis input:
+    m = stat(node_coords, 1)
+    centered = node_coords - node_coords.mean(1)[:, None]
+    c = np.triu(np.einsum('nsi,nsj->nij', centered, centered) /
+                len(bundle))
+    # In the special case where all the streamlines have the exact same
+    # coordinate in a node, the covariance matrix is all zeros, so we can't
+    # calculate the Mahalanobis distance, we will instead give each
+    # streamline an identical weight, equal to the number of streamlines:
+    degenerate = np.array([np.allclose(ci, 0) for ci in c])
+    c[degenerate] = np.eye(3)
+    # Otherwise, calculate Mahalanobis for each node on each fiber:
+    delta = node_coords - m[:, None]
+    w = np.sqrt(np.einsum('nsi,nij,nsj->ns', delta, np.linalg.inv(c),
+                          delta)).T
+    w[:, degenerate] = len(bundle)
     if return_mahalnobis:
         return w
     # weighting is inverse to the distance (the further you are, the less you
@@ -301,3 +310,139 @@ def afq_profile(data, bundle, affine, n_points=100, profile_stat=np.average,
         return profile_stat(values, weights=weights, axis=0)
     else:
         return profile_stat(values, axis=0)
+
+
+def afq_profiles(data, bundles, affine, n_points=100,
+                 profile_stat=np.average, orient_by=None, weights=None,
+                 **weights_kwarg):
+    """
+    Calculates summarized profiles of several statistics for several bundles
+    along their length.
+
+    This is the batched version of :func:`afq_profile`: each bundle is
+    resampled (and weighted) once, and all the statistics are interpolated
+    at once.
+
+    Parameters
+    ----------
+    data : 3D or 4D volume
+        The statistics to sample with the streamlines, one per volume along
+        the last axis if 4D (e.g. FA, MD, RD and AD stacked).
+    bundles : sequence of StreamLines class instances
+        The bundles or tracts. See Note below about orienting the streamlines.
+    affine : array_like (4, 4)
+        The mapping from voxel coordinates to streamline points.
+        The voxel_to_rasmm matrix, typically from a NIFTI file.
+    n_points: int, optional
+        The number of points to sample along the bundles. Default: 100.
+    profile_stat : callable
+        The statistic used to average the profile across streamlines.
+        If weights is not None, this must take weights as a keyword argument.
+        The default, np.average, is the same as np.mean but takes weights
+        as a keyword argument.
+    orient_by: sequence of streamlines, optional.
+        One streamline per bundle to use as a standard to orient all of the
+        streamlines of the bundle according to.
+    weights : sequence of arrays or callable (optional)
+        Weight each streamline (1D) or each node (2D) of each bundle when
+        calculating the tract-profiles (one array per bundle). Must sum to 1
+        across streamlines (in each node if relevant). If callable, this is a
+        function that calculates the weights of a bundle (e.g.
+        :func:`gaussian_weights`).
+    weights_kwarg : key-word arguments
+        Additional key-word arguments to pass to the weight-calculating
+        function. Only to be used if weights is a callable.
+
+    Returns
+    -------
+    ndarray : array of shape (len(bundles), n_statistics, n_points) with the
+        profile of each statistic along each bundle.
+
+    Notes
+    -----
+    Before providing the bundles as input to this function, you will need to
+    make sure that the streamlines in each bundle are all oriented in the same
+    orientation relative to the bundle (use :func:`orient_by_streamline` or
+    `orient_by`).
+
+    """
+    data = np.asarray(data)
+    if data.ndim == 3:
+        data = data[..., None]
+    if data.ndim != 4:
+        raise ValueError("Data needs to have 3 or 4 dimensions")
+    if affine is None:
+        affine = np.eye(4)
+    inv_affine = np.linalg.inv(affine)
+
+    profiles = np.zeros((len(bundles), data.shape[-1], n_points))
+    for i, bundle in enumerate(bundles):
+        if orient_by is not None:
+            bundle = orient_by_streamline(bundle, orient_by[i])
+        if len(bundle) == 0:
+            raise ValueError("The bundle %d contains no streamlines" % i)
+
+        # Resample each streamline to the same number of points:
+        fgarray = set_number_of_points(bundle, n_points)
+
+        # Extract the values of all the statistics at once
+        points = apply_affine(inv_affine, fgarray.get_data())
+        values = _interpolate_volumes(data, points)
+        values = values.reshape((len(fgarray), n_points, data.shape[-1]))
+
+        if weights is None:
+            bundle_weights = None
+        elif (weights is gaussian_weights and
+              weights_kwarg.get('n_points', 100) == n_points):
+            # Reuse the resampled bundle
+            kwarg = dict((key, value) for key, value in weights_kwarg.items()
+                         if key != 'n_points')
+            bundle_weights = _gaussian_weights(fgarray, n_points, **kwarg)
+        elif callable(weights):
+            bundle_weights = weights(bundle, **weights_kwarg)
+        else:
+            bundle_weights = weights[i]
+            # We check that weights *always sum to 1 across streamlines*:
+            if not np.allclose(np.sum(bundle_weights, 0), np.ones(n_points)):
+                raise ValueError("The sum of weights across streamlines"
+                                 " must be equal to 1")
+
+        for j in range(data.shape[-1]):
+            if bundle_weights is None:
+                profiles[i, j] = profile_stat(values[..., j], axis=0)
+            else:
+                profiles[i, j] = profile_stat(values[..., j],
+                                              weights=bundle_weights, axis=0)
+    return profiles
+
+
+def _interpolate_volumes(data, points):
+    """Trilinear interpolation of all the volumes of a 4D array.
+
+    Values outside of the volume are taken to be zero, as in
+    :func:`dipy.core.interpolation.interpolate_scalar_3d` (used by
+    ``values_from_volume``).
+
+    Parameters
+    ----------
+    data : 4D array
+        Volumes to interpolate, stacked along the last axis.
+    points : array (N, 3)
+        Points, in voxel coordinates.
+
+    Returns
+    -------
+    values : array (N, data.shape[-1])
+    """
+    points = np.asarray(points, dtype=float)
+    shape = np.array(data.shape[:3])
+    corner = np.floor(points).astype(np.intp)
+    frac = points - corner
+    values = np.zeros((len(points), data.shape[-1]))
+    for offset in np.ndindex(2, 2, 2):
+        idx = corner + offset
+        inside = np.all((idx >= 0) & (idx < shape), axis=1)
+        weight = np.prod(np.where(offset, frac, 1 - frac), axis=1) * inside
+        idx = np.minimum(np.maximum(idx, 0), shape - 1)
+        values += weight[:, None] * data[idx[:, 0], idx[:, 1], idx[:, 2]]
+    return values
@@ -8,7 +8,7 @@ from dipy.data import get_fnames
 from dipy.io.image import save_nifti
 from dipy.io.stateful_tractogram import Space, StatefulTractogram
 from dipy.io.streamline import load_tractogram, save_tractogram
-from dipy.stats.analysis import (gaussian_weights, afq_profile)
+from dipy.stats.analysis import (gaussian_weights, afq_profile, afq_profiles)
 from dipy.testing import assert_true
 from dipy.tracking.streamline import Streamlines
 from dipy.utils.optpkg import optional_package
@@ -145,5 +145,40 @@ def test_afq_profile():
     npt.assert_raises(ValueError, afq_profile, data, empty_bundle, np.eye(4))
 
 
+def test_afq_profiles():
+    rng = np.random.RandomState(42)
+    data = rng.rand(10, 10, 10, 3)
+    affine = np.eye(4)
+    affine[:3, 3] = [-1, 2, 0.5]
+    bundles = [Streamlines([np.cumsum(rng.rand(20, 3), 0) + affine[:3, 3]
+                            for _ in range(10)]) for _ in range(2)]
+
+    for weights, kwarg in [(None, {}), (gaussian_weights, {}),
+                           (gaussian_weights, {'stat': np.median})]:
+        profiles = afq_profiles(data, bundles, affine, weights=weights,
+                                **kwarg)
+        npt.assert_equal(profiles.shape, (2, 3, 100))
+        for i, bundle in enumerate(bundles):
+            for j in range(3):
+                npt.assert_almost_equal(
+                    profiles[i, j], afq_profile(data[..., j], bundle, affine,
+                                                weights=weights, **kwarg))
+
+    # One weights array per bundle and a 3D volume
+    weights = [np.ones((10, 20)) / 10] * 2
+    profiles = afq_profiles(data[..., 0], bundles, affine, n_points=20,
+                            weights=weights, orient_by=[b[0] for b in bundles])
+    npt.assert_equal(profiles.shape, (2, 1, 20))
+    npt.assert_almost_equal(profiles[1, 0],
+                            afq_profile(data[..., 0], bundles[1], affine,
+                                        n_points=20))
+
+    npt.assert_raises(ValueError, afq_profiles, data, bundles, affine,
+                      n_points=20, weights=[np.ones((10, 20))] * 2)
+    npt.assert_raises(ValueError, afq_profiles, data, [Streamlines([])],
+                      affine)
+    npt.assert_raises(ValueError, afq_profiles, data[0, 0], bundles, affine)
+
+
 if __name__ == '__main__':
     npt.run_module_suite()
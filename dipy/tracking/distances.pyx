@@ -7,14 +7,20 @@
 
 cimport cython
 
-from libc.stdlib cimport calloc, realloc, free
+from libc.stdlib cimport calloc, malloc, realloc, free
 from libc.string cimport memcpy
 
 import time
 import numpy as np
+from scipy import sparse
 from warnings import warn
 cimport numpy as cnp
 
+from safe_openmp cimport have_openmp
+from cython.parallel import parallel, prange
+from dipy.tracking import Streamlines
+from dipy.utils.omp import determine_num_threads
+
 
 cdef extern from "dpy_math.h" nogil:
     double floor(double x)
@@ -471,9 +477,102 @@ def most_similar_track_mam(tracks,metric='avg'):
         track2others[j] = czhang(t1_len, t1_ptr, t2_len, t2_ptr, min_buffer, metric_type)
     return si, track2others
 
-@cython.boundscheck(False)
-@cython.wraparound(False)
-def bundles_distances_mam(tracksA, tracksB, metric='avg'):
+def _flat_tracks(tracks):
+    """ Points (as one float32 array), offsets and lengths of tracks """
+    if isinstance(tracks, Streamlines):
+        points = np.ascontiguousarray(tracks._data, dtype=f32_dt)
+        offsets = np.ascontiguousarray(tracks._offsets, dtype=np.intp)
+        lengths = np.ascontiguousarray(tracks._lengths, dtype=np.intp)
+        if len(points) == 0:
+            points = np.zeros((1, 3), dtype=f32_dt)
+        return points, offsets, lengths
+    lengths = np.array([len(t) for t in tracks], dtype=np.intp)
+    offsets = np.cumsum(lengths) - lengths
+    if len(tracks) == 0 or lengths.sum() == 0:
+        return np.zeros((1, 3), dtype=f32_dt), offsets, lengths
+    points = np.ascontiguousarray(np.concatenate([np.asarray(t).reshape(-1, 3)
+                                                  for t in tracks]),
+                                  dtype=f32_dt)
+    return points, offsets, lengths
+
+
+def _check_number_of_points(tracksA, tracksB):
+    # for performance issue, we just check the first streamline
+    if len(tracksA[0]) != len(tracksB[0]):
+        w_s = "Streamlines do not have the same number of points. "
+        w_s += "All streamlines need to have the same number of points. "
+        w_s += "Use dipy.tracking.streamline.set_number_of_points to adjust "
+        w_s += "your streamlines"
+        warn(w_s)
+
+
+def _distance_type(distance, metric):
+    """ 0 for MDF, 1 + the metric type of `czhang` for MAM """
+    if distance.lower() == 'mdf':
+        return 0
+    if distance.lower() != 'mam':
+        raise ValueError('Distance should be one of mdf, mam')
+    if metric == 'avg':
+        return 1
+    elif metric == 'min':
+        return 2
+    elif metric == 'max':
+        return 3
+    raise ValueError('Metric should be one of avg, min, max')
+
+
+class _BundlesDistances(object):
+    """ Tracks of two bundles prepared for the blocked distance kernels """
+
+    def __init__(self, tracksA, tracksB, distance, metric, num_threads):
+        self.distance_type = _distance_type(distance, metric)
+        self.lenA = len(tracksA)
+        self.lenB = len(tracksB)
+        if self.lenA and self.lenB:
+            _check_number_of_points(tracksA, tracksB)
+        self.pointsA, self.offsetsA, self.lengthsA = _flat_tracks(tracksA)
+        self.pointsB, self.offsetsB, self.lengthsB = _flat_tracks(tracksB)
+        self.rows = 0
+        if self.distance_type == 0 and self.lenA and self.lenB:
+            # MDF compares the first `rows` points of each track
+            self.rows = self.lengthsA[0]
+            if (self.lengthsA.min() < self.rows or
+                    self.lengthsB.min() < self.rows):
+                raise ValueError("All streamlines need to have the same "
+                                 "number of points.")
+        self.threads_to_use = determine_num_threads(num_threads)
+        if not have_openmp:
+            self.threads_to_use = 1
+        self.longest = max(self.lengthsA.max() if self.lenA else 0,
+                           self.lengthsB.max() if self.lenB else 0)
+
+    def block(self, start, stop, threshold=np.inf):
+        """ Distances (float32) between tracks A[start:stop] and B
+
+        Distances larger than `threshold` are set to infinity.
+        """
+        out = np.empty((stop - start, self.lenB), dtype=f32_dt)
+        if stop > start and self.lenB:
+            _distances_block(self.pointsA, self.offsetsA, self.lengthsA,
+                             self.pointsB, self.offsetsB, self.lengthsB,
+                             start, self.distance_type, self.rows,
+                             self.longest, threshold, out,
+                             self.threads_to_use)
+        return out
+
+    def knn(self, start, stop, k):
+        """ The `k` nearest tracks of B of the tracks A[start:stop] """
+        dist = np.empty((stop - start, k), dtype=f32_dt)
+        idx = np.empty((stop - start, k), dtype=np.intp)
+        if stop > start:
+            _knn_block(self.pointsA, self.offsetsA, self.lengthsA,
+                       self.pointsB, self.offsetsB, self.lengthsB,
+                       start, self.distance_type, self.rows, self.longest,
+                       dist, idx, self.threads_to_use)
+        return dist, idx
+
+
+def bundles_distances_mam(tracksA, tracksB, metric='avg', num_threads=None):
     """ Calculate distances between list of tracks A and list of tracks B
 
     Parameters
@@ -484,6 +583,12 @@ def bundles_distances_mam(tracksA, tracksB, metric='avg'):
        of tracks as arrays, shape (N1,3) .. (Nm,3)
     metric : str
        'avg', 'min', 'max'
+    num_threads : int, optional
+        Number of threads to be used for OpenMP parallelization. If None
+        (default) the value of OMP_NUM_THREADS environment variable is used
+        if it is set, otherwise all available threads are used. If < 0 the
+        maximal number of threads minus |num_threads + 1| is used (enter -1 to
+        use as many threads as possible). 0 raises an error.
 
     Returns
     -------
@@ -493,79 +598,14 @@ def bundles_distances_mam(tracksA, tracksB, metric='avg'):
     See Also
     ---------
     dipy.tracking.streamline.set_number_of_points
+    bundles_distances_blocks, bundles_distances_sparse, bundles_distances_knn
 
     """
-    cdef:
-        cnp.npy_intp i, j, lentA, lentB
-        int metric_type
-    if metric=='avg':
-        metric_type = 0
-    elif metric == 'min':
-        metric_type = 1
-    elif metric == 'max':
-        metric_type = 2
-    else:
-        raise ValueError('Metric should be one of avg, min, max')
-    # preprocess tracks
-    cdef:
-        cnp.npy_intp longest_track_len = 0, track_len
-        cnp.npy_intp longest_track_lenA = 0, longest_track_lenB = 0
-        cnp.ndarray[object, ndim=1] tracksA32
-        cnp.ndarray[object, ndim=1] tracksB32
-        cnp.ndarray[cnp.double_t, ndim=2] DM
-    lentA = len(tracksA)
-    lentB = len(tracksB)
-    # for performance issue, we just check the first streamline
-    if len(tracksA[0]) != len(tracksB[0]):
-        w_s = "Streamlines do not have the same number of points. "
-        w_s += "All streamlines need to have the same number of points. "
-        w_s += "Use dipy.tracking.streamline.set_number_of_points to adjust "
-        w_s += "your streamlines"
-        warn(w_s)
-    tracksA32 = np.zeros((lentA,), dtype=object)
-    tracksB32 = np.zeros((lentB,), dtype=object)
-    DM = np.zeros((lentA,lentB), dtype=np.double)
-    # process tracks to predictable memory layout, find longest track
-    for i in range(lentA):
-        tracksA32[i] = np.ascontiguousarray(tracksA[i], dtype=f32_dt)
-        track_len = tracksA32[i].shape[0]
-        if track_len > longest_track_lenA:
-            longest_track_lenA = track_len
-    for i in range(lentB):
-        tracksB32[i] = np.ascontiguousarray(tracksB[i], dtype=f32_dt)
-        track_len = tracksB32[i].shape[0]
-        if track_len > longest_track_lenB:
-            longest_track_lenB = track_len
-    if longest_track_lenB > longest_track_lenA:
-        longest_track_lenA = longest_track_lenB
-    # preallocate buffer array for track distance calculations
-    cdef:
-        cnp.ndarray [cnp.float32_t, ndim=1] distances_buffer
-        cnp.float32_t *t1_ptr
-        cnp.float32_t *t2_ptr
-        cnp.float32_t *min_buffer
-    distances_buffer = np.zeros((longest_track_lenA*2,), dtype=np.float32)
-    min_buffer = <cnp.float32_t *> cnp.PyArray_DATA(distances_buffer)
-    # cycle over tracks
-    cdef:
-        cnp.ndarray [cnp.float32_t, ndim=2] t1, t2
-        cnp.npy_intp t1_len, t2_len
-    for i from 0 <= i < lentA:
-        t1 = tracksA32[i]
-        t1_len = cnp.PyArray_DIM(t1, 0)
-        t1_ptr = <cnp.float32_t *> cnp.PyArray_DATA(t1)
-        for j from 0 <= j < lentB:
-            t2 = tracksB32[j]
-            t2_len = cnp.PyArray_DIM(t2, 0)
-            t2_ptr = <cnp.float32_t *> cnp.PyArray_DATA(t2)
-            DM[i,j] = czhang(t1_len, t1_ptr, t2_len, t2_ptr, min_buffer, metric_type)
-
-    return DM
+    bd = _BundlesDistances(tracksA, tracksB, 'mam', metric, num_threads)
+    return bd.block(0, bd.lenA).astype(np.double)
 
 
-@cython.boundscheck(False)
-@cython.wraparound(False)
-def bundles_distances_mdf(tracksA, tracksB):
+def bundles_distances_mdf(tracksA, tracksB, num_threads=None):
     """ Calculate distances between list of tracks A and list of tracks B
 
     All tracks need to have the same number of points
@@ -576,6 +616,12 @@ def bundles_distances_mdf(tracksA, tracksB):
        of tracks as arrays, [(N,3) .. (N,3)]
     tracksB : sequence
        of tracks as arrays, [(N,3) .. (N,3)]
+    num_threads : int, optional
+        Number of threads to be used for OpenMP parallelization. If None
+        (default) the value of OMP_NUM_THREADS environment variable is used
+        if it is set, otherwise all available threads are used. If < 0 the
+        maximal number of threads minus |num_threads + 1| is used (enter -1 to
+        use as many threads as possible). 0 raises an error.
 
     Returns
     -------
@@ -585,64 +631,290 @@ def bundles_distances_mdf(tracksA, tracksB):
     See Also
     ---------
     dipy.tracking.streamline.set_number_of_points
+    bundles_distances_blocks, bundles_distances_sparse, bundles_distances_knn
 
+    """
+    bd = _BundlesDistances(tracksA, tracksB, 'mdf', 'avg', num_threads)
+    return bd.block(0, bd.lenA).astype(np.double)
+
+
+def bundles_distances_blocks(tracksA, tracksB, distance='mdf', metric='avg',
+                             block_size=256, num_threads=None):
+    """ Generate the distance matrix between two bundles, block by block
+
+    The rows of the distance matrix are computed in blocks of `block_size`
+    tracks of A, so that distances between large bundles can be processed
+    (e.g. reduced or written to disk) without holding the whole matrix.
+
+    Parameters
+    ----------
+    tracksA : sequence
+       of tracks as arrays, shape (N1,3) .. (Nm,3)
+    tracksB : sequence
+       of tracks as arrays, shape (N1,3) .. (Nm,3)
+    distance : str
+       'mdf' or 'mam'. For 'mdf', all tracks need to have the same number of
+       points.
+    metric : str
+       'avg', 'min', 'max', the metric of the 'mam' distance.
+    block_size : int
+       Number of tracks of A in each block.
+    num_threads : int, optional
+        Number of threads to be used for OpenMP parallelization. If None
+        (default) the value of OMP_NUM_THREADS environment variable is used
+        if it is set, otherwise all available threads are used. If < 0 the
+        maximal number of threads minus |num_threads + 1| is used (enter -1 to
+        use as many threads as possible). 0 raises an error.
+
+    Yields
+    ------
+    start : int
+        Index of the first track of A of the block.
+    DM : array, shape (n, len(tracksB)), float32
+        Distances between tracksA[start:start + n] and tracksB.
+
+    See Also
+    ---------
+    bundles_distances_mdf, bundles_distances_mam
+    """
+    bd = _BundlesDistances(tracksA, tracksB, distance, metric, num_threads)
+    for start in range(0, bd.lenA, block_size):
+        yield start, bd.block(start, min(start + block_size, bd.lenA))
+
+
+def bundles_distances_sparse(tracksA, tracksB, threshold, distance='mdf',
+                             metric='avg', block_size=256, num_threads=None):
+    """ Distances between two bundles that are below a threshold
+
+    Parameters
+    ----------
+    tracksA : sequence
+       of tracks as arrays, shape (N1,3) .. (Nm,3)
+    tracksB : sequence
+       of tracks as arrays, shape (N1,3) .. (Nm,3)
+    threshold : float
+       Only the distances smaller or equal to `threshold` are kept.
+    distance : str
+       'mdf' or 'mam'. For 'mdf', all tracks need to have the same number of
+       points.
+    metric : str
+       'avg', 'min', 'max', the metric of the 'mam' distance.
+    block_size : int
+       Number of tracks of A whose distances are computed at once.
+    num_threads : int, optional
+        Number of threads to be used for OpenMP parallelization. If None
+        (default) the value of OMP_NUM_THREADS environment variable is used
+        if it is set, otherwise all available threads are used. If < 0 the
+        maximal number of threads minus |num_threads + 1| is used (enter -1 to
+        use as many threads as possible). 0 raises an error.
+
+    Returns
+    -------
+    DM : scipy.sparse.csr_matrix, shape (len(tracksA), len(tracksB))
+        The distances smaller or equal to `threshold`, float32. Pairs of
+        identical tracks are stored as explicit zeros.
+
+    Notes
+    -----
+    The MDF distance of a pair is abandoned as soon as both its direct and
+    flipped partial sums exceed the threshold.
+    """
+    bd = _BundlesDistances(tracksA, tracksB, distance, metric, num_threads)
+    data = []
+    indices = []
+    indptr = [np.zeros(1, dtype=np.intp)]
+    nnz = 0
+    for start in range(0, bd.lenA, block_size):
+        block = bd.block(start, min(start + block_size, bd.lenA), threshold)
+        rows, cols = np.nonzero(block <= threshold)
+        data.append(block[rows, cols])
+        indices.append(cols)
+        indptr.append(nnz + np.cumsum(np.bincount(rows,
+                                                  minlength=len(block))))
+        nnz += len(rows)
+    data = np.concatenate(data) if data else np.zeros(0, dtype=f32_dt)
+    indices = np.concatenate(indices) if indices else np.zeros(0, np.intp)
+    return sparse.csr_matrix((data, indices, np.concatenate(indptr)),
+                             shape=(bd.lenA, bd.lenB))
+
+
+def bundles_distances_knn(tracksA, tracksB, k, distance='mdf', metric='avg',
+                          block_size=256, num_threads=None):
+    """ The k nearest tracks of B of each track of A
+
+    Parameters
+    ----------
+    tracksA : sequence
+       of tracks as arrays, shape (N1,3) .. (Nm,3)
+    tracksB : sequence
+       of tracks as arrays, shape (N1,3) .. (Nm,3)
+    k : int
+       Number of neighbors, at most ``len(tracksB)``.
+    distance : str
+       'mdf' or 'mam'. For 'mdf', all tracks need to have the same number of
+       points.
+    metric : str
+       'avg', 'min', 'max', the metric of the 'mam' distance.
+    block_size : int
+       Number of tracks of A processed at once.
+    num_threads : int, optional
+        Number of threads to be used for OpenMP parallelization. If None
+        (default) the value of OMP_NUM_THREADS environment variable is used
+        if it is set, otherwise all available threads are used. If < 0 the
+        maximal number of threads minus |num_threads + 1| is used (enter -1 to
+        use as many threads as possible). 0 raises an error.
+
+    Returns
+    -------
+    distances : array, shape (len(tracksA), k), float32
+        Distances to the nearest tracks, in increasing order.
+    indices : array, shape (len(tracksA), k)
+        Indices in `tracksB` of the nearest tracks.
+
+    Notes
+    -----
+    The MDF distance of a pair is abandoned as soon as both its direct and
+    flipped partial sums exceed the distance of the current k-th neighbor.
+    """
+    if k < 1 or k > len(tracksB):
+        raise ValueError("k should be between 1 and the number of tracks "
+                         "of B.")
+    bd = _BundlesDistances(tracksA, tracksB, distance, metric, num_threads)
+    distances = np.empty((bd.lenA, k), dtype=f32_dt)
+    indices = np.empty((bd.lenA, k), dtype=np.intp)
+    for start in range(0, bd.lenA, block_size):
+        stop = min(start + block_size, bd.lenA)
+        distances[start:stop], indices[start:stop] = bd.knn(start, stop, k)
+    return distances, indices
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef inline float track_mdf_bounded(float *a, float *b, long rows,
+                                    double bound) nogil:
+    """ MDF distance of two tracks, or infinity if it is larger than `bound`
+
+    Same computation as `track_direct_flip_dist`, abandoned as soon as both
+    the direct and flipped partial sums are larger than ``bound * rows``.
     """
     cdef:
-        cnp.npy_intp i, j, lentA, lentB
-    # preprocess tracks
-    cdef:
-        cnp.npy_intp longest_track_len = 0, track_len
-        longest_track_lenA, longest_track_lenB
-        cnp.ndarray[object, ndim=1] tracksA32
-        cnp.ndarray[object, ndim=1] tracksB32
-        cnp.ndarray[cnp.double_t, ndim=2] DM
-    lentA = len(tracksA)
-    lentB = len(tracksB)
-    # for performance issue, we just check the first streamline
-    if len(tracksA[0]) != len(tracksB[0]):
-        w_s = "Streamlines do not have the same number of points. "
-        w_s += "All streamlines need to have the same number of points. "
-        w_s += "Use dipy.tracking.streamline.set_number_of_points to adjust "
-        w_s += "your streamlines"
-        warn(w_s)
-    tracksA32 = np.zeros((lentA,), dtype=object)
-    tracksB32 = np.zeros((lentB,), dtype=object)
-    DM = np.zeros((lentA,lentB), dtype=np.double)
-    # process tracks to predictable memory layout
-    for i in range(lentA):
-        tracksA32[i] = np.ascontiguousarray(tracksA[i], dtype=f32_dt)
-    for i in range(lentB):
-        tracksB32[i] = np.ascontiguousarray(tracksB[i], dtype=f32_dt)
-    # preallocate buffer array for track distance calculations
-    cdef:
-        cnp.float32_t *t1_ptr
-        cnp.float32_t *t2_ptr
-        cnp.float32_t *min_buffer
-    # cycle over tracks
-    cdef:
-        cnp.ndarray [cnp.float32_t, ndim=2] t1, t2
-        cnp.npy_intp t1_len, t2_len
-        float d[2]
-    t_len = tracksA32[0].shape[0]
+        cnp.npy_intp i, j
+        cnp.float32_t sub, subf, tmprow, tmprowf
+        double distf = 0, dist = 0
+        double max_sum = bound * rows
+
+    for i in range(rows):
+        tmprow = 0
+        tmprowf = 0
+        for j in range(3):
+            sub = a[i*3+j] - b[i*3+j]
+            subf = a[i*3+j] - b[(rows-1-i)*3+j]
+            tmprow += sub*sub
+            tmprowf += subf*subf
+        dist += sqrt(tmprow)
+        distf += sqrt(tmprowf)
+        if dist > max_sum and distf > max_sum:
+            return inf
+
+    if dist < distf:
+        return <cnp.float32_t>dist/<cnp.float32_t>rows
+    return <cnp.float32_t>distf/<cnp.float32_t>rows
+
+
+cdef inline float pair_distance(float[:, ::1] pointsA, cnp.npy_intp offA,
+                                cnp.npy_intp lenA, float[:, ::1] pointsB,
+                                cnp.npy_intp offB, cnp.npy_intp lenB,
+                                int distance_type, long rows, double bound,
+                                float *buffer) nogil:
+    """ Distance between two tracks (MDF if `distance_type` is 0, MAM
+    otherwise)
+    """
+    if distance_type == 0:
+        return track_mdf_bounded(&pointsA[offA, 0], &pointsB[offB, 0], rows,
+                                 bound)
+    return czhang(lenA, &pointsA[offA, 0], lenB, &pointsB[offB, 0], buffer,
+                  distance_type - 1)
 
-    for i from 0 <= i < lentA:
-        t1 = tracksA32[i]
-        #t1_len = t1.shape[0]
-        t1_ptr = <cnp.float32_t *> cnp.PyArray_DATA(t1)
-        for j from 0 <= j < lentB:
-            t2 = tracksB32[j]
-            #t2_len = t2.shape[0]
-            t2_ptr = <cnp.float32_t *> cnp.PyArray_DATA(t2)
-            #DM[i,j] = czhang(t1_len, t1_ptr, t2_len, t2_ptr, min_buffer, metric_type)
-            track_direct_flip_dist(t1_ptr, t2_ptr,t_len,<float *>d)
-            if d[0]<d[1]:
-                DM[i,j]=d[0]
-            else:
-                DM[i,j]=d[1]
-    return DM
 
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def _distances_block(float[:, ::1] pointsA, cnp.npy_intp[::1] offsetsA,
+                     cnp.npy_intp[::1] lengthsA, float[:, ::1] pointsB,
+                     cnp.npy_intp[::1] offsetsB, cnp.npy_intp[::1] lengthsB,
+                     cnp.npy_intp start, int distance_type, long rows,
+                     cnp.npy_intp longest, double threshold,
+                     float[:, ::1] out, int num_threads):
+    """ Distances between tracks A[start:start + len(out)] and B, in
+    parallel over the tracks of A. Distances above `threshold` are set to
+    infinity.
+    """
+    cdef:
+        cnp.npy_intp i, j, a
+        cnp.npy_intp n_rows = out.shape[0]
+        cnp.npy_intp n_cols = out.shape[1]
+        float d
+        float *buffer
+
+    with nogil, parallel(num_threads=num_threads):
+        buffer = <float *> malloc(2 * longest * sizeof(float))
+        for i in prange(n_rows, schedule='guided'):
+            a = start + i
+            for j in range(n_cols):
+                d = pair_distance(pointsA, offsetsA[a], lengthsA[a],
+                                  pointsB, offsetsB[j], lengthsB[j],
+                                  distance_type, rows, threshold, buffer)
+                if d > threshold:
+                    d = inf
+                out[i, j] = d
+        free(buffer)
 
 
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def _knn_block(float[:, ::1] pointsA, cnp.npy_intp[::1] offsetsA,
+               cnp.npy_intp[::1] lengthsA, float[:, ::1] pointsB,
+               cnp.npy_intp[::1] offsetsB, cnp.npy_intp[::1] lengthsB,
+               cnp.npy_intp start, int distance_type, long rows,
+               cnp.npy_intp longest, float[:, ::1] dist,
+               cnp.npy_intp[:, ::1] idx, int num_threads):
+    """ The nearest tracks of B of the tracks A[start:start + len(dist)],
+    in parallel over the tracks of A.
+    """
+    cdef:
+        cnp.npy_intp i, j, a, m
+        cnp.npy_intp n_rows = dist.shape[0]
+        cnp.npy_intp k = dist.shape[1]
+        cnp.npy_intp n_cols = offsetsB.shape[0]
+        float d
+        float *buffer
+
+    with nogil, parallel(num_threads=num_threads):
+        buffer = <float *> malloc(2 * longest * sizeof(float))
+        for i in prange(n_rows, schedule='guided'):
+            a = start + i
+            for m in range(k):
+                dist[i, m] = inf
+                idx[i, m] = -1
+            for j in range(n_cols):
+                # The current k-th neighbor bounds the distances to compute
+                d = pair_distance(pointsA, offsetsA[a], lengthsA[a],
+                                  pointsB, offsetsB[j], lengthsB[j],
+                                  distance_type, rows, dist[i, k - 1],
+                                  buffer)
+                if idx[i, k - 1] != -1 and d >= dist[i, k - 1]:
+                    continue
+                # Insertion in the sorted neighbors
+                m = k - 1
+                while m > 0 and (idx[i, m - 1] == -1 or
+                                 dist[i, m - 1] > d):
+                    dist[i, m] = dist[i, m - 1]
+                    idx[i, m] = idx[i, m - 1]
+                    m = m - 1
+                dist[i, m] = d
+                idx[i, m] = j
+        free(buffer)
+
 
 cdef cnp.float32_t inf = np.inf
 
@@ -1501,6 +1773,63 @@ cdef void track_direct_flip_dist(float *a,float *b,long rows,float *out) nogil:
     out[1]=<cnp.float32_t>distf/<cnp.float32_t>rows
 
 
+cdef inline float track_mdf(float *a, float *b, long rows) nogil:
+    """ Minimum of the direct and flipped average distances of two tracks
+    """
+    cdef float d[2]
+    track_direct_flip_dist(a, b, rows, d)
+    if d[0] < d[1]:
+        return d[0]
+    return d[1]
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def _pairs_mdf(float[:, :, ::1] tracksA,
+               float[:, :, ::1] tracksB,
+               cnp.npy_intp[::1] first,
+               cnp.npy_intp[::1] second,
+               double[::1] out,
+               num_threads=None):
+    """ MDF distance between given pairs of tracks, computed in parallel
+
+    This function is private because it's supposed to be called only by
+    ``dipy.tracking.streamline.cluster_confidence`` and
+    ``dipy.segment.search.StreamlineIndex``.
+
+    Parameters
+    ----------
+    tracksA, tracksB : arrays (N, rows, 3) of float32
+        Tracks with the same number of points.
+    first, second : arrays (P,)
+        Indices in `tracksA` and `tracksB` of the two tracks of each pair.
+    out : array (P,)
+        MDF distance of each pair, filled in place.
+    num_threads : int, optional
+        Number of threads to be used for OpenMP parallelization. If None
+        (default) the value of OMP_NUM_THREADS environment variable is used
+        if it is set, otherwise all available threads are used. If < 0 the
+        maximal number of threads minus |num_threads + 1| is used (enter -1 to
+        use as many threads as possible). 0 raises an error.
+    """
+    cdef:
+        cnp.npy_intp n_pairs = first.shape[0]
+        long rows = tracksA.shape[1]
+        cnp.npy_intp p
+        int threads_to_use = determine_num_threads(num_threads)
+
+    if not have_openmp:
+        threads_to_use = 1
+    if n_pairs == 0:
+        return
+
+    with nogil:
+        for p in prange(n_pairs, num_threads=threads_to_use,
+                        schedule='static'):
+            out[p] = track_mdf(&tracksA[first[p], 0, 0],
+                               &tracksB[second[p], 0, 0], rows)
+
+
 @cython.cdivision(True)
 cdef inline void track_direct_flip_3dist(float *a1, float *b1,float  *c1,float *a2, float *b2, float *c2, float *out) nogil:
     """ Calculate the euclidean distance between two 3pt tracks
@@ -9,11 +9,14 @@ and statistical inference in living connectomes. Nature Methods 11:
 import numpy as np
 import scipy.sparse as sps
 import scipy.linalg as la
+from scipy.sparse.linalg import LinearOperator
 
+from dipy.core.sphere import HemiSphere
 from dipy.reconst.base import ReconstModel, ReconstFit
 from dipy.tracking.utils import unique_rows
 from dipy.tracking.streamline import transform_streamlines
-from dipy.tracking.vox2track import _voxel2streamline
+from dipy.tracking.vox2track import (_voxel2streamline, _life_matvec,
+                                     _life_rmatvec)
 import dipy.data as dpd
 import dipy.core.optimize as opt
 
@@ -299,6 +302,151 @@ def voxel2streamline(streamline, affine, unique_idx=None):
                              unique_idx.astype(np.intp))
 
 
+class LifeOperator(LinearOperator):
+    """
+    A memory-compact, factored representation of the LiFE matrix.
+
+    Instead of storing the signal of every fiber in every voxel, as the
+    sparse LiFE matrix does, the operator stores a dictionary of signals (one
+    per discrete orientation, or one per node for exact signals) and a list
+    of entries ``(voxel, fiber, atom, weight)``, as in ENCODE [1]_. The
+    contribution of a fiber to the signal of a voxel is the weighted sum of
+    the atoms of its entries in this voxel.
+
+    Products with fiber weights (``matvec``) and with signals (``rmatvec``)
+    are computed with OpenMP threads, over voxels and over fibers
+    respectively, without building the matrix.
+
+    References
+    ----------
+    .. [1] Caiafa, C. F., and Pestilli, F. (2017). Multidimensional encoding
+       of brain connectomes. Scientific Reports 7: 11491.
+    """
+
+    def __init__(self, voxels, fibers, atoms, weights, dictionary, n_voxels,
+                 n_fibers, num_threads=None):
+        """
+        Parameters
+        ----------
+        voxels, fibers, atoms : 1D int arrays
+            The voxel, fiber and atom of each entry.
+        weights : 1D array
+            The weight of each entry (e.g. the number of nodes of the fiber
+            in the voxel oriented as the atom).
+        dictionary : array (n_atoms, n_bvecs)
+            The signal of each atom.
+        n_voxels, n_fibers : int
+            Number of voxels and fibers of the model.
+        num_threads : int, optional
+            Number of threads to be used for OpenMP parallelization. If None
+            (default) the value of OMP_NUM_THREADS environment variable is
+            used if it is set, otherwise all available threads are used. If
+            < 0 the maximal number of threads minus |num_threads + 1| is used
+            (enter -1 to use as many threads as possible). 0 raises an error.
+        """
+        self.dictionary = np.ascontiguousarray(dictionary, dtype=float)
+        self.n_voxels = n_voxels
+        self.n_fibers = n_fibers
+        self.num_threads = num_threads
+        n_bvecs = self.dictionary.shape[1]
+        super(LifeOperator, self).__init__(
+            dtype=np.float64, shape=(n_voxels * n_bvecs, n_fibers))
+
+        voxels = np.asarray(voxels, dtype=np.intp)
+        fibers = np.asarray(fibers, dtype=np.intp)
+        atoms = np.asarray(atoms, dtype=np.intp)
+        weights = np.asarray(weights, dtype=float)
+        # The entries, sorted by voxel (for matvec) and by fiber (rmatvec)
+        order = np.argsort(voxels, kind='stable')
+        self._voxel_ptr = np.searchsorted(voxels[order],
+                                          np.arange(n_voxels + 1))
+        self._voxel_entries = (np.ascontiguousarray(fibers[order]),
+                               np.ascontiguousarray(atoms[order]),
+                               np.ascontiguousarray(weights[order]))
+        order = np.argsort(fibers, kind='stable')
+        self._fiber_ptr = np.searchsorted(fibers[order],
+                                          np.arange(n_fibers + 1))
+        self._fiber_entries = (np.ascontiguousarray(voxels[order]),
+                               np.ascontiguousarray(atoms[order]),
+                               np.ascontiguousarray(weights[order]))
+
+    @property
+    def n_entries(self):
+        return len(self._voxel_entries[0])
+
+    def _matvec(self, beta):
+        beta = np.ascontiguousarray(np.ravel(beta), dtype=float)
+        out = np.zeros((self.n_voxels, self.dictionary.shape[1]))
+        fibers, atoms, weights = self._voxel_entries
+        _life_matvec(beta, self._voxel_ptr, fibers, atoms, weights,
+                     self.dictionary, out, num_threads=self.num_threads)
+        return out.ravel()
+
+    def _rmatvec(self, signal):
+        signal = np.ascontiguousarray(signal, dtype=float)
+        signal = signal.reshape((self.n_voxels, self.dictionary.shape[1]))
+        out = np.zeros(self.n_fibers)
+        voxels, atoms, weights = self._fiber_entries
+        _life_rmatvec(signal, self._fiber_ptr, voxels, atoms, weights,
+                      self.dictionary, out, num_threads=self.num_threads)
+        return out
+
+    def tocsr(self):
+        """
+        The LiFE matrix, as a sparse matrix in CSR format.
+        """
+        n_bvecs = self.dictionary.shape[1]
+        voxels, atoms, weights = self._fiber_entries
+        fibers = np.repeat(np.arange(self.n_fibers), np.diff(self._fiber_ptr))
+        data = weights[:, None] * self.dictionary[atoms]
+        rows = voxels[:, None] * n_bvecs + np.arange(n_bvecs)
+        cols = np.repeat(fibers[:, None], n_bvecs, axis=1)
+        return sps.csr_matrix((data.ravel(), (rows.ravel(), cols.ravel())),
+                              shape=self.shape)
+
+
+def _streamlines_gradients(points, lengths):
+    """
+    ``streamline_gradients`` of all the streamlines, given as their
+    concatenated points and their numbers of points.
+    """
+    starts = np.cumsum(lengths) - lengths
+    ends = starts + lengths - 1
+    grad = np.empty_like(points)
+    grad[1:-1] = (points[2:] - points[:-2]) / 2.0
+    grad[starts] = points[starts + 1] - points[starts]
+    grad[ends] = points[ends] - points[ends - 1]
+    return grad
+
+
+def _tensor_signals(grads, gtab, evals):
+    """
+    The signal of the canonical tensor along each of the gradients (the
+    vectorized equivalent of ``grad_tensor`` and the Stejskal-Tanner
+    equation).
+    """
+    R = np.linalg.svd(grads[:, None, :])[2]
+    tensors = np.einsum('nij,j,nkj->nik', R, np.asarray(evals, dtype=float),
+                        R)
+    bvecs = gtab.bvecs[~gtab.b0s_mask]
+    bvals = gtab.bvals[~gtab.b0s_mask]
+    ADC = np.einsum('bi,nij,bj->nb', bvecs, tensors, bvecs)
+    return np.exp(-bvals * ADC)
+
+
+def _closest_vertices(sphere, xyz, chunk_size=10000):
+    """
+    ``sphere.find_closest`` for each of the rows of `xyz`.
+    """
+    idx = np.empty(len(xyz), dtype=np.intp)
+    for start in range(0, len(xyz), chunk_size):
+        cos_sim = np.dot(xyz[start:start + chunk_size], sphere.vertices.T)
+        if isinstance(sphere, HemiSphere):
+            cos_sim = np.abs(cos_sim)
+        idx[start:start + chunk_size] = np.argmax(cos_sim, axis=1)
+    return idx
+
+
 class FiberModel(ReconstModel):
     """
     A class for representing and solving predictive models based on
@@ -323,7 +471,8 @@ class FiberModel(ReconstModel):
         # Initialize the super-class:
         ReconstModel.__init__(self, gtab)
 
-    def setup(self, streamline, affine, evals=[0.001, 0, 0], sphere=None):
+    def setup(self, streamline, affine, evals=[0.001, 0, 0], sphere=None,
+              factored=False, num_threads=None):
         """
         Set up the necessary components for the LiFE model: the matrix of
         fiber-contributions to the DWI signal, and the coordinates of voxels
@@ -346,67 +495,80 @@ class FiberModel(ReconstModel):
             gradients along the streamlines to calculate the matrix, instead of
             an approximation. Defaults to use the 724-vertex symmetric sphere
             from :mod:`dipy.data`
-        """
-        if sphere is not False:
-            SignalMaker = LifeSignalMaker(self.gtab,
-                                          evals=evals,
-                                          sphere=sphere)
+        factored : bool, optional
+            Whether to return the matrix as a factored ``LifeOperator``,
+            which needs much less memory than the sparse matrix. Default:
+            False.
+        num_threads : int, optional
+            Number of threads used by the products of the ``LifeOperator``.
+            If None (default) the value of OMP_NUM_THREADS environment
+            variable is used if it is set, otherwise all available threads
+            are used. If < 0 the maximal number of threads minus
+            |num_threads + 1| is used (enter -1 to use as many threads as
+            possible). 0 raises an error.
 
+        Returns
+        -------
+        life_matrix : sparse matrix (CSR) or LifeOperator
+            The contribution of each fiber (columns) to the signal of each
+            voxel and direction (rows).
+        vox_coords : array (n_voxels, 3)
+            The coordinates of the voxels of the model.
+        """
         streamline = transform_streamlines(streamline, affine)
-        # Assign some local variables, for shorthand:
-        all_coords = np.concatenate(streamline)
-        vox_coords = unique_rows(np.round(all_coords).astype(np.intp))
-        del all_coords
-        # We only consider the diffusion-weighted signals:
-        n_bvecs = self.gtab.bvals[~self.gtab.b0s_mask].shape[0]
-        v2f, v2fn = voxel2streamline(streamline, np.eye(4),
-                                     unique_idx=vox_coords)
-        # How many fibers in each voxel (this will determine how many
-        # components are in the matrix):
-        n_unique_f = len(np.hstack(list(v2f.values())))
-        # Preallocate these, which will be used to generate the sparse
-        # matrix:
-        f_matrix_sig = np.zeros(n_unique_f * n_bvecs, dtype=float)
-        f_matrix_row = np.zeros(n_unique_f * n_bvecs, dtype=np.intp)
-        f_matrix_col = np.zeros(n_unique_f * n_bvecs, dtype=np.intp)
-
-        fiber_signal = []
-        for s_idx, s in enumerate(streamline):
-            if sphere is not False:
-                fiber_signal.append(SignalMaker.streamline_signal(s))
-            else:
-                fiber_signal.append(streamline_signal(s, self.gtab, evals))
-
+        lengths = np.array([len(s) for s in streamline], dtype=np.intp)
+        if np.any(lengths < 2):
+            raise IndexError("Streamlines need at least two nodes")
+        points = np.concatenate(streamline).astype(float)
         del streamline
-        if sphere is not False:
-            del SignalMaker
-
-        keep_ct = 0
-        range_bvecs = np.arange(n_bvecs).astype(int)
-        # In each voxel:
-        for v_idx in range(vox_coords.shape[0]):
-            mat_row_idx = (range_bvecs + v_idx * n_bvecs).astype(np.intp)
-            # For each fiber in that voxel:
-            for f_idx in v2f[v_idx]:
-                # For each fiber-voxel combination, store the row/column
-                # indices in the pre-allocated linear arrays
-                f_matrix_row[keep_ct:keep_ct+n_bvecs] = mat_row_idx
-                f_matrix_col[keep_ct:keep_ct+n_bvecs] = f_idx
-
-                vox_fiber_sig = np.zeros(n_bvecs)
-                for node_idx in v2fn[f_idx][v_idx]:
-                    # Sum the signal from each node of the fiber in that voxel:
-                    vox_fiber_sig += fiber_signal[f_idx][node_idx]
-                # And add the summed thing into the corresponding rows:
-                f_matrix_sig[keep_ct:keep_ct+n_bvecs] += vox_fiber_sig
-                keep_ct = keep_ct + n_bvecs
-
-        del v2f, v2fn
-        # Allocate the sparse matrix, using the more memory-efficient 'csr'
-        # format:
-        life_matrix = sps.csr_matrix((f_matrix_sig,
-                                      [f_matrix_row, f_matrix_col]))
+        n_fibers = len(lengths)
+        n_bvecs = self.gtab.bvals[~self.gtab.b0s_mask].shape[0]
 
+        # The voxel of each node, in the order of their first appearance:
+        node_coords = np.round(points).astype(np.intp)
+        vox_coords = unique_rows(node_coords)
+        _, first, node_voxels = np.unique(node_coords, axis=0,
+                                          return_index=True,
+                                          return_inverse=True)
+        rank = np.empty(len(first), dtype=np.intp)
+        rank[np.argsort(first)] = np.arange(len(first))
+        node_voxels = rank[node_voxels.ravel()]
+        del node_coords
+        node_fibers = np.repeat(np.arange(n_fibers), lengths)
+        grads = _streamlines_gradients(points, lengths)
+        del points
+
+        if sphere is False:
+            # One atom per node, with the exact signal of the node:
+            dictionary = _tensor_signals(grads, self.gtab, evals)
+            starts = np.cumsum(lengths) - lengths
+            mean_sig = (np.add.reduceat(dictionary.sum(-1), starts) /
+                        (lengths * n_bvecs))
+            dictionary -= np.repeat(mean_sig, lengths)[:, None]
+            voxels, fibers = node_voxels, node_fibers
+            atoms = np.arange(len(grads))
+            weights = np.ones(len(grads))
+        else:
+            # One atom per vertex of the sphere. The nodes of a fiber in a
+            # voxel with the same atom are gathered in one entry:
+            sphere = sphere or dpd.default_sphere
+            used, node_atoms = np.unique(_closest_vertices(sphere, grads),
+                                         return_inverse=True)
+            dictionary = _tensor_signals(sphere.vertices[used], self.gtab,
+                                         evals)
+            dictionary -= dictionary.mean(-1)[:, None]
+            n_atoms = len(used)
+            keys = ((node_voxels * n_fibers + node_fibers) * n_atoms +
+                    node_atoms.ravel())
+            keys, weights = np.unique(keys, return_counts=True)
+            voxels, keys = np.divmod(keys, n_fibers * n_atoms)
+            fibers, atoms = np.divmod(keys, n_atoms)
+
+        life_matrix = LifeOperator(voxels, fibers, atoms, weights, dictionary,
+                                   len(vox_coords), n_fibers,
+                                   num_threads=num_threads)
+        if not factored:
+            life_matrix = life_matrix.tocsr()
         return life_matrix, vox_coords
 
     def _signals(self, data, vox_coords):
@@ -438,7 +600,8 @@ class FiberModel(ReconstModel):
                 vox_data)
 
     def fit(self, data, streamline, affine, evals=[0.001, 0, 0],
-            sphere=None):
+            sphere=None, solver='sbb', max_iter=1000, tol=1e-4,
+            num_threads=None):
         """
         Fit the LiFE FiberModel for data and a set of streamlines associated
         with this data
@@ -461,11 +624,40 @@ class FiberModel(ReconstModel):
             problem, but is not as accurate. If `False`, we use the exact
             gradients along the streamlines to calculate the matrix, instead of
             an approximation.
+        solver : {'sbb', 'sparse_nnls'}, optional
+            The non-negative least squares solver. 'sbb' (default) uses
+            the subspace Barzilai-Borwein method of
+            :func:`dipy.core.optimize.sbb_nnls` on the factored
+            ``LifeOperator``, which never builds the LiFE matrix.
+            'sparse_nnls' uses :func:`dipy.core.optimize.sparse_nnls` on the
+            sparse LiFE matrix.
+        max_iter : int, optional
+            Maximal number of iterations of the 'sbb' solver. Default: 1000.
+        tol : float, optional
+            Tolerance of the 'sbb' solver on the norm of the projected
+            gradient, relative to its initial value. Default: 1e-4.
+        num_threads : int, optional
+            Number of threads used by the products of the ``LifeOperator``.
+            If None (default) the value of OMP_NUM_THREADS environment
+            variable is used if it is set, otherwise all available threads
+            are used. If < 0 the maximal number of threads minus
+            |num_threads + 1| is used (enter -1 to use as many threads as
+            possible). 0 raises an error.
 
         Returns
         -------
         FiberFit class instance
+
+        Notes
+        -----
+        Since DIPY 1.5, the default solver is 'sbb' instead of
+        'sparse_nnls'. Both solve the same non-negative least squares
+        problem, but stop at different tolerances, so the weights differ
+        slightly. Use ``solver='sparse_nnls'`` to get the previous results.
         """
+        if solver not in ('sbb', 'sparse_nnls'):
+            raise ValueError("solver must be 'sbb' or 'sparse_nnls', not %r"
+                             % (solver,))
         if affine is None:
             affine = np.eye(4)
         sl_len = np.array([len(s) for s in streamline])
@@ -473,10 +665,16 @@ class FiberModel(ReconstModel):
             raise ValueError("Input contains streamlines with only one node."
             " The LiFE model cannot be fit with these streamlines included.")
         life_matrix, vox_coords = \
-            self.setup(streamline, affine, evals=evals, sphere=sphere)
+            self.setup(streamline, affine, evals=evals, sphere=sphere,
+                       factored=True, num_threads=num_threads)
         (to_fit, weighted_signal, b0_signal, relative_signal, mean_sig,
          vox_data) = self._signals(data, vox_coords)
-        beta = opt.sparse_nnls(to_fit, life_matrix)
+        if solver == 'sbb':
+            beta = opt.sbb_nnls(to_fit, life_matrix, max_iter=max_iter,
+                                tol=tol)
+        else:
+            life_matrix = life_matrix.tocsr()
+            beta = opt.sparse_nnls(to_fit, life_matrix)
         return FiberFit(self, life_matrix, vox_coords, to_fit, beta,
                         weighted_signal, b0_signal, relative_signal, mean_sig,
                         vox_data, streamline, affine, evals)
@@ -495,12 +693,25 @@ class FiberFit(ReconstFit):
         ----------
         fiber_model : A FiberModel class instance
 
+        life_matrix : sparse matrix or LifeOperator
+            The LiFE matrix, or its factored representation.
+
         params : the parameters derived from a fit of the model to the data.
 
+        Notes
+        -----
+        The ``life_operator`` attribute holds the matrix used to fit the
+        model, a ``LifeOperator`` for the default 'sbb' solver. The
+        ``life_matrix`` attribute is always the sparse LiFE matrix (CSR),
+        built from the operator on first access.
         """
         ReconstFit.__init__(self, fiber_model, vox_data)
 
-        self.life_matrix = life_matrix
+        self.life_operator = life_matrix
+        if isinstance(life_matrix, LifeOperator):
+            self._life_matrix = None
+        else:
+            self._life_matrix = life_matrix
         self.vox_coords = vox_coords
         self.fit_data = to_fit
         self.beta = beta
@@ -512,6 +723,15 @@ class FiberFit(ReconstFit):
         self.affine = affine
         self.evals = evals
 
+    @property
+    def life_matrix(self):
+        """
+        The LiFE matrix, as a sparse matrix in CSR format.
+        """
+        if self._life_matrix is None:
+            self._life_matrix = self.life_operator.tocsr()
+        return self._life_matrix
+
     def predict(self, gtab=None, S0=None):
         """
         Predict the signal
@@ -533,7 +753,7 @@ class FiberFit(ReconstFit):
         # offset, according to the isotropic part of the signal, which was
         # removed prior to fitting:
         if gtab is None:
-            _matrix = self.life_matrix
+            _matrix = self.life_operator
             gtab = self.model.gtab
         else:
             _model = FiberModel(gtab)
@@ -541,7 +761,7 @@ class FiberFit(ReconstFit):
                                       self.affine,
                                       self.evals)
 
-        pred_weighted = np.reshape(opt.spdot(_matrix, self.beta),
+        pred_weighted = np.reshape(_matrix.dot(self.beta),
                                    (self.vox_coords.shape[0],
                                     np.sum(~gtab.b0s_mask)))
 
@@ -2,6 +2,7 @@ from copy import deepcopy
 from warnings import warn
 import types
 
+from scipy.spatial import cKDTree
 from scipy.spatial.distance import cdist
 
 import numpy as np
@@ -9,7 +10,7 @@ from nibabel.affines import apply_affine
 from nibabel.streamlines import ArraySequence as Streamlines
 from dipy.tracking.streamlinespeed import (compress_streamlines, length,
                                            set_number_of_points)
-from dipy.tracking.distances import bundles_distances_mdf
+from dipy.tracking.distances import _pairs_mdf
 import dipy.tracking.utils as ut
 from dipy.core.geometry import dist_to_corner
 from dipy.core.interpolation import (interpolate_vector_3d,
@@ -325,7 +326,7 @@ def select_by_rois(streamlines, affine, rois, include, mode=None,
 
 
 def cluster_confidence(streamlines, max_mdf=5, subsample=12, power=1,
-                       override=False):
+                       override=False, block_size=10000, num_threads=None):
     """ Computes the cluster confidence index (cci), which is an
     estimation of the support a set of streamlines gives to
     a particular pathway.
@@ -360,11 +361,28 @@ def cluster_confidence(streamlines, max_mdf=5, subsample=12, power=1,
         override means that the cci calculation will still occur even
         though there are short streamlines in the dataset that may alter
         expected behaviour.
+    block_size : int, optional
+        Number of streamlines whose neighbors are searched at once. Larger
+        blocks are faster but need more memory. Default: 10000.
+    num_threads : int, optional
+        Number of threads to be used for OpenMP parallelization of the MDF
+        distances. If None (default) the value of OMP_NUM_THREADS environment
+        variable is used if it is set, otherwise all available threads are
+        used. If < 0 the maximal number of threads minus |num_threads + 1| is
+        used (enter -1 to use as many threads as possible). 0 raises an error.
 
     Returns
     -------
     Returns an array of CCI scores
 
+    Notes
+    -----
+    The mean distance between the points of two streamlines, direct or
+    flipped, is larger than the distance between their centroids. Only the
+    pairs of streamlines whose centroids are closer than `max_mdf`, found
+    with a KD-tree, are thus compared, and the scores are accumulated block
+    by block.
+
     References
     ----------
     [Jordan17] Jordan K. Et al., Cluster Confidence Index: A Streamline-Wise
@@ -384,19 +402,39 @@ def cluster_confidence(streamlines, max_mdf=5, subsample=12, power=1,
                          ' To continue without removing short streamlines set'
                          ' override=True')
 
-    # calculate the pairwise MDF distance between all streamlines in dataset
     subsamp_sls = set_number_of_points(streamlines, subsample)
-
-    cci_score_mtrx = np.zeros([len(subsamp_sls)])
-
-    for i, sl in enumerate(subsamp_sls):
-        mdf_mx = bundles_distances_mdf([subsamp_sls[i]], subsamp_sls)
-        if (mdf_mx == 0).sum() > 1:
+    subsamp_sls = np.array(subsamp_sls, dtype=np.float32)
+    n_sls = len(subsamp_sls)
+    cci_score_mtrx = np.zeros(n_sls)
+
+    # Candidate pairs from the centroids, with some slack for the float32
+    # rounding of the distances
+    centroids = subsamp_sls.mean(axis=1, dtype=np.float64)
+    tree = cKDTree(centroids)
+    radius = max_mdf * (1 + 1e-5) + 1e-5
+
+    for start in range(0, n_sls, block_size):
+        neighbors = tree.query_ball_point(centroids[start:start + block_size],
+                                          radius)
+        counts = np.array([len(n) for n in neighbors], dtype=np.intp)
+        first = np.repeat(np.arange(start, start + len(neighbors)), counts)
+        second = np.fromiter((j for n in neighbors for j in n),
+                             dtype=np.intp, count=counts.sum())
+        # Each pair is computed once, and counts for both streamlines
+        keep = first < second
+        first = np.ascontiguousarray(first[keep])
+        second = np.ascontiguousarray(second[keep])
+        mdf = np.empty(len(first))
+        _pairs_mdf(subsamp_sls, subsamp_sls, first, second, mdf,
+                   num_threads=num_threads)
+
+        if np.any(mdf == 0):
             raise ValueError('Identical streamlines. CCI calculation invalid')
-        mdf_mx_oi = (mdf_mx > 0) & (mdf_mx < max_mdf) & ~ np.isnan(mdf_mx)
-        mdf_mx_oi_only = mdf_mx[mdf_mx_oi]
-        cci_score = np.sum(np.divide(1, np.power(mdf_mx_oi_only, power)))
-        cci_score_mtrx[i] = cci_score
+        mdf_oi = (mdf > 0) & (mdf < max_mdf) & ~np.isnan(mdf)
+        scores = np.divide(1, np.power(mdf[mdf_oi], power))
+        cci_score_mtrx += np.bincount(first[mdf_oi], scores, minlength=n_sls)
+        cci_score_mtrx += np.bincount(second[mdf_oi], scores,
+                                      minlength=n_sls)
 
     return cci_score_mtrx
 
@@ -8,7 +8,10 @@ from libc.stdlib cimport malloc, free
 
 cimport numpy as cnp
 
+from safe_openmp cimport have_openmp
+from cython.parallel import prange
 from dipy.tracking import Streamlines
+from dipy.utils.omp import determine_num_threads
 
 
 cdef extern from "dpy_math.h" nogil:
@@ -248,24 +251,24 @@ cdef void c_set_number_of_points_from_arraysequence(Streamline points,
                                                     cnp.npy_intp[:] offsets,
                                                     cnp.npy_intp[:] lengths,
                                                     long nb_points,
-                                                    Streamline out) nogil:
+                                                    Streamline out,
+                                                    int num_threads):
     cdef:
-        cnp.npy_intp i, j, k
+        cnp.npy_intp i
         cnp.npy_intp offset, length
-        cnp.npy_intp offset_out = 0
-        double dn, sum_dn_sqr
-
-    for i in range(offsets.shape[0]):
-        offset = offsets[i]
-        length = lengths[i]
 
-        c_set_number_of_points(points[offset:offset+length, :],
-                               out[offset_out:offset_out+nb_points, :])
+    # Each streamline writes its own fixed-size block of the output
+    with nogil:
+        for i in prange(offsets.shape[0], num_threads=num_threads,
+                        schedule='guided'):
+            offset = offsets[i]
+            length = lengths[i]
 
-        offset_out += nb_points
+            c_set_number_of_points(points[offset:offset+length, :],
+                                   out[i*nb_points:(i+1)*nb_points, :])
 
 
-def set_number_of_points(streamlines, nb_points=3):
+def set_number_of_points(streamlines, nb_points=3, num_threads=None):
     """ Change the number of points of streamlines
         (either by downsampling or upsampling)
 
@@ -284,6 +287,13 @@ def set_number_of_points(streamlines, nb_points=3):
 
     nb_points : int
         integer representing number of points wanted along the curve.
+    num_threads : int, optional
+        Number of threads to be used for OpenMP parallelization over the
+        streamlines of a :class:`dipy.tracking.Streamlines`. If None (default)
+        the value of OMP_NUM_THREADS environment variable is used if it is
+        set, otherwise all available threads are used. If < 0 the maximal
+        number of threads minus |num_threads + 1| is used (enter -1 to use as
+        many threads as possible). 0 raises an error.
 
     Returns
     -------
@@ -320,6 +330,13 @@ def set_number_of_points(streamlines, nb_points=3):
         if len(streamlines) == 0:
             return Streamlines()
 
+        if nb_points < 2:
+            raise ValueError("nb_points must be at least 2")
+
+        threads_to_use = determine_num_threads(num_threads)
+        if not have_openmp:
+            threads_to_use = 1
+
         nb_streamlines = len(streamlines)
         dtype = streamlines._data.dtype
         new_streamlines = Streamlines()
@@ -334,12 +351,12 @@ def set_number_of_points(streamlines, nb_points=3):
             c_set_number_of_points_from_arraysequence[float2d](
                 streamlines._data, streamlines._offsets.astype(np.intp),
                 streamlines._lengths.astype(np.intp), nb_points,
-                new_streamlines._data)
+                new_streamlines._data, threads_to_use)
         else:
             c_set_number_of_points_from_arraysequence[double2d](
                 streamlines._data, streamlines._offsets.astype(np.intp),
                 streamlines._lengths.astype(np.intp), nb_points,
-                new_streamlines._data)
+                new_streamlines._data, threads_to_use)
 
         return new_streamlines
 
@@ -488,18 +505,24 @@ cdef double c_segment_length(Streamline streamline,
 
 
 cdef cnp.npy_intp c_compress_streamline(Streamline streamline, Streamline out,
-                                       double tol_error, double max_segment_length) nogil:
-    """ Compresses a streamline (see function `compress_streamlines`)."""
+                                       double tol_error, double max_segment_length,
+                                       bint fill=True) nogil:
+    """ Compresses a streamline (see function `compress_streamlines`).
+
+    If `fill` is False, only the number of points of the compressed
+    streamline is computed and `out` is left untouched.
+    """
     cdef:
         cnp.npy_intp N = streamline.shape[0]
         cnp.npy_intp D = streamline.shape[1]
         cnp.npy_intp nb_points = 0
         cnp.npy_intp d, prev, next, curr
-        double segment_length
+        double segment_length, dist
 
     # Copy first point since it is always kept.
-    for d in range(D):
-        out[0, d] = streamline[0, d]
+    if fill:
+        for d in range(D):
+            out[0, d] = streamline[0, d]
 
     nb_points = 1
     prev = 0
@@ -510,8 +533,9 @@ cdef cnp.npy_intp c_compress_streamline(Streamline streamline, Streamline out,
     for next in range(2, N):
         # Euclidean distance between last added point and current point.
         if c_segment_length(streamline, prev, next) > max_segment_length:
-            for d in range(D):
-                out[nb_points, d] = streamline[next-1, d]
+            if fill:
+                for d in range(D):
+                    out[nb_points, d] = streamline[next-1, d]
 
             nb_points += 1
             prev = next-1
@@ -524,22 +548,66 @@ cdef cnp.npy_intp c_compress_streamline(Streamline streamline, Streamline out,
             dist = c_dist_to_line(streamline, prev, next, curr)
 
             if dpy_isnan(dist) or dist > tol_error:
-                for d in range(D):
-                    out[nb_points, d] = streamline[next-1, d]
+                if fill:
+                    for d in range(D):
+                        out[nb_points, d] = streamline[next-1, d]
 
                 nb_points += 1
                 prev = next-1
                 break
 
     # Copy last point since it is always kept.
-    for d in range(D):
-        out[nb_points, d] = streamline[N-1, d]
+    if fill:
+        for d in range(D):
+            out[nb_points, d] = streamline[N-1, d]
 
     nb_points += 1
     return nb_points
 
 
-def compress_streamlines(streamlines, tol_error=0.01, max_segment_length=10):
+cdef void c_compress_streamlines_from_arraysequence(
+        Streamline points, cnp.npy_intp[:] offsets, cnp.npy_intp[:] lengths,
+        double tol_error, double max_segment_length, cnp.npy_intp[:] offsets_out,
+        cnp.npy_intp[:] lengths_out, Streamline out, bint fill,
+        int num_threads):
+    """ Compresses all the streamlines of an ArraySequence in parallel.
+
+    If `fill` is False, only `lengths_out` is computed. Otherwise the
+    compressed streamlines are written in `out` at `offsets_out`.
+    """
+    cdef:
+        cnp.npy_intp i, d, k
+        cnp.npy_intp offset, length, offset_out
+
+    with nogil:
+        for i in prange(offsets.shape[0], num_threads=num_threads,
+                        schedule='guided'):
+            offset = offsets[i]
+            length = lengths[i]
+            if length <= 2:
+                # Short streamlines are kept as they are.
+                if fill:
+                    offset_out = offsets_out[i]
+                    for k in range(length):
+                        for d in range(points.shape[1]):
+                            out[offset_out + k, d] = points[offset + k, d]
+                else:
+                    lengths_out[i] = length
+            elif fill:
+                offset_out = offsets_out[i]
+                c_compress_streamline(
+                    points[offset:offset+length, :],
+                    out[offset_out:offset_out+lengths_out[i], :],
+                    tol_error, max_segment_length, True)
+            else:
+                lengths_out[i] = c_compress_streamline(
+                    points[offset:offset+length, :],
+                    points[offset:offset+length, :],
+                    tol_error, max_segment_length, False)
+
+
+def compress_streamlines(streamlines, tol_error=0.01, max_segment_length=10,
+                         num_threads=None):
     """ Compress streamlines by linearization as in [Presseau15]_.
 
     The compression consists in merging consecutive segments that are
@@ -568,11 +636,20 @@ def compress_streamlines(streamlines, tol_error=0.01, max_segment_length=10):
     max_segment_length : float (optional)
         Maximum length in mm of any given segment produced by the compression.
         The default is 10mm. (In [Presseau15]_, they used a value of `np.inf`).
+    num_threads : int, optional
+        Number of threads to be used for OpenMP parallelization over the
+        streamlines of a :class:`dipy.tracking.Streamlines`. If None (default)
+        the value of OMP_NUM_THREADS environment variable is used if it is
+        set, otherwise all available threads are used. If < 0 the maximal
+        number of threads minus |num_threads + 1| is used (enter -1 to use as
+        many threads as possible). 0 raises an error.
 
     Returns
     -------
-    compressed_streamlines : one or a list of array-like
-        Results of the linearization process.
+    compressed_streamlines : one or a list of array-like or :class:`dipy.tracking.Streamlines`
+        Results of the linearization process. A
+        :class:`dipy.tracking.Streamlines` is returned for a
+        :class:`dipy.tracking.Streamlines` input.
 
     Examples
     --------
@@ -601,6 +678,11 @@ def compress_streamlines(streamlines, tol_error=0.01, max_segment_length=10):
     Be aware that compressed streamlines have variable step sizes. One needs to
     be careful when computing streamlines-based metrics [Houde15]_.
 
+    The streamlines of a :class:`dipy.tracking.Streamlines` are compressed in
+    two parallel passes: the number of points of each compressed streamline
+    is computed first, then the compressed streamlines are written directly
+    in the data of the output.
+
     References
     ----------
     .. [Presseau15] Presseau C. et al., A new compression format for fiber
@@ -610,6 +692,10 @@ def compress_streamlines(streamlines, tol_error=0.01, max_segment_length=10):
     .. [Houde15] Houde J.-C. et al. How to Avoid Biased Streamlines-Based
                  Metrics for Streamlines with Variable Step Sizes, ISMRM, 2015.
     """
+    if isinstance(streamlines, Streamlines):
+        return _compress_arraysequence(streamlines, tol_error,
+                                       max_segment_length, num_threads)
+
     only_one_streamlines = False
     if type(streamlines) is cnp.ndarray:
         only_one_streamlines = True
@@ -651,3 +737,55 @@ def compress_streamlines(streamlines, tol_error=0.01, max_segment_length=10):
         return compressed_streamlines[0]
     else:
         return compressed_streamlines
+
+
+def _compress_arraysequence(streamlines, tol_error, max_segment_length,
+                            num_threads):
+    """ `compress_streamlines` of a :class:`dipy.tracking.Streamlines`. """
+    if len(streamlines) == 0:
+        return Streamlines()
+
+    threads_to_use = determine_num_threads(num_threads)
+    if not have_openmp:
+        threads_to_use = 1
+
+    data = streamlines._data
+    dtype = data.dtype
+    if dtype != np.float32 and dtype != np.float64:
+        dtype = np.float64 if dtype == np.int64 or dtype == np.uint64 else np.float32
+        data = data.astype(dtype)
+
+    offsets = streamlines._offsets.astype(np.intp)
+    lengths = streamlines._lengths.astype(np.intp)
+    new_streamlines = Streamlines()
+    new_streamlines._lengths = np.empty(len(streamlines), dtype=np.intp)
+
+    # First pass: the number of points of each compressed streamline.
+    if dtype == np.float32:
+        c_compress_streamlines_from_arraysequence[float2d](
+            data, offsets, lengths, tol_error, max_segment_length,
+            new_streamlines._lengths, new_streamlines._lengths, data, False,
+            threads_to_use)
+    else:
+        c_compress_streamlines_from_arraysequence[double2d](
+            data, offsets, lengths, tol_error, max_segment_length,
+            new_streamlines._lengths, new_streamlines._lengths, data, False,
+            threads_to_use)
+
+    # Second pass: the compressed streamlines, written in place.
+    new_streamlines._offsets = (np.cumsum(new_streamlines._lengths) -
+                                new_streamlines._lengths)
+    new_streamlines._data = np.empty((new_streamlines._lengths.sum(),
+                                      data.shape[1]), dtype=dtype)
+    if dtype == np.float32:
+        c_compress_streamlines_from_arraysequence[float2d](
+            data, offsets, lengths, tol_error, max_segment_length,
+            new_streamlines._offsets, new_streamlines._lengths,
+            new_streamlines._data, True, threads_to_use)
+    else:
+        c_compress_streamlines_from_arraysequence[double2d](
+            data, offsets, lengths, tol_error, max_segment_length,
+            new_streamlines._offsets, new_streamlines._lengths,
+            new_streamlines._data, True, threads_to_use)
+
+    return new_streamlines
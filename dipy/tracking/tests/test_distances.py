@@ -4,7 +4,7 @@ import numpy as np
 from dipy.testing import assert_true
 from numpy.testing import (assert_array_almost_equal,
                            assert_equal, assert_almost_equal,
-                           assert_array_equal)
+                           assert_array_equal, assert_raises)
 from dipy.tracking import distances as pf
 from dipy.tracking.streamline import set_number_of_points
 from dipy.data import get_fnames
@@ -193,6 +193,73 @@ def test_bundles_distances_mdf(verbose=False):
         assert_true("not have the same number of points" in str(w[0].message))
 
 
+def test_bundles_distances_blocked():
+    rng = np.random.RandomState(42)
+    tracksA = [rng.rand(rng.randint(5, 20), 3).astype('f4') * 10
+               for _ in range(40)]
+    tracksB = [rng.rand(rng.randint(5, 20), 3).astype('f4') * 10
+               for _ in range(30)]
+    tracksA_mdf = set_number_of_points(tracksA, 8)
+    tracksB_mdf = set_number_of_points(tracksB, 8)
+
+    for num_threads in [1, 2, None]:
+        DM = pf.bundles_distances_mdf(tracksA_mdf, tracksB_mdf,
+                                      num_threads=num_threads)
+        expected = np.array([[min(np.mean(np.linalg.norm(a - b, axis=1)),
+                                  np.mean(np.linalg.norm(a - b[::-1],
+                                                         axis=1)))
+                              for b in tracksB_mdf] for a in tracksA_mdf])
+        assert_array_almost_equal(DM, expected, 5)
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", category=UserWarning)
+            for metric in ['avg', 'min', 'max']:
+                DM = pf.bundles_distances_mam(tracksA, tracksB, metric,
+                                              num_threads=num_threads)
+                expected = np.array([[pf.mam_distances(a, b, metric)
+                                      for b in tracksB] for a in tracksA])
+                assert_array_almost_equal(DM, expected, 5)
+
+    # Blocks cover the dense matrix
+    DM = pf.bundles_distances_mdf(tracksA_mdf, tracksB_mdf)
+    starts = []
+    for start, block in pf.bundles_distances_blocks(tracksA_mdf, tracksB_mdf,
+                                                    block_size=16):
+        starts.append(start)
+        assert_equal(block.dtype, np.float32)
+        assert_array_almost_equal(block, DM[start:start + len(block)])
+    assert_array_equal(starts, [0, 16, 32])
+
+    # Sparse matrix of the pairs below the threshold
+    threshold = np.median(DM)
+    DS = pf.bundles_distances_sparse(tracksA_mdf, tracksB_mdf, threshold,
+                                     block_size=16)
+    assert_equal(DS.shape, DM.shape)
+    assert_equal(DS.nnz, np.sum(DM <= threshold))
+    assert_array_almost_equal(DS.toarray(), np.where(DM <= threshold, DM, 0))
+
+    # k nearest neighbors
+    dist, idx = pf.bundles_distances_knn(tracksA_mdf, tracksB_mdf, 4,
+                                         block_size=16)
+    assert_array_almost_equal(dist, np.sort(DM, axis=1)[:, :4])
+    assert_array_almost_equal(DM[np.arange(len(DM))[:, None], idx], dist)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=UserWarning)
+        DM = pf.bundles_distances_mam(tracksA, tracksB, 'min')
+        dist, idx = pf.bundles_distances_knn(tracksA, tracksB, 3,
+                                             distance='mam', metric='min')
+    assert_array_almost_equal(dist, np.sort(DM, axis=1)[:, :3])
+
+    assert_raises(ValueError, pf.bundles_distances_knn, tracksA_mdf,
+                  tracksB_mdf, 31)
+    assert_raises(ValueError, pf.bundles_distances_sparse, tracksA_mdf,
+                  tracksB_mdf, 1., distance='mdm')
+    # MDF needs at least as many points as the first track of A
+    assert_raises(ValueError, pf.bundles_distances_mdf,
+                  [tracksA[0]], [tracksB[0][:3]])
+
+
 def test_mam_distances():
     xyz1 = np.array([[0, 0, 0], [1, 0, 0], [2, 0, 0], [3, 0, 0]])
     xyz2 = np.array([[0, 1, 1], [1, 0, 1], [2, 3, -2]])
@@ -10,6 +10,7 @@ import nibabel as nib
 import numpy as np
 import numpy.testing as npt
 import scipy.linalg as la
+import scipy.sparse as sps
 
 THIS_DIR = op.dirname(__file__)
 
@@ -119,6 +120,34 @@ def test_FiberModel_init():
                           sphere=sphere)
 
 
+def test_LifeOperator():
+    data_file, bval_file, bvec_file = dpd.get_fnames('small_64D')
+    bvals, bvecs = read_bvals_bvecs(bval_file, bvec_file)
+    gtab = grad.gradient_table(bvals, bvecs)
+    FM = life.FiberModel(gtab)
+    rng = np.random.RandomState(42)
+    streamline = [np.cumsum(rng.randn(rng.randint(2, 20), 3), 0) + 5
+                  for _ in range(50)]
+
+    for sphere in [None, False]:
+        fiber_matrix, vox_coords = FM.setup(streamline, np.eye(4),
+                                            sphere=sphere)
+        operator, op_vox_coords = FM.setup(streamline, np.eye(4),
+                                           sphere=sphere, factored=True,
+                                           num_threads=2)
+        npt.assert_(isinstance(operator, life.LifeOperator))
+        npt.assert_array_equal(vox_coords, op_vox_coords)
+        npt.assert_equal(operator.shape, fiber_matrix.shape)
+        npt.assert_array_almost_equal(operator.tocsr().toarray(),
+                                      fiber_matrix.toarray())
+        beta = rng.rand(len(streamline))
+        npt.assert_array_almost_equal(operator.dot(beta),
+                                      fiber_matrix.dot(beta))
+        signal = rng.randn(fiber_matrix.shape[0])
+        npt.assert_array_almost_equal(operator.rmatvec(signal),
+                                      fiber_matrix.T.dot(signal))
+
+
 def test_FiberFit():
     data_file, bval_file, bvec_file = dpd.get_fnames('small_64D')
     data = load_nifti_data(data_file)
@@ -146,6 +175,14 @@ def test_FiberFit():
     fit = FM.fit(this_data, streamline, np.eye(4))
     npt.assert_almost_equal(fit.predict()[1],
                             fit.data[1], decimal=-1)
+    # The LiFE matrix is still available as a sparse matrix
+    npt.assert_(isinstance(fit.life_operator, life.LifeOperator))
+    npt.assert_(sps.isspmatrix_csr(fit.life_matrix))
+    npt.assert_array_almost_equal(
+        fit.life_matrix.toarray(),
+        FM.setup(streamline, np.eye(4))[0].toarray())
+    npt.assert_raises(ValueError, FM.fit, this_data, streamline, np.eye(4),
+                      solver='lsqr')
 
     # Predict with an input GradientTable
     npt.assert_almost_equal(fit.predict(gtab)[1],
@@ -177,3 +214,10 @@ def test_fit_data():
     npt.assert_(np.median(model_rmse) < np.median(matlab_rmse))
     # And a moderate correlation with the Matlab implementation weights:
     npt.assert_(np.corrcoef(matlab_weights, life_fit.beta)[0, 1] > 0.6)
+
+    # The gradient descent solver on the sparse matrix:
+    life_fit = life_model.fit(data, tensor_streamlines_vox, np.eye(4),
+                              solver='sparse_nnls')
+    model_error = life_fit.predict() - life_fit.data
+    model_rmse = np.sqrt(np.mean(model_error ** 2, -1))
+    npt.assert_(np.median(model_rmse) < np.median(matlab_rmse))
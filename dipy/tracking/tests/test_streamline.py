@@ -13,6 +13,7 @@ from numpy.testing import (assert_array_equal, assert_array_almost_equal,
                            assert_raises, assert_allclose,
                            assert_almost_equal, assert_equal)
 
+from dipy.tracking.distances import bundles_distances_mdf
 from dipy.tracking.streamline import Streamlines
 from dipy.tracking.streamline import (set_number_of_points,
                                       length,
@@ -257,6 +258,14 @@ def test_set_number_of_points():
     assert_array_almost_equal(new_streamlines_as_seq_cython,
                               new_streamlines_cython)
 
+    # ArraySequence view, in parallel
+    for num_threads in [1, 2]:
+        new_streamlines_as_seq_cython = set_number_of_points(
+            arrseq[::-2], nb_points, num_threads=num_threads)
+        assert_array_almost_equal(new_streamlines_as_seq_cython,
+                                  new_streamlines_cython[::-2])
+    assert_raises(ValueError, set_number_of_points, arrseq, 1)
+
     # Test streamlines with mixed dtype
     streamlines_mixed_dtype = [streamline,
                                streamline.astype(np.float64),
@@ -733,6 +742,25 @@ def test_compress_streamlines():
         assert_array_almost_equal(cspecial_streamline, cstreamline_python)
 
 
+def test_compress_streamlines_arraysequence():
+    rng = np.random.RandomState(42)
+    streamlines = [np.cumsum(rng.randn(rng.randint(1, 50), 3), axis=0)
+                   for _ in range(100)]
+    for dtype in [np.float32, np.float64, np.int32]:
+        arrseq = Streamlines([s.astype(dtype) for s in streamlines])
+        expected = compress_streamlines(list(arrseq[::-2]), tol_error=0.5)
+        for num_threads in [1, 2]:
+            cstreamlines = compress_streamlines(arrseq[::-2], tol_error=0.5,
+                                                num_threads=num_threads)
+            assert_true(isinstance(cstreamlines, Streamlines))
+            assert_equal(len(cstreamlines), len(expected))
+            for cs, es in zip(cstreamlines, expected):
+                assert_equal(cs.dtype, es.dtype)
+                assert_array_equal(cs, es)
+
+    assert_equal(len(compress_streamlines(Streamlines())), 0)
+
+
 def test_compress_streamlines_identical_points():
 
     sl_1 = np.array([[1, 1, 1], [1, 1, 1], [2, 2, 2], [3, 3, 3], [3, 3, 3]])
@@ -1276,3 +1304,19 @@ def test_cluster_confidence():
 
     expected_cci_dist = np.concatenate([cci_p1, np.zeros(1)])
     assert_array_equal(cci_dist, expected_cci_dist)
+
+    # the scores don't depend on the blocks and the threads, and match the
+    # all-pairs MDF distances
+    rng = np.random.RandomState(42)
+    test_streamlines = Streamlines(
+        [np.cumsum(rng.randn(20, 3), axis=0) + rng.rand(3) * 30
+         for _ in range(200)])
+    subsamp_sls = set_number_of_points(test_streamlines, 12)
+    mdf = bundles_distances_mdf(subsamp_sls, subsamp_sls)
+    np.fill_diagonal(mdf, np.inf)
+    expected = np.sum(np.where(mdf < 5, 1. / mdf, 0), axis=1)
+    for block_size, num_threads in [(10000, None), (7, 1), (64, 2)]:
+        cci = cluster_confidence(test_streamlines, override=True,
+                                 block_size=block_size,
+                                 num_threads=num_threads)
+        assert_array_almost_equal(cci, expected)
@@ -5,13 +5,15 @@ import pytest
 
 from dipy.tracking import metrics
 from dipy.tracking.streamline import transform_streamlines
-from dipy.tracking.utils import (connectivity_matrix, density_map, length,
+from dipy.tracking.utils import (connectivity_matrix, connectivity_metrics,
+                                 density_map, length,
                                  ndbincount, reduce_labels, seeds_from_mask,
                                  random_seeds_from_mask, target,
                                  target_line_based, unique_rows, near_roi,
                                  reduce_rois, path_length, _min_at,
                                  max_angle_from_curvature,
                                  min_radius_curvature_from_angle)
+from dipy.tracking.vox2track import _density_map
 
 from dipy.tracking._utils import _to_voxel_coordinates
 from dipy.tracking.vox2track import streamline_mapping
@@ -78,6 +80,60 @@ def test_density_map():
     npt.assert_array_equal(dm, expected)
 
 
+def test_density_map_modes():
+    # A streamline along the x axis, from the center of voxel 0 to the
+    # center of voxel 3, with 2 points in voxel 0
+    streamlines = [np.array([[0, 0, 0], [0.2, 0, 0], [3, 0, 0]], 'float'),
+                   np.array([[1, 0, 0], [1, 0, 0]], 'float')]
+    shape = (4, 1, 1)
+    for num_threads in [1, 2]:
+        dm = density_map(streamlines, np.eye(4), shape,
+                         num_threads=num_threads)
+        npt.assert_array_equal(dm[:, 0, 0], [1, 1, 0, 1])
+        dm = density_map(streamlines, np.eye(4), shape, mode='points',
+                         num_threads=num_threads)
+        npt.assert_array_equal(dm[:, 0, 0], [2, 2, 0, 1])
+        dm = density_map(iter(streamlines), np.eye(4), shape, mode='length',
+                         chunk_size=1, num_threads=num_threads)
+        npt.assert_array_almost_equal(dm[:, 0, 0], [0.5, 1, 1, 0.5])
+
+    # The counts are integers, the number of threads is reduced to fit in
+    # the memory budget
+    rng = np.random.RandomState(0)
+    chunk = (rng.rand(200, 3) * 4, np.full(20, 10), rng.rand(200))
+    for mode in ['streamlines', 'points', 'length']:
+        dm = _density_map([chunk], (4, 4, 4), mode=mode, num_threads=2)
+        npt.assert_equal(dm.dtype.kind, 'f' if mode == 'length' else 'i')
+        npt.assert_array_almost_equal(
+            _density_map([chunk], (4, 4, 4), mode=mode, num_threads=2,
+                         max_memory=0), dm)
+
+    # Super-resolution, the length is split between the subvoxels
+    dm = density_map(streamlines, np.eye(4), shape, mode='length',
+                     upsample=2)
+    npt.assert_equal(dm.shape, (8, 2, 2))
+    npt.assert_array_almost_equal(dm[:, 1, 1], [0, 0.5] + [0.5] * 5 + [0])
+    npt.assert_equal(dm[:, 0, :].sum(), 0)
+    dm = density_map(streamlines, np.eye(4), shape, mode='points',
+                     upsample=2)
+    npt.assert_array_equal(dm[:, 1, 1], [0, 2, 0, 2, 0, 0, 0, 1])
+
+    # The length is in the units of the streamlines
+    affine = np.diag([2., 2., 2., 1.])
+    dm = density_map([sl * 2 for sl in streamlines], affine, shape,
+                     mode='length')
+    npt.assert_array_almost_equal(dm[:, 0, 0], [1, 2, 2, 1])
+
+    npt.assert_raises(ValueError, density_map, streamlines, np.eye(4), shape,
+                      mode='voxels')
+    npt.assert_raises(ValueError, density_map, streamlines, np.eye(4), shape,
+                      upsample=0)
+    npt.assert_raises(IndexError, density_map, streamlines, np.eye(4),
+                      (3, 1, 1))
+    npt.assert_raises(IndexError, density_map, [-sl for sl in streamlines],
+                      np.eye(4), shape)
+
+
 def test_to_voxel_coordinates_precision():
     # To simplify tests, use an identity affine. This would be the result of
     # a call to _mapping_to_voxel with another identity affine.
@@ -204,6 +260,91 @@ def test_connectivity_matrix():
     npt.assert_equal(matrix[4, 3], matrix[4, 3])
 
 
+def test_connectivity_matrix_chunks():
+    label_volume = np.array([[[3, 0, 0],
+                              [0, 0, 5],
+                              [0, 0, 4]]], dtype=np.uint8)
+    # The last streamline goes back to label 3 after visiting label 4
+    streamlines = [np.array([[0, 0, 0], [0, 1, 2], [0, 2, 2]], 'float'),
+                   np.array([[0, 0, 0], [0, 1, 1], [0, 2, 2]], 'float'),
+                   np.array([[0, 2, 2], [0, 1, 1], [0, 0, 0]], 'float'),
+                   np.array([[0, 0, 0], [0, 2, 2], [0, 0, 0]], 'float')]
+
+    for inclusive in [False, True]:
+        for symmetric in [False, True]:
+            expected, expected_mapping = connectivity_matrix(
+                streamlines, np.eye(4), label_volume, inclusive=inclusive,
+                symmetric=symmetric, return_mapping=True)
+            # Streamlines given by a generator and processed in chunks
+            matrix, mapping = connectivity_matrix(
+                (sl for sl in streamlines), np.eye(4), label_volume,
+                inclusive=inclusive, symmetric=symmetric,
+                return_mapping=True, chunk_size=3)
+            npt.assert_array_equal(matrix, expected)
+            npt.assert_equal(sorted(mapping), sorted(expected_mapping))
+            for key in mapping:
+                npt.assert_array_equal(mapping[key], expected_mapping[key])
+
+    matrix, mapping = connectivity_matrix(streamlines, np.eye(4),
+                                          label_volume, inclusive=True,
+                                          symmetric=False,
+                                          return_mapping=True)
+    npt.assert_equal(matrix[3, 4], 3)
+    npt.assert_equal(matrix[4, 3], 2)
+    npt.assert_equal(matrix[3, 3], 0)
+    npt.assert_array_equal(mapping[4, 3], [2, 3])
+    npt.assert_equal(mapping[4, 3].dtype.kind, 'i')
+
+
+def test_connectivity_metrics():
+    label_volume = np.array([[[3, 0, 0],
+                              [0, 0, 5],
+                              [0, 0, 4]]])
+    fa = np.arange(9, dtype=float).reshape(label_volume.shape)
+    streamlines = [np.array([[0, 0, 0], [0, 1, 2], [0, 2, 2]], 'float'),
+                   np.array([[0, 0, 0], [0, 1, 1], [0, 2, 2]], 'float'),
+                   np.array([[0, 2, 2], [0, 1, 1], [0, 0, 0]], 'float')]
+    weights = np.array([1., 2., 4.])
+
+    matrices = connectivity_metrics(streamlines, np.eye(4), label_volume,
+                                    scalar_maps={'fa': fa},
+                                    statistics=('mean', 'median'),
+                                    weights=weights, symmetric=False,
+                                    chunk_size=2)
+    npt.assert_array_equal(matrices['count'],
+                           connectivity_matrix(streamlines, np.eye(4),
+                                               label_volume, symmetric=False))
+    sl_lengths = np.array(list(length(streamlines)))
+    npt.assert_almost_equal(matrices['length'][3, 4], sl_lengths[:2].mean())
+    npt.assert_almost_equal(matrices['length'][4, 3], sl_lengths[2])
+    npt.assert_almost_equal(matrices['weight'][3, 4], 3)
+    npt.assert_almost_equal(matrices['weight'][4, 3], 4)
+    # Mean of fa along each streamline
+    sl_fa = np.array([(0 + 5 + 8) / 3., (0 + 4 + 8) / 3., (8 + 4 + 0) / 3.])
+    npt.assert_almost_equal(matrices['fa_mean'][3, 4], sl_fa[:2].mean())
+    npt.assert_almost_equal(matrices['fa_median'][3, 4], sl_fa[:2].mean())
+    npt.assert_almost_equal(matrices['fa_mean'][4, 3], sl_fa[2])
+    npt.assert_equal(matrices['fa_mean'][0, 0], 0)
+
+    matrices = connectivity_metrics(streamlines, np.eye(4), label_volume,
+                                    scalar_maps={'fa': fa},
+                                    statistics=('median',), inclusive=True)
+    expected = connectivity_matrix(streamlines, np.eye(4), label_volume,
+                                   inclusive=True)
+    npt.assert_array_equal(matrices['count'], expected)
+    npt.assert_array_almost_equal(matrices['length'], matrices['length'].T)
+    npt.assert_almost_equal(matrices['fa_median'][3, 4], sl_fa[1])
+    npt.assert_equal('fa_mean' in matrices, False)
+    npt.assert_equal('weight' in matrices, False)
+
+    npt.assert_raises(ValueError, connectivity_metrics, streamlines,
+                      np.eye(4), label_volume, statistics=('max',))
+    npt.assert_raises(ValueError, connectivity_metrics, streamlines,
+                      np.eye(4), label_volume, weights=[1., 2.])
+    npt.assert_raises(ValueError, connectivity_metrics, streamlines,
+                      np.eye(4), label_volume, scalar_maps={'fa': fa[0]})
+
+
 def test_ndbincount():
     def check(expected):
         npt.assert_equal(bc[0, 0], expected[0])
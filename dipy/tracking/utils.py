@@ -47,9 +47,9 @@ And the letters A-D represent the following points in
 
 """
 
-from collections import defaultdict, OrderedDict
+from collections import defaultdict
 from functools import wraps
-from itertools import combinations, groupby
+from itertools import islice
 from warnings import warn
 
 import numpy as np
@@ -57,31 +57,52 @@ from nibabel.affines import apply_affine
 from scipy.spatial.distance import cdist
 
 from dipy.core.geometry import dist_to_corner
+from dipy.core.interpolation import interpolate_scalar_3d
 from dipy.tracking import metrics
-from dipy.tracking.vox2track import _streamlines_in_mask
+from dipy.tracking.vox2track import _density_map, _streamlines_in_mask
 
 # Import helper functions shared with vox2track
 from dipy.tracking._utils import (_mapping_to_voxel, _to_voxel_coordinates)
 
 
-def density_map(streamlines, affine, vol_dims):
+def density_map(streamlines, affine, vol_dims, mode='streamlines',
+                upsample=1, chunk_size=100000, num_threads=None):
     """Count the number of unique streamlines that pass through each voxel.
 
     Parameters
     ----------
     streamlines : iterable
-        A sequence of streamlines.
+        A sequence of streamlines. It can also be a generator (e.g. a lazily
+        loaded tractogram), it is then consumed in chunks of `chunk_size`
+        streamlines.
     affine : array_like (4, 4)
         The mapping from voxel coordinates to streamline points.
         The voxel_to_rasmm matrix, typically from a NIFTI file.
     vol_dims : 3 ints
         The shape of the volume to be returned containing the streamlines
         counts
+    mode : str, optional
+        'streamlines' (default) counts the streamlines having at least one
+        point in each voxel, 'points' counts the streamline points in each
+        voxel and 'length' sums the length of the streamline segments inside
+        each voxel (in the units of the streamlines).
+    upsample : int, optional
+        Each voxel is divided in ``upsample ** 3`` voxels, to compute a
+        super-resolution track-density image [1]_. Default: 1.
+    chunk_size : int, optional
+        Number of streamlines processed at once (default 100000).
+    num_threads : int, optional
+        Number of threads to be used for OpenMP parallelization. If None
+        (default) the value of OMP_NUM_THREADS environment variable is used
+        if it is set, otherwise all available threads are used. If < 0 the
+        maximal number of threads minus |num_threads + 1| is used (enter -1 to
+        use as many threads as possible). 0 raises an error.
 
     Returns
     -------
-    image_volume : ndarray, shape=vol_dims
-        The number of streamline points in each voxel of volume.
+    image_volume : ndarray, shape=vol_dims * upsample
+        The number of streamlines (or points) in each voxel of volume, or the
+        length of streamlines in each voxel for the 'length' mode.
 
     Raises
     ------
@@ -93,29 +114,70 @@ def density_map(streamlines, affine, vol_dims):
     A streamline can pass through a voxel even if one of the points of the
     streamline does not lie in the voxel. For example a step from [0,0,0] to
     [0,0,2] passes through [0,0,1]. Consider subsegmenting the streamlines when
-    the edges of the voxels are smaller than the steps of the streamlines.
+    the edges of the voxels are smaller than the steps of the streamlines, or
+    use the 'length' mode which follows the segments through the voxels.
+
+    With `upsample`, the voxel_to_rasmm matrix of the returned volume is
+    ``np.dot(affine, S)`` where `S` is the diagonal scaling by
+    ``1 / upsample`` followed by a translation of ``(1 / upsample - 1) / 2``
+    voxel along each axis.
+
+    Each thread accumulates the density in its own volume, so the memory
+    needed grows with the number of threads. The number of threads is
+    reduced so that these volumes take at most 1 GiB, which matters for
+    large `upsample` factors.
+
+    References
+    ----------
+    .. [1] Calamante, F. et al. Track-density imaging (TDI): Super-resolution
+           white matter imaging using whole-brain track-density mapping.
+           NeuroImage 53, 1233-1243 (2010).
 
     """
+    upsample = int(upsample)
+    if upsample < 1:
+        raise ValueError("upsample must be a positive integer")
+    affine = np.asarray(affine, dtype=float)
+    vol_dims = tuple(int(dim) * upsample for dim in vol_dims)
+    if upsample > 1:
+        scaling = np.eye(4)
+        scaling[:3, :3] /= upsample
+        scaling[:3, 3] = (1. / upsample - 1) / 2.
+        affine = np.dot(affine, scaling)
     lin_T, offset = _mapping_to_voxel(affine)
-    counts = np.zeros(vol_dims, 'int')
-    for sl in streamlines:
-        inds = _to_voxel_coordinates(sl, lin_T, offset)
-        i, j, k = inds.T
-        # this takes advantage of the fact that numpy's += operator only
-        # acts once even if there are repeats in inds
-        counts[i, j, k] += 1
-    return counts
+
+    def chunks():
+        for points, lengths in _streamline_chunks(streamlines, chunk_size):
+            inds = np.dot(points, lin_T)
+            inds += offset
+            if inds.min().round(decimals=6) < 0:
+                raise IndexError('streamline has points that map to negative '
+                                 'voxel indices')
+            np.maximum(inds, 0, out=inds)
+            if np.any(np.floor(inds.max(0)) >= vol_dims):
+                raise IndexError('streamline has points that map outside of '
+                                 'the volume')
+            segment_lengths = np.zeros(len(points))
+            if mode == 'length' and len(points) > 1:
+                segment_lengths[:-1] = np.sqrt(
+                    (np.diff(points, axis=0) ** 2).sum(1))
+            yield inds, lengths, segment_lengths
+
+    return _density_map(chunks(), vol_dims, mode=mode,
+                        num_threads=num_threads)
 
 
 def connectivity_matrix(streamlines, affine, label_volume, inclusive=False,
                         symmetric=True, return_mapping=False,
-                        mapping_as_streamlines=False):
+                        mapping_as_streamlines=False, chunk_size=100000):
     """Count the streamlines that start and end at each label pair.
 
     Parameters
     ----------
-    streamlines : sequence
-        A sequence of streamlines.
+    streamlines : iterable
+        A sequence of streamlines. It can also be a generator (e.g. a lazily
+        loaded tractogram), it is then consumed in chunks of `chunk_size`
+        streamlines and the matrix is accumulated incrementally.
     affine : array_like (4, 4)
         The mapping from voxel coordinates to streamline coordinates.
         The voxel_to_rasmm matrix, typically from a NIFTI file.
@@ -134,7 +196,9 @@ def connectivity_matrix(streamlines, affine, label_volume, inclusive=False,
         streamlines.
     mapping_as_streamlines : bool, False by default
         If True voxel indices map to lists of streamline objects. Otherwise
-        voxel indices map to lists of integers.
+        voxel indices map to arrays of streamline indices.
+    chunk_size : int, optional
+        Number of streamlines processed at once (default 100000).
 
     Returns
     -------
@@ -142,105 +206,304 @@ def connectivity_matrix(streamlines, affine, label_volume, inclusive=False,
         The number of connection between each pair of regions in
         `label_volume`.
     mapping : defaultdict(list)
-        ``mapping[i, j]`` returns all the streamlines that connect region `i`
-        to region `j`. If `symmetric` is True mapping will only have one key
-        for each start end pair such that if ``i < j`` mapping will have key
-        ``(i, j)`` but not key ``(j, i)``.
+        ``mapping[i, j]`` returns the indices of all the streamlines that
+        connect region `i` to region `j`. If `symmetric` is True mapping will
+        only have one key for each start end pair such that if ``i < j``
+        mapping will have key ``(i, j)`` but not key ``(j, i)``.
 
     """
-    # Error checking on label_volume
-    kind = label_volume.dtype.kind
-    labels_positive = ((kind == 'u') or
-                       ((kind == 'i') and (label_volume.min() >= 0)))
-    valid_label_volume = (labels_positive and label_volume.ndim == 3)
-    if not valid_label_volume:
-        raise ValueError("label_volume must be a 3d integer array with"
-                         "non-negative label values")
+    _check_label_volume(label_volume)
 
     # If streamlines is an iterator
     if return_mapping and mapping_as_streamlines:
         streamlines = list(streamlines)
 
-    if inclusive:
-        # Create ndarray to store streamline connections
-        edges = np.ndarray(shape=(3, 0), dtype=int)
-        lin_T, offset = _mapping_to_voxel(affine)
-        for sl, _ in enumerate(streamlines):
-            # Convert streamline to voxel coordinates
-            entire = _to_voxel_coordinates(streamlines[sl], lin_T, offset)
-            i, j, k = entire.T
-
-            if symmetric:
-                # Create list of all labels streamline passes through
-                entirelabels = list(OrderedDict.fromkeys(label_volume[i, j, k]))
-                # Append all connection combinations with streamline number
-                for comb in combinations(entirelabels, 2):
-                    edges = np.append(edges, [[comb[0]], [comb[1]], [sl]],
-                                      axis=1)
-            else:
-                # Create list of all labels streamline passes through, keeping
-                # order and whether a label was entered multiple times
-                entirelabels = list(groupby(label_volume[i, j, k]))
-                # Append connection combinations along with streamline number,
-                # removing duplicates and connections from a label to itself
-                combs = set(combinations([z[0] for z in entirelabels], 2))
-                for comb in combs:
-                    if comb[0] == comb[1]:
-                        pass
-                    else:
-                        edges = np.append(edges, [[comb[0]], [comb[1]], [sl]],
-                                          axis=1)
-        if symmetric:
-            edges[0:2].sort(0)
-        mx = label_volume.max() + 1
-        matrix = ndbincount(edges[0:2], shape=(mx, mx))
-
-        if symmetric:
-            matrix = np.maximum(matrix, matrix.T)
+    lin_T, offset = _mapping_to_voxel(affine)
+    mx = int(label_volume.max()) + 1
+    matrix = np.zeros((mx, mx), dtype=np.intp)
+    all_edges = []
+    first_sl = 0
+    for points, lengths in _streamline_chunks(streamlines, chunk_size,
+                                              endpoints=not inclusive):
+        i, j, k = _to_voxel_coordinates(points, lin_T, offset).T
+        point_labels = label_volume[i, j, k].astype(np.intp)
+        edges = _chunk_edges(point_labels, lengths, mx, inclusive, symmetric)
+        matrix += ndbincount(edges[0:2], shape=(mx, mx))
         if return_mapping:
-            mapping = defaultdict(list)
-            for i, (a, b, c) in enumerate(edges.T):
-                mapping[a, b].append(c)
-            # Replace each list of indices with the streamlines they index
-            if mapping_as_streamlines:
-                for key in mapping:
-                    mapping[key] = [streamlines[i] for i in mapping[key]]
+            edges[2] += first_sl
+            all_edges.append(edges)
+        first_sl += len(lengths)
+
+    if symmetric:
+        matrix = np.maximum(matrix, matrix.T)
+
+    if return_mapping:
+        mapping = defaultdict(list)
+        if all_edges:
+            edges = np.concatenate(all_edges, axis=1)
+            keys = edges[0] * mx + edges[1]
+            # Group by label pair, keeping streamline order within a pair
+            order = np.lexsort((edges[2], keys))
+            keys = keys[order]
+            sl_indices = edges[2][order]
+            splits = np.flatnonzero(np.diff(keys)) + 1
+            for key, indices in zip(keys[np.r_[0, splits]],
+                                    np.split(sl_indices, splits)):
+                mapping[divmod(int(key), int(mx))] = indices
+
+        # Replace each array of indices with the streamlines they index
+        if mapping_as_streamlines:
+            for key in mapping:
+                mapping[key] = [streamlines[i] for i in mapping[key]]
+
+        # Return the mapping matrix and the mapping
+        return matrix, mapping
+
+    return matrix
+
+
+def connectivity_metrics(streamlines, affine, label_volume, scalar_maps=None,
+                         statistics=('mean',), weights=None, inclusive=False,
+                         symmetric=True, chunk_size=100000):
+    """Compute several edge-wise statistics of a connectome in a single pass.
+
+    The streamlines are assigned to pairs of labels as in
+    ``connectivity_matrix`` and, for each pair, the number of streamlines,
+    their mean length, the sum of their weights and statistics of scalar
+    maps sampled along them are computed while the tractogram is read once.
 
-            return matrix, mapping
+    Parameters
+    ----------
+    streamlines : iterable
+        A sequence of streamlines. It can also be a generator (e.g. a lazily
+        loaded tractogram), it is then consumed in chunks of `chunk_size`
+        streamlines.
+    affine : array_like (4, 4)
+        The mapping from voxel coordinates to streamline coordinates.
+        The voxel_to_rasmm matrix, typically from a NIFTI file.
+    label_volume : ndarray
+        An image volume with an integer data type, where the intensities in the
+        volume map to anatomical structures.
+    scalar_maps : dict, optional
+        Scalar volumes (e.g. ``{'fa': fa}``) with the same shape as
+        `label_volume`. Each map is interpolated (trilinear) at the points of
+        the streamlines and averaged along each streamline.
+    statistics : sequence of str, optional
+        Statistics, over the streamlines of each edge, of the average of each
+        scalar map along the streamlines. Can contain 'mean' and 'median'.
+        Default: ('mean',).
+    weights : array_like (N,), optional
+        One weight per streamline (e.g. the weights estimated by LiFE). They
+        are summed over the streamlines of each edge.
+    inclusive: bool, optional
+        Whether to analyze the entire streamline, as opposed to just the
+        endpoints. False by default.
+    symmetric : bool, optional
+        Symmetric means we don't distinguish between start and end points. If
+        symmetric is True, ``matrix[i, j] == matrix[j, i]``. True by default.
+    chunk_size : int, optional
+        Number of streamlines processed at once (default 100000).
 
-        return matrix
-    else:
-        # take the first and last point of each streamline
-        endpoints = [sl[0::len(sl)-1] for sl in streamlines]
+    Returns
+    -------
+    matrices : dict
+        Matrices of shape ``(label_volume.max() + 1,) * 2``. 'count' holds the
+        number of streamlines of each edge, 'length' their mean length,
+        'weight' the sum of their `weights` (if given) and ``name_stat`` the
+        statistic `stat` of the scalar map `name`. Edges without streamlines
+        are 0.
 
-        # Map the streamlines coordinates to voxel coordinates
-        lin_T, offset = _mapping_to_voxel(affine)
-        endpoints = _to_voxel_coordinates(endpoints, lin_T, offset)
+    """
+    _check_label_volume(label_volume)
+    if scalar_maps is None:
+        scalar_maps = {}
+    for stat in statistics:
+        if stat not in ('mean', 'median'):
+            raise ValueError("Unknown statistic %s, statistics can be 'mean'"
+                             " or 'median'" % stat)
+    scalar_maps = {name: np.asarray(data, dtype=float)
+                   for name, data in scalar_maps.items()}
+    for name, data in scalar_maps.items():
+        if data.shape != label_volume.shape:
+            raise ValueError("The scalar map %s does not have the shape of "
+                             "label_volume" % name)
+    if weights is not None:
+        weights = np.asarray(weights, dtype=float)
 
-        # get labels for label_volume
-        i, j, k = endpoints.T
-        endlabels = label_volume[i, j, k]
-        if symmetric:
-            endlabels.sort(0)
-        mx = label_volume.max() + 1
-        matrix = ndbincount(endlabels, shape=(mx, mx))
+    lin_T, offset = _mapping_to_voxel(affine)
+    mx = int(label_volume.max()) + 1
+    count = np.zeros(mx * mx, dtype=np.intp)
+    sums = {'length': np.zeros(mx * mx)}
+    if weights is not None:
+        sums['weight'] = np.zeros(mx * mx)
+    if 'mean' in statistics:
+        for name in scalar_maps:
+            sums[name] = np.zeros(mx * mx)
+    all_keys = []
+    all_values = dict((name, []) for name in scalar_maps)
+    keep_values = 'median' in statistics
+
+    first_sl = 0
+    for points, lengths in _streamline_chunks(streamlines, chunk_size):
+        starts = np.cumsum(lengths) - lengths
+        i, j, k = _to_voxel_coordinates(points, lin_T, offset).T
+        point_labels = label_volume[i, j, k].astype(np.intp)
+        edges = _chunk_edges(point_labels, lengths, mx, inclusive, symmetric)
+        keys = edges[0] * mx + edges[1]
+        sl_indices = edges[2]
+
+        # Values of each streamline of the chunk
+        segments = np.zeros(len(points))
+        segments[:-1] = np.sqrt((np.diff(points, axis=0) ** 2).sum(1))
+        segments[starts[1:] - 1] = 0
+        values = {'length': np.add.reduceat(segments, starts)}
+        if weights is not None:
+            values['weight'] = weights[first_sl:first_sl + len(lengths)]
+            if len(values['weight']) != len(lengths):
+                raise ValueError("There should be one weight per streamline")
+        if scalar_maps:
+            vox_points = np.dot(points, lin_T) + (offset - .5)
+            for name, data in scalar_maps.items():
+                point_values = interpolate_scalar_3d(data, vox_points)[0]
+                values[name] = (np.add.reduceat(point_values, starts) /
+                                lengths)
+                if keep_values:
+                    all_values[name].append(values[name][sl_indices])
+
+        count += np.bincount(keys, minlength=mx * mx)
+        for name in sums:
+            sums[name] += np.bincount(keys, values[name][sl_indices],
+                                      minlength=mx * mx)
+        if keep_values:
+            all_keys.append(keys)
+        first_sl += len(lengths)
+
+    if weights is not None and first_sl != len(weights):
+        raise ValueError("There should be one weight per streamline")
+
+    nonzero = count > 0
+    matrices = {'count': count}
+    for name in sums:
+        if name == 'weight':
+            matrices[name] = sums[name]
+            continue
+        mean = np.zeros(mx * mx)
+        mean[nonzero] = sums[name][nonzero] / count[nonzero]
+        matrices[name if name == 'length' else name + '_mean'] = mean
+
+    if keep_values and scalar_maps:
+        keys = np.concatenate(all_keys)
+        edge_keys, edge_counts = np.unique(keys, return_counts=True)
+        edge_starts = np.cumsum(edge_counts) - edge_counts
+        # The median of each edge is taken from its values sorted by key
+        low = edge_starts + (edge_counts - 1) // 2
+        high = edge_starts + edge_counts // 2
+        for name in scalar_maps:
+            sl_values = np.concatenate(all_values[name])
+            sorted_values = sl_values[np.lexsort((sl_values, keys))]
+            median = np.zeros(mx * mx)
+            median[edge_keys] = (sorted_values[low] + sorted_values[high]) / 2
+            matrices[name + '_median'] = median
+
+    for name, matrix in matrices.items():
+        matrix = matrix.reshape((mx, mx))
         if symmetric:
-            matrix = np.maximum(matrix, matrix.T)
+            matrix = matrix + np.triu(matrix, 1).T
+        matrices[name] = matrix
+    return matrices
 
-        if return_mapping:
-            mapping = defaultdict(list)
-            for i, (a, b) in enumerate(endlabels.T):
-                mapping[a, b].append(i)
 
-            # Replace each list of indices with the streamlines they index
-            if mapping_as_streamlines:
-                for key in mapping:
-                    mapping[key] = [streamlines[i] for i in mapping[key]]
+def _check_label_volume(label_volume):
+    """Raise a ValueError if `label_volume` is not a valid label volume."""
+    kind = label_volume.dtype.kind
+    labels_positive = ((kind == 'u') or
+                       ((kind == 'i') and (label_volume.min() >= 0)))
+    valid_label_volume = (labels_positive and label_volume.ndim == 3)
+    if not valid_label_volume:
+        raise ValueError("label_volume must be a 3d integer array with"
+                         "non-negative label values")
+
+
+def _chunk_edges(point_labels, lengths, mx, inclusive, symmetric):
+    """Label pairs connected by the streamlines of a chunk.
+
+    Returns an array of shape (3, N) holding the two labels and the index of
+    the streamline (in the chunk) of each of the N connections.
+    """
+    if inclusive:
+        edges = _inclusive_edges(point_labels, lengths, mx, symmetric)
+    else:
+        ends = np.cumsum(lengths) - 1
+        edges = np.array([point_labels[ends - lengths + 1],
+                          point_labels[ends],
+                          np.arange(len(lengths))])
+    if symmetric:
+        edges[0:2].sort(0)
+    return edges
 
-            # Return the mapping matrix and the mapping
-            return matrix, mapping
 
-        return matrix
+def _streamline_chunks(streamlines, chunk_size, endpoints=False):
+    """Yield the points and the lengths of chunks of streamlines.
+
+    If `endpoints` is True only the first and last points of each streamline
+    are kept.
+    """
+    streamlines = iter(streamlines)
+    while True:
+        chunk = [np.asarray(sl) for sl in islice(streamlines, chunk_size)]
+        if not chunk:
+            return
+        if endpoints:
+            points = np.asarray([sl[0::len(sl) - 1] if len(sl) > 1
+                                 else sl[[0, 0]] for sl in chunk])
+            yield (points.reshape(-1, points.shape[-1]),
+                   np.full(len(chunk), 2, dtype=np.intp))
+            continue
+        lengths = np.array([len(sl) for sl in chunk], dtype=np.intp)
+        yield np.concatenate(chunk), lengths
+
+
+def _inclusive_edges(point_labels, lengths, mx, symmetric):
+    """Label pairs connected by each streamline of a chunk.
+
+    Returns an array of shape (3, N) holding the two labels and the index of
+    the streamline of each of the N connections. If `symmetric`, every pair
+    of distinct labels visited by a streamline is a connection. Otherwise
+    ``(a, b)`` is a connection if `a` is visited before `b` at least once.
+    """
+    nb_streamlines = len(lengths)
+    sl_ids = np.repeat(np.arange(nb_streamlines), lengths)
+    positions = np.arange(len(point_labels))
+    # One entry per (streamline, label), sorted by streamline then label
+    keys = sl_ids * mx + point_labels
+    order = np.lexsort((positions, keys))
+    keys = keys[order]
+    starts = np.r_[0, np.flatnonzero(np.diff(keys)) + 1]
+    ends = np.r_[starts[1:], len(keys)] - 1
+    uniq_sl, uniq_labels = np.divmod(keys[starts], mx)
+    first_pos = positions[order[starts]]
+    last_pos = positions[order[ends]]
+
+    counts = np.bincount(uniq_sl, minlength=nb_streamlines)
+    group_start = np.r_[0, np.cumsum(counts)[:-1]]
+    edges = [np.zeros((3, 0), dtype=np.intp)]
+    # Streamlines visiting the same number of labels are processed together
+    for n in np.unique(counts):
+        if n < 2:
+            continue
+        sls = np.flatnonzero(counts == n)
+        idx = group_start[sls][:, None] + np.arange(n)
+        labels = uniq_labels[idx]
+        if symmetric:
+            a, b = np.triu_indices(n, 1)
+            keep = np.ones((len(sls), len(a)), dtype=bool)
+        else:
+            a, b = np.nonzero(~np.eye(n, dtype=bool))
+            keep = first_pos[idx][:, a] < last_pos[idx][:, b]
+        sl_rep = np.repeat(sls[:, None], len(a), axis=1)
+        edges.append(np.array([labels[:, a][keep], labels[:, b][keep],
+                               sl_rep[keep]]))
+    return np.concatenate(edges, axis=1)
 
 
 def ndbincount(x, weights=None, shape=None):